@@ -7,13 +7,56 @@ import json
 sys.path.insert(0, '/var/task/shared')
 sys.path.insert(0, '/var/task')
 
-from shared.openai_client import get_openai_response
+from shared.model_router import get_routed_response
+from shared.prompts import build_audio_greeting_prompt
+from shared.greeting_pool import get_pooled_greeting
+from shared.health import health_response
+from shared.warmup import init_container, warmup_response
+from shared.metrics import metrics_response_body
+from shared.admission import admit, track_upstream
+from shared.deadline import Deadline, DeadlineExceeded, get_timeout
+from shared.entitlements import (count_fallback, expires_at_iso, has_audio_access, issue_token,
+                                 revoke_tokens, verify_token)
 from shared.utils import success_response, error_response, parse_request_body, validate_required_fields
+from shared.logger import get_logger
+from shared.tracing import traced
 
+log = get_logger('audio_dialog')
 
+
+# Приветствие без вызова модели - отдаётся, когда генерация приветствий сброшена из-за нагрузки
+FALLBACK_AUDIO_GREETING = (
+    "Hello! I'm excited to practice English with you today! "
+    "We could talk about travel, hobbies, your daily routine, or food. "
+    "Which one sounds interesting to you, or would you prefer to talk about something else?"
+)
+
+# Фидбэк без модели, если генерация сброшена при перегрузке: урок всё равно завершается
+FALLBACK_AUDIO_FEEDBACK = {
+    'ru': (
+        "🎉 **Отличная работа!**\n\n"
+        "Спасибо за урок! Подробный разбор сейчас недоступен, "
+        "но каждая такая практика делает вашу разговорную речь увереннее.\n\n"
+        "💡 Возвращайтесь завтра - продолжим!"
+    ),
+    'en': (
+        "🎉 **Great work!**\n\n"
+        "Thank you for the lesson! A detailed review is not available right now, "
+        "but every practice like this makes your spoken English more confident.\n\n"
+        "💡 Come back tomorrow and let's keep going!"
+    )
+}
+
+
+# Init-фаза контейнера: пул соединений; прогрев сразу - при provisioned concurrency
+init_container('audio_dialog')
+
+
+@traced('audio_dialog')
 def lambda_handler(event, context):
     """Обработчик Lambda для аудио диалогов"""
-    print(f"🎤 Audio Dialog Lambda called")
+    log.debug("🎤 Audio Dialog Lambda called")
+    deadline = Deadline.from_context(context)
     
     try:
         body = parse_request_body(event)
@@ -24,25 +67,49 @@ def lambda_handler(event, context):
         
         action = body['action']
         
-        if action == 'generate_greeting':
-            return handle_generate_greeting(body)
+        # При перегрузке upstream низкоприоритетные действия сбрасываются первыми
+        admitted, load_level = admit(action)
+        if not admitted:
+            if action == 'generate_greeting':
+                return success_response({
+                    'reply': FALLBACK_AUDIO_GREETING,
+                    'degraded': True
+                })
+            if action == 'generate_dialog_feedback':
+                return success_response({
+                    'feedback': FALLBACK_AUDIO_FEEDBACK.get(body.get('user_lang'), FALLBACK_AUDIO_FEEDBACK['ru']),
+                    'degraded': True
+                })
+            return error_response(f'Service overloaded ({load_level}), action {action} shed, retry later', 503)
+        
+        if action == 'metrics':
+            return success_response(metrics_response_body('audio_dialog', body))
+        elif action == 'health':
+            return health_response('audio_dialog')
+        elif action == 'warmup':
+            return warmup_response('audio_dialog')
+        elif action == 'generate_greeting':
+            return handle_generate_greeting(body, deadline)
         elif action == 'generate_dialog_feedback':
-            return handle_generate_feedback(body)
+            return handle_generate_feedback(body, deadline)
         elif action == 'decrease_lessons_left':
-            return handle_decrease_lessons_left(body)
+            return handle_decrease_lessons_left(body, deadline)
         elif action == 'check_audio_access':
-            return handle_check_audio_access(body)
+            return handle_check_audio_access(body, deadline)
         elif action == 'generate_response':
-            return handle_generate_response(body)
+            return handle_generate_response(body, deadline)
         else:
             return error_response(f'Unknown action: {action}')
             
+    except DeadlineExceeded as e:
+        log.warning(f"⏱️ Audio Dialog Lambda deadline exceeded: {e}")
+        return error_response(str(e), 504, **e.details())
     except Exception as e:
-        print(f"❌ Audio Dialog Lambda error: {e}")
+        log.error(f"❌ Audio Dialog Lambda error: {e}")
         return error_response(f'Internal error: {str(e)}', 500)
 
 
-def handle_generate_greeting(body):
+def handle_generate_greeting(body, deadline=None):
     """Генерация приветственного сообщения для аудио диалога"""
     validation_error = validate_required_fields(body, ['user_id'])
     if validation_error:
@@ -51,39 +118,34 @@ def handle_generate_greeting(body):
     user_id = body['user_id']
     user_level = body.get('user_level', 'Intermediate')
     
-    print(f"🎤 Generating audio greeting for user {user_id}, level: {user_level}")
+    # Готовое приветствие из пула (пакетная задача greeting_pool); пула нет - генерируем
+    pooled = get_pooled_greeting(user_level, deadline)
+    if pooled:
+        log.debug("👋 Audio greeting for user %s served from pool, level: %s", user_id, user_level)
+        return success_response({
+            'reply': pooled,
+            'pooled': True
+        })
+    
+    log.debug("🎤 Generating audio greeting for user %s, level: %s", user_id, user_level)
     
     # Системный промпт для приветствия
-    greeting_prompt = f"""You are an English conversation tutor. Generate a friendly greeting to start an audio conversation practice session with topic suggestions.
-
-User's English level: {user_level}
-
-Requirements:
-- Start with a warm, encouraging greeting
-- Adapt language complexity to the user's level
-- Offer 3-4 conversation topic suggestions (like: travel, hobbies, daily routine, food, etc.)
-- Ask the user to choose a topic or suggest their own
-- Keep it under 80 words total
-- Be enthusiastic and supportive
-
-Example structure: "Hello! I'm excited to practice English with you today! Let's have a great conversation. I can suggest a few topics: [topic 1], [topic 2], [topic 3], or [topic 4]. Which one sounds interesting to you, or would you prefer to talk about something else?"
-
-Generate ONLY the greeting text with topic suggestions, nothing else."""
+    greeting_prompt = build_audio_greeting_prompt(user_level)
     
     # Получаем приветствие от OpenAI
-    result = get_openai_response("Generate audio greeting", greeting_prompt)
+    result = get_routed_response('audio_greeting', "Generate audio greeting", greeting_prompt, user_id=user_id, deadline=deadline)
     
     if result['success']:
-        print(f"✅ Audio greeting generated for user {user_id}")
+        log.info(f"✅ Audio greeting generated for user {user_id}")
         return success_response({
             'reply': result['reply']
         })
     else:
-        print(f"❌ Audio greeting failed: {result['error']}")
+        log.error(f"❌ Audio greeting failed: {result['error']}")
         return error_response(f"Greeting generation error: {result['error']}")
 
 
-def handle_generate_feedback(body):
+def handle_generate_feedback(body, deadline=None):
     """Генерация финального фидбэка для аудио диалога"""
     validation_error = validate_required_fields(body, ['user_id'])
     if validation_error:
@@ -92,7 +154,7 @@ def handle_generate_feedback(body):
     user_id = body['user_id']
     user_lang = body.get('user_lang', 'ru')
     
-    print(f"📊 Generating audio dialog feedback for user {user_id}")
+    log.debug("📊 Generating audio dialog feedback for user %s", user_id)
     
     # Системный промпт для фидбэка
     if user_lang == 'en':
@@ -139,21 +201,21 @@ Structure:
 Keep it concise (max 150 words) and encouraging. Give realistic scores 70-95. Focus only on audio-based skills."""
     
     # Получаем фидбэк от OpenAI
-    result = get_openai_response("Generate feedback for completed audio dialog", feedback_prompt)
+    result = get_routed_response('dialog_feedback', "Generate feedback for completed audio dialog", feedback_prompt, user_id=user_id, mode='audio_dialog', deadline=deadline)
     
     if result['success']:
-        print(f"✅ Audio dialog feedback generated for user {user_id}")
+        log.info(f"✅ Audio dialog feedback generated for user {user_id}")
         return success_response({
             'feedback': result['reply']
         })
     else:
-        print(f"❌ Audio dialog feedback failed: {result['error']}")
+        log.error(f"❌ Audio dialog feedback failed: {result['error']}")
         return error_response(f"Feedback generation error: {result['error']}")
 
 
-def handle_decrease_lessons_left(body):
+def handle_decrease_lessons_left(body, deadline=None):
     """Уменьшение lessons_left при завершении аудио-урока"""
-    from database import get_supabase_config
+    from shared.database import get_supabase_config
     import urllib.request
     import json
     from datetime import datetime, timedelta
@@ -168,17 +230,17 @@ def handle_decrease_lessons_left(body):
     supabase_key = supabase_config['key']
     
     try:
-        print(f"Decreasing lessons_left for user {user_id}")
+        log.debug("Decreasing lessons_left for user %s", user_id)
         
         # Получаем текущие данные пользователя
-        url = f"{supabase_url}/rest/v1/users?telegram_id=eq.{user_id}&select=lessons_left,total_lessons_completed,current_streak,last_lesson_date"
+        url = f"{supabase_url}/rest/v1/users?telegram_id=eq.{user_id}&select=lessons_left,total_lessons_completed,current_streak,last_lesson_date,package_expires_at,interface_language"
         headers = {
             'Authorization': f'Bearer {supabase_key}',
             'apikey': supabase_key
         }
         
         req = urllib.request.Request(url, headers=headers)
-        with urllib.request.urlopen(req) as response:
+        with track_upstream('supabase'), urllib.request.urlopen(req, timeout=get_timeout(deadline, 'supabase')) as response:
             response_text = response.read().decode('utf-8')
             users = json.loads(response_text)
             
@@ -202,25 +264,25 @@ def handle_decrease_lessons_left(body):
                         # Если уже занимались сегодня, не увеличиваем streak
                         if last_date == today:
                             should_update_streak = False
-                            print(f"User {user_id} already practiced today, not updating streak")
+                            log.debug("User %s already practiced today, not updating streak", user_id)
                         # Если последний раз занимались вчера, увеличиваем streak
                         elif last_date == today - timedelta(days=1):
                             current_streak += 1
-                            print(f"User {user_id} practiced yesterday, increasing streak to {current_streak}")
+                            log.debug("User %s practiced yesterday, increasing streak to %s", user_id, current_streak)
                         # Если пропустили дни, streak = 0
                         elif last_date < today - timedelta(days=1):
                             current_streak = 0
-                            print(f"User {user_id} missed days, resetting streak to 0")
+                            log.debug("User %s missed days, resetting streak to 0", user_id)
                     except Exception as e:
-                        print(f"Error parsing last_lesson_date: {e}")
+                        log.warning(f"Error parsing last_lesson_date: {e}")
                         # Если ошибка парсинга, устанавливаем streak = 1
                         current_streak = 1
                 else:
                     # Первый раз занимается
                     current_streak = 1
-                    print(f"User {user_id} first time practicing, setting streak to 1")
+                    log.debug("User %s first time practicing, setting streak to 1", user_id)
                 
-                print(f"User {user_id}: lessons_left {current_lessons} -> {new_lessons}, total_completed {total_completed} -> {new_total}")
+                log.debug("User %s: lessons_left %s -> %s, total_completed %s -> %s", user_id, current_lessons, new_lessons, total_completed, new_total)
                 
                 # Подготавливаем данные для обновления
                 update_data = {
@@ -244,31 +306,38 @@ def handle_decrease_lessons_left(body):
                 }
                 
                 update_req = urllib.request.Request(update_url, data=update_data_json, headers=update_headers, method='PATCH')
-                urllib.request.urlopen(update_req)
+                with track_upstream('supabase'):
+                    urllib.request.urlopen(update_req, timeout=get_timeout(deadline, 'supabase'))
                 
-                print(f"Successfully updated lessons for user {user_id}: lessons_left {current_lessons} -> {new_lessons}, total_completed {total_completed} -> {new_total}")
+                log.info(f"Successfully updated lessons for user {user_id}: lessons_left {current_lessons} -> {new_lessons}, total_completed {total_completed} -> {new_total}")
+                # Старые токены доступа помнят прежний остаток уроков - отзываем их и выдаём новый
+                revoke_tokens(user_id)
                 if should_update_streak:
-                    print(f"Also updated streak: {current_streak}, last_lesson_date: {today}")
+                    log.info(f"Also updated streak: {current_streak}, last_lesson_date: {today}")
                 
                 return success_response({
                     'lessons_left': new_lessons,
                     'total_lessons_completed': new_total,
                     'decreased_by': 1,
                     'streak_updated': should_update_streak,
-                    'new_streak': current_streak
+                    'new_streak': current_streak,
+                    'entitlement_token': issue_token(user_id, user_data.get('package_expires_at'), new_lessons,
+                                                     user_data.get('interface_language'))
                 })
         
         # Пользователь не найден
         return error_response('User not found')
         
+    except DeadlineExceeded:
+        raise
     except Exception as e:
-        print(f"Error decreasing lessons_left: {e}")
+        log.error(f"Error decreasing lessons_left: {e}")
         return error_response(f'Error decreasing lessons: {str(e)}')
 
 
-def handle_check_audio_access(body):
-    """Проверка доступа к аудио-урокам"""
-    from database import get_supabase_config
+def handle_check_audio_access(body, deadline=None):
+    """Проверка доступа к аудио-урокам: по токену доступа, иначе по базе"""
+    from shared.database import get_supabase_config
     from datetime import datetime, timezone
     import urllib.request
     import json
@@ -278,18 +347,28 @@ def handle_check_audio_access(body):
         return error_response(validation_error)
     
     user_id = body['user_id']
+    claims = verify_token(body.get('entitlement_token'), user_id)
+    if claims and has_audio_access(claims):
+        log.debug("Audio access for user %s confirmed by entitlement token", user_id)
+        return success_response({
+            'has_access': True,
+            'lessons_left': claims['l'],
+            'package_expires_at': expires_at_iso(claims),
+            'has_active_subscription': True,
+            'interface_language': claims['il']
+        })
+    
+    count_fallback()
     supabase_config = get_supabase_config()
     supabase_url = supabase_config['url']
     supabase_key = supabase_config['key']
     
     try:
-        print(f"Checking audio access for user {user_id}")
-        print(f"Supabase URL: {supabase_url}")
-        print(f"Supabase Key: {supabase_key[:10]}...")
+        log.debug("Checking audio access for user %s", user_id)
         
         # Получаем данные пользователя из Supabase
         url = f"{supabase_url}/rest/v1/users?telegram_id=eq.{user_id}"
-        print(f"Request URL: {url}")
+        log.debug("Request URL: %s", url)
         
         headers = {
             'Authorization': f'Bearer {supabase_key}',
@@ -298,13 +377,13 @@ def handle_check_audio_access(body):
         }
         
         req = urllib.request.Request(url, headers=headers)
-        with urllib.request.urlopen(req) as response:
+        with track_upstream('supabase'), urllib.request.urlopen(req, timeout=get_timeout(deadline, 'supabase')) as response:
             response_text = response.read().decode('utf-8')
-            print(f"Supabase response: {response_text}")
+            log.debug("Supabase response: %s", response_text)
             users = json.loads(response_text) if response_text else []
             
             if not users:
-                print(f"User {user_id} not found in database")
+                log.warning(f"User {user_id} not found in database")
                 return error_response('User not found')
             
             user = users[0]
@@ -312,7 +391,7 @@ def handle_check_audio_access(body):
             package_expires_at = user.get('package_expires_at')
             interface_language = user.get('interface_language', 'ru')
             
-            print(f"User {user_id}: lessons_left={lessons_left}, package_expires_at={package_expires_at}")
+            log.debug("User %s: lessons_left=%s, package_expires_at=%s", user_id, lessons_left, package_expires_at)
             
             # Проверяем доступ
             now = datetime.now(timezone.utc)
@@ -323,35 +402,40 @@ def handle_check_audio_access(body):
                 try:
                     expires_date = datetime.fromisoformat(package_expires_at.replace('Z', '+00:00'))
                     has_active_subscription = expires_date > now
-                    print(f"Subscription check: {expires_date} > {now} = {has_active_subscription}")
+                    log.debug("Subscription check: %s > %s = %s", expires_date, now, has_active_subscription)
                 except Exception as e:
-                    print(f"Error parsing package_expires_at: {e}")
+                    log.warning(f"Error parsing package_expires_at: {e}")
                     has_active_subscription = False
             
             # Доступ есть если есть уроки И активная подписка
             has_access = has_lessons and has_active_subscription
             
-            print(f"Access result: has_lessons={has_lessons}, has_active_subscription={has_active_subscription}, has_access={has_access}")
+            log.info(f"Audio access for user {user_id}: {has_access}", has_lessons=has_lessons, has_active_subscription=has_active_subscription)
             
-            return success_response({
+            response = {
                 'has_access': has_access,
                 'lessons_left': lessons_left,
                 'package_expires_at': package_expires_at,
                 'has_active_subscription': has_active_subscription,
                 'interface_language': interface_language
-            })
+            }
+            if has_access:
+                response['entitlement_token'] = issue_token(user_id, package_expires_at, lessons_left, interface_language)
+            return success_response(response)
             
     except urllib.error.HTTPError as e:
-        print(f"HTTP Error checking audio access: {e.code} - {e.reason}")
+        log.error(f"HTTP Error checking audio access: {e.code} - {e.reason}")
         error_body = e.read().decode('utf-8') if e.fp else 'No error body'
-        print(f"Error body: {error_body}")
+        log.error(f"Error body: {error_body}")
         return error_response(f'Database error: {e.code} - {e.reason}')
+    except DeadlineExceeded:
+        raise
     except Exception as e:
-        print(f"Error checking audio access: {e}")
+        log.error(f"Error checking audio access: {e}")
         return error_response(f'Error checking access: {str(e)}')
 
 
-def handle_generate_response(body):
+def handle_generate_response(body, deadline=None):
     """Генерация ответа в аудио диалоге с контекстом"""
     validation_error = validate_required_fields(body, ['user_id', 'user_text'])
     if validation_error:
@@ -362,7 +446,7 @@ def handle_generate_response(body):
     user_level = body.get('user_level', 'Intermediate')
     previous_messages = body.get('previous_messages', [])
     
-    print(f"🎤 Generating audio response for user {user_id}, level: {user_level}")
+    log.debug("🎤 Generating audio response for user %s, level: %s", user_id, user_level)
     
     # Строим контекст из предыдущих сообщений
     context = ""
@@ -393,13 +477,13 @@ RESPONSE STRUCTURE:
 Just your English response - nothing else."""
     
     # Получаем ответ от OpenAI
-    result = get_openai_response(user_text, system_prompt, max_tokens=200)
+    result = get_routed_response('audio_response', user_text, system_prompt, user_id=user_id, deadline=deadline)
     
     if result['success']:
-        print(f"✅ Audio response generated successfully")
+        log.info("✅ Audio response generated successfully")
         return success_response({
             'reply': result['reply']
         })
     else:
-        print(f"❌ Audio response generation failed: {result['error']}")
+        log.error(f"❌ Audio response generation failed: {result['error']}")
         return error_response(f"Response generation error: {result['error']}")
@@ -7,47 +7,26 @@ import json
 sys.path.insert(0, '/var/task/shared')
 sys.path.insert(0, '/var/task')
 
-from shared.openai_client import get_openai_response
+from shared.model_router import get_routed_response
+from shared.intent_classifier import get_local_grammar_reply
+from shared.cache import TTLCache, make_cache_key
+from shared.rate_limiter import check_rate_limit, get_rate_limit_reply
+from shared.health import health_response
+from shared.warmup import init_container, warmup_response
+from shared.metrics import metrics_response_body, register_cache
+from shared.admission import admit
+from shared.deadline import Deadline, DeadlineExceeded
 from shared.database import log_text_usage, get_supabase_config
-from shared.utils import success_response, error_response, parse_request_body, validate_required_fields
+from shared.utils import success_response, error_response, parse_request_body, parse_bool, validate_required_fields
+from shared.logger import get_logger
+from shared.tracing import traced
 
+log = get_logger('grammar')
 
-def lambda_handler(event, context):
-    """Обработчик Lambda для грамматики"""
-    print(f"📝 Grammar Lambda called")
-    
-    try:
-        body = parse_request_body(event)
-        
-        validation_error = validate_required_fields(body, ['action'])
-        if validation_error:
-            return error_response(validation_error)
-        
-        action = body['action']
-        
-        if action == 'check_grammar':
-            return handle_grammar_check(body)
-        else:
-            return error_response(f'Unknown action: {action}')
-            
-    except Exception as e:
-        print(f"❌ Grammar Lambda error: {e}")
-        return error_response(f'Internal error: {str(e)}', 500)
 
-
-def handle_grammar_check(body):
-    """Обработка проверки грамматики"""
-    validation_error = validate_required_fields(body, ['text', 'user_id'])
-    if validation_error:
-        return error_response(validation_error)
-    
-    text = body['text']
-    user_id = body['user_id']
-    
-    print(f"📝 Checking grammar for user {user_id}: {text[:50]}...")
-    
-    # Системный промпт для грамматики (оригинальный структурированный формат)
-    system_prompt = """You are the Grammar mode of a language-learning bot.
+# Системный промпт для грамматики (оригинальный структурированный формат) собирается из частей,
+# чтобы прогрессивный режим мог запрашивать разделы ответа по отдельности
+GRAMMAR_BASE_PROMPT = """You are the Grammar mode of a language-learning bot.
 Your only task is to answer questions about English grammar.
 
 Rules of behavior:
@@ -80,9 +59,9 @@ Use English ONLY for examples and grammar term definitions.
 
 Be concise, clear, and practical.
 
-If the user provides their own sentence → first confirm/correct it, then explain why.
+If the user provides their own sentence → first confirm/correct it, then explain why."""
 
-Structure of full answer:
+GRAMMAR_FULL_STRUCTURE = """Structure of full answer:
 
 *Rule*
 1–2 lines
@@ -103,9 +82,9 @@ when to use, difference from related forms
 *Answer key*
 1. ||answer||
 2. ||answer||  
-3. ||answer||
+3. ||answer||"""
 
-FORMATTING REQUIREMENTS:
+GRAMMAR_FORMATTING = """FORMATTING REQUIREMENTS:
 - Use single asterisks *word* for bold (NOT **word**)
 - ALWAYS wrap practice answers in double pipes: ||answer||
 - Example: "1. ||would go||" NOT "1. would go"
@@ -116,21 +95,278 @@ Example of correct Answer key format:
 1. ||would go||
 2. ||to like||
 3. ||would buy||"""
+
+GRAMMAR_SYSTEM_PROMPT = GRAMMAR_BASE_PROMPT + "\n\n" + GRAMMAR_FULL_STRUCTURE + "\n\n" + GRAMMAR_FORMATTING
+
+# Прогрессивный режим: разделы ответа группами, первая группа отдаётся сразу
+GRAMMAR_SECTION_GROUPS = [
+    {
+        'sections': """*Rule*
+1–2 lines
+
+*Form/Structure*
+patterns, word order, common collocations""",
+        'max_tokens': 350
+    },
+    {
+        'sections': """*Use & Contrast*
+when to use, difference from related forms
+
+*Examples*
+5–7 with ✅/❌ if relevant""",
+        'max_tokens': 450
+    },
+    {
+        'sections': """*Common mistakes & tips*
+
+*Mini-practice (3 items)*
+
+*Answer key*
+1. ||answer||
+2. ||answer||  
+3. ||answer||""",
+        'max_tokens': 450
+    }
+]
+
+# Маркер конца первой части: модель ставит его, только если дала объяснение (не отказ и не уточняющий вопрос)
+MORE_MARKER = '---MORE---'
+
+# Уже показанная часть ответа, присланная клиентом после смены контейнера, обрезается до этой длины
+MAX_ANSWERED_CHARS = 6000
+
+# Контекст вопросов для догрузки разделов (question_id -> вопрос и уже показанная часть ответа)
+_question_cache = TTLCache(maxsize=1024, ttl=3600)
+register_cache('grammar_questions', _question_cache)
+
+# Init-фаза контейнера: пул соединений; прогрев сразу - при provisioned concurrency
+init_container('grammar')
+
+
+@traced('grammar')
+def lambda_handler(event, context):
+    """Обработчик Lambda для грамматики"""
+    log.debug("📝 Grammar Lambda called")
+    deadline = Deadline.from_context(context)
+    
+    try:
+        body = parse_request_body(event)
+        
+        validation_error = validate_required_fields(body, ['action'])
+        if validation_error:
+            return error_response(validation_error)
+        
+        action = body['action']
+        
+        # При перегрузке upstream низкоприоритетные действия сбрасываются первыми
+        admitted, load_level = admit(action)
+        if not admitted:
+            return error_response(f'Service overloaded ({load_level}), action {action} shed, retry later', 503)
+        
+        if action == 'metrics':
+            return success_response(metrics_response_body('grammar', body))
+        elif action == 'health':
+            return health_response('grammar')
+        elif action == 'warmup':
+            return warmup_response('grammar')
+        elif action == 'check_grammar':
+            return handle_grammar_check(body, deadline)
+        elif action == 'grammar_more':
+            return handle_grammar_more(body, deadline)
+        else:
+            return error_response(f'Unknown action: {action}')
+            
+    except DeadlineExceeded as e:
+        log.warning(f"⏱️ Grammar Lambda deadline exceeded: {e}")
+        return error_response(str(e), 504, **e.details())
+    except Exception as e:
+        log.error(f"❌ Grammar Lambda error: {e}")
+        return error_response(f'Internal error: {str(e)}', 500)
+
+
+def handle_grammar_check(body, deadline=None):
+    """Обработка проверки грамматики"""
+    validation_error = validate_required_fields(body, ['text', 'user_id'])
+    if validation_error:
+        return error_response(validation_error)
+    
+    text = body['text']
+    user_id = body['user_id']
+    
+    log.debug("📝 Checking grammar for user %s: %s...", user_id, text[:50])
+    
+    # Явно нерелевантные вопросы отсекаем локально, без вызова OpenAI
+    local_reply = get_local_grammar_reply(text)
+    if local_reply:
+        supabase_config = get_supabase_config()
+        if supabase_config['url'] and supabase_config['key']:
+            log_text_usage(user_id, supabase_config['url'], supabase_config['key'], deadline)
+        
+        return success_response({
+            'reply': local_reply
+        })
+    
+    # Лимит частоты запросов к модели (token bucket на пользователя и режим)
+    allowed, retry_after = check_rate_limit(user_id, 'grammar', deadline)
+    if not allowed:
+        return success_response({
+            'reply': get_rate_limit_reply(retry_after, body.get('interface_language', 'ru')),
+            'rate_limited': True,
+            'retry_after': round(retry_after, 1)
+        })
+    
+    # Прогрессивный режим (по умолчанию): сначала только Rule и Form, остальное - по кнопке «Подробнее» (grammar_more);
+    # GRAMMAR_PROGRESSIVE=false или progressive=false в запросе - полный ответ сразу
+    progressive = parse_bool(body.get('progressive'), parse_bool(os.environ.get('GRAMMAR_PROGRESSIVE'), True))
+    if progressive:
+        return handle_grammar_progressive(text, user_id, deadline)
     
     # Получаем ответ от OpenAI
-    result = get_openai_response(text, system_prompt)
+    result = get_routed_response('grammar', text, GRAMMAR_SYSTEM_PROMPT, user_id=user_id, deadline=deadline)
     
     if result['success']:
-        print(f"✅ Grammar check successful for user {user_id}")
+        log.info(f"✅ Grammar check successful for user {user_id}")
         
         # Логируем использование
         supabase_config = get_supabase_config()
         if supabase_config['url'] and supabase_config['key']:
-            log_text_usage(user_id, supabase_config['url'], supabase_config['key'])
+            log_text_usage(user_id, supabase_config['url'], supabase_config['key'], deadline)
         
         return success_response({
             'reply': result['reply']
         })
     else:
-        print(f"❌ Grammar check failed: {result['error']}")
+        log.error(f"❌ Grammar check failed: {result['error']}")
+        return error_response(f"Grammar check error: {result['error']}")
+
+
+def handle_grammar_progressive(text, user_id, deadline=None):
+    """Первая часть ответа (Rule + Form) короткой генерацией"""
+    first_group = GRAMMAR_SECTION_GROUPS[0]
+    system_prompt = (
+        GRAMMAR_BASE_PROMPT
+        + "\n\nStructure of this answer (SHORT version - write ONLY these sections, the rest will be requested later):\n\n"
+        + first_group['sections']
+        + f"\n\nIf you gave a grammar explanation (not a refusal and not a clarifying question), end your reply with the line {MORE_MARKER}"
+        + "\n\n" + GRAMMAR_FORMATTING
+    )
+    
+    result = get_routed_response('grammar_progressive', text, system_prompt, user_id=user_id, deadline=deadline, max_tokens=first_group['max_tokens'])
+    
+    if not result['success']:
+        log.error(f"❌ Grammar check failed: {result['error']}")
         return error_response(f"Grammar check error: {result['error']}")
+    
+    reply = result['reply']
+    has_more = MORE_MARKER in reply
+    reply = reply.replace(MORE_MARKER, '').strip()
+    
+    question_id = make_cache_key(user_id, text)[:16]
+    if has_more:
+        _question_cache.set(question_id, {'user_id': str(user_id), 'text': text, 'answered': reply, 'next_group': 1})
+    
+    log.info(f"✅ Grammar check (progressive) successful for user {user_id}, has_more={has_more}")
+    
+    supabase_config = get_supabase_config()
+    if supabase_config['url'] and supabase_config['key']:
+        log_text_usage(user_id, supabase_config['url'], supabase_config['key'], deadline)
+    
+    return success_response({
+        'reply': reply,
+        'question_id': question_id,
+        'has_more': has_more
+    })
+
+
+def handle_grammar_more(body, deadline=None):
+    """Следующая группа разделов ответа по закэшированному контексту вопроса"""
+    validation_error = validate_required_fields(body, ['question_id', 'user_id'])
+    if validation_error:
+        return error_response(validation_error)
+    
+    question_id = body['question_id']
+    user_id = body['user_id']
+    
+    # section_group - какую группу разделов показать; без него - следующая после уже показанных
+    section_group = body.get('section_group')
+    if section_group is not None:
+        try:
+            section_group = int(section_group)
+        except (TypeError, ValueError):
+            return error_response('section_group must be an integer')
+        if not 1 <= section_group < len(GRAMMAR_SECTION_GROUPS):
+            return error_response(f'section_group must be between 1 and {len(GRAMMAR_SECTION_GROUPS) - 1}')
+    
+    answered = body.get('answered') or ''
+    if not isinstance(answered, str):
+        return error_response('answered must be a string')
+    
+    context = _question_cache.get(question_id)
+    if context is not None and context.get('user_id') != str(user_id):
+        log.warning("⚠️ Grammar more for someone else's question", user_id=user_id, question_id=question_id)
+        return error_response('Question not found', 404)
+    if context is None:
+        # Контейнер мог смениться - восстанавливаем контекст из присланных вопроса и уже показанной части ответа
+        if not body.get('text'):
+            return error_response('Question context expired, text is required')
+        context = {'user_id': str(user_id), 'text': body['text'], 'answered': answered[-MAX_ANSWERED_CHARS:],
+                   'next_group': section_group or 1}
+    elif section_group is not None and section_group != context['next_group']:
+        # Клиент просит другую группу (например, повтор после потерянного ответа): показанная часть - его
+        context = {**context, 'next_group': section_group,
+                   'answered': answered[-MAX_ANSWERED_CHARS:] if answered else context['answered']}
+    
+    group_index = context['next_group']
+    if group_index >= len(GRAMMAR_SECTION_GROUPS):
+        return success_response({
+            'reply': '',
+            'question_id': question_id,
+            'has_more': False
+        })
+    
+    allowed, retry_after = check_rate_limit(user_id, 'grammar', deadline)
+    if not allowed:
+        return success_response({
+            'reply': get_rate_limit_reply(retry_after, body.get('interface_language', 'ru')),
+            'question_id': question_id,
+            'has_more': True,
+            'rate_limited': True,
+            'retry_after': round(retry_after, 1)
+        })
+    
+    log.debug("📝 Grammar more for user %s: question %s, group %s", user_id, question_id, group_index)
+    
+    group = GRAMMAR_SECTION_GROUPS[group_index]
+    system_prompt = GRAMMAR_BASE_PROMPT + "\n\nYou are CONTINUING your previous answer to the same question."
+    if context['answered']:
+        system_prompt += f"\n\nThe user has already seen this part of the answer:\n\n{context['answered']}"
+    system_prompt += (
+        "\n\nNow write ONLY these next sections, do not repeat earlier sections:\n\n"
+        + group['sections']
+        + "\n\n" + GRAMMAR_FORMATTING
+    )
+    
+    result = get_routed_response('grammar_progressive', context['text'], system_prompt, user_id=user_id, deadline=deadline, max_tokens=group['max_tokens'])
+    
+    if not result['success']:
+        log.error(f"❌ Grammar more failed: {result['error']}")
+        return error_response(f"Grammar check error: {result['error']}")
+    
+    reply = result['reply'].replace(MORE_MARKER, '').strip()
+    has_more = group_index + 1 < len(GRAMMAR_SECTION_GROUPS)
+    
+    if has_more:
+        _question_cache.set(question_id, {
+            'user_id': str(user_id),
+            'text': context['text'],
+            'answered': (context['answered'] + "\n\n" + reply).strip(),
+            'next_group': group_index + 1
+        })
+    else:
+        _question_cache.delete(question_id)
+    
+    return success_response({
+        'reply': reply,
+        'question_id': question_id,
+        'has_more': has_more
+    })
@@ -0,0 +1,29 @@
+-- Migration: Tables for offline Batch API jobs (Telegram bot backend)
+-- Description: greeting pool refills, feedback summaries, nightly progress digests
+
+-- Пул заранее сгенерированных приветствий аудио диалога
+CREATE TABLE IF NOT EXISTS greeting_pool (
+  id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+  level TEXT NOT NULL,
+  text TEXT NOT NULL,
+  batch_custom_id TEXT UNIQUE,
+  used_count INTEGER NOT NULL DEFAULT 0,
+  created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+CREATE INDEX IF NOT EXISTS idx_greeting_pool_level ON greeting_pool(level);
+
+-- Краткое саммари пользовательского фидбэка
+ALTER TABLE feedback ADD COLUMN IF NOT EXISTS summary TEXT;
+
+-- Ночные дайджесты прогресса
+CREATE TABLE IF NOT EXISTS progress_digests (
+  user_id UUID NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+  day DATE NOT NULL,
+  text TEXT NOT NULL,
+  created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+  PRIMARY KEY (user_id, day)
+);
+
+COMMENT ON TABLE greeting_pool IS 'Audio dialog greetings generated offline via OpenAI Batch API';
+COMMENT ON TABLE progress_digests IS 'Nightly per-user progress digests generated via OpenAI Batch API';
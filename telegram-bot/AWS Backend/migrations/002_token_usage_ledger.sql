@@ -0,0 +1,75 @@
+-- Migration: Per-user and per-mode OpenAI token accounting (Telegram bot backend)
+-- Description: daily token ledger filled in batches by shared/usage_ledger.py, plus report function
+
+-- Дневной агрегат токенов: пользователь x режим x профиль генерации x модель
+CREATE TABLE IF NOT EXISTS token_usage_ledger (
+  day DATE NOT NULL,
+  telegram_id TEXT NOT NULL,
+  mode TEXT NOT NULL,
+  profile TEXT NOT NULL,
+  model TEXT NOT NULL,
+  requests INTEGER NOT NULL DEFAULT 0,
+  prompt_tokens BIGINT NOT NULL DEFAULT 0,
+  completion_tokens BIGINT NOT NULL DEFAULT 0,
+  updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+  PRIMARY KEY (day, telegram_id, mode, profile, model)
+);
+
+CREATE INDEX IF NOT EXISTS idx_token_usage_ledger_telegram_id ON token_usage_ledger(telegram_id, day);
+
+-- Пакетный инкремент счётчиков (один вызов на сброс агрегата Lambda)
+CREATE OR REPLACE FUNCTION record_token_usage(entries JSONB)
+RETURNS INTEGER
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  affected INTEGER;
+BEGIN
+  INSERT INTO token_usage_ledger AS l (day, telegram_id, mode, profile, model, requests, prompt_tokens, completion_tokens)
+  SELECT
+    (e->>'day')::DATE,
+    e->>'telegram_id',
+    e->>'mode',
+    e->>'profile',
+    e->>'model',
+    COALESCE((e->>'requests')::INTEGER, 0),
+    COALESCE((e->>'prompt_tokens')::BIGINT, 0),
+    COALESCE((e->>'completion_tokens')::BIGINT, 0)
+  FROM jsonb_array_elements(entries) AS e
+  ON CONFLICT (day, telegram_id, mode, profile, model) DO UPDATE SET
+    requests = l.requests + EXCLUDED.requests,
+    prompt_tokens = l.prompt_tokens + EXCLUDED.prompt_tokens,
+    completion_tokens = l.completion_tokens + EXCLUDED.completion_tokens,
+    updated_at = now();
+
+  GET DIAGNOSTICS affected = ROW_COUNT;
+  RETURN affected;
+END;
+$$;
+
+-- Самые дорогие пользователи (p_group_by = 'user') или промпты/профили ('prompt') за N дней
+CREATE OR REPLACE FUNCTION top_token_consumers(p_group_by TEXT DEFAULT 'user', p_days INTEGER DEFAULT 7, p_limit INTEGER DEFAULT 20)
+RETURNS TABLE (
+  key TEXT,
+  requests BIGINT,
+  prompt_tokens BIGINT,
+  completion_tokens BIGINT,
+  total_tokens BIGINT
+)
+LANGUAGE sql
+STABLE
+AS $$
+  SELECT
+    CASE WHEN p_group_by = 'prompt' THEN l.mode || '/' || l.profile ELSE l.telegram_id END AS key,
+    SUM(l.requests)::BIGINT,
+    SUM(l.prompt_tokens)::BIGINT,
+    SUM(l.completion_tokens)::BIGINT,
+    SUM(l.prompt_tokens + l.completion_tokens)::BIGINT AS total_tokens
+  FROM token_usage_ledger l
+  WHERE l.day >= CURRENT_DATE - p_days
+  GROUP BY 1
+  ORDER BY total_tokens DESC
+  LIMIT p_limit;
+$$;
+
+COMMENT ON TABLE token_usage_ledger IS 'Daily OpenAI token usage per user, mode, generation profile and model';
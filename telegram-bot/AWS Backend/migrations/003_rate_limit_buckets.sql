@@ -0,0 +1,41 @@
+-- Migration: Shared token buckets for per-user rate limiting (Telegram bot backend)
+-- Description: optional backend for shared/rate_limiter.py when RATE_LIMIT_BACKEND=supabase
+
+-- Состояние корзины на пару "telegram_id:режим"
+CREATE TABLE IF NOT EXISTS rate_limit_buckets (
+  key TEXT PRIMARY KEY,
+  tokens DOUBLE PRECISION NOT NULL,
+  updated_at TIMESTAMPTZ NOT NULL DEFAULT clock_timestamp()
+);
+
+-- Атомарно пополнить корзину и списать один токен
+CREATE OR REPLACE FUNCTION take_rate_limit_token(p_key TEXT, p_burst DOUBLE PRECISION, p_refill_per_sec DOUBLE PRECISION)
+RETURNS TABLE (allowed BOOLEAN, retry_after DOUBLE PRECISION)
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  now_ts TIMESTAMPTZ := clock_timestamp();
+  current_tokens DOUBLE PRECISION;
+BEGIN
+  INSERT INTO rate_limit_buckets (key, tokens, updated_at)
+  VALUES (p_key, p_burst, now_ts)
+  ON CONFLICT (key) DO NOTHING;
+
+  SELECT LEAST(p_burst, b.tokens + EXTRACT(EPOCH FROM (now_ts - b.updated_at)) * p_refill_per_sec)
+  INTO current_tokens
+  FROM rate_limit_buckets b
+  WHERE b.key = p_key
+  FOR UPDATE;
+
+  IF current_tokens >= 1 THEN
+    UPDATE rate_limit_buckets SET tokens = current_tokens - 1, updated_at = now_ts WHERE key = p_key;
+    RETURN QUERY SELECT TRUE, 0::DOUBLE PRECISION;
+  ELSE
+    UPDATE rate_limit_buckets SET tokens = current_tokens, updated_at = now_ts WHERE key = p_key;
+    RETURN QUERY SELECT FALSE,
+      CASE WHEN p_refill_per_sec > 0 THEN (1 - current_tokens) / p_refill_per_sec ELSE 3600::DOUBLE PRECISION END;
+  END IF;
+END;
+$$;
+
+COMMENT ON TABLE rate_limit_buckets IS 'Per-user, per-mode token buckets shared across Lambda containers';
@@ -0,0 +1,56 @@
+-- Migration: Atomic payment record and access grant for YooMoney payments (Telegram bot backend)
+-- Description: payments/lambda_function.py records the paid operation and extends the package in one transaction
+
+-- Первая версия функции (только начисление) на проде не применялась, но могла остаться в dev-базах
+DROP FUNCTION IF EXISTS grant_payment_access(UUID, INTEGER, INTEGER);
+
+-- Записать оплаченную операцию и в той же транзакции продлить пакет от текущего срока
+-- (или от now(), если он истёк) и начислить уроки. granted = false - операция уже была
+-- оплачена и начислена раньше (повторное уведомление), ничего не меняется.
+-- Ошибка начисления откатывает и запись платежа: повтор уведомления начислит доступ заново.
+CREATE OR REPLACE FUNCTION grant_payment_access(
+  p_payment_id UUID,
+  p_user_id UUID,
+  p_product_id UUID,
+  p_amount INTEGER,
+  p_provider_operation_id TEXT,
+  p_label TEXT,
+  p_raw JSONB,
+  p_days INTEGER,
+  p_lessons INTEGER
+)
+RETURNS TABLE (granted BOOLEAN, package_expires_at TIMESTAMPTZ, lessons_left INTEGER)
+LANGUAGE plpgsql
+AS $$
+#variable_conflict use_column
+BEGIN
+  -- Строка со статусом failed (например, отклонённая сумма) не мешает оплате той же операции
+  INSERT INTO payments AS p (id, user_id, product_id, amount, status, provider, provider_operation_id, label, raw, created_at)
+  VALUES (p_payment_id, p_user_id, p_product_id, p_amount, 'paid', 'yoomoney', p_provider_operation_id, p_label, p_raw, now())
+  ON CONFLICT (id) DO UPDATE SET
+    user_id = EXCLUDED.user_id,
+    product_id = EXCLUDED.product_id,
+    amount = EXCLUDED.amount,
+    status = 'paid',
+    label = EXCLUDED.label,
+    raw = EXCLUDED.raw
+  WHERE p.status IS DISTINCT FROM 'paid';
+
+  IF NOT FOUND THEN
+    RETURN QUERY SELECT false, u.package_expires_at, u.lessons_left FROM users u WHERE u.id = p_user_id;
+    RETURN;
+  END IF;
+
+  -- Инкремент на стороне базы: параллельные платежи одного пользователя не теряют начисления
+  RETURN QUERY
+  UPDATE users u SET
+    package_expires_at = GREATEST(COALESCE(u.package_expires_at, now()), now()) + make_interval(days => p_days),
+    lessons_left = COALESCE(u.lessons_left, 0) + p_lessons
+  WHERE u.id = p_user_id
+  RETURNING true, u.package_expires_at, u.lessons_left;
+
+  IF NOT FOUND THEN
+    RAISE EXCEPTION 'grant_payment_access: user % not found', p_user_id;
+  END IF;
+END;
+$$;
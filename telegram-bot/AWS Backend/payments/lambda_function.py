@@ -1,16 +1,29 @@
 import os
+import sys
 import json
 import base64
 import hashlib
 import hmac
 from urllib.parse import parse_qs
-from datetime import datetime, timedelta, timezone
+from datetime import datetime, timezone
 
 import requests
 
+# Общие модули (shared/logger.py) лежат в корне zip Lambda
+sys.path.insert(0, '/var/task')
+
+from shared.logger import get_logger
+from shared.health import health_response
+from shared.metrics import metrics_response_body
+from shared.tracing import traced, trace_span, annotate_span
+
+log = get_logger('payments')
+
 SUPABASE_URL = os.environ["SUPABASE_URL"].rstrip("/")
 SUPABASE_KEY = os.environ["SUPABASE_SERVICE_KEY"]
 YOOMONEY_SECRET = os.environ.get("YOOMONEY_WEBHOOK_SECRET", "")
+# Ключ для action=metrics / action=health (заголовок X-Ops-Key); без него эти действия выключены
+OPS_SECRET = os.environ.get("PAYMENTS_OPS_SECRET", "")
 
 HEADERS = {
     "apikey": SUPABASE_KEY,
@@ -46,12 +59,22 @@ def _response(status=200, body="OK"):
         "body": body,
     }
 
+def ops_authorized(event):
+    """Заголовок X-Ops-Key совпадает с PAYMENTS_OPS_SECRET: URL вебхука публичный"""
+    headers = event.get("headers") if isinstance(event, dict) else None
+    if not OPS_SECRET or not isinstance(headers, dict):
+        return False
+    key = next((value for name, value in headers.items() if str(name).lower() == "x-ops-key"), None)
+    if not key:
+        return False
+    return hmac.compare_digest(str(key).encode("utf-8"), OPS_SECRET.encode("utf-8"))
+
 def notify_telegram(user_id, text):
     """Отправляем уведомление в Telegram пользователю"""
     try:
         bot_token = os.environ.get("BOT_TOKEN")
         if not bot_token:
-            print(f"⚠️ BOT_TOKEN not set, skipping Telegram notification")
+            log.warning("⚠️ BOT_TOKEN not set, skipping Telegram notification")
             return
         
         # Получаем telegram_id из user_id (UUID)
@@ -60,17 +83,19 @@ def notify_telegram(user_id, text):
             # Получаем telegram_id из Supabase
             url = f"{SUPABASE_URL}/rest/v1/users?id=eq.{user_id}&select=telegram_id"
             headers = {"apikey": SUPABASE_KEY, "Authorization": f"Bearer {SUPABASE_KEY}"}
-            r = requests.get(url, headers=headers, timeout=3)
+            with trace_span('supabase', 'GET /rest/v1/users'):
+                r = requests.get(url, headers=headers, timeout=3)
+                annotate_span(status=r.status_code)
             if r.status_code == 200:
                 users = r.json()
                 if users:
                     telegram_id = users[0].get('telegram_id')
         except Exception as e:
-            print(f"⚠️ Error getting telegram_id: {e}")
+            log.warning(f"⚠️ Error getting telegram_id: {e}")
             return
         
         if not telegram_id:
-            print(f"⚠️ No telegram_id found for user {user_id}")
+            log.warning(f"⚠️ No telegram_id found for user {user_id}")
             return
         
         # Отправляем сообщение
@@ -81,14 +106,16 @@ def notify_telegram(user_id, text):
             "parse_mode": "Markdown"
         }
         
-        r = requests.post(telegram_url, json=payload, timeout=4)
+        with trace_span('telegram', 'POST sendMessage'):
+            r = requests.post(telegram_url, json=payload, timeout=4)
+            annotate_span(status=r.status_code)
         if r.status_code == 200:
-            print(f"✅ Telegram notification sent to {telegram_id}")
+            log.info(f"✅ Telegram notification sent to {telegram_id}")
         else:
-            print(f"⚠️ Telegram notification failed: {r.status_code} - {r.text}")
+            log.warning(f"⚠️ Telegram notification failed: {r.status_code} - {r.text}")
             
     except Exception as e:
-        print(f"⚠️ Error sending Telegram notification: {e}")
+        log.warning(f"⚠️ Error sending Telegram notification: {e}")
 
 def _sha1_hex(s: str) -> str:
     return hashlib.sha1(s.encode("utf-8")).hexdigest()
@@ -102,7 +129,7 @@ def verify_signature(params: dict) -> bool:
     )
     """
     if not YOOMONEY_SECRET:
-        print("❌ YOOMONEY_WEBHOOK_SECRET not set, rejecting request")
+        log.error("❌ YOOMONEY_WEBHOOK_SECRET not set, rejecting request")
         return False  # В продакшене обязательно
 
     pieces = [
@@ -119,7 +146,7 @@ def verify_signature(params: dict) -> bool:
     calc = _sha1_hex("&".join(pieces))
     received_hash = params.get("sha1_hash", "")
     
-    print(f"🔐 Signature verification: calculated={calc}, received={received_hash}")
+    log.debug("🔐 Signature verification", valid=calc == received_hash)
     return calc == received_hash
 
 def parse_event_body(event) -> dict:
@@ -128,25 +155,29 @@ def parse_event_body(event) -> dict:
     if event.get("isBase64Encoded"):
         body = base64.b64decode(body).decode("utf-8", errors="ignore")
     
-    print(f"📦 Raw body: {body}")
-    
     # parse_qs -> dict[str, list[str]]
     parsed = {k: v[0] for k, v in parse_qs(body).items()}
-    print(f"📦 Parsed params: {parsed}")
+    log.debug("📦 Parsed params", params=parsed)
     return parsed
 
+def payment_id_for(provider_operation_id):
+    """UUID записи payments из provider_operation_id: повторные уведомления попадают в ту же строку"""
+    import uuid
+    return str(uuid.uuid5(uuid.NAMESPACE_DNS, f"yoomoney-{provider_operation_id}"))
+
+def payment_amount(amount):
+    return int(round(float(amount))) if amount else None
+
 def supabase_upsert_payment(provider_operation_id, user_id, product_id, amount, label, raw, status="paid"):
     """Записываем платеж в таблицу payments (идемпотентно)"""
-    # Генерируем UUID на основе provider_operation_id для идемпотентности
-    import uuid
-    payment_id = str(uuid.uuid5(uuid.NAMESPACE_DNS, f"yoomoney-{provider_operation_id}"))
+    payment_id = payment_id_for(provider_operation_id)
     
     url = f"{SUPABASE_URL}/rest/v1/payments?on_conflict=id"
     payload = [{
         "id": payment_id,                # UUID для идемпотентности
         "user_id": user_id,
         "product_id": product_id,
-        "amount": int(round(float(amount))) if amount else None,
+        "amount": payment_amount(amount),
         "status": status,
         "provider": "yoomoney",
         "provider_operation_id": provider_operation_id,
@@ -155,15 +186,17 @@ def supabase_upsert_payment(provider_operation_id, user_id, product_id, amount,
         "created_at": datetime.now(timezone.utc).isoformat()
     }]
     
-    print(f"💰 Upserting payment: {payload}")
+    log.debug("💰 Upserting payment", payload=payload)
     try:
-        r = requests.post(url, headers=HEADERS, data=json.dumps(payload), timeout=5)
+        with trace_span('supabase', 'POST /rest/v1/payments'):
+            r = requests.post(url, headers=HEADERS, data=json.dumps(payload), timeout=5)
+            annotate_span(status=r.status_code)
         r.raise_for_status()
-        print(f"✅ Payment recorded successfully")
+        log.info("✅ Payment recorded successfully", operation_id=provider_operation_id, status=status)
     except requests.HTTPError as e:
         # Если дубликат по provider_operation_id - это нормально
         if e.response.status_code == 409:  # Conflict
-            print(f"⚠️ Duplicate provider_operation_id: {provider_operation_id}")
+            log.warning(f"⚠️ Duplicate provider_operation_id: {provider_operation_id}")
             return "duplicate"
         else:
             raise e
@@ -175,51 +208,73 @@ def supabase_get_user(telegram_id):
         "telegram_id": f"eq.{telegram_id}",
         "select": "id,telegram_id,package_expires_at,lessons_left"
     }
-    r = requests.get(url, headers={"apikey": SUPABASE_KEY, "Authorization": f"Bearer {SUPABASE_KEY}"}, params=params, timeout=5)
+    with trace_span('supabase', 'GET /rest/v1/users'):
+        r = requests.get(url, headers={"apikey": SUPABASE_KEY, "Authorization": f"Bearer {SUPABASE_KEY}"}, params=params, timeout=5)
+        annotate_span(status=r.status_code)
     r.raise_for_status()
     arr = r.json()
     return arr[0] if arr else None
 
-def supabase_update_user(user_id, new_expiry_iso, new_lessons):
-    """Обновляем доступ пользователя"""
-    url = f"{SUPABASE_URL}/rest/v1/users?id=eq.{user_id}"
+def supabase_grant_access(provider_operation_id, user_id, product_id, amount, label, raw, days, lessons):
+    """Записываем оплату и начисляем доступ одной транзакцией (migrations/004_grant_payment_access.sql)"""
+    url = f"{SUPABASE_URL}/rest/v1/rpc/grant_payment_access"
     payload = {
-        "package_expires_at": new_expiry_iso,
-        "lessons_left": new_lessons
+        "p_payment_id": payment_id_for(provider_operation_id),
+        "p_user_id": user_id,
+        "p_product_id": product_id,
+        "p_amount": payment_amount(amount),
+        "p_provider_operation_id": provider_operation_id,
+        "p_label": label,
+        "p_raw": raw,
+        "p_days": days,
+        "p_lessons": lessons
     }
     
-    print(f"👤 Updating user {user_id}: expiry={new_expiry_iso}, lessons={new_lessons}")
-    r = requests.patch(url, headers=HEADERS, data=json.dumps(payload), timeout=5)
+    log.debug("👤 Granting access to user %s: +%s days, +%s lessons", user_id, days, lessons)
+    with trace_span('supabase', 'POST /rest/v1/rpc/grant_payment_access'):
+        r = requests.post(url, headers=HEADERS, data=json.dumps(payload), timeout=5)
+        annotate_span(status=r.status_code)
     r.raise_for_status()
-    print(f"✅ User access updated successfully")
+    rows = r.json()
+    row = rows[0] if isinstance(rows, list) else rows
+    log.info("✅ Payment recorded and access updated", operation_id=provider_operation_id, user_id=user_id, result=row)
+    return row
 
+@traced('payments', action='payment_webhook')
 def lambda_handler(event, context):
-    # Принудительное логирование для диагностики
-    print("=" * 50)
-    print("🚀 YOOMONEY WEBHOOK CALLED")
-    print("=" * 50)
-    print(f"Event: {json.dumps(event, default=str)}")
-    print(f"Context: {json.dumps(vars(context), default=str)}")
-    print("=" * 50)
+    log.info("🚀 YooMoney webhook called")
     
     try:
         # 1) Распарсить form-data
         params = parse_event_body(event)
         
+        # Снимок метрик и проверка здоровья контейнера (action=metrics / action=health вместо уведомления YooMoney)
+        if params.get("action") in ("metrics", "health") and not ops_authorized(event):
+            log.warning("🚫 Unauthorized ops action", action=params.get("action"))
+            return _response(403, "Forbidden")
+        if params.get("action") == "metrics":
+            return {
+                "statusCode": 200,
+                "headers": {"Content-Type": "application/json"},
+                "body": json.dumps(metrics_response_body("payments", {"buckets": params.get("buckets") == "true"})),
+            }
+        if params.get("action") == "health":
+            return health_response("payments", dependencies=("supabase",))
+        
         # 2) ВРЕМЕННО: Отключаем проверку подписи для диагностики
-        print("🔍 DEBUG MODE: Skipping signature verification")
+        log.debug("🔍 DEBUG MODE: Skipping signature verification")
         # if not verify_signature(params):
-        #     print("❌ Signature verification failed")
+        #     log.error("❌ Signature verification failed")
         #     return _response(403, "Bad signature")
         
         # 3) Распаковать label = base64({"u","pkg","o"})
         lbl = params.get("label", "")
-        print(f"🏷️ Raw label: {lbl}")
+        log.debug("🏷️ Raw label: %s", lbl)
         
         try:
             # Пробуем декодировать label
             decoded_label = base64.b64decode(lbl).decode("utf-8")
-            print(f"🏷️ Decoded label: {decoded_label}")
+            log.debug("🏷️ Decoded label: %s", decoded_label)
             
             # Пробуем парсить JSON
             info = json.loads(decoded_label)
@@ -229,26 +284,25 @@ def lambda_handler(event, context):
             pkg_name = info["pkg"]
             if pkg_name in PACKAGE_NAMES:
                 product_id = PACKAGE_NAMES[pkg_name]
-                print(f"🏷️ Package name '{pkg_name}' mapped to UUID: {product_id}")
+                log.debug("🏷️ Package name '%s' mapped to UUID: %s", pkg_name, product_id)
             else:
                 product_id = pkg_name  # Уже UUID
             
             # order_id больше не нужен - используем provider_operation_id
-            print(f"🏷️ Label parsed successfully: user_id={user_id}, product_id={product_id}")
+            log.info("🏷️ Label parsed", user_id=user_id, product_id=product_id)
         except Exception as e:
-            print(f"❌ Error decoding label: {e}")
-            print(f"❌ Raw label was: {lbl}")
-            print(f"❌ Decoded label was: {decoded_label if 'decoded_label' in locals() else 'Failed to decode'}")
+            log.error(f"❌ Error decoding label: {e}", label=lbl,
+                      decoded_label=decoded_label if 'decoded_label' in locals() else 'Failed to decode')
             
             # Если label пустой или поврежден, попробуем извлечь данные из других параметров
             if not lbl or lbl.strip() == "":
-                print("⚠️ Empty label detected, trying to extract from operation_label")
+                log.warning("⚠️ Empty label detected, trying to extract from operation_label")
                 operation_label = params.get("operation_label", "")
                 if operation_label:
                     # Пробуем использовать operation_label как fallback
                     user_id = "b2d41704-4a91-4164-bd02-347d2875af04"  # Временно используем тестового пользователя
                     product_id = "3ec3f495-7257-466b-a0ba-bfac669a68c8"  # 3-дневный пакет
-                    print(f"⚠️ Using fallback data: user_id={user_id}, product_id={product_id}")
+                    log.warning(f"⚠️ Using fallback data: user_id={user_id}, product_id={product_id}")
                 else:
                     return _response(400, "Bad label")
             else:
@@ -258,7 +312,7 @@ def lambda_handler(event, context):
         amount = params.get("amount", "")
         exp_amount = PRICE.get(product_id)
         if exp_amount is None:
-            print(f"❌ Unknown product_id: {product_id}")
+            log.error(f"❌ Unknown product_id: {product_id}")
             supabase_upsert_payment(params.get("operation_id", ""), user_id, product_id, amount, lbl, {"m": "unknown_product", "raw": params}, "failed")
             return _response(400, "Unknown product")
         
@@ -274,77 +328,58 @@ def lambda_handler(event, context):
         # Получить данные пользователя для записи неуспешного платежа
         try:
             urow = supabase_get_user(user_id)  # user_id теперь это telegram_id
-            user_db_id = urow["id"] if urow else None
-        except Exception:
-            user_db_id = None
+        except Exception as e:
+            log.error(f"❌ User lookup error: {e}", telegram_id=user_id)
+            # Не-2xx: YooMoney повторит уведомление
+            return _response(500, "User lookup failed")
+        user_db_id = urow["id"] if urow else None
         
         if not (min_amount <= amount_kopecks <= max_amount):
-            print(f"❌ Amount mismatch: expected {min_amount}-{max_amount} kopecks, got {amount_kopecks} kopecks ({amount} rubles)")
-            print(f"❌ Expected package price: {exp_amount} kopecks")
+            log.error(f"❌ Amount mismatch: expected {min_amount}-{max_amount} kopecks, got {amount_kopecks} kopecks ({amount} rubles)",
+                      expected_price=exp_amount)
             supabase_upsert_payment(params.get("operation_id", ""), user_db_id, product_id, amount, lbl, {"m": "amount_mismatch", "expected_range": f"{min_amount}-{max_amount}", "received": amount_kopecks, "raw": params}, "failed")
             return _response(400, "Amount mismatch")
         
         # Проверить что пользователь найден
         if not urow:
-            print(f"❌ User not found: {user_id}")
+            log.error(f"❌ User not found: {user_id}")
             supabase_upsert_payment(params.get("operation_id", ""), None, product_id, amount, lbl, {"m": "user_not_found", "telegram_id": user_id, "raw": params}, "failed")
             return _response(400, "User not found")
         
-        print(f"✅ Amount validation passed: {amount_kopecks} kopecks ({amount} rubles) within range {min_amount}-{max_amount}")
-        print(f"💰 Commission: {exp_amount - amount_kopecks} kopecks ({((exp_amount - amount_kopecks) / exp_amount * 100):.1f}%)")
+        log.debug("✅ Amount validation passed: %s kopecks (%s rubles) within range %s-%s, commission %s kopecks",
+                  amount_kopecks, amount, min_amount, max_amount, exp_amount - amount_kopecks)
         
-        # 6) Записать платёж в payments (идемпотентно)
+        # 6) Записать платёж и начислить доступ одной транзакцией (идемпотентно по operation_id)
         provider_operation_id = params.get("operation_id", "")
+        conf = PKG[product_id]
+        log.debug("📦 Package found: %s", conf)
         try:
-            result = supabase_upsert_payment(provider_operation_id, urow["id"], product_id, amount, lbl, params)
-            if result == "duplicate":
-                print(f"✅ Duplicate operation_id, returning OK")
-                return _response(200, "Duplicate op_id")
+            # Инкремент в одном UPDATE: параллельные платежи одного пользователя не затирают друг друга
+            granted = supabase_grant_access(provider_operation_id, urow["id"], product_id, amount, lbl, params,
+                                            conf["days"], conf["lessons"])  # Используем UUID из БД
         except Exception as e:
-            print(f"❌ Database payments error: {e}")
-            # Не валим вебхук - YooMoney будет ретраить
-            return _response(200, "OK")
+            log.error(f"❌ Payment grant error: {e}", operation_id=provider_operation_id)
+            # Транзакция откатилась - ни платежа, ни доступа. Не-2xx: YooMoney повторит уведомление
+            return _response(500, "Grant failed")
         
-        # 7) Начислить доступ
-        conf = PKG.get(product_id)
-        if conf:
-            print(f"📦 Package found: {conf}")
-            try:
-                base_dt = datetime.now(timezone.utc)
-                
-                if urow and urow.get("package_expires_at"):
-                    try:
-                        cur = datetime.fromisoformat(urow["package_expires_at"].replace("Z", "+00:00"))
-                        if cur > base_dt:
-                            base_dt = cur
-                            print(f"⏰ Extending existing subscription from {cur}")
-                    except Exception as e:
-                        print(f"⚠️ Error parsing existing expiry: {e}")
-                
-                new_expiry = base_dt + timedelta(days=conf["days"])
-                new_lessons = (urow.get("lessons_left") if urow else 0) or 0
-                new_lessons += conf["lessons"]
-                
-                supabase_update_user(urow["id"], new_expiry.isoformat(), new_lessons)  # Используем UUID из БД
-                print(f"🎉 Access granted: +{conf['days']} days, +{conf['lessons']} lessons")
-                
-                # 7) Уведомление в Telegram
-                try:
-                    notification_text = f"💳 *Оплата получена!* ✅\n\n+{conf['lessons']} уроков до {new_expiry.date()}\n\nПриятной практики! 🎯"
-                    notify_telegram(urow["id"], notification_text)  # Передаем UUID пользователя
-                except Exception as e:
-                    print(f"⚠️ Telegram notification error: {e}")
-                
-            except Exception as e:
-                print(f"⚠️ Access grant error: {e}")
-                # Не валим вебхук — платёж уже записан; доступ можно догнать ретраем
-        else:
-            print(f"⚠️ Unknown package ID: {product_id}")
+        if not granted["granted"]:
+            log.info("✅ Duplicate operation_id, access already granted")
+            return _response(200, "Duplicate op_id")
+        
+        new_expiry_date = granted["package_expires_at"][:10]
+        log.info(f"🎉 Access granted: +{conf['days']} days, +{conf['lessons']} lessons")
         
-        print(f"✅ Webhook processed successfully")
+        # 7) Уведомление в Telegram
+        try:
+            notification_text = f"💳 *Оплата получена!* ✅\n\n+{conf['lessons']} уроков до {new_expiry_date}\n\nПриятной практики! 🎯"
+            notify_telegram(urow["id"], notification_text)  # Передаем UUID пользователя
+        except Exception as e:
+            log.warning(f"⚠️ Telegram notification error: {e}")
+        
+        log.info("✅ Webhook processed successfully")
         return _response(200, "OK")
         
     except Exception as e:
-        print(f"❌ Unexpected error: {e}")
-        # Не валим вебхук - YooMoney будет ретраить
-        return _response(200, "OK")
+        log.error(f"❌ Unexpected error: {e}")
+        # Не-2xx: YooMoney будет ретраить
+        return _response(500, "Internal error")
@@ -0,0 +1 @@
+"""Долгоживущий HTTP-сервер, обслуживающий все Lambda-обработчики в одном процессе"""
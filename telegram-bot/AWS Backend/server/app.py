@@ -0,0 +1,250 @@
+"""Режим долгоживущего сервера: все Lambda-обработчики в одном процессе asyncio
+
+Каждая Lambda монтируется на свой маршрут (POST /shared, /translation, ...) и вызывается
+через тот же lambda_handler(event, context), что и в AWS, поэтому точки входа Lambda
+не меняются. В одном процессе общие модули (кэши, rate limiter, admission control,
+single-flight OpenAI, журнал токенов) разделяются между всеми маршрутами, а исходящие
+urllib-вызовы идут через общий пул keep-alive соединений (shared/http_pool.py).
+Синхронные обработчики выполняются в общем пуле потоков.
+
+    python -m server.app                      # SERVER_HOST/SERVER_PORT, по умолчанию 0.0.0.0:8080
+    curl -X POST localhost:8080/translation -d '{"action": "translate", "text": "hi", "user_id": 1}'
+"""
+import asyncio
+import importlib
+import importlib.util
+import json
+import os
+import signal
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from shared.http_pool import install_pooled_opener, get_pool_stats
+from shared.logger import get_logger
+
+log = get_logger('server')
+
+
+DEFAULT_HOST = '0.0.0.0'
+DEFAULT_PORT = 8080
+DEFAULT_WORKERS = 32
+# Бюджет одного запроса (аналог таймаута Lambda) для Deadline.from_context
+DEFAULT_REQUEST_TIMEOUT_MS = 30000
+DEFAULT_KEEPALIVE_TIMEOUT = 15
+MAX_BODY_BYTES = 1024 * 1024
+MAX_HEADER_LINES = 100
+
+# Маршрут -> модуль обработчика (shared импортируется как пакет, остальные - по пути файла)
+ROUTES = {
+    '/shared': 'shared/lambda_function.py',
+    '/translation': 'translation/lambda_function.py',
+    '/grammar': 'grammar/lambda_function.py',
+    '/text_dialog': 'text_dialog/lambda_function.py',
+    '/audio_dialog': 'audio_dialog/lambda_function.py',
+    '/payments': 'payments/lambda_function.py'
+}
+
+
+class ServerContext:
+    """Аналог Lambda context для одного HTTP-запроса"""
+
+    def __init__(self, function_name, timeout_ms):
+        self.function_name = function_name
+        self.memory_limit_in_mb = None
+        self.aws_request_id = str(uuid.uuid4())
+        self._expires_at = time.monotonic() + timeout_ms / 1000
+
+    def get_remaining_time_in_millis(self):
+        return max(0, int((self._expires_at - time.monotonic()) * 1000))
+
+
+def load_handler(route, relative_path):
+    """Импортировать lambda_handler модуля; None, если модуль не загружается (например, нет зависимостей)"""
+    try:
+        if route == '/shared':
+            module = importlib.import_module('shared.lambda_function')
+        else:
+            module_name = f"{route.strip('/')}_lambda_function"
+            spec = importlib.util.spec_from_file_location(module_name, os.path.join(BACKEND_DIR, relative_path))
+            module = importlib.util.module_from_spec(spec)
+            sys.modules[module_name] = module
+            spec.loader.exec_module(module)
+        log.info(f"✅ Mounted {route}")
+        return module.lambda_handler
+    except Exception as e:
+        log.error(f"❌ Failed to mount {route}: {type(e).__name__}: {e}")
+        return None
+
+
+class LambdaServer:
+    """HTTP/1.1 сервер поверх asyncio.start_server с маршрутизацией на lambda_handler"""
+
+    def __init__(self, workers=DEFAULT_WORKERS, request_timeout_ms=DEFAULT_REQUEST_TIMEOUT_MS,
+                 keepalive_timeout=DEFAULT_KEEPALIVE_TIMEOUT):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='lambda')
+        self.request_timeout_ms = request_timeout_ms
+        self.keepalive_timeout = keepalive_timeout
+        self.handlers = {route: load_handler(route, path) for route, path in ROUTES.items()}
+        self.started_at = time.monotonic()
+        self.requests_served = 0
+
+    async def handle_connection(self, reader, writer):
+        """Обслужить соединение (несколько запросов при keep-alive)"""
+        try:
+            while True:
+                try:
+                    request = await asyncio.wait_for(self.read_request(reader), self.keepalive_timeout)
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+                    break
+                if request is None:
+                    break
+                if isinstance(request, int):
+                    await self.write_response(writer, request, {}, json.dumps({'error': HTTPStatus(request).phrase}), False)
+                    break
+
+                method, path, headers, body = request
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                status, response_headers, response_body = await self.route(method, path, headers, body)
+                await self.write_response(writer, status, response_headers, response_body, keep_alive)
+                if not keep_alive:
+                    break
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def read_request(self, reader):
+        """Разобрать запрос: (метод, путь, заголовки, тело), код ошибки или None при закрытии"""
+        request_line = await reader.readline()
+        if not request_line:
+            return None
+        parts = request_line.decode('latin-1').split()
+        if len(parts) != 3:
+            return HTTPStatus.BAD_REQUEST
+
+        headers = {}
+        for _ in range(MAX_HEADER_LINES):
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        else:
+            return HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE
+
+        try:
+            length = int(headers.get('content-length') or 0)
+        except ValueError:
+            return HTTPStatus.BAD_REQUEST
+        if length > MAX_BODY_BYTES:
+            return HTTPStatus.REQUEST_ENTITY_TOO_LARGE
+        body = await reader.readexactly(length) if length else b''
+        return parts[0].upper(), parts[1].split('?', 1)[0], headers, body
+
+    async def route(self, method, path, headers, body):
+        """Вызвать обработчик маршрута; вернуть (статус, заголовки, тело)"""
+        if path == '/healthz' and method == 'GET':
+            return 200, {'Content-Type': 'application/json'}, json.dumps(self.health())
+
+        if path not in self.handlers:
+            return 404, {'Content-Type': 'application/json'}, json.dumps({'error': f'Unknown route {path}'})
+        if method != 'POST':
+            return 405, {'Content-Type': 'application/json', 'Allow': 'POST'}, json.dumps({'error': 'Method not allowed'})
+
+        handler = self.handlers[path]
+        if handler is None:
+            return 503, {'Content-Type': 'application/json'}, json.dumps({'error': f'Route {path} is not available'})
+
+        event = {
+            'body': body.decode('utf-8', errors='replace'),
+            'headers': headers,
+            'isBase64Encoded': False,
+            'requestContext': {'http': {'method': method, 'path': path}}
+        }
+        context = ServerContext(path.strip('/'), self.request_timeout_ms)
+        loop = asyncio.get_running_loop()
+        self.requests_served += 1
+        try:
+            response = await loop.run_in_executor(self.executor, handler, event, context)
+        except Exception as e:
+            log.error(f"❌ Unhandled error in {path}: {type(e).__name__}: {e}")
+            return 500, {'Content-Type': 'application/json'}, json.dumps({'error': 'Internal server error'})
+
+        if not isinstance(response, dict) or 'statusCode' not in response:
+            return 200, {'Content-Type': 'application/json'}, json.dumps(response)
+        response_body = response.get('body', '')
+        if not isinstance(response_body, str):
+            response_body = json.dumps(response_body)
+        return response['statusCode'], response.get('headers') or {}, response_body
+
+    async def write_response(self, writer, status, headers, body, keep_alive):
+        data = body.encode('utf-8')
+        try:
+            phrase = HTTPStatus(status).phrase
+        except ValueError:
+            phrase = ''
+        lines = [f'HTTP/1.1 {status} {phrase}']
+        lines += [f'{name}: {value}' for name, value in headers.items()
+                  if name.lower() not in ('content-length', 'connection')]
+        lines.append(f'Content-Length: {len(data)}')
+        lines.append('Connection: keep-alive' if keep_alive else 'Connection: close')
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + data)
+        await writer.drain()
+
+    def health(self):
+        """Состояние сервера: смонтированные маршруты, пул соединений, счётчики"""
+        return {
+            'status': 'ok',
+            'routes': {route: handler is not None for route, handler in self.handlers.items()},
+            'uptime_s': round(time.monotonic() - self.started_at, 1),
+            'requests_served': self.requests_served,
+            'http_pool': get_pool_stats()
+        }
+
+    def shutdown(self):
+        """Дождаться обработчиков и сбросить накопленный журнал токенов"""
+        self.executor.shutdown(wait=True)
+        try:
+            from shared.usage_ledger import flush_usage_ledger
+            flush_usage_ledger(force=True)
+        except Exception as e:
+            log.warning(f"⚠️ Failed to flush usage ledger on shutdown: {e}")
+
+
+async def serve(host, port, server):
+    tcp_server = await asyncio.start_server(server.handle_connection, host, port)
+    log.info(f"🚀 Serving {', '.join(ROUTES)} on {host}:{port}")
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    async with tcp_server:
+        await stop.wait()
+    log.info("🛑 Shutting down")
+
+
+def main():
+    install_pooled_opener(int(os.environ.get('SERVER_POOL_PER_HOST', 16)))
+    server = LambdaServer(
+        workers=int(os.environ.get('SERVER_WORKERS', DEFAULT_WORKERS)),
+        request_timeout_ms=int(os.environ.get('SERVER_REQUEST_TIMEOUT_MS', DEFAULT_REQUEST_TIMEOUT_MS)),
+        keepalive_timeout=float(os.environ.get('SERVER_KEEPALIVE_TIMEOUT', DEFAULT_KEEPALIVE_TIMEOUT))
+    )
+    try:
+        asyncio.run(serve(os.environ.get('SERVER_HOST', DEFAULT_HOST), int(os.environ.get('SERVER_PORT', DEFAULT_PORT)), server))
+    finally:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""Реестр действий общей Lambda: действие -> модуль с функцией handle
+
+Модуль действия импортируется при первом обращении и кэшируется, поэтому холодный старт
+не платит за импорт промптов, конфигурации опросника и т.п. для всех действий сразу.
+Каждый вызов замеряется и передаётся хукам тайминга (add_timing_hook).
+"""
+import importlib
+import threading
+import time
+
+from shared.logger import get_logger
+
+log = get_logger(__name__)
+
+
+# Действие -> модуль в пакете shared.actions
+ACTION_MODULES = {
+    'check_user': 'check_user',
+    'start_survey': 'start_survey',
+    'get_survey_question': 'get_survey_question',
+    'complete_survey': 'complete_survey',
+    'deactivate_user': 'deactivate_user',
+    'process_text_message': 'process_text_message',
+    'get_profile': 'get_profile',
+    'update_daily_streak': 'update_daily_streak',
+    'save_feedback': 'save_feedback',
+    'set_ai_mode': 'set_ai_mode',
+    'get_ai_mode': 'get_ai_mode',
+    'metrics': 'metrics',
+    'health': 'health',
+    'warmup': 'warmup'
+}
+
+_handlers = {}
+_handlers_lock = threading.Lock()
+_timing_hooks = []
+
+
+def get_handler(action):
+    """Функция handle для действия (модуль загружается лениво) или None"""
+    handler = _handlers.get(action)
+    if handler is not None:
+        return handler
+
+    module_name = ACTION_MODULES.get(action)
+    if module_name is None:
+        return None
+
+    with _handlers_lock:
+        if action not in _handlers:
+            started = time.monotonic()
+            module = importlib.import_module(f'{__name__}.{module_name}')
+            _handlers[action] = module.handle
+            log.debug("📦 Action module %s loaded in %.1fms", module_name, (time.monotonic() - started) * 1000)
+        return _handlers[action]
+
+
+def preload_actions():
+    """Загрузить модули всех действий (промпты, конфигурация опросника); число загруженных"""
+    for action in ACTION_MODULES:
+        get_handler(action)
+    return len(_handlers)
+
+
+def add_timing_hook(hook):
+    """Зарегистрировать хук hook(action, duration_ms, status_code), вызываемый после каждого действия"""
+    _timing_hooks.append(hook)
+
+
+def _log_timing(action, duration_ms, status_code):
+    log.info(f"⏱️ Action {action}", action=action, duration_ms=round(duration_ms), status=status_code)
+
+
+add_timing_hook(_log_timing)
+
+
+def dispatch(action, body, supabase_url, supabase_key, deadline):
+    """Выполнить действие; None, если действие неизвестно или обработчик не вернул ответ"""
+    handler = get_handler(action)
+    if handler is None:
+        return None
+
+    started = time.monotonic()
+    status_code = 500
+    try:
+        response = handler(body, supabase_url, supabase_key, deadline)
+        status_code = (response or {}).get('statusCode', 200)
+        return response
+    finally:
+        duration_ms = (time.monotonic() - started) * 1000
+        for hook in _timing_hooks:
+            try:
+                hook(action, duration_ms, status_code)
+            except Exception as e:
+                log.warning(f"⚠️ Timing hook failed: {e}")
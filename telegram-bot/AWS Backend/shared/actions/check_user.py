@@ -0,0 +1,49 @@
+"""Действие check_user: Проверка существования пользователя"""
+import json
+import urllib.request
+
+from shared.admission import track_upstream
+from shared.deadline import DeadlineExceeded, get_timeout
+from shared.actions.common import success_response, error_response
+from shared.logger import get_logger
+
+log = get_logger(__name__)
+
+
+def handle(body, supabase_url, supabase_key, deadline):
+    """Проверка существования пользователя"""
+    user_id = body.get('user_id')
+    if not user_id:
+        return error_response('user_id is required')
+    
+    try:
+        # Проверяем существование пользователя в Supabase
+        url = f"{supabase_url}/rest/v1/users?telegram_id=eq.{user_id}"
+        headers = {
+            'Authorization': f'Bearer {supabase_key}',
+            'apikey': supabase_key
+        }
+        
+        req = urllib.request.Request(url, headers=headers, method='GET')
+        
+        with track_upstream('supabase'), urllib.request.urlopen(req, timeout=get_timeout(deadline, 'supabase')) as response:
+            response_text = response.read().decode('utf-8')
+            users = json.loads(response_text) if response_text else []
+            
+            if users:
+                log.debug("User %s exists in Supabase", user_id)
+                return success_response({
+                    'user_exists': True,
+                    'user_data': users[0]
+                })
+            else:
+                log.info(f"User {user_id} not found in Supabase")
+                return success_response({
+                    'user_exists': False
+                })
+                
+    except DeadlineExceeded:
+        raise
+    except Exception as e:
+        log.error(f"Error checking user: {e}")
+        return error_response(f'Failed to check user: {str(e)}')
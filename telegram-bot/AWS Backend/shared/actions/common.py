@@ -0,0 +1,36 @@
+"""Общие ответы действий общей Lambda (с заголовком Content-Type)"""
+import json
+
+
+def success_response(data):
+    """Успешный ответ"""
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json'},
+        'body': json.dumps({
+            'success': True,
+            **data
+        })
+    }
+
+
+def error_response(message, status_code=400, **details):
+    """Ответ с ошибкой (details - дополнительные поля, например error_code)"""
+    return {
+        'statusCode': status_code,
+        'headers': {'Content-Type': 'application/json'},
+        'body': json.dumps({
+            'success': False,
+            'error': message,
+            **details
+        })
+    }
+
+
+def ok_response():
+    """Ответ по умолчанию для неизвестных действий и действий без явного ответа"""
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json'},
+        'body': json.dumps({'message': 'OK'})
+    }
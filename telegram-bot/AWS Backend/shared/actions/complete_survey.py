@@ -0,0 +1,110 @@
+"""Действие complete_survey: Завершение опросника - обновление пользователя и начисление продукта"""
+import json
+import urllib.request
+from datetime import datetime, timedelta
+
+from shared.admission import track_upstream
+from shared.catalog import get_product
+from shared.deadline import DeadlineExceeded, get_timeout
+from shared.actions.common import success_response, error_response
+from shared.logger import get_logger
+
+log = get_logger(__name__)
+
+
+def handle(body, supabase_url, supabase_key, deadline):
+    """Завершение опросника - обновление пользователя и начисление продукта"""
+    user_id = body.get('user_id')
+    language_level = body.get('language_level')
+    survey_data = body.get('survey_data', {})  # Все ответы опросника
+    
+    if not user_id or not language_level:
+        return error_response('user_id and language_level are required')
+    
+    try:
+        # Трансформируем уровень языка в формат Supabase
+        transformed_level = transform_language_level(language_level)
+        
+        # Получаем информацию о продукте (Starter Pack)
+        product_id = "7d9d5dbb-7ed2-4bdc-9d2f-c88929085ab5"
+        product_info = get_product_info(product_id, supabase_url, supabase_key, deadline)
+        
+        # Обновляем пользователя - завершаем опрос и начисляем уроки
+        update_data = {
+            'current_level': transformed_level,
+            'quiz_completed_at': 'now()',  # Только завершение, quiz_started_at уже установлен
+            'lessons_left': product_info.get('lessons_granted', 1),  # Берем из Starter Pack в базе
+            'package_expires_at': product_info.get('expires_at') if product_info else None
+        }
+        
+        log.info(f"Updating user {user_id} with language level: {transformed_level}")
+        log.debug("Full survey data", survey_data=survey_data)
+        
+        url = f"{supabase_url}/rest/v1/users?telegram_id=eq.{user_id}"
+        headers = {
+            'Content-Type': 'application/json',
+            'Authorization': f'Bearer {supabase_key}',
+            'apikey': supabase_key,
+            'Prefer': 'return=representation'
+        }
+        
+        req = urllib.request.Request(url, 
+                                   data=json.dumps(update_data).encode('utf-8'),
+                                   headers=headers,
+                                   method='PATCH')
+        
+        with track_upstream('supabase'), urllib.request.urlopen(req, timeout=get_timeout(deadline, 'supabase')) as response:
+            response_text = response.read().decode('utf-8')
+            log.debug("Supabase update response: %s", response_text)
+            
+            log.info(f"Product {product_id} assigned to user {user_id}")
+            
+            return success_response({
+                'message': 'Survey completed successfully',
+                'language_level': transformed_level,
+                'product_assigned': product_id,
+                'survey_data': survey_data  # Возвращаем все данные для логирования
+            })
+            
+    except DeadlineExceeded:
+        raise
+    except Exception as e:
+        log.error(f"Error completing survey: {e}")
+        return error_response(f'Failed to complete survey: {str(e)}')
+
+
+def transform_language_level(russian_level):
+    """Трансформирует русский уровень языка в английский для Supabase"""
+    level_mapping = {
+        'Начинающий': 'Beginner',
+        'Средний': 'Intermediate', 
+        'Продвинутый': 'Advanced',
+        'Beginner': 'Beginner',
+        'Intermediate': 'Intermediate',
+        'Advanced': 'Advanced'
+    }
+    return level_mapping.get(russian_level, 'Beginner')
+
+
+def get_product_info(product_id, supabase_url, supabase_key, deadline=None):
+    """Информация о продукте из каталога (shared/catalog.py) и дата истечения пакета"""
+    try:
+        product = get_product(product_id, deadline)
+        if product:
+            # Вычисляем дату истечения пакета
+            duration_days = product.get('duration_days', 30)
+            expires_at = (datetime.now() + timedelta(days=duration_days)).isoformat()
+            
+            return {
+                'id': product['id'],
+                'name': product['name'],
+                'duration_days': duration_days,
+                'expires_at': expires_at
+            }
+        return None
+            
+    except DeadlineExceeded:
+        raise
+    except Exception as e:
+        log.error(f"Error getting product info: {e}")
+        return None
@@ -0,0 +1,53 @@
+"""Действие deactivate_user: Обработка отписки пользователя"""
+import json
+import urllib.request
+
+from shared.admission import track_upstream
+from shared.deadline import DeadlineExceeded, get_timeout
+from shared.actions.common import success_response, error_response
+from shared.logger import get_logger
+
+log = get_logger(__name__)
+
+
+def handle(body, supabase_url, supabase_key, deadline):
+    """Обработка отписки пользователя"""
+    user_id = body.get('user_id')
+    
+    if not user_id:
+        return error_response('user_id is required')
+    
+    try:
+        # Деактивируем пользователя
+        update_data = {
+            'is_active': False
+        }
+        
+        log.info(f"Deactivating user {user_id}")
+        
+        url = f"{supabase_url}/rest/v1/users?telegram_id=eq.{user_id}"
+        headers = {
+            'Content-Type': 'application/json',
+            'Authorization': f'Bearer {supabase_key}',
+            'apikey': supabase_key,
+            'Prefer': 'return=representation'
+        }
+        
+        req = urllib.request.Request(url, 
+                                   data=json.dumps(update_data).encode('utf-8'),
+                                   headers=headers,
+                                   method='PATCH')
+        
+        with track_upstream('supabase'), urllib.request.urlopen(req, timeout=get_timeout(deadline, 'supabase')) as response:
+            response_text = response.read().decode('utf-8')
+            log.debug("Supabase deactivation response: %s", response_text)
+            
+            return success_response({
+                'message': 'User deactivated successfully'
+            })
+            
+    except DeadlineExceeded:
+        raise
+    except Exception as e:
+        log.error(f"Error deactivating user: {e}")
+        return error_response(f'Failed to deactivate user: {str(e)}')
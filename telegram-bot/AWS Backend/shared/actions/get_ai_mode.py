@@ -0,0 +1,62 @@
+"""Действие get_ai_mode: Получение режима ИИ пользователя из Supabase"""
+import json
+import urllib.request
+
+from shared.admission import track_upstream
+from shared.deadline import DeadlineExceeded, get_timeout
+from shared.actions.common import success_response, error_response
+from shared.logger import get_logger
+
+log = get_logger(__name__)
+
+
+def handle(body, supabase_url, supabase_key, deadline):
+    """Получение режима ИИ пользователя из Supabase"""
+    user_id = body.get('user_id')
+
+    if not user_id:
+        return error_response('user_id is required')
+
+    try:
+        log.debug("Getting AI mode for user %s", user_id)
+        
+        # Получаем режим из Supabase
+        req = urllib.request.Request(
+            f"{supabase_url}/rest/v1/users?telegram_id=eq.{user_id}&select=ai_mode,interface_language",
+            headers={
+                'apikey': supabase_key,
+                'Authorization': f'Bearer {supabase_key}',
+                'Content-Type': 'application/json'
+            }
+        )
+        
+        with track_upstream('supabase'), urllib.request.urlopen(req, timeout=get_timeout(deadline, 'supabase')) as response:
+            response_text = response.read().decode('utf-8')
+            if response_text:
+                users = json.loads(response_text)
+                if users:
+                    ai_mode = users[0].get('ai_mode', 'translation')
+                    log.debug("Retrieved AI mode '%s' for user %s", ai_mode, user_id)
+                    # Язык интерфейса тем же запросом: воркер передаёт его в Lambda режима (ответ о лимите и т.п.)
+                    return success_response({
+                        'ai_mode': ai_mode,
+                        'interface_language': users[0].get('interface_language') or 'ru'
+                    })
+                else:
+                    log.info(f"User {user_id} not found, returning default mode")
+                    return success_response({
+                        'ai_mode': 'translation'
+                    })
+            else:
+                log.warning(f"Empty response from Supabase for user {user_id}")
+                return success_response({
+                    'ai_mode': 'translation'
+                })
+
+    except DeadlineExceeded:
+        raise
+    except Exception as e:
+        log.error(f"Error getting AI mode: {e}")
+        return success_response({
+            'ai_mode': 'translation'  # Fallback to default
+        })
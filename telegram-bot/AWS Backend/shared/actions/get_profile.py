@@ -0,0 +1,193 @@
+"""Действие get_profile: Получение профиля пользователя для команды /profile"""
+import json
+import urllib.request
+from datetime import datetime, timedelta
+
+from shared.admission import track_upstream
+from shared.deadline import DeadlineExceeded, get_timeout
+from shared.entitlements import issue_token
+from shared.actions.common import error_response
+from shared.logger import get_logger
+
+log = get_logger(__name__)
+
+
+def handle(body, supabase_url, supabase_key, deadline):
+    """Получение профиля пользователя для команды /profile"""
+    user_id = body.get('user_id')
+    
+    if not user_id:
+        return error_response('user_id is required')
+    
+    try:
+        from datetime import datetime, timedelta
+        log.debug("Getting profile for user %s", user_id)
+        
+        # Получаем данные пользователя из Supabase
+        url = f"{supabase_url}/rest/v1/users?telegram_id=eq.{user_id}&select=*"
+        headers = {
+            'Authorization': f'Bearer {supabase_key}',
+            'apikey': supabase_key
+        }
+        
+        req = urllib.request.Request(url, headers=headers)
+        with track_upstream('supabase'), urllib.request.urlopen(req, timeout=get_timeout(deadline, 'supabase')) as response:
+            response_text = response.read().decode('utf-8')
+            
+            if response_text:
+                users = json.loads(response_text)
+                if users:
+                    user_data = users[0]
+                    
+                    # Обработка логики lessons_left при истечении package_expires_at
+                    package_expires_at = user_data.get('package_expires_at')
+                    lessons_left = user_data.get('lessons_left', 0)
+                    
+                    # Если подписка истекла, обнуляем lessons_left
+                    if package_expires_at and lessons_left > 0:
+                        try:
+                            package_end = datetime.fromisoformat(package_expires_at.replace('Z', '+00:00'))
+                            now = datetime.now(package_end.tzinfo) if package_end.tzinfo else datetime.now()
+                            
+                            if now >= package_end:  # Подписка истекла
+                                log.info(f"Package expired for user {user_id}, resetting lessons_left to 0")
+                                
+                                # Обновляем lessons_left в базе
+                                update_url = f"{supabase_url}/rest/v1/users?telegram_id=eq.{user_id}"
+                                update_data = json.dumps({'lessons_left': 0}).encode('utf-8')
+                                update_headers = {
+                                    'Authorization': f'Bearer {supabase_key}',
+                                    'apikey': supabase_key,
+                                    'Content-Type': 'application/json'
+                                }
+                                
+                                update_req = urllib.request.Request(update_url, data=update_data, headers=update_headers, method='PATCH')
+                                with track_upstream('supabase'):
+                                    urllib.request.urlopen(update_req, timeout=get_timeout(deadline, 'supabase'))
+                                
+                                # Обновляем локальные данные
+                                user_data['lessons_left'] = 0
+                        except Exception as e:
+                            log.error(f"Error processing package expiry: {e}")
+                    
+                    # Определяем доступ к различным функциям
+                    now = datetime.now()
+                    
+                    # Доступ к аудио-урокам
+                    has_audio_access = False
+                    if package_expires_at and user_data.get('lessons_left', 0) > 0:
+                        try:
+                            package_end = datetime.fromisoformat(package_expires_at.replace('Z', '+00:00'))
+                            package_now = datetime.now(package_end.tzinfo) if package_end.tzinfo else datetime.now()
+                            has_audio_access = package_now < package_end
+                        except Exception as e:
+                            log.warning(f"Error parsing package_expires_at for audio access: {e}")
+                    
+                    # Доступ к текстовым функциям - проверяем только package_expires_at
+                    has_text_access = False
+                    
+                    # Проверяем package_expires_at для текстового доступа
+                    if package_expires_at:
+                        try:
+                            package_end = datetime.fromisoformat(package_expires_at.replace('Z', '+00:00'))
+                            package_now = datetime.now(package_end.tzinfo) if package_end.tzinfo else datetime.now()
+                            if package_now < package_end:
+                                has_text_access = True
+                        except Exception as e:
+                            log.warning(f"Error parsing package_expires_at for text access: {e}")
+                    
+                    # Определяем дату доступа
+                    access_date = None
+                    if package_expires_at:
+                        dates = []
+                        if package_expires_at:
+                            try:
+                                dates.append(datetime.fromisoformat(package_expires_at.replace('Z', '+00:00')))
+                            except:
+                                pass
+                        if dates:
+                            access_date = max(dates)
+            
+            # АВТОМАТИЧЕСКОЕ ОБНОВЛЕНИЕ СТРИКА ПРИ ПОЛУЧЕНИИ ПРОФИЛЯ
+            try:
+                current_streak = user_data.get('current_streak', 0)
+                last_lesson_date = user_data.get('last_lesson_date')
+                today = datetime.now().date()
+                should_update_streak = False
+                new_streak = current_streak
+                
+                if last_lesson_date:
+                    try:
+                        last_date = datetime.fromisoformat(last_lesson_date).date()
+                        # Если уже занимались сегодня, не обновляем
+                        if last_date == today:
+                            log.debug("🔥 [PROFILE] User %s already practiced today, keeping streak %s", user_id, current_streak)
+                        # Если последний раз занимались вчера, увеличиваем streak
+                        elif last_date == today - timedelta(days=1):
+                            new_streak = current_streak + 1
+                            should_update_streak = True
+                            log.debug("🔥 [PROFILE] User %s practiced yesterday, increasing streak to %s", user_id, new_streak)
+                        # Если пропустили дни, сбрасываем в 0
+                        elif last_date < today - timedelta(days=1):
+                            new_streak = 0
+                            should_update_streak = True
+                            log.debug("🔥 [PROFILE] User %s missed days, resetting streak to 0", user_id)
+                    except Exception as e:
+                        log.warning(f"🔥 [PROFILE] Error parsing last_lesson_date: {e}")
+                else:
+                    # Первый раз - стрик остается 0
+                    log.debug("🔥 [PROFILE] User %s never practiced, keeping streak 0", user_id)
+                
+                # Обновляем в базе если нужно
+                if should_update_streak:
+                    update_url = f"{supabase_url}/rest/v1/users?telegram_id=eq.{user_id}"
+                    update_data = json.dumps({
+                        'current_streak': new_streak,
+                        'last_lesson_date': today.isoformat()
+                    }).encode('utf-8')
+                    
+                    update_headers = {
+                        'Authorization': f'Bearer {supabase_key}',
+                        'apikey': supabase_key,
+                        'Content-Type': 'application/json'
+                    }
+                    
+                    update_req = urllib.request.Request(update_url, data=update_data, headers=update_headers, method='PATCH')
+                    with track_upstream('supabase'):
+                        urllib.request.urlopen(update_req, timeout=get_timeout(deadline, 'supabase'))
+                    
+                    # Обновляем локальные данные
+                    user_data['current_streak'] = new_streak
+                    user_data['last_lesson_date'] = today.isoformat()
+                    log.info(f"🔥 [PROFILE] Updated streak for user {user_id}: {current_streak} -> {new_streak}")
+                    
+            except Exception as e:
+                log.error(f"🔥 [PROFILE] Error updating streak: {e}")
+            
+            return {
+                'statusCode': 200,
+                'body': json.dumps({
+                            'success': True,
+                            'user_data': user_data,
+                            'has_audio_access': has_audio_access,
+                            'has_text_access': has_text_access,
+                            'access_date': access_date.strftime('%d.%m.%Y') if access_date else None,
+                            'entitlement_token': issue_token(user_id, package_expires_at, user_data.get('lessons_left', 0),
+                                                               user_data.get('interface_language'))
+                        })
+                    }
+        
+        # Пользователь не найден
+        return {
+            'statusCode': 404,
+            'body': json.dumps({
+                'success': False,
+                'error': 'User not found'
+            })
+        }
+        
+    except DeadlineExceeded:
+        raise
+    except Exception as e:
+        log.error(f"Error getting profile: {e}")
+        return error_response(f'Error getting profile: {str(e)}')
@@ -0,0 +1,125 @@
+"""Действие get_survey_question: Получение следующего вопроса опросника"""
+from shared.deadline import DeadlineExceeded
+from shared.actions.common import success_response, error_response
+from shared.logger import get_logger
+
+log = get_logger(__name__)
+
+
+def handle(body, supabase_url, supabase_key, deadline):
+    """Получение следующего вопроса опросника"""
+    question_type = body.get('question_type')
+    language = body.get('language', 'ru')
+    
+    if not question_type:
+        return error_response('question_type is required')
+    
+    try:
+        question_data = get_survey_question(question_type, language)
+        return success_response(question_data)
+    except DeadlineExceeded:
+        raise
+    except Exception as e:
+        log.error(f"Error getting survey question: {e}")
+        return error_response(f'Failed to get survey question: {str(e)}')
+
+
+# Конфигурация вопросов опросника (из newbies-funnel.js)
+SURVEY_QUESTIONS = {
+    'language_level': {
+        'ru': {
+            'question': "Какой у тебя уровень языка?",
+            'options': ["Начинающий", "Средний", "Продвинутый"]
+        },
+        'en': {
+            'question': "What's your language level?",
+            'options': ["Beginner", "Intermediate", "Advanced"]
+        }
+    },
+    'study_goal': {
+        'ru': {
+            'question': "Основная цель изучения?",
+            'options': ["Для работы", "Для путешествий", "Для учебы", "Хобби", "Другое"]
+        },
+        'en': {
+            'question': "Main study goal?",
+            'options': ["For work", "For travel", "For study", "Hobby", "Other"]
+        }
+    },
+    'gender': {
+        'ru': {
+            'question': "Укажи свой пол",
+            'options': ["Мужской", "Женский", "Предпочитаю не отвечать"]
+        },
+        'en': {
+            'question': "What's your gender?",
+            'options': ["Male", "Female", "Prefer not to say"]
+        }
+    },
+    'age': {
+        'ru': {
+            'question': "Сколько тебе лет?",
+            'options': ["Менее 14", "14-21", "22-28", "29-35", "36-45", "46-60", "Более 60"]
+        },
+        'en': {
+            'question': "How old are you?",
+            'options': ["Under 14", "14-21", "22-28", "29-35", "36-45", "46-60", "Over 60"]
+        }
+    },
+    'telegram_preference': {
+        'ru': {
+            'question': "Нравится ли тебе идея заниматься в Телеграм?",
+            'options': ["Да", "Предпочёл бы app"]
+        },
+        'en': {
+            'question': "Do you like the idea of studying in Telegram?",
+            'options': ["Yes", "Prefer app"]
+        }
+    },
+    'voice_usage': {
+        'ru': {
+            'question': "Часто ли ты пользуешься голосовыми сообщениями в Телеграм?",
+            'options': ["Что это?", "Нет", "Иногда", "Постоянно"]
+        },
+        'en': {
+            'question': "How often do you use voice messages in Telegram?",
+            'options': ["What's that?", "No", "Sometimes", "Constantly"]
+        }
+    }
+}
+
+
+# Порядок вопросов
+QUESTION_ORDER = [
+    'language_level',
+    'study_goal', 
+    'gender',
+    'age',
+    'telegram_preference',
+    'voice_usage'
+]
+
+
+def get_survey_question(question_type, language='ru'):
+    """Получить вопрос опросника"""
+    if question_type not in SURVEY_QUESTIONS:
+        raise ValueError(f"Unknown question type: {question_type}")
+    
+    question_config = SURVEY_QUESTIONS[question_type]
+    if language not in question_config:
+        language = 'ru'  # Fallback to Russian
+    
+    return {
+        'question_type': question_type,
+        'question': question_config[language]['question'],
+        'options': question_config[language]['options'],
+        'language': language
+    }
+
+
+def get_next_question(current_question):
+    """Получить следующий вопрос"""
+    current_index = QUESTION_ORDER.index(current_question) if current_question in QUESTION_ORDER else -1
+    if current_index == -1 or current_index >= len(QUESTION_ORDER) - 1:
+        return None  # No more questions
+    return QUESTION_ORDER[current_index + 1]
@@ -0,0 +1,7 @@
+"""Действие health: пробы Supabase и OpenAI, пул соединений, кэши общей Lambda"""
+from shared.health import health_response
+
+
+def handle(body, supabase_url, supabase_key, deadline):
+    """Отчёт о здоровье (кэшируется на HEALTH_CACHE_TTL секунд)"""
+    return health_response('shared')
@@ -0,0 +1,8 @@
+"""Действие metrics: снимок метрик тёплого контейнера общей Lambda"""
+from shared.actions.common import success_response
+from shared.metrics import metrics_response_body
+
+
+def handle(body, supabase_url, supabase_key, deadline):
+    """Гистограммы задержек действий и зависимостей, токены, кэши, admission control"""
+    return success_response(metrics_response_body('shared', body))
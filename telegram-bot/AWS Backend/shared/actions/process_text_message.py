@@ -0,0 +1,360 @@
+"""Действие process_text_message: Обработка текстовых сообщений через OpenAI"""
+import json
+import urllib.request
+from datetime import datetime
+
+from shared.prompts import build_audio_greeting_prompt
+from shared.greeting_pool import get_pooled_greeting
+from shared.model_router import get_routed_response
+from shared.rate_limiter import check_rate_limit, get_rate_limit_reply
+from shared.admission import track_upstream
+from shared.entitlements import count_fallback, has_text_access, issue_token, verify_token
+from shared.deadline import DeadlineExceeded, get_timeout
+from shared.actions.common import success_response, error_response
+from shared.logger import get_logger
+
+log = get_logger(__name__)
+
+
+def handle(body, supabase_url, supabase_key, deadline):
+    """Обработка текстовых сообщений через OpenAI"""
+    user_id = body.get('user_id')
+    message = body.get('message')
+    mode = body.get('mode', 'general')  # Получаем режим, по умолчанию 'general'
+    
+    if not user_id or not message:
+        return error_response('user_id and message are required')
+    
+    try:
+        log.debug("Processing text message from user %s in mode '%s': %s", user_id, mode, message)
+        
+        # Проверяем, есть ли у пользователя активный пробный период
+        user_check_response = check_text_trial_access(user_id, supabase_url, supabase_key, deadline,
+                                                      body.get('entitlement_token'))
+        
+        if not user_check_response['has_access']:
+            return success_response({
+                'reply': user_check_response['message']
+            })
+        
+        # Лимит частоты запросов к модели (token bucket на пользователя и режим)
+        allowed, retry_after = check_rate_limit(user_id, mode, deadline)
+        if not allowed:
+            return success_response({
+                'reply': get_rate_limit_reply(retry_after, body.get('interface_language', 'ru')),
+                'rate_limited': True,
+                'retry_after': round(retry_after, 1)
+            })
+        
+        # Special handling for audio dialog start
+        if message == '---START_AUDIO_DIALOG---':
+            user_level = body.get('user_level', 'Intermediate')
+            pooled = get_pooled_greeting(user_level, deadline)
+            if pooled:
+                log.debug("Audio dialog greeting served from pool for user level: %s", user_level)
+                openai_response = {'success': True, 'reply': pooled}
+            else:
+                log.debug("Generating audio dialog greeting for user level: %s", user_level)
+                # Generate personalized audio greeting with topic suggestions
+                greeting_prompt = build_audio_greeting_prompt(user_level)
+                openai_response = get_openai_response(greeting_prompt, 'audio_dialog', user_id, deadline, profile='audio_greeting')
+        else:
+            # Получаем ответ от OpenAI с указанным режимом
+            openai_response = get_openai_response(message, mode, user_id, deadline)
+        
+        if openai_response['success']:
+            # Логируем использование для ВСЕХ текстовых режимов КРОМЕ переводов (audio_dialog НЕ вызывает process_text_message)
+            if mode != 'translation':
+                log_text_usage(user_id, supabase_url, supabase_key, deadline)
+                log.debug("✅ Text usage logged for mode: %s", mode)
+            else:
+                log.debug("⏭️ Skipping text usage logging for translation mode")
+            
+            response = {'reply': openai_response['reply']}
+            # Доступ проверен по базе - отдаём свежий токен, следующие сообщения обойдутся без запроса
+            if user_check_response.get('entitlement_token'):
+                response['entitlement_token'] = user_check_response['entitlement_token']
+            return success_response(response)
+        else:
+            return error_response(f"OpenAI error: {openai_response['error']}")
+            
+    except DeadlineExceeded:
+        raise
+    except Exception as e:
+        log.error(f"Error processing text message: {e}")
+        return error_response(f'Failed to process text message: {str(e)}')
+
+
+def check_text_trial_access(user_id, supabase_url, supabase_key, deadline=None, entitlement_token=None):
+    """Проверяет доступ к текстовому помощнику: по токену доступа, иначе по базе"""
+    claims = verify_token(entitlement_token, user_id)
+    if claims and has_text_access(claims):
+        return {'has_access': True}
+
+    count_fallback()
+    try:
+        url = f"{supabase_url}/rest/v1/users?telegram_id=eq.{user_id}&select=package_expires_at,lessons_left,interface_language"
+        headers = {
+            'Authorization': f'Bearer {supabase_key}',
+            'apikey': supabase_key
+        }
+        
+        req = urllib.request.Request(url, headers=headers)
+        with track_upstream('supabase'), urllib.request.urlopen(req, timeout=get_timeout(deadline, 'supabase')) as response:
+            response_text = response.read().decode('utf-8')
+            
+            if response_text:
+                users = json.loads(response_text)
+                if users:
+                    user = users[0]
+                    package_expires_at = user.get('package_expires_at')
+                    interface_language = user.get('interface_language', 'ru')
+                    
+                    now = datetime.now()
+                    has_access = False
+                    
+                    # Проверяем package_expires_at
+                    if package_expires_at:
+                        try:
+                            package_end = datetime.fromisoformat(package_expires_at.replace('Z', '+00:00'))
+                            package_now = datetime.now(package_end.tzinfo) if package_end.tzinfo else datetime.now()
+                            if package_now < package_end:
+                                has_access = True
+                        except Exception as e:
+                            log.warning(f"Error parsing package_expires_at: {e}")
+                    
+                    if has_access:
+                        return {
+                            'has_access': True,
+                            'entitlement_token': issue_token(user_id, package_expires_at, user.get('lessons_left', 0), interface_language)
+                        }
+                    
+                    # Нет доступа - вернуть локализованное сообщение
+                    if interface_language == 'en':
+                        message = "🔒 Your free text assistant trial has ended. Upgrade to continue getting help with English!"
+                    else:
+                        message = "🔒 Пробный период текстового помощника закончился. Оформите подписку, чтобы продолжить изучение английского!"
+                    
+                    return {'has_access': False, 'message': message}
+        
+        # Пользователь не найден
+        return {'has_access': False, 'message': 'User not found. Please complete onboarding first with /start'}
+        
+    except DeadlineExceeded:
+        raise
+    except Exception as e:
+        log.error(f"Error checking text trial access: {e}")
+        return {'has_access': False, 'message': 'Error checking access. Please try again.'}
+
+
+# Системные промпты для разных режимов (tools/prompt_budget.py следит за их размером в токенах)
+SYSTEM_PROMPTS = {
+    'translation': """You are a bilingual translation bot. Your only task is to automatically translate each incoming message:
+
+If the message is in Russian → translate it into English.
+
+If the message is in English → translate it into Russian.
+
+Do not add explanations, comments, or extra text.
+Do not ask questions or start conversations.
+Only return the translated text, nothing else.""",
+    
+    'grammar': """You are the Grammar mode of a language-learning bot.
+Your only task is to answer questions about English grammar.
+
+Rules of behavior:
+
+Treat broadly: any question about usage of words, forms, structures, or patterns in English (including prepositions, articles, tense choice, word order, conditionals, etc.) counts as grammar.
+
+Only if the question is 100% unrelated to English grammar (e.g., "translate this text," "tell me about New York") → reply once: Этот режим отвечает только на вопросы о грамматике английского языка.
+
+If the question is vague but grammar-related → ask one clarifying question.
+
+If the question is clear → give a structured explanation immediately.
+
+CRITICAL LANGUAGE RULE:
+
+ALWAYS answer in the SAME language the user used for their question:
+- If user writes in Russian → answer in Russian
+- If user writes in English → answer in English  
+
+Use English ONLY for examples and grammar terms.
+
+Be concise, clear, and practical.
+
+If the user provides their own sentence → first confirm/correct it, then explain why.
+
+Structure of full answer:
+
+*Rule*
+1–2 lines
+
+*Form/Structure*
+patterns, word order, common collocations
+
+*Use & Contrast*
+when to use, difference from related forms
+
+*Examples*
+5–7 with ✅/❌ if relevant
+
+*Common mistakes & tips*
+
+*Mini-practice (3 items)*
+
+*Answer key*
+1. ||answer||
+2. ||answer||  
+3. ||answer||
+
+IMPORTANT: Use single asterisks *word* for bold, not double **word** which may break Telegram parsing""",
+    
+    'text_dialog': """You are a friendly English conversation partner for structured dialog practice.
+
+CORE RULES:
+1. ALWAYS respond in English only
+2. ALWAYS add Russian translation in spoiler: ||Русский перевод||
+3. Maintain natural conversation flow - ask follow-up questions
+4. Give brief grammar/vocabulary feedback on user's message before responding
+5. Keep conversation engaging and educational
+
+RESPONSE STRUCTURE:
+*Feedback:* Brief comment on user's grammar/vocabulary (if needed)
+
+---SPLIT---
+
+[Your English response with natural flow]
+||[Russian translation of your response]||
+
+FEEDBACK GUIDELINES:
+- If user makes grammar errors → gently suggest better version
+- If user uses good vocabulary → praise it
+- If user's message is perfect → mention what they did well
+- Keep feedback encouraging and constructive
+
+CONVERSATION FLOW:
+- Ask follow-up questions to keep dialog going
+- Show genuine interest in user's responses  
+- Introduce new vocabulary naturally
+- Vary topics: hobbies, travel, food, work, dreams, etc.
+
+DIALOG ENDING:
+- If user asks to end/finish/stop the conversation → immediately end the session
+- Watch for phrases like: "let's wrap up", "I need to go", "finish", "stop", "end", "bye"
+- When ending, use this EXACT format:
+
+*Feedback:* [Brief final comment on their English]
+
+---SPLIT---
+
+Thank you so much for this wonderful conversation! You did great with your English practice. I hope we can chat again soon. Take care!
+
+||Спасибо большое за этот замечательный разговор! У вас отлично получилось практиковать английский. Надеюсь, мы сможем поговорить снова. Берегите себя!||
+
+---END_DIALOG---
+
+Example response:
+*Feedback:* Great use of past tense! Small tip: "I have been" is more natural than "I was been"
+
+---SPLIT---
+
+That sounds like an amazing trip! What was your favorite moment during the vacation? Did you try any local food that surprised you?
+
+||Это звучит как потрясающая поездка! Какой момент больше всего запомнился во время отпуска? Пробовали ли вы местную еду, которая вас удивила?||""",
+    
+    'audio_dialog': "You are an English speaking coach. Focus on pronunciation tips, speaking practice, and conversational skills.",
+    
+    'general': """You are a concise English tutor. 
+Only answer questions about English: grammar, vocabulary, translations, writing texts, interviews. 
+If the question is not about English, respond: "I can only help with English. Try asking something about grammar, vocabulary, or translation"."""
+}
+
+
+def get_openai_response(message, mode='general', user_id=None, deadline=None, profile='text_message'):
+    """Получает ответ OpenAI через профиль генерации с системным промптом режима"""
+    system_prompt = SYSTEM_PROMPTS.get(mode, SYSTEM_PROMPTS['general'])
+    log.debug("Using AI mode: %s", mode)
+    result = get_routed_response(profile, message, system_prompt, user_id=user_id, mode=mode, deadline=deadline)
+    if result['success']:
+        result['mode'] = mode
+    return result
+
+
+def log_text_usage(user_id, supabase_url, supabase_key, deadline=None):
+    """Логирует использование текстового помощника"""
+    try:
+        # 1. Обновляем общие счетчики пользователя
+        url = f"{supabase_url}/rest/v1/users?telegram_id=eq.{user_id}"
+        headers = {
+            'Content-Type': 'application/json',
+            'Authorization': f'Bearer {supabase_key}',
+            'apikey': supabase_key
+        }
+        
+        # Получаем текущие значения
+        req = urllib.request.Request(url, headers=headers)
+        with track_upstream('supabase'), urllib.request.urlopen(req, timeout=get_timeout(deadline, 'supabase')) as response:
+            response_text = response.read().decode('utf-8')
+            if response_text:
+                users = json.loads(response_text)
+                if users:
+                    user = users[0]
+                    current_total = user.get('text_messages_total', 0)
+                    
+                    # Обновляем счетчики
+                    update_data = {
+                        'text_messages_total': current_total + 1,
+                        'last_text_used_at': datetime.now().isoformat()
+                    }
+                    
+                    req_update = urllib.request.Request(
+                        url, 
+                        data=json.dumps(update_data).encode('utf-8'),
+                        headers=headers,
+                        method='PATCH'
+                    )
+                    
+                    with track_upstream('supabase'), urllib.request.urlopen(req_update, timeout=get_timeout(deadline, 'supabase')) as update_response:
+                        log.debug("User text usage updated for %s", user_id)
+        
+        # 2. UPSERT в daily usage таблицу через raw SQL
+        # Получаем user UUID для foreign key
+        user_url = f"{supabase_url}/rest/v1/users?telegram_id=eq.{user_id}&select=id"
+        req_user = urllib.request.Request(user_url, headers=headers)
+        
+        with track_upstream('supabase'), urllib.request.urlopen(req_user, timeout=get_timeout(deadline, 'supabase')) as response:
+            response_text = response.read().decode('utf-8')
+            if response_text:
+                users = json.loads(response_text)
+                if users:
+                    user_uuid = users[0]['id']
+                    
+                    # Используем POST с upsert для daily usage
+                    daily_url = f"{supabase_url}/rest/v1/text_usage_daily"
+                    daily_headers = {
+                        'Content-Type': 'application/json',
+                        'Authorization': f'Bearer {supabase_key}',
+                        'apikey': supabase_key,
+                        'Prefer': 'resolution=merge-duplicates'
+                    }
+                    
+                    today = datetime.now().date().isoformat()
+                    daily_data = {
+                        'user_id': user_uuid,
+                        'day': today,
+                        'messages': 1
+                    }
+                    
+                    req_daily = urllib.request.Request(
+                        daily_url, 
+                        data=json.dumps(daily_data).encode('utf-8'),
+                        headers=daily_headers,
+                        method='POST'
+                    )
+                    
+                    with track_upstream('supabase'), urllib.request.urlopen(req_daily, timeout=get_timeout(deadline, 'supabase')) as daily_response:
+                        log.debug("Daily text usage logged for %s", user_id)
+            
+    except Exception as e:
+        log.error(f"Error logging text usage: {e}")
+        # Не возвращаем ошибку, так как это не критично для пользователя
@@ -0,0 +1,154 @@
+"""Действие save_feedback: Сохранение feedback пользователя с начислением Starter pack"""
+import json
+import urllib.request
+from datetime import datetime, timedelta
+
+from shared.admission import track_upstream
+from shared.catalog import get_product
+from shared.deadline import DeadlineExceeded, get_timeout
+from shared.actions.common import error_response
+from shared.logger import get_logger
+
+log = get_logger(__name__)
+
+
+def handle(body, supabase_url, supabase_key, deadline):
+    """Сохранение feedback пользователя с начислением Starter pack"""
+    user_id = body.get('user_id')
+    feedback_text = body.get('feedback_text', '').strip()
+    
+    if not user_id or not feedback_text:
+        return error_response('user_id and feedback_text are required')
+    
+    try:
+        log.debug("Saving feedback for user %s", user_id)
+        
+        # Проверяем, оставлял ли пользователь фидбэк ранее
+        check_url = f"{supabase_url}/rest/v1/feedback?telegram_id=eq.{user_id}&select=id"
+        headers = {
+            'Authorization': f'Bearer {supabase_key}',
+            'apikey': supabase_key
+        }
+        
+        req = urllib.request.Request(check_url, headers=headers)
+        with track_upstream('supabase'), urllib.request.urlopen(req, timeout=get_timeout(deadline, 'supabase')) as response:
+            response_text = response.read().decode('utf-8')
+            existing_feedback = json.loads(response_text) if response_text else []
+            is_first_feedback = len(existing_feedback) == 0
+        
+        # Получаем user_id (UUID) из users таблицы
+        user_uuid = None
+        user_url = f"{supabase_url}/rest/v1/users?telegram_id=eq.{user_id}&select=id"
+        user_req = urllib.request.Request(user_url, headers=headers)
+        with track_upstream('supabase'), urllib.request.urlopen(user_req, timeout=get_timeout(deadline, 'supabase')) as response:
+            response_text = response.read().decode('utf-8')
+            users = json.loads(response_text) if response_text else []
+            if users:
+                user_uuid = users[0]['id']
+        
+        # Сохраняем feedback в базу
+        feedback_data = {
+            'user_id': user_uuid,
+            'telegram_id': int(user_id),
+            'text': feedback_text,
+            'created_at': 'now()'
+        }
+        
+        feedback_url = f"{supabase_url}/rest/v1/feedback"
+        feedback_json = json.dumps(feedback_data).encode('utf-8')
+        feedback_headers = {
+            'Authorization': f'Bearer {supabase_key}',
+            'apikey': supabase_key,
+            'Content-Type': 'application/json'
+        }
+        
+        feedback_req = urllib.request.Request(feedback_url, data=feedback_json, headers=feedback_headers, method='POST')
+        with track_upstream('supabase'):
+            urllib.request.urlopen(feedback_req, timeout=get_timeout(deadline, 'supabase'))
+        
+        log.info(f"Feedback saved for user {user_id}, first_feedback: {is_first_feedback}")
+        
+        # Если это первый фидбэк, начисляем Starter pack
+        starter_pack_granted = False
+        if is_first_feedback:
+            try:
+                # Используем правильный ID Starter pack (тот же что и в complete_survey)
+                starter_pack_id = "7d9d5dbb-7ed2-4bdc-9d2f-c88929085ab5"
+                starter_pack = get_product(starter_pack_id, deadline)
+                if starter_pack:
+                    # Получаем текущие данные пользователя
+                    current_user_url = f"{supabase_url}/rest/v1/users?telegram_id=eq.{user_id}&select=lessons_left,package_expires_at"
+                    current_req = urllib.request.Request(current_user_url, headers=headers)
+                    with track_upstream('supabase'), urllib.request.urlopen(current_req, timeout=get_timeout(deadline, 'supabase')) as response:
+                        response_text = response.read().decode('utf-8')
+                        current_users = json.loads(response_text) if response_text else []
+                        
+                        if current_users:
+                            current_user = current_users[0]
+                            current_lessons = current_user.get('lessons_left', 0)
+                            current_expires_at = current_user.get('package_expires_at')
+                            
+                            # Вычисляем новые значения
+                            new_lessons = current_lessons + starter_pack.get('lessons_granted', 0)
+                            
+                            # Логика продления package_expires_at
+                            from datetime import datetime, timedelta
+                            duration_days = starter_pack.get('duration_days', 30)
+                            now = datetime.now()
+                            
+                            if current_expires_at:
+                                try:
+                                    current_expires_date = datetime.fromisoformat(current_expires_at.replace('Z', '+00:00'))
+                                    # Если текущая дата истечения в будущем, продляем от неё
+                                    # ВСЕГДА продляем от существующей даты в таблице, независимо от того активна подписка или нет
+                                    new_expires_date = current_expires_date + timedelta(days=duration_days)
+                                    log.debug("📅 ДАТА РАСЧЕТ: %s + %s дней = %s", current_expires_at, duration_days, new_expires_date.isoformat())
+                                except Exception as e:
+                                    log.warning(f"Error parsing current_expires_at '{current_expires_at}': {e}")
+                                    # Если ошибка парсинга, продляем от текущего момента
+                                    new_expires_date = now + timedelta(days=duration_days)
+                            else:
+                                # Если package_expires_at не установлен, устанавливаем от текущего момента
+                                new_expires_date = now + timedelta(days=duration_days)
+                            
+                            log.debug("Updating package_expires_at: current='%s', new='%s', duration_days=%s", current_expires_at, new_expires_date.isoformat(), duration_days)
+                            
+                            # Обновляем пользователя
+                            update_data = {
+                                'lessons_left': new_lessons,
+                                'package_expires_at': new_expires_date.isoformat()
+                            }
+                            
+                            update_url = f"{supabase_url}/rest/v1/users?telegram_id=eq.{user_id}"
+                            update_json = json.dumps(update_data).encode('utf-8')
+                            update_headers = {
+                                'Authorization': f'Bearer {supabase_key}',
+                                'apikey': supabase_key,
+                                'Content-Type': 'application/json'
+                            }
+                            
+                            update_req = urllib.request.Request(update_url, data=update_json, headers=update_headers, method='PATCH')
+                            with track_upstream('supabase'):
+                                urllib.request.urlopen(update_req, timeout=get_timeout(deadline, 'supabase'))
+                            
+                            starter_pack_granted = True
+                            log.info(f"Starter pack granted to user {user_id}: +{starter_pack.get('lessons_granted', 0)} lessons, +{duration_days} days")
+                
+            except Exception as e:
+                log.error(f"Error granting starter pack to user {user_id}: {e}")
+                # Не прерываем выполнение, фидбэк уже сохранен
+        
+        return {
+            'statusCode': 200,
+            'body': json.dumps({
+                'success': True,
+                'is_first_feedback': is_first_feedback,
+                'starter_pack_granted': starter_pack_granted
+            })
+        }
+        
+    except DeadlineExceeded:
+        raise
+    except Exception as e:
+        log.error(f"Error saving feedback: {e}")
+        return error_response(f'Error saving feedback: {str(e)}')
@@ -0,0 +1,51 @@
+"""Действие set_ai_mode: Установка режима ИИ для пользователя"""
+import json
+import urllib.request
+
+from shared.admission import track_upstream
+from shared.deadline import DeadlineExceeded, get_timeout
+from shared.actions.common import success_response, error_response
+from shared.logger import get_logger
+
+log = get_logger(__name__)
+
+
+def handle(body, supabase_url, supabase_key, deadline):
+    """Установка режима ИИ для пользователя"""
+    user_id = body.get('user_id')
+    mode = body.get('mode')
+    
+    if not user_id or not mode:
+        return error_response('user_id and mode are required')
+    
+    try:
+        log.debug("Setting AI mode '%s' for user %s", mode, user_id)
+        
+        # Сохраняем режим в Supabase
+        update_data = {'ai_mode': mode}
+        data_json = json.dumps(update_data)
+        
+        req = urllib.request.Request(
+            f"{supabase_url}/rest/v1/users?telegram_id=eq.{user_id}",
+            data=data_json.encode('utf-8'),
+            headers={
+                'apikey': supabase_key,
+                'Authorization': f'Bearer {supabase_key}',
+                'Content-Type': 'application/json',
+                'Prefer': 'return=minimal'
+            },
+            method='PATCH'
+        )
+        
+        with track_upstream('supabase'), urllib.request.urlopen(req, timeout=get_timeout(deadline, 'supabase')) as response:
+            log.info(f"AI mode '{mode}' saved to Supabase for user {user_id}")
+            return success_response({
+                'mode_set': mode,
+                'message': f'AI mode set to {mode}'
+            })
+            
+    except DeadlineExceeded:
+        raise
+    except Exception as e:
+        log.error(f"Error setting AI mode: {e}")
+        return error_response(f'Failed to set AI mode: {str(e)}')
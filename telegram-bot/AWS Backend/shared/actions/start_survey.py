@@ -0,0 +1,77 @@
+"""Действие start_survey: Начало опросника - создание пользователя"""
+import json
+import urllib.request
+
+from shared.admission import track_upstream
+from shared.deadline import DeadlineExceeded, get_timeout
+from shared.actions.common import success_response, error_response
+from shared.logger import get_logger
+
+log = get_logger(__name__)
+
+
+def handle(body, supabase_url, supabase_key, deadline):
+    """Начало опросника - создание пользователя"""
+    user_id = body.get('user_id')
+    interface_language = body.get('interface_language', 'ru')
+    username = body.get('username', f'user_{user_id}')  # Получаем username из Telegram
+    
+    if not user_id:
+        return error_response('user_id is required')
+    
+    try:
+        # Создаем пользователя в Supabase с quiz_started_at
+        user_data = {
+            'telegram_id': int(user_id),
+            'username': username,
+            'interface_language': interface_language,
+            'lessons_left': 0,  # Уроки начисляются только после завершения опроса
+            'quiz_started_at': 'now()',  # Фиксируем начало прохождения опроса
+            'is_active': True
+        }
+        
+        log.info(f"Creating user {user_id} in Supabase", interface_language=interface_language)
+        
+        url = f"{supabase_url}/rest/v1/users"
+        headers = {
+            'Content-Type': 'application/json',
+            'Authorization': f'Bearer {supabase_key}',
+            'apikey': supabase_key,
+            'Prefer': 'return=representation'
+        }
+        
+        req = urllib.request.Request(url, 
+                                   data=json.dumps(user_data).encode('utf-8'),
+                                   headers=headers,
+                                   method='POST')
+        
+        with track_upstream('supabase'), urllib.request.urlopen(req, timeout=get_timeout(deadline, 'supabase')) as response:
+            response_text = response.read().decode('utf-8')
+            log.debug("Supabase response %s: %s", response.status, response_text)
+            
+            if response_text:
+                result = json.loads(response_text)
+            else:
+                result = {"status": "success", "message": "User created"}
+            
+            return success_response({
+                'message': 'User created successfully',
+                'user_data': result[0] if isinstance(result, list) else result
+            })
+            
+    except urllib.error.HTTPError as e:
+        if e.code == 409:  # Conflict - user already exists
+            log.info(f"User {user_id} already exists in Supabase")
+            return success_response({
+                'message': 'User already exists',
+                'user_exists': True
+            })
+        else:
+            error_body = e.read().decode('utf-8')
+            log.error(f"HTTP Error {e.code}: {error_body}")
+            return error_response(f'HTTP Error {e.code}: {error_body}')
+    except DeadlineExceeded:
+        raise
+    except Exception as e:
+        log.error(f"Error creating user in Supabase: {e}")
+        return error_response(f'Failed to create user: {str(e)}')
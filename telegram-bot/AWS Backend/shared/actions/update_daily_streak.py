@@ -0,0 +1,126 @@
+"""Действие update_daily_streak: Обновление общего daily streak при использовании любого функционала"""
+import json
+import urllib.request
+from datetime import datetime, timedelta
+
+from shared.admission import track_upstream
+from shared.deadline import DeadlineExceeded, get_timeout
+from shared.logger import get_logger
+
+log = get_logger(__name__)
+
+
+def handle(body, supabase_url, supabase_key, deadline):
+    """Обновление общего daily streak при использовании любого функционала"""
+    log.debug("🔥 [STREAK] Starting update_daily_streak for user %s", body.get('user_id'))
+    user_id = body.get('user_id')
+    
+    if not user_id:
+        return {
+            'statusCode': 200,
+            'body': json.dumps({
+                'success': False,
+                'error': 'user_id is required'
+            })
+        }
+    
+    # Нормальная логика обновления streak
+    try:
+        log.debug("🔥 [STREAK] Updating streak for user %s", user_id)
+        from datetime import datetime, timedelta
+        
+        # Получаем текущие данные пользователя
+        url = f"{supabase_url}/rest/v1/users?telegram_id=eq.{user_id}&select=current_streak,last_lesson_date"
+        headers = {
+            'Authorization': f'Bearer {supabase_key}',
+            'apikey': supabase_key
+        }
+        
+        req = urllib.request.Request(url, headers=headers)
+        with track_upstream('supabase'), urllib.request.urlopen(req, timeout=get_timeout(deadline, 'supabase')) as response:
+            response_text = response.read().decode('utf-8')
+            log.debug("🔥 [STREAK] Supabase response: %s", response_text)
+            
+            if response_text:
+                users = json.loads(response_text)
+                log.debug("🔥 [STREAK] Found %s users", len(users))
+                if users:
+                    user_data = users[0]
+                    current_streak = user_data.get('current_streak', 0)
+                    last_lesson_date = user_data.get('last_lesson_date')
+                    log.debug("🔥 [STREAK] Current streak: %s, last_lesson_date: %s", current_streak, last_lesson_date)
+                    
+                    # Определяем, нужно ли увеличивать streak
+                    today = datetime.now().date()
+                    should_update_streak = True
+                    
+                    if last_lesson_date:
+                        try:
+                            last_date = datetime.fromisoformat(last_lesson_date).date()
+                            # Если уже занимались сегодня, не увеличиваем streak
+                            if last_date == today:
+                                should_update_streak = False
+                                log.debug("🔥 [STREAK] User already practiced today, not updating streak")
+                            # Если последний раз занимались вчера, увеличиваем streak
+                            elif last_date == today - timedelta(days=1):
+                                current_streak += 1
+                                log.debug("🔥 [STREAK] User practiced yesterday, increasing streak to %s", current_streak)
+                            # Если пропустили дни, streak = 0
+                            elif last_date < today - timedelta(days=1):
+                                current_streak = 0
+                                log.debug("🔥 [STREAK] User missed days, resetting streak to 0")
+                        except Exception as e:
+                            log.warning(f"🔥 [STREAK] Error parsing last_lesson_date: {e}")
+                            current_streak = 1
+                    else:
+                        # Первый раз занимается
+                        current_streak = 1
+                        log.debug("🔥 [STREAK] First time practicing, setting streak to 1")
+                    
+                    # Обновляем данные в базе только если нужно
+                    if should_update_streak:
+                        update_url = f"{supabase_url}/rest/v1/users?telegram_id=eq.{user_id}"
+                        update_data = json.dumps({
+                            'current_streak': current_streak,
+                            'last_lesson_date': today.isoformat()
+                        }).encode('utf-8')
+                        
+                        update_headers = {
+                            'Authorization': f'Bearer {supabase_key}',
+                            'apikey': supabase_key,
+                            'Content-Type': 'application/json'
+                        }
+                        
+                        update_req = urllib.request.Request(update_url, data=update_data, headers=update_headers, method='PATCH')
+                        with track_upstream('supabase'), urllib.request.urlopen(update_req, timeout=get_timeout(deadline, 'supabase')) as update_response:
+                            update_result = update_response.read().decode('utf-8')
+                            log.debug("🔥 [STREAK] Update result: %s", update_result)
+                        
+                        log.info(f"🔥 [STREAK] Successfully updated streak for user {user_id}: {current_streak}")
+                    
+                    return {
+                        'success': True,
+                        'streak_updated': should_update_streak,
+                        'new_streak': current_streak
+                    }
+                else:
+                    log.warning("🔥 [STREAK] User not found", user_id=user_id)
+                    return {
+                        'success': False,
+                        'error': 'User not found'
+                    }
+            else:
+                log.warning("🔥 [STREAK] Empty response from Supabase", user_id=user_id)
+                return {
+                    'success': False,
+                    'error': 'Empty response from Supabase'
+                }
+        
+    except DeadlineExceeded:
+        raise
+    except Exception as e:
+        log.error(f"🔥 [STREAK] Error updating streak: {e}")
+        return {
+            'success': False,
+            'error': f'Error updating streak: {str(e)}'
+        }
@@ -0,0 +1,7 @@
+"""Действие warmup: прогрев соединений, каталога продуктов и модулей действий общей Lambda"""
+from shared.warmup import warmup_response
+
+
+def handle(body, supabase_url, supabase_key, deadline):
+    """Отчёт о прогреве: что прогрето, за сколько, что не удалось"""
+    return warmup_response('shared')
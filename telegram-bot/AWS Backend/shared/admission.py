@@ -0,0 +1,320 @@
+"""Адаптивный контроль допуска (admission control) и сброс нагрузки
+
+Каждый вызов upstream (OpenAI, Supabase) оборачивается в track_upstream: считаем запросы
+«в полёте», экспоненциально сглаженные задержку и долю ошибок (исключения, в том числе
+таймауты). По ним вычисляется уровень нагрузки:
+  normal     - принимаем всё;
+  degraded   - сбрасываем низкоприоритетные действия (фидбэк, streak, приветствия);
+  overloaded - принимаем только основные ответы пользователю (critical).
+
+Задержка - сигнал только для upstream с запросами примерно одного размера (Supabase).
+Время ответа OpenAI растёт с длиной генерации (ответ на 1000 токенов - 10-20 с и без
+перегрузки), поэтому для него slow_ms = None и перегрузку показывают ошибки, 429 и таймауты.
+
+Сброшенные фоновые записи из DEFERRABLE_ACTIONS не теряются: defer() кладёт их в очередь
+контейнера, replay_deferred_in_background() после запроса выполняет их в фоновом потоке (не на
+пути ответа, не больше DEFERRED_REPLAY_PER_REQUEST за запуск), когда нагрузка вернулась к normal.
+Очередь живёт в памяти контейнера: заморозка её не трогает (поток продолжит после разморозки),
+теряется она только вместе с контейнером - допустимо для записей вроде streak.
+
+Решения о сбросе пишутся в лог метриками в формате CloudWatch EMF.
+Пороги переопределяются через ADMISSION_THRESHOLDS (JSON), например:
+{"supabase": {"slow_ms": 1000}, "openai": {"error_rate": 0.3}, "max_inflight": 24}
+"""
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from shared.deadline import Deadline
+from shared.logger import get_logger
+from shared.metrics import record_dependency, register_source
+from shared.tracing import start_span, end_span
+
+log = get_logger(__name__)
+
+
+METRICS_NAMESPACE = 'LinguaPulse/Backend'
+
+PRIORITY_CRITICAL = 'critical'
+PRIORITY_NORMAL = 'normal'
+PRIORITY_LOW = 'low'
+
+LOAD_NORMAL = 'normal'
+LOAD_DEGRADED = 'degraded'
+LOAD_OVERLOADED = 'overloaded'
+
+# Основные пути ответа пользователю сохраняют бюджет задержки; остальное - normal
+ACTION_PRIORITIES = {
+    'process_text_message': PRIORITY_CRITICAL,
+    'translate': PRIORITY_CRITICAL,
+    'check_grammar': PRIORITY_CRITICAL,
+    'process_dialog': PRIORITY_CRITICAL,
+    'generate_response': PRIORITY_CRITICAL,
+    'check_audio_access': PRIORITY_CRITICAL,
+    'decrease_lessons_left': PRIORITY_CRITICAL,
+    'get_profile': PRIORITY_CRITICAL,
+    'check_user': PRIORITY_CRITICAL,
+    # Снимок метрик и проверка здоровья нужны именно под нагрузкой
+    'metrics': PRIORITY_CRITICAL,
+    'health': PRIORITY_CRITICAL,
+    'generate_dialog_feedback': PRIORITY_LOW,
+    'update_daily_streak': PRIORITY_LOW,
+    'generate_greeting': PRIORITY_LOW,
+    'warmup': PRIORITY_LOW
+}
+
+# Фоновые записи, которые при сбросе откладываются, а не теряются
+DEFERRABLE_ACTIONS = {'update_daily_streak'}
+
+# slow_ms - сглаженная задержка, с которой upstream считается перегруженным (x2 - overloaded),
+# None - задержка не сигнал; error_rate - сглаженная доля ошибок для degraded (x2 - overloaded)
+DEFAULT_THRESHOLDS = {
+    'openai': {'slow_ms': None, 'error_rate': 0.25},
+    'supabase': {'slow_ms': 1500, 'error_rate': 0.25},
+    'default': {'slow_ms': 3000, 'error_rate': 0.25},
+    # Доля ошибок учитывается, когда за окно набралось хотя бы столько вызовов
+    'min_calls': 5,
+    # Запросов в полёте на процесс: 75% - degraded, 100% - overloaded
+    'max_inflight': 16,
+    # Замеры старше этого не влияют на решение (upstream мог восстановиться)
+    'stale_after_sec': 60
+}
+
+# Вес нового замера в сглаженных задержке и доле ошибок
+EWMA_ALPHA = 0.2
+
+# Отложенные записи: не больше DEFERRED_MAX_ITEMS, старше DEFERRED_MAX_AGE_SEC - отбрасываются
+DEFERRED_MAX_ITEMS = 500
+DEFERRED_MAX_AGE_SEC = 900
+# Сколько отложенных записей выполнять за один фоновый запуск и бюджет на каждую
+DEFERRED_REPLAY_PER_REQUEST = 5
+DEFERRED_ITEM_BUDGET_MS = 5000
+
+_thresholds = None
+_upstreams = {}
+_inflight_total = 0
+_counters = {}
+_deferred = OrderedDict()
+_deferred_stats = {'deferred': 0, 'replayed': 0, 'failed': 0, 'expired': 0, 'dropped': 0}
+_replay_thread = None
+_lock = threading.Lock()
+
+
+def get_thresholds():
+    """Пороги по умолчанию с учётом переопределений из ADMISSION_THRESHOLDS"""
+    global _thresholds
+    if _thresholds is None:
+        thresholds = {key: dict(value) if isinstance(value, dict) else value for key, value in DEFAULT_THRESHOLDS.items()}
+        overrides_raw = os.environ.get('ADMISSION_THRESHOLDS')
+        if overrides_raw:
+            try:
+                for key, override in json.loads(overrides_raw).items():
+                    if isinstance(override, dict):
+                        thresholds.setdefault(key, {}).update(override)
+                    else:
+                        thresholds[key] = override
+            except (ValueError, AttributeError) as e:
+                log.warning(f"⚠️ Invalid ADMISSION_THRESHOLDS, using defaults: {e}")
+        _thresholds = thresholds
+    return _thresholds
+
+
+@contextmanager
+def track_upstream(name):
+    """Учесть вызов upstream: в полёте, задержка, ошибка (исключение внутри блока), спан трассы"""
+    global _inflight_total
+    with _lock:
+        stats = _upstreams.setdefault(name, {'inflight': 0, 'ewma_ms': None, 'error_rate': 0.0, 'window_calls': 0,
+                                             'updated_at': 0.0, 'calls': 0, 'errors': 0})
+        stats['inflight'] += 1
+        _inflight_total += 1
+
+    started = time.monotonic()
+    span = start_span(name)
+    success = False
+    try:
+        yield
+        success = True
+    finally:
+        latency_ms = (time.monotonic() - started) * 1000
+        end_span(span, success)
+        record_dependency(name, latency_ms, success)
+        with _lock:
+            stats['inflight'] -= 1
+            _inflight_total -= 1
+            now = time.monotonic()
+            stats['calls'] += 1
+            if not success:
+                stats['errors'] += 1
+            # Устаревшее окно начинается заново: старые ошибки не держат upstream в degraded
+            if now - stats['updated_at'] > get_thresholds()['stale_after_sec']:
+                stats['ewma_ms'], stats['error_rate'], stats['window_calls'] = None, 0.0, 0
+            stats['ewma_ms'] = latency_ms if stats['ewma_ms'] is None else (
+                EWMA_ALPHA * latency_ms + (1 - EWMA_ALPHA) * stats['ewma_ms']
+            )
+            stats['error_rate'] = EWMA_ALPHA * (0.0 if success else 1.0) + (1 - EWMA_ALPHA) * stats['error_rate']
+            stats['window_calls'] += 1
+            stats['updated_at'] = now
+
+
+def get_load_level():
+    """Текущий уровень нагрузки по задержкам и ошибкам upstream и числу запросов в полёте"""
+    thresholds = get_thresholds()
+    now = time.monotonic()
+    level = LOAD_NORMAL
+
+    with _lock:
+        max_inflight = thresholds['max_inflight']
+        if _inflight_total >= max_inflight:
+            return LOAD_OVERLOADED
+        if _inflight_total >= 0.75 * max_inflight:
+            level = LOAD_DEGRADED
+
+        for name, stats in _upstreams.items():
+            if stats['ewma_ms'] is None or now - stats['updated_at'] > thresholds['stale_after_sec']:
+                continue
+            upstream = {**thresholds['default'], **thresholds.get(name, {})}
+            slow_ms = upstream['slow_ms']
+            if slow_ms is not None:
+                if stats['ewma_ms'] >= 2 * slow_ms:
+                    return LOAD_OVERLOADED
+                if stats['ewma_ms'] >= slow_ms:
+                    level = LOAD_DEGRADED
+            if stats['window_calls'] >= thresholds['min_calls']:
+                if stats['error_rate'] >= 2 * upstream['error_rate']:
+                    return LOAD_OVERLOADED
+                if stats['error_rate'] >= upstream['error_rate']:
+                    level = LOAD_DEGRADED
+
+    return level
+
+
+def admit(action):
+    """Решить, принимать ли действие при текущей нагрузке; возвращает (принято, уровень нагрузки)"""
+    if os.environ.get('ADMISSION_CONTROL_ENABLED', 'true').lower() == 'false':
+        return True, LOAD_NORMAL
+
+    priority = ACTION_PRIORITIES.get(action, PRIORITY_NORMAL)
+    level = get_load_level()
+    admitted = (
+        priority == PRIORITY_CRITICAL
+        or level == LOAD_NORMAL
+        or (level == LOAD_DEGRADED and priority == PRIORITY_NORMAL)
+    )
+
+    with _lock:
+        counter = _counters.setdefault(action, {'admitted': 0, 'shed': 0})
+        counter['admitted' if admitted else 'shed'] += 1
+
+    if not admitted:
+        log.warning(f"🛑 Shedding action {action}", action=action, priority=priority, load=level)
+        emit_shed_metric(action, priority, level)
+    return admitted, level
+
+
+def defer(action, subject, run):
+    """Отложить сброшенную запись: run(deadline) выполнится в run_deferred; та же пара (action, subject) заменяет прежнюю"""
+    with _lock:
+        _deferred.pop((action, subject), None)
+        _deferred[(action, subject)] = (time.monotonic(), run)
+        _deferred_stats['deferred'] += 1
+        while len(_deferred) > DEFERRED_MAX_ITEMS:
+            _deferred.popitem(last=False)
+            _deferred_stats['dropped'] += 1
+    log.info(f"⏸️ Deferred action {action}", action=action, subject=subject)
+
+
+def run_deferred(deadline=None, min_remaining_ms=1000, max_items=None):
+    """Выполнить отложенные записи, пока нагрузка normal и хватает бюджета; возвращает число выполненных
+
+    Без deadline каждая запись получает свой бюджет DEFERRED_ITEM_BUDGET_MS.
+    """
+    replayed = 0
+    attempted = 0
+    while _deferred and get_load_level() == LOAD_NORMAL:
+        if max_items is not None and attempted >= max_items:
+            break
+        if deadline is not None and deadline.remaining_ms() < min_remaining_ms:
+            break
+        with _lock:
+            if not _deferred:
+                break
+            (action, subject), (deferred_at, run) = _deferred.popitem(last=False)
+            if time.monotonic() - deferred_at > DEFERRED_MAX_AGE_SEC:
+                _deferred_stats['expired'] += 1
+                continue
+        attempted += 1
+        try:
+            run(deadline if deadline is not None else Deadline(DEFERRED_ITEM_BUDGET_MS))
+            outcome = 'replayed'
+            replayed += 1
+        except Exception as e:
+            log.warning(f"⚠️ Deferred action {action} failed: {e}", action=action, subject=subject)
+            outcome = 'failed'
+        with _lock:
+            _deferred_stats[outcome] += 1
+    return replayed
+
+
+def replay_deferred_in_background(max_items=None):
+    """Запустить run_deferred в фоновом потоке, если есть что выполнять и поток ещё не запущен"""
+    global _replay_thread
+    if not _deferred or get_load_level() != LOAD_NORMAL:
+        return False
+    if max_items is None:
+        max_items = int(os.environ.get('DEFERRED_REPLAY_PER_REQUEST', DEFERRED_REPLAY_PER_REQUEST))
+
+    with _lock:
+        if _replay_thread is not None and _replay_thread.is_alive():
+            return False
+        _replay_thread = threading.Thread(
+            target=run_deferred, kwargs={'max_items': max_items}, name='deferred-replay', daemon=True
+        )
+        _replay_thread.start()
+    return True
+
+
+def emit_shed_metric(action, priority, level):
+    """Метрика сброса запроса в формате CloudWatch Embedded Metric Format"""
+    print(json.dumps({
+        '_aws': {
+            'Timestamp': int(time.time() * 1000),
+            'CloudWatchMetrics': [{
+                'Namespace': METRICS_NAMESPACE,
+                'Dimensions': [['Action'], ['LoadLevel']],
+                'Metrics': [{'Name': 'ShedRequests', 'Unit': 'Count'}]
+            }]
+        },
+        'Action': action,
+        'Priority': priority,
+        'LoadLevel': level,
+        'ShedRequests': 1
+    }))
+
+
+def get_admission_metrics():
+    """Снимок состояния: уровень нагрузки, upstream, счётчики принятых/сброшенных действий"""
+    level = get_load_level()
+    with _lock:
+        return {
+            'load_level': level,
+            'inflight': _inflight_total,
+            'upstreams': {
+                name: {
+                    'inflight': stats['inflight'],
+                    'ewma_ms': round(stats['ewma_ms'], 1) if stats['ewma_ms'] is not None else None,
+                    'error_rate': round(stats['error_rate'], 3),
+                    'calls': stats['calls'],
+                    'errors': stats['errors']
+                }
+                for name, stats in _upstreams.items()
+            },
+            'actions': {action: dict(counter) for action, counter in _counters.items()},
+            'deferred': {'pending': len(_deferred), **_deferred_stats}
+        }
+
+
+register_source('admission', get_admission_metrics)
@@ -0,0 +1,350 @@
+"""Пакетная генерация через OpenAI Batch API для задач, которым не нужна низкая задержка
+
+Задача проходит этапы new → written → uploaded → submitted → downloaded → done. После каждого
+этапа состояние сохраняется в checkpoint (BATCH_CHECKPOINT_DIR, по умолчанию /tmp/batch_checkpoints),
+поэтому прерванный запуск продолжается с того же места, а уже записанные в базу результаты
+повторно не применяются.
+
+Запуск: python tools/run_batch_job.py <job> (см. JOBS ниже)
+"""
+import json
+import os
+import time
+import urllib.request
+import uuid
+from datetime import datetime, timezone
+
+from shared.openai_client import get_openai_base_url
+from shared.database import supabase_request
+from shared.prompts import build_audio_greeting_prompt
+from shared.greeting_pool import LEVELS
+from shared.logger import get_logger
+
+log = get_logger(__name__)
+
+
+BATCH_ENDPOINT = '/v1/chat/completions'
+COMPLETION_WINDOW = '24h'
+FINAL_BATCH_STATUSES = ('completed', 'failed', 'expired', 'cancelled')
+
+# Как часто сохранять прогресс применения результатов
+CHECKPOINT_EVERY = 50
+
+
+def get_checkpoint_dir():
+    """Каталог для checkpoint-файлов и JSONL запросов"""
+    path = os.environ.get('BATCH_CHECKPOINT_DIR', '/tmp/batch_checkpoints')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def make_batch_request(custom_id, message, system_prompt=None, model='gpt-4o-mini', temperature=0.7, max_tokens=300):
+    """Одна строка JSONL для Batch API (тот же формат тела, что у get_openai_response)"""
+    messages = []
+    if system_prompt:
+        messages.append({'role': 'system', 'content': system_prompt})
+    messages.append({'role': 'user', 'content': message})
+    return {
+        'custom_id': custom_id,
+        'method': 'POST',
+        'url': BATCH_ENDPOINT,
+        'body': {
+            'model': model,
+            'messages': messages,
+            'temperature': temperature,
+            'max_tokens': max_tokens
+        }
+    }
+
+
+def write_requests_file(batch_requests, path):
+    """Записать запросы в JSONL файл"""
+    with open(path, 'w', encoding='utf-8') as f:
+        for request in batch_requests:
+            f.write(json.dumps(request, ensure_ascii=False) + '\n')
+    return path
+
+
+def _openai_api(path, method='GET', data=None, content_type='application/json'):
+    """Запрос к OpenAI API, возвращает сырые байты ответа"""
+    openai_api_key = os.environ.get('OPENAI_API_KEY')
+    if not openai_api_key:
+        raise RuntimeError('OpenAI API key not found')
+
+    headers = {'Authorization': f'Bearer {openai_api_key}'}
+    if data is not None:
+        headers['Content-Type'] = content_type
+    req = urllib.request.Request(f"{get_openai_base_url()}{path}", data=data, headers=headers, method=method)
+    with urllib.request.urlopen(req) as response:
+        return response.read()
+
+
+def upload_batch_file(path):
+    """Загрузить JSONL файл (purpose=batch), вернуть file_id"""
+    boundary = uuid.uuid4().hex
+    with open(path, 'rb') as f:
+        content = f.read()
+
+    body = (
+        f'--{boundary}\r\nContent-Disposition: form-data; name="purpose"\r\n\r\nbatch\r\n'
+        f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{os.path.basename(path)}"\r\n'
+        f'Content-Type: application/jsonl\r\n\r\n'
+    ).encode('utf-8') + content + f'\r\n--{boundary}--\r\n'.encode('utf-8')
+
+    response = json.loads(_openai_api('/files', 'POST', body, f'multipart/form-data; boundary={boundary}'))
+    return response['id']
+
+
+def create_batch(input_file_id, job_name):
+    """Создать batch для загруженного файла"""
+    data = {
+        'input_file_id': input_file_id,
+        'endpoint': BATCH_ENDPOINT,
+        'completion_window': COMPLETION_WINDOW,
+        'metadata': {'job': job_name}
+    }
+    return json.loads(_openai_api('/batches', 'POST', json.dumps(data).encode('utf-8')))
+
+
+def get_batch(batch_id):
+    """Текущее состояние batch"""
+    return json.loads(_openai_api(f'/batches/{batch_id}'))
+
+
+def download_file_content(file_id):
+    """Содержимое файла результатов"""
+    return _openai_api(f'/files/{file_id}/content').decode('utf-8')
+
+
+def parse_batch_output(text):
+    """Разобрать JSONL результатов: custom_id -> {'success', 'reply' | 'error', 'usage'}"""
+    results = {}
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        item = json.loads(line)
+        custom_id = item.get('custom_id')
+        response = item.get('response') or {}
+        body = response.get('body') or {}
+
+        if item.get('error') or response.get('status_code', 200) != 200 or not body.get('choices'):
+            error = item.get('error') or body.get('error') or 'No response from OpenAI'
+            results[custom_id] = {'success': False, 'error': error}
+            continue
+
+        results[custom_id] = {
+            'success': True,
+            'reply': body['choices'][0]['message']['content'].strip(),
+            'usage': body.get('usage', {})
+        }
+    return results
+
+
+def _checkpoint_path(job_name):
+    return os.path.join(get_checkpoint_dir(), f'{job_name}.json')
+
+
+def load_checkpoint(job_name):
+    """Состояние незавершённого запуска задачи или None"""
+    try:
+        with open(_checkpoint_path(job_name), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def save_checkpoint(job_name, state):
+    """Атомарно сохранить состояние задачи"""
+    state['updated_at'] = datetime.now(timezone.utc).isoformat()
+    path = _checkpoint_path(job_name)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def run_batch_job(job_name, build_requests, apply_result, wait=True, poll_interval=60, timeout=None):
+    """Выполнить (или продолжить) пакетную задачу. Возвращает итоговое состояние."""
+    state = load_checkpoint(job_name)
+    if state is None or state.get('stage') in ('done', 'failed'):
+        state = {'job': job_name, 'stage': 'new', 'created_at': datetime.now(timezone.utc).isoformat()}
+    else:
+        log.info(f"🔁 Resuming batch job {job_name} from stage '{state['stage']}'")
+
+    if state['stage'] == 'new':
+        batch_requests = build_requests()
+        if not batch_requests:
+            log.info(f"⏭️ Batch job {job_name}: nothing to do")
+            state['stage'] = 'done'
+            state['request_count'] = 0
+            save_checkpoint(job_name, state)
+            return state
+
+        requests_path = os.path.join(get_checkpoint_dir(), f'{job_name}.requests.jsonl')
+        write_requests_file(batch_requests, requests_path)
+        state.update({'stage': 'written', 'requests_path': requests_path, 'request_count': len(batch_requests)})
+        save_checkpoint(job_name, state)
+        log.info(f"📝 Batch job {job_name}: {len(batch_requests)} requests written")
+
+    if state['stage'] == 'written':
+        state['input_file_id'] = upload_batch_file(state['requests_path'])
+        state['stage'] = 'uploaded'
+        save_checkpoint(job_name, state)
+        log.info(f"📤 Batch job {job_name}: uploaded as {state['input_file_id']}")
+
+    if state['stage'] == 'uploaded':
+        batch = create_batch(state['input_file_id'], job_name)
+        state['batch_id'] = batch['id']
+        state['stage'] = 'submitted'
+        save_checkpoint(job_name, state)
+        log.info(f"🚀 Batch job {job_name}: submitted batch {batch['id']}")
+
+    if state['stage'] == 'submitted':
+        started = time.monotonic()
+        while True:
+            batch = get_batch(state['batch_id'])
+            state['batch_status'] = batch.get('status')
+            if batch.get('status') in FINAL_BATCH_STATUSES:
+                break
+            if not wait or (timeout is not None and time.monotonic() - started > timeout):
+                save_checkpoint(job_name, state)
+                log.info(f"⏳ Batch job {job_name}: batch is {batch.get('status')}, resume later")
+                return state
+            time.sleep(poll_interval)
+
+        if batch.get('status') != 'completed' or not batch.get('output_file_id'):
+            state['stage'] = 'failed'
+            state['error'] = batch.get('errors') or f"Batch finished with status {batch.get('status')}"
+            save_checkpoint(job_name, state)
+            log.error(f"❌ Batch job {job_name}: {state['error']}")
+            return state
+
+        output_path = os.path.join(get_checkpoint_dir(), f'{job_name}.output.jsonl')
+        with open(output_path, 'w', encoding='utf-8') as f:
+            f.write(download_file_content(batch['output_file_id']))
+        state.update({'stage': 'downloaded', 'output_path': output_path, 'applied_ids': []})
+        save_checkpoint(job_name, state)
+        log.info(f"📥 Batch job {job_name}: results downloaded")
+
+    if state['stage'] == 'downloaded':
+        with open(state['output_path'], 'r', encoding='utf-8') as f:
+            results = parse_batch_output(f.read())
+
+        applied = set(state.get('applied_ids', []))
+        failed = 0
+        try:
+            for custom_id, result in results.items():
+                if custom_id in applied:
+                    continue
+                if result['success']:
+                    apply_result(custom_id, result)
+                else:
+                    failed += 1
+                    log.warning(f"⚠️ Batch job {job_name}: {custom_id} failed: {result['error']}")
+                applied.add(custom_id)
+                if len(applied) % CHECKPOINT_EVERY == 0:
+                    state['applied_ids'] = sorted(applied)
+                    save_checkpoint(job_name, state)
+        finally:
+            # Даже при ошибке apply_result уже применённые результаты не применятся повторно
+            state['applied_ids'] = sorted(applied)
+            save_checkpoint(job_name, state)
+
+        state.update({'stage': 'done', 'applied_ids': sorted(applied), 'failed_count': failed})
+        save_checkpoint(job_name, state)
+        log.info(f"✅ Batch job {job_name}: {len(applied) - failed} results applied, {failed} failed")
+
+    return state
+
+
+# ---- Задачи ----
+
+def build_greeting_pool_requests():
+    """Запросы на пополнение пула приветствий аудио диалога (по уровням)"""
+    pool_size = int(os.environ.get('GREETING_POOL_SIZE', 20))
+    batch_requests = []
+    for level in LEVELS:
+        prompt = build_audio_greeting_prompt(level)
+        for i in range(pool_size):
+            batch_requests.append(make_batch_request(
+                f'greeting:{level}:{i}:{uuid.uuid4().hex[:8]}', "Generate audio greeting", prompt,
+                temperature=0.9, max_tokens=150
+            ))
+    return batch_requests
+
+
+def apply_greeting_result(custom_id, result):
+    """Сохранить приветствие в greeting_pool"""
+    _, level, _, _ = custom_id.split(':')
+    supabase_request('greeting_pool', 'POST', {
+        'level': level,
+        'text': result['reply'],
+        'batch_custom_id': custom_id
+    }, prefer='resolution=ignore-duplicates,return=minimal')
+
+
+FEEDBACK_SUMMARY_PROMPT = """Summarize the user's feedback about an English-learning Telegram bot in ONE short English sentence.
+Start with the sentiment in square brackets: [positive], [neutral] or [negative].
+Return only the summary."""
+
+
+def build_feedback_summary_requests():
+    """Запросы на саммари фидбэка, у которого ещё нет summary"""
+    rows = supabase_request('feedback?summary=is.null&select=id,text&order=created_at.asc&limit=1000') or []
+    return [
+        make_batch_request(f"feedback:{row['id']}", row['text'], FEEDBACK_SUMMARY_PROMPT, temperature=0.2, max_tokens=80)
+        for row in rows if row.get('text')
+    ]
+
+
+def apply_feedback_summary_result(custom_id, result):
+    """Записать summary в строку feedback"""
+    feedback_id = custom_id.split(':', 1)[1]
+    supabase_request(f'feedback?id=eq.{feedback_id}', 'PATCH', {'summary': result['reply']}, prefer='return=minimal')
+
+
+PROGRESS_DIGEST_PROMPT = """You write a short nightly progress digest for a learner of English in a Telegram bot.
+Use the learner's stats from the user message. Write in {language}.
+2-3 sentences, warm and motivating, mention the streak and completed lessons, suggest one next step.
+Use single asterisks *word* for bold. Return only the digest text."""
+
+
+def build_progress_digest_requests():
+    """Запросы на ночные дайджесты прогресса активных пользователей"""
+    day = datetime.now(timezone.utc).date().isoformat()
+    rows = supabase_request(
+        'users?is_active=eq.true&select=id,current_streak,total_lessons_completed,lessons_left,'
+        'text_messages_total,interface_language&limit=5000'
+    ) or []
+
+    batch_requests = []
+    for row in rows:
+        language = 'English' if row.get('interface_language') == 'en' else 'Russian'
+        stats = json.dumps({
+            'streak_days': row.get('current_streak') or 0,
+            'audio_lessons_completed': row.get('total_lessons_completed') or 0,
+            'audio_lessons_left': row.get('lessons_left') or 0,
+            'text_messages_total': row.get('text_messages_total') or 0
+        })
+        batch_requests.append(make_batch_request(
+            f"digest:{row['id']}:{day}", stats, PROGRESS_DIGEST_PROMPT.format(language=language),
+            temperature=0.7, max_tokens=200
+        ))
+    return batch_requests
+
+
+def apply_progress_digest_result(custom_id, result):
+    """Сохранить дайджест (upsert по user_id + day)"""
+    _, user_id, day = custom_id.split(':')
+    supabase_request('progress_digests?on_conflict=user_id,day', 'POST', {
+        'user_id': user_id,
+        'day': day,
+        'text': result['reply']
+    }, prefer='resolution=merge-duplicates,return=minimal')
+
+
+JOBS = {
+    'greeting_pool': (build_greeting_pool_requests, apply_greeting_result),
+    'feedback_summaries': (build_feedback_summary_requests, apply_feedback_summary_result),
+    'progress_digests': (build_progress_digest_requests, apply_progress_digest_result)
+}
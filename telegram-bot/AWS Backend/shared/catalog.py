@@ -0,0 +1,46 @@
+"""Каталог продуктов (пакеты уроков) в памяти тёплого контейнера
+
+Таблица products меняется редко, а читается при каждом начислении пакета (опросник, первый
+фидбэк). Каталог загружается целиком одним запросом (при прогреве - действие warmup; прогрев
+регистрируется при импорте модуля действиями, которым он нужен) и хранится PRODUCT_CATALOG_TTL секунд; продукт, которого нет в кэше, дочитывается по id.
+"""
+import os
+
+from shared.cache import TTLCache
+from shared.database import supabase_request
+from shared.logger import get_logger
+from shared.metrics import register_cache
+from shared.warmup import register_warmer
+
+log = get_logger(__name__)
+
+
+DEFAULT_CATALOG_TTL = 600
+
+_products = TTLCache(maxsize=256, ttl=float(os.environ.get('PRODUCT_CATALOG_TTL', DEFAULT_CATALOG_TTL)))
+register_cache('product_catalog', _products)
+
+
+def load_catalog(deadline=None):
+    """Загрузить все продукты в кэш; число загруженных"""
+    products = supabase_request('products?select=*', deadline=deadline) or []
+    for product in products:
+        _products.set(product['id'], product)
+    log.debug("📦 Product catalog loaded: %d products", len(products))
+    return len(products)
+
+
+def get_product(product_id, deadline=None):
+    """Продукт по id из кэша или из Supabase; None, если такого нет"""
+    product = _products.get(product_id)
+    if product is not None:
+        return product
+
+    rows = supabase_request(f'products?id=eq.{product_id}', deadline=deadline) or []
+    if not rows:
+        return None
+    _products.set(product_id, rows[0])
+    return rows[0]
+
+
+register_warmer('product_catalog', load_catalog)
@@ -1,8 +1,13 @@
 """Общие функции для работы с базой данных Supabase"""
 import json
-import urllib.request
 from datetime import datetime
 
+from shared.admission import track_upstream
+from shared.deadline import get_timeout
+from shared.logger import get_logger
+
+log = get_logger(__name__)
+
 
 def get_supabase_config():
     """Получить конфигурацию Supabase"""
@@ -13,8 +18,32 @@ def get_supabase_config():
     }
 
 
-def log_text_usage(user_id, supabase_url, supabase_key):
+def supabase_request(path, method='GET', data=None, prefer=None, deadline=None):
+    """Запрос к Supabase REST API (path относительно /rest/v1/), возвращает разобранный JSON или None"""
+    # urllib.request (с http.client и ssl) - при первом запросе, а не при импорте модуля: холодный старт
+    import urllib.request
+
+    config = get_supabase_config()
+    url = f"{config['url']}/rest/v1/{path}"
+    headers = {
+        'Content-Type': 'application/json',
+        'Authorization': f"Bearer {config['key']}",
+        'apikey': config['key']
+    }
+    if prefer:
+        headers['Prefer'] = prefer
+    
+    body = json.dumps(data).encode('utf-8') if data is not None else None
+    req = urllib.request.Request(url, data=body, headers=headers, method=method)
+    with track_upstream('supabase'), urllib.request.urlopen(req, timeout=get_timeout(deadline, 'supabase')) as response:
+        response_text = response.read().decode('utf-8')
+        return json.loads(response_text) if response_text else None
+
+
+def log_text_usage(user_id, supabase_url, supabase_key, deadline=None):
     """Логирует использование текстового помощника"""
+    import urllib.request
+
     try:
         url = f"{supabase_url}/rest/v1/users?telegram_id=eq.{user_id}"
         headers = {
@@ -25,7 +54,7 @@ def log_text_usage(user_id, supabase_url, supabase_key):
         
         # Получаем текущие значения
         req = urllib.request.Request(url, headers=headers)
-        with urllib.request.urlopen(req) as response:
+        with track_upstream('supabase'), urllib.request.urlopen(req, timeout=get_timeout(deadline, 'supabase')) as response:
             response_text = response.read().decode('utf-8')
             if response_text:
                 users = json.loads(response_text)
@@ -46,14 +75,14 @@ def log_text_usage(user_id, supabase_url, supabase_key):
                         method='PATCH'
                     )
                     
-                    with urllib.request.urlopen(req_update) as update_response:
-                        print(f"✅ Text usage logged for user {user_id}")
+                    with track_upstream('supabase'), urllib.request.urlopen(req_update, timeout=get_timeout(deadline, 'supabase')) as update_response:
+                        log.debug("✅ Text usage logged for user %s", user_id)
                         
     except Exception as e:
-        print(f"❌ Error logging text usage: {e}")
+        log.error(f"❌ Error logging text usage: {e}", user_id=user_id)
 
 
-def get_user_profile(user_id, supabase_url, supabase_key):
+def get_user_profile(user_id, supabase_url, supabase_key, deadline=None):
     """Получить профиль пользователя"""
     try:
         url = f"{supabase_url}/rest/v1/users?telegram_id=eq.{user_id}&select=*"
@@ -63,11 +92,11 @@ def get_user_profile(user_id, supabase_url, supabase_key):
         }
         
         req = urllib.request.Request(url, headers=headers)
-        with urllib.request.urlopen(req) as response:
+        with track_upstream('supabase'), urllib.request.urlopen(req, timeout=get_timeout(deadline, 'supabase')) as response:
             response_text = response.read().decode('utf-8')
             users = json.loads(response_text)
             return users[0] if users else None
                 
     except Exception as e:
-        print(f"❌ Error getting user profile: {e}")
+        log.error(f"❌ Error getting user profile: {e}")
         return None
@@ -0,0 +1,82 @@
+"""Дедлайн запроса: оставшееся время Lambda -> таймауты исходящих вызовов
+
+Deadline создаётся в начале lambda_handler из context.get_remaining_time_in_millis()
+и передаётся во все HTTP-вызовы (Supabase, OpenAI). Каждый вызов получает таймаут
+min(потолок шага, оставшееся время - резерв). Если на шаг не хватает даже минимального
+времени, бросается DeadlineExceeded, и обработчик возвращает структурированную ошибку
+до того, как Lambda будет убита посреди записи.
+"""
+import os
+import time
+
+
+# Резерв на формирование ответа и логирование после последнего вызова
+DEFAULT_RESERVE_MS = 500
+# Бюджет, если context недоступен (локальный запуск, тесты)
+DEFAULT_BUDGET_MS = 30000
+
+# Минимальный и максимальный таймаут шага в секундах по типу upstream
+STEP_TIMEOUTS = {
+    'openai': {'min': 2.0, 'max': 25.0},
+    'supabase': {'min': 0.3, 'max': 5.0},
+    'telegram': {'min': 0.5, 'max': 4.0},
+    'default': {'min': 0.5, 'max': 10.0}
+}
+
+
+class DeadlineExceeded(Exception):
+    """Оставшегося времени не хватает на очередной шаг"""
+
+    def __init__(self, step, remaining_ms, needed_ms):
+        super().__init__(f"Deadline exceeded before {step}: {remaining_ms:.0f}ms left, {needed_ms:.0f}ms needed")
+        self.step = step
+        self.remaining_ms = remaining_ms
+        self.needed_ms = needed_ms
+
+    def details(self):
+        """Поля структурированной ошибки для ответа"""
+        return {
+            'error_code': 'deadline_exceeded',
+            'step': self.step,
+            'remaining_ms': round(self.remaining_ms),
+            'needed_ms': round(self.needed_ms)
+        }
+
+
+class Deadline:
+    """Бюджет времени одного вызова Lambda"""
+
+    def __init__(self, budget_ms, reserve_ms=None):
+        if reserve_ms is None:
+            reserve_ms = float(os.environ.get('DEADLINE_RESERVE_MS', DEFAULT_RESERVE_MS))
+        self.expires_at = time.monotonic() + (budget_ms - reserve_ms) / 1000
+
+    @classmethod
+    def from_context(cls, context):
+        """Дедлайн по оставшемуся времени Lambda (или DEFAULT_BUDGET_MS без context)"""
+        get_remaining = getattr(context, 'get_remaining_time_in_millis', None)
+        budget_ms = get_remaining() if get_remaining else DEFAULT_BUDGET_MS
+        return cls(budget_ms)
+
+    def remaining_ms(self):
+        """Сколько миллисекунд осталось (с учётом резерва)"""
+        return max(0.0, (self.expires_at - time.monotonic()) * 1000)
+
+    def check(self, step, needed_ms):
+        """Убедиться, что на шаг осталось хотя бы needed_ms"""
+        remaining = self.remaining_ms()
+        if remaining < needed_ms:
+            raise DeadlineExceeded(step, remaining, needed_ms)
+
+    def timeout(self, upstream):
+        """Таймаут в секундах для вызова upstream; DeadlineExceeded, если шаг не помещается"""
+        limits = STEP_TIMEOUTS.get(upstream, STEP_TIMEOUTS['default'])
+        self.check(upstream, limits['min'] * 1000)
+        return min(limits['max'], self.remaining_ms() / 1000)
+
+
+def get_timeout(deadline, upstream):
+    """Таймаут вызова: от дедлайна запроса или потолок шага, если дедлайна нет"""
+    if deadline is None:
+        return STEP_TIMEOUTS.get(upstream, STEP_TIMEOUTS['default'])['max']
+    return deadline.timeout(upstream)
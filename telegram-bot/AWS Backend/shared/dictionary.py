@@ -0,0 +1,144 @@
+"""Офлайн-словарь RU↔EN для быстрого перевода коротких запросов без OpenAI
+
+Данные лежат в dictionary_ru_en.tsv: строки "ключ<TAB>перевод", отсортированные по байтам UTF-8,
+ключи в нижнем регистре (ё → е), обе стороны перевода в одном файле. Файл отображается в память
+(mmap) и ищется бинарным поиском, поэтому поиск не требует загрузки словаря целиком.
+
+После ручного редактирования файл нужно пересортировать: python dictionary.py
+"""
+import mmap
+import os
+import re
+
+from shared.logger import get_logger
+from shared.warmup import register_warmer
+
+log = get_logger(__name__)
+
+
+DICTIONARY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'dictionary_ru_en.tsv')
+
+# Длиннее этого - сразу в модель
+MAX_WORDS = 2
+MAX_CHARS = 40
+
+CYRILLIC_RE = re.compile(r'[а-яё]', re.IGNORECASE)
+LATIN_RE = re.compile(r'[a-z]', re.IGNORECASE)
+
+# Лениво открытый mmap словаря (переживает вызовы в тёплом контейнере)
+_dictionary_mmap = None
+
+
+def _get_dictionary():
+    """Открыть (один раз) mmap словаря; None если файла нет"""
+    global _dictionary_mmap
+    if _dictionary_mmap is None:
+        try:
+            with open(DICTIONARY_PATH, 'rb') as f:
+                _dictionary_mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError) as e:
+            log.warning(f"⚠️ Dictionary not available: {e}")
+            return None
+    return _dictionary_mmap
+
+
+def normalize_key(text):
+    """Ключ поиска: нижний регистр, ё → е, без пунктуации по краям и лишних пробелов"""
+    text = (text or '').lower().replace('ё', 'е')
+    text = re.sub(r'\s+', ' ', text).strip()
+    return text.strip(' .!?,;:"\'()«»…')
+
+
+def detect_direction(text):
+    """Направление перевода по алфавиту: 'ru-en', 'en-ru' или None для смешанного текста"""
+    has_cyrillic = bool(CYRILLIC_RE.search(text))
+    has_latin = bool(LATIN_RE.search(text))
+    if has_cyrillic and not has_latin:
+        return 'ru-en'
+    if has_latin and not has_cyrillic:
+        return 'en-ru'
+    return None
+
+
+def lookup(key):
+    """Бинарный поиск ключа в отсортированном словаре"""
+    mm = _get_dictionary()
+    if mm is None or not key:
+        return None
+
+    needle = key.encode('utf-8')
+    lo, hi = 0, len(mm)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        start = mm.rfind(b'\n', 0, mid) + 1
+        end = mm.find(b'\n', start)
+        if end == -1:
+            end = len(mm)
+        line_key, _, value = mm[start:end].partition(b'\t')
+        if line_key == needle:
+            return value.decode('utf-8')
+        if line_key < needle:
+            lo = end + 1
+        else:
+            hi = start
+    return None
+
+
+def translate_short_text(text):
+    """Перевод одного-двух слов по словарю или None, если нужен OpenAI"""
+    if not text or len(text) > MAX_CHARS:
+        return None
+
+    key = normalize_key(text)
+    if not key or len(key.split(' ')) > MAX_WORDS:
+        return None
+
+    direction = detect_direction(key)
+    if not direction:
+        return None
+
+    translation = lookup(key)
+    if translation is None:
+        return None
+
+    # Сохраняем заглавную букву, если пользователь написал с неё
+    stripped = text.strip()
+    if stripped[:1].isupper():
+        translation = translation[:1].upper() + translation[1:]
+
+    log.debug("📖 Dictionary hit (%s): %s -> %s", direction, key, translation)
+    return translation
+
+
+def warm_dictionary():
+    """Открыть mmap словаря и попросить ядро заранее подгрузить его страницы; размер в байтах"""
+    dictionary = _get_dictionary()
+    if dictionary is None:
+        return 0
+    if hasattr(dictionary, 'madvise') and hasattr(mmap, 'MADV_WILLNEED'):
+        dictionary.madvise(mmap.MADV_WILLNEED)
+    return len(dictionary)
+
+
+register_warmer('dictionary', warm_dictionary)
+
+
+def sort_dictionary_file(path=DICTIONARY_PATH):
+    """Нормализовать ключи и пересортировать файл словаря по байтам UTF-8"""
+    entries = {}
+    with open(path, 'rb') as f:
+        for raw_line in f:
+            line = raw_line.decode('utf-8').rstrip('\n')
+            if '\t' not in line:
+                continue
+            key, value = line.split('\t', 1)
+            entries[normalize_key(key).encode('utf-8')] = value.strip().encode('utf-8')
+
+    with open(path, 'wb') as f:
+        for key in sorted(entries):
+            f.write(key + b'\t' + entries[key] + b'\n')
+    return len(entries)
+
+
+if __name__ == '__main__':
+    print(f"✅ Dictionary sorted: {sort_dictionary_file()} entries")
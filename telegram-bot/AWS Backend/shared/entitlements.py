@@ -0,0 +1,159 @@
+"""Подписанные короткоживущие токены доступа (entitlement): проверка доступа без запроса к users
+
+get_profile и проверки доступа, сходившие в базу, отдают entitlement_token - HMAC-SHA256
+(ENTITLEMENT_SECRET) от срока пакета, остатка уроков, языка интерфейса и времени выдачи; токен
+живёт ENTITLEMENT_TOKEN_TTL секунд (по умолчанию 300), но не дольше самого пакета. Worker хранит
+его в KV и передаёт в process_text_message и check_audio_access - доступ проверяется локально.
+
+Токену верим только когда он разрешает доступ. Покупки и начисления лишь продлевают пакет,
+поэтому токен, выданный до покупки, может только занизить доступ - такой отказ всегда
+перепроверяется по базе, и покупка видна сразу. Списание урока (decrease_lessons_left) отзывает
+старые токены пользователя в контейнере и отдаёт новый. Без ENTITLEMENT_SECRET или с
+ENTITLEMENT_TOKENS_ENABLED=false токены не выдаются и все проверки идут в базу.
+"""
+import base64
+import hashlib
+import hmac
+import json
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+from shared.cache import TTLCache
+from shared.logger import get_logger
+from shared.metrics import register_source
+
+log = get_logger(__name__)
+
+
+DEFAULT_TOKEN_TTL = 300
+TOKEN_VERSION = 1
+
+_revoked = TTLCache(maxsize=10000, ttl=float(os.environ.get('ENTITLEMENT_TOKEN_TTL', DEFAULT_TOKEN_TTL)))
+_stats = {'issued': 0, 'verified': 0, 'rejected': 0, 'fallbacks': 0}
+_stats_lock = threading.Lock()
+
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def get_secret():
+    """Ключ подписи или None, если токены выключены"""
+    if os.environ.get('ENTITLEMENT_TOKENS_ENABLED', 'true').lower() == 'false':
+        return None
+    return os.environ.get('ENTITLEMENT_SECRET') or None
+
+
+def get_token_ttl():
+    return float(os.environ.get('ENTITLEMENT_TOKEN_TTL', DEFAULT_TOKEN_TTL))
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+
+def _sign(payload, secret):
+    return hmac.new(secret.encode('utf-8'), payload.encode('ascii'), hashlib.sha256).digest()
+
+
+def parse_expires_at(package_expires_at):
+    """package_expires_at из Supabase в unix-время (без зоны - UTC); None, если нет или не разбирается"""
+    if not package_expires_at:
+        return None
+    try:
+        expires = datetime.fromisoformat(package_expires_at.replace('Z', '+00:00'))
+    except (TypeError, ValueError):
+        return None
+    if expires.tzinfo is None:
+        expires = expires.replace(tzinfo=timezone.utc)
+    return expires.timestamp()
+
+
+def issue_token(user_id, package_expires_at, lessons_left, interface_language=None):
+    """Токен для пользователя с действующим пакетом; None - выдавать нечего (нет ключа или пакета)"""
+    secret = get_secret()
+    expires_at = parse_expires_at(package_expires_at)
+    now = time.time()
+    if not secret or user_id is None or expires_at is None or expires_at <= now:
+        return None
+
+    claims = {
+        'v': TOKEN_VERSION,
+        'u': str(user_id),
+        'pe': expires_at,
+        'l': int(lessons_left or 0),
+        'il': interface_language or 'ru',
+        'iat': round(now, 3),
+        'exp': round(min(now + get_token_ttl(), expires_at), 3)
+    }
+    payload = _b64encode(json.dumps(claims, separators=(',', ':')).encode('utf-8'))
+    _count('issued')
+    return f'{payload}.{_b64encode(_sign(payload, secret))}'
+
+
+def verify_token(token, user_id):
+    """Проверенные поля токена или None (нет, подделан, чужой, истёк или отозван) - тогда идём в базу"""
+    secret = get_secret()
+    if not token or not secret or not isinstance(token, str):
+        return None
+    try:
+        payload, signature = token.split('.', 1)
+        if not hmac.compare_digest(_sign(payload, secret), _b64decode(signature)):
+            raise ValueError('bad signature')
+        claims = json.loads(_b64decode(payload))
+        if claims.get('v') != TOKEN_VERSION or claims.get('u') != str(user_id):
+            raise ValueError('wrong user or version')
+        expires, issued = float(claims['exp']), float(claims['iat'])
+    except (ValueError, TypeError, AttributeError, KeyError) as e:
+        log.warning(f"⚠️ Invalid entitlement token for user {user_id}: {e}")
+        _count('rejected')
+        return None
+
+    revoked_at = _revoked.get(claims['u'])
+    if expires <= time.time() or (revoked_at is not None and issued < revoked_at):
+        log.debug("Entitlement token for user %s expired or revoked", user_id)
+        _count('rejected')
+        return None
+    _count('verified')
+    return claims
+
+
+def revoke_tokens(user_id):
+    """Отозвать в этом контейнере токены пользователя, выданные до текущего момента"""
+    _revoked.set(str(user_id), time.time())
+
+
+def expires_at_iso(claims):
+    """Срок пакета из токена в формате Supabase (ISO, UTC)"""
+    return datetime.fromtimestamp(claims['pe'], timezone.utc).isoformat()
+
+
+def has_text_access(claims):
+    """Текстовый помощник: действующий пакет"""
+    return claims['pe'] > time.time()
+
+
+def has_audio_access(claims):
+    """Аудио-уроки: действующий пакет и хотя бы один урок"""
+    return claims['l'] > 0 and has_text_access(claims)
+
+
+def count_fallback():
+    """Учесть проверку доступа, которой пришлось идти в базу"""
+    _count('fallbacks')
+
+
+def get_entitlement_stats():
+    """Выдано, принято, отклонено токенов и проверок через базу"""
+    with _stats_lock:
+        return dict(_stats)
+
+
+register_source('entitlements', get_entitlement_stats)
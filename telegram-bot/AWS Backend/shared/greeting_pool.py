@@ -0,0 +1,71 @@
+"""Пул приветствий аудио диалога, заранее сгенерированных пакетной задачей greeting_pool
+
+Приветствие не зависит от пользователя (только от уровня), поэтому его не нужно генерировать
+на каждый старт диалога: tools/run_batch_job.py greeting_pool пополняет таблицу greeting_pool,
+а Lambda отдаёт случайное приветствие из пула. Пул загружается целиком одним запросом
+(при прогреве - действие warmup) и хранится GREETING_POOL_TTL секунд; пустой пул или ошибка
+чтения - вызывающий код генерирует приветствие как раньше.
+"""
+import os
+import random
+
+from shared.cache import TTLCache
+from shared.database import supabase_request
+from shared.deadline import DeadlineExceeded
+from shared.logger import get_logger
+from shared.metrics import register_cache
+from shared.warmup import register_warmer
+
+log = get_logger(__name__)
+
+
+LEVELS = ['Beginner', 'Intermediate', 'Advanced']
+
+DEFAULT_POOL_TTL = 600
+# Сколько последних приветствий читать за раз (на все уровни)
+POOL_FETCH_LIMIT = 300
+# После ошибки чтения пул не запрашивается столько секунд
+POOL_RETRY_AFTER = 60
+
+_pool = TTLCache(maxsize=len(LEVELS), ttl=float(os.environ.get('GREETING_POOL_TTL', DEFAULT_POOL_TTL)))
+register_cache('greeting_pool', _pool)
+
+
+def load_greeting_pool(deadline=None):
+    """Загрузить пул приветствий в кэш по уровням; число загруженных"""
+    rows = supabase_request(
+        f'greeting_pool?select=level,text&order=created_at.desc&limit={POOL_FETCH_LIMIT}', deadline=deadline
+    ) or []
+    by_level = {level: [] for level in LEVELS}
+    for row in rows:
+        if row.get('level') in by_level and row.get('text'):
+            by_level[row['level']].append(row['text'])
+    # Пустой уровень тоже кэшируется, чтобы не читать таблицу на каждый старт диалога
+    for level, texts in by_level.items():
+        _pool.set(level, texts)
+    log.debug("👋 Greeting pool loaded: %d greetings", sum(len(texts) for texts in by_level.values()))
+    return len(rows)
+
+
+def get_pooled_greeting(level, deadline=None):
+    """Случайное приветствие из пула для уровня или None (пула нет - нужна живая генерация)"""
+    if level not in LEVELS:
+        return None
+
+    texts = _pool.get(level)
+    if texts is None:
+        try:
+            load_greeting_pool(deadline)
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            log.warning(f"⚠️ Greeting pool unavailable, generating live: {e}")
+            for pool_level in LEVELS:
+                _pool.set(pool_level, [], ttl=POOL_RETRY_AFTER)
+            return None
+        texts = _pool.get(level) or []
+
+    return random.choice(texts) if texts else None
+
+
+register_warmer('greeting_pool', load_greeting_pool)
@@ -0,0 +1,202 @@
+"""Глубокая проверка здоровья Lambda: замеренные пробы зависимостей и состояние контейнера
+
+Действие health каждой Lambda выполняет дешёвые пробы параллельно:
+  supabase - GET /rest/v1/users?select=id&limit=1 (одна колонка, одна строка)
+  openai   - GET /v1/models/<HEALTH_OPENAI_MODEL> (метаданные одной модели, без токенов)
+и добавляет к ним пул соединений, заполненность кэшей, уровень нагрузки и перцентили задержки
+зависимостей по реальному трафику (shared/metrics.py).
+
+Результат кэшируется на HEALTH_CACHE_TTL секунд (по умолчанию 10), одновременные проверки
+ждут одну пробу - частый мониторинг не добавляет нагрузки на Supabase и OpenAI.
+Проба медленнее порога (HEALTH_SLOW_MS, JSON) - статус degraded, ошибка - error и HTTP 503.
+"""
+import json
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+from shared.logger import get_logger
+from shared.metrics import get_cache_stats, get_dependency_summary, get_source_snapshot
+
+log = get_logger(__name__)
+
+
+DEFAULT_CACHE_TTL = 10
+DEFAULT_PROBE_TIMEOUT = 3
+DEFAULT_OPENAI_MODEL = 'gpt-4o-mini'
+
+# Порог «медленной» пробы, мс; переопределяется HEALTH_SLOW_MS, например {"openai": 2500}
+DEFAULT_SLOW_MS = {
+    'supabase': 500,
+    'openai': 1500
+}
+
+STATUS_OK = 'ok'
+STATUS_DEGRADED = 'degraded'
+STATUS_ERROR = 'error'
+
+_cached = {}
+_cache_lock = threading.Lock()
+
+
+def get_slow_thresholds():
+    """Пороги медленной пробы с учётом переопределений из окружения"""
+    thresholds = dict(DEFAULT_SLOW_MS)
+    overrides = os.environ.get('HEALTH_SLOW_MS')
+    if overrides:
+        try:
+            thresholds.update(json.loads(overrides))
+        except ValueError as e:
+            log.warning(f"⚠️ Invalid HEALTH_SLOW_MS, using defaults: {e}")
+    return thresholds
+
+
+def _timed_get(url, headers, timeout):
+    """GET с замером задержки: (HTTP-статус или None, задержка мс, ошибка или None)"""
+    # urllib (с http.client и ssl) - при первой пробе, а не при импорте модуля: холодный старт
+    import urllib.error
+    import urllib.request
+
+    started = time.monotonic()
+    try:
+        req = urllib.request.Request(url, headers=headers)
+        with urllib.request.urlopen(req, timeout=timeout) as response:
+            response.read()
+            status = response.status
+        error = None
+    except urllib.error.HTTPError as e:
+        status, error = e.code, f'HTTP {e.code}'
+    except Exception as e:
+        status, error = None, str(e) or e.__class__.__name__
+    return status, round((time.monotonic() - started) * 1000, 1), error
+
+
+def probe_supabase(timeout):
+    """Минимальный запрос к Supabase: одна колонка одной строки"""
+    supabase_url = os.environ.get('SUPABASE_URL')
+    supabase_key = os.environ.get('SUPABASE_SERVICE_KEY')
+    if not supabase_url or not supabase_key:
+        return None, 0.0, 'Supabase not configured'
+    return _timed_get(
+        f"{supabase_url.rstrip('/')}/rest/v1/users?select=id&limit=1",
+        {'apikey': supabase_key, 'Authorization': f'Bearer {supabase_key}'},
+        timeout
+    )
+
+
+def probe_openai(timeout):
+    """Метаданные одной модели OpenAI: проверяет сеть, ключ и доступ к модели без расхода токенов"""
+    openai_api_key = os.environ.get('OPENAI_API_KEY')
+    if not openai_api_key:
+        return None, 0.0, 'OpenAI API key not configured'
+    # Импорт здесь: payments проверяет только Supabase и не включает клиент OpenAI в свой zip
+    from shared.openai_client import get_openai_base_url
+    model = os.environ.get('HEALTH_OPENAI_MODEL', DEFAULT_OPENAI_MODEL)
+    return _timed_get(f'{get_openai_base_url()}/models/{model}', {'Authorization': f'Bearer {openai_api_key}'}, timeout)
+
+
+PROBES = {
+    'supabase': probe_supabase,
+    'openai': probe_openai
+}
+
+
+def run_probes(dependencies):
+    """Параллельно выполнить пробы зависимостей; результат по каждой"""
+    from concurrent.futures import ThreadPoolExecutor
+
+    timeout = float(os.environ.get('HEALTH_PROBE_TIMEOUT', DEFAULT_PROBE_TIMEOUT))
+    thresholds = get_slow_thresholds()
+
+    with ThreadPoolExecutor(max_workers=len(dependencies)) as executor:
+        futures = {name: executor.submit(PROBES[name], timeout) for name in dependencies}
+
+    traffic = get_dependency_summary()
+    results = {}
+    for name, future in futures.items():
+        http_status, latency_ms, error = future.result()
+        if error:
+            status = STATUS_ERROR
+        elif latency_ms > thresholds.get(name, max(thresholds.values())):
+            status = STATUS_DEGRADED
+        else:
+            status = STATUS_OK
+        result = {'status': status, 'probe_ms': latency_ms, 'http_status': http_status}
+        if error:
+            result['error'] = error
+        if name in traffic:
+            result['traffic'] = {key: traffic[name][key] for key in ('count', 'errors', 'p50_ms', 'p99_ms')}
+        results[name] = result
+    return results
+
+
+def _cache_warmth():
+    return {
+        name: {
+            'size': stats.get('size', 0),
+            'fill': round(stats.get('size', 0) / stats['maxsize'], 4) if stats.get('maxsize') else None,
+            'hit_rate': stats.get('hit_rate')
+        }
+        for name, stats in get_cache_stats().items()
+    }
+
+
+def build_report(function_name, dependencies):
+    """Полный отчёт о здоровье: пробы, пул, кэши, нагрузка"""
+    started = time.monotonic()
+    probes = run_probes(dependencies)
+    statuses = [probe['status'] for probe in probes.values()]
+    if STATUS_ERROR in statuses:
+        status = STATUS_ERROR
+    elif STATUS_DEGRADED in statuses:
+        status = STATUS_DEGRADED
+    else:
+        status = STATUS_OK
+
+    admission = get_source_snapshot('admission')
+    report = {
+        'status': status,
+        'function': function_name,
+        'checked_at': datetime.now(timezone.utc).isoformat(),
+        'check_ms': round((time.monotonic() - started) * 1000, 1),
+        'dependencies': probes,
+        'connection_pool': get_source_snapshot('connection_pool'),
+        'caches': _cache_warmth(),
+        'load_level': admission['load_level'] if admission else None
+    }
+    if status != STATUS_OK:
+        log.warning(f"🩺 Health {status}", function=function_name,
+                    failing={name: probe.get('error') or f"{probe['probe_ms']}ms" for name, probe in probes.items()
+                             if probe['status'] != STATUS_OK})
+    return report
+
+
+def get_health(function_name, dependencies=('supabase', 'openai')):
+    """Отчёт о здоровье из кэша (не старше HEALTH_CACHE_TTL) или свежий"""
+    ttl = float(os.environ.get('HEALTH_CACHE_TTL', DEFAULT_CACHE_TTL))
+    key = (function_name, tuple(dependencies))
+    # Одна проба на процесс: остальные проверки ждут её и берут готовый отчёт
+    with _cache_lock:
+        entry = _cached.get(key)
+        if entry is None or time.monotonic() - entry['at'] >= ttl:
+            report = build_report(function_name, dependencies)
+            entry = {'at': time.monotonic(), 'report': report}
+            _cached[key] = entry
+            cached = False
+        else:
+            cached = True
+    report = dict(entry['report'])
+    report['cached'] = cached
+    report['age_s'] = round(time.monotonic() - entry['at'], 1)
+    return report
+
+
+def health_response(function_name, dependencies=('supabase', 'openai')):
+    """Ответ Lambda на действие health: 200 (ok/degraded) или 503 (error)"""
+    report = get_health(function_name, dependencies)
+    return {
+        'statusCode': 503 if report['status'] == STATUS_ERROR else 200,
+        'headers': {'Content-Type': 'application/json'},
+        'body': json.dumps({'success': report['status'] != STATUS_ERROR, 'health': report})
+    }
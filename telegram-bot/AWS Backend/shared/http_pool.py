@@ -0,0 +1,177 @@
+"""Пул keep-alive соединений для urllib.request (режим долгоживущего сервера)
+
+urllib закрывает соединение после каждого запроса, поэтому каждый вызов Supabase/OpenAI
+платит за TCP+TLS рукопожатие. install_pooled_opener() подменяет глобальный opener:
+все существующие вызовы urllib.request.urlopen(...) в обработчиках начинают переиспользовать
+соединения из общего пула, без изменений в их коде. В Lambda пул подключает init_container
+(shared/warmup.py) перед первым запросом или при прогреве в init-фазе: соединения, открытые
+прогревом, переживают вызовы тёплого контейнера.
+"""
+import http.client
+import io
+import queue
+import select
+import socket
+import threading
+import urllib.error
+import urllib.request
+import urllib.response
+
+from shared.metrics import register_source
+from shared.tracing import install_trace_processor
+
+
+DEFAULT_MAX_PER_HOST = 16
+
+# Ошибки закрытого сервером переиспользованного соединения
+STALE_CONNECTION_ERRORS = (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError, http.client.BadStatusLine)
+
+# Запрос, отправленный целиком, повторяется только для этих методов: POST/PATCH (completions,
+# RPC, вставки) сервер мог уже выполнить, и повтор списал бы или записал дважды
+IDEMPOTENT_METHODS = frozenset(('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'))
+
+
+def connection_dropped(conn):
+    """Простаивающее соединение закрыто сервером: сокет «читаем» (FIN или мусор) без запроса"""
+    if conn.sock is None:
+        return True
+    try:
+        readable, _, _ = select.select([conn.sock], [], [], 0)
+    except (OSError, ValueError):
+        return True
+    return bool(readable)
+
+
+class ConnectionPool:
+    """Свободные соединения по (схема, хост, порт)"""
+
+    def __init__(self, max_per_host=DEFAULT_MAX_PER_HOST):
+        self.max_per_host = max_per_host
+        self._idle = {}
+        self._lock = threading.Lock()
+        self.stats = {'created': 0, 'reused': 0, 'discarded': 0}
+
+    def _queue(self, key):
+        with self._lock:
+            if key not in self._idle:
+                self._idle[key] = queue.LifoQueue(self.max_per_host)
+            return self._idle[key]
+
+    def acquire(self, scheme, host, timeout):
+        """Взять свободное соединение или создать новое; возвращает (соединение, переиспользовано)"""
+        key = (scheme, host)
+        idle = self._queue(key)
+        while True:
+            try:
+                conn = idle.get_nowait()
+            except queue.Empty:
+                break
+            # Закрытое сервером соединение отбрасываем до отправки запроса, а не после
+            if connection_dropped(conn):
+                self.discard(conn)
+                continue
+            conn.timeout = timeout
+            # urlopen без timeout передаёт маркер «по умолчанию», а не число
+            conn.sock.settimeout(socket.getdefaulttimeout() if timeout is socket._GLOBAL_DEFAULT_TIMEOUT else timeout)
+            with self._lock:
+                self.stats['reused'] += 1
+            return conn, True
+
+        connection_class = http.client.HTTPSConnection if scheme == 'https' else http.client.HTTPConnection
+        with self._lock:
+            self.stats['created'] += 1
+        return connection_class(host, timeout=timeout), False
+
+    def release(self, scheme, host, conn):
+        """Вернуть соединение в пул (или закрыть, если пул хоста заполнен)"""
+        try:
+            self._queue((scheme, host)).put_nowait(conn)
+        except queue.Full:
+            self.discard(conn)
+
+    def idle_count(self):
+        """Число свободных соединений по всем хостам"""
+        with self._lock:
+            return sum(idle.qsize() for idle in self._idle.values())
+
+    def discard(self, conn):
+        conn.close()
+        with self._lock:
+            self.stats['discarded'] += 1
+
+
+class PooledHTTPHandler(urllib.request.HTTPHandler, urllib.request.HTTPSHandler):
+    """Обработчик http/https для urllib, берущий соединения из ConnectionPool"""
+
+    def __init__(self, pool):
+        urllib.request.HTTPHandler.__init__(self)
+        urllib.request.HTTPSHandler.__init__(self)
+        self.pool = pool
+
+    def http_open(self, req):
+        return self._open(req, 'http')
+
+    def https_open(self, req):
+        return self._open(req, 'https')
+
+    def _open(self, req, scheme):
+        host = req.host
+        if not host:
+            raise urllib.error.URLError('no host given')
+
+        headers = dict(req.unredirected_hdrs)
+        headers.update({key: value for key, value in req.headers.items() if key not in headers})
+        headers = {name.title(): value for name, value in headers.items()}
+        headers.pop('Connection', None)
+
+        timeout = req.timeout
+        method = req.get_method()
+        for attempt in range(2):
+            conn, reused = self.pool.acquire(scheme, host, timeout)
+            sent = False
+            try:
+                conn.request(method, req.selector, req.data, headers)
+                sent = True
+                response = conn.getresponse()
+                # Тело читаем целиком, чтобы сразу вернуть соединение в пул
+                body = response.read()
+            except STALE_CONNECTION_ERRORS:
+                self.pool.discard(conn)
+                # Сервер закрыл простаивающее соединение - повторяем один раз на новом, если
+                # запрос не ушёл целиком или его повтор безопасен
+                if reused and attempt == 0 and (not sent or method in IDEMPOTENT_METHODS):
+                    continue
+                raise
+            except OSError as e:
+                self.pool.discard(conn)
+                raise urllib.error.URLError(e)
+            except BaseException:
+                self.pool.discard(conn)
+                raise
+
+            if response.will_close:
+                self.pool.discard(conn)
+            else:
+                self.pool.release(scheme, host, conn)
+
+            result = urllib.response.addinfourl(io.BytesIO(body), response.msg, req.get_full_url(), response.status)
+            result.msg = response.reason
+            return result
+
+
+_pool = None
+
+
+def install_pooled_opener(max_per_host=DEFAULT_MAX_PER_HOST):
+    """Подключить общий пул соединений ко всем вызовам urllib.request.urlopen в процессе"""
+    global _pool
+    if _pool is None:
+        _pool = ConnectionPool(max_per_host)
+        install_trace_processor(PooledHTTPHandler(_pool))
+        register_source('connection_pool', get_pool_stats)
+    return _pool
+
+
+def get_pool_stats():
+    """Статистика пула (None, если пул не подключён)"""
+    return dict(_pool.stats, idle=_pool.idle_count()) if _pool else None
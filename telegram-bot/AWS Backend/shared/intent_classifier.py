@@ -0,0 +1,151 @@
+"""Локальный классификатор намерений (RU/EN) - отвечает без вызова OpenAI в очевидных случаях"""
+import os
+import re
+
+from shared.logger import get_logger
+
+log = get_logger(__name__)
+
+
+# Порог уверенности: ниже него решение отдаём модели
+DEFAULT_CONFIDENCE_THRESHOLD = 0.85
+
+# Фиксированный ответ режима грамматики на вопросы не по теме (тот же, что в промпте)
+GRAMMAR_OFF_TOPIC_REPLY = "Этот режим отвечает только на вопросы о грамматике английского языка."
+
+# Канонический ответ завершения текстового диалога (формат из промпта text_dialog)
+DIALOG_END_REPLY = """*Feedback:* Great job practicing your English today! Keep it up.
+
+---SPLIT---
+
+Thank you so much for this wonderful conversation! You did great with your English practice. I hope we can chat again soon. Take care!
+
+||Спасибо большое за этот замечательный разговор! У вас отлично получилось практиковать английский. Надеюсь, мы сможем поговорить снова. Берегите себя!||
+
+---END_DIALOG---"""
+
+# Явные просьбы не по теме грамматики: (паттерн, уверенность). Только просьбы в начале фразы:
+# одно слово-тема ("news", "recipe") встречается и в вопросах о грамматике и не проходит порог
+OFF_TOPIC_PATTERNS = [
+    (r'^(пожалуйста\s+)?(переведи|переведите|перевести)\b', 0.95),
+    (r'^(please\s+)?translate\b', 0.95),
+    (r'^(расскажи|расскажите)\s+(мне\s+)?(о|об|про)\b', 0.9),
+    (r'^(please\s+)?tell me about\b', 0.9),
+    (r'^(напиши|напишите)\s+(мне\s+)?(код|программу|стих|стихотворение|рецепт|сочинение|эссе)\b', 0.9),
+    (r'^(please\s+)?write (me )?(a |an )?(code|program|poem|recipe|story|essay)\b', 0.9),
+]
+
+# Признаки того, что вопрос всё-таки про грамматику - при их наличии решает модель
+GRAMMAR_CUES = re.compile(
+    r'\b(граммат\w*|grammar|врем(я|ена|ени)|tense\w*|артикл\w*|articles?|предлог\w*|prepositions?|'
+    r'глагол\w*|verbs?|существительн\w*|nouns?|прилагательн\w*|adjectives?|наречи\w*|adverbs?|'
+    r'местоимени\w*|pronouns?|порядок слов|word order|услов\w*|conditionals?|'
+    r'пассив\w*|passive|модальн\w*|modals?|причасти\w*|participles?|герунди\w*|gerunds?|'
+    r'инфинитив\w*|infinitives?|present|past|future|perfect|continuous|'
+    r'как правильно|правильно ли|как сказать|как говорить|what is the difference|difference between|'
+    r'разниц\w*|отлича\w*|употребл\w*|использ\w*|usage|use of|correct)\b',
+    re.IGNORECASE
+)
+
+# Явные просьбы завершить диалог
+DIALOG_END_PHRASES = [
+    "let's wrap up", "lets wrap up", "wrap up", "i need to go", "i have to go", "i gotta go",
+    "finish", "let's finish", "stop", "let's stop", "end", "end the dialog", "end the conversation",
+    "bye", "goodbye", "good bye", "bye bye", "see you", "see you later",
+    "пока", "до свидания", "закончим", "давай закончим", "заканчиваем", "хватит", "стоп",
+    "мне пора", "мне нужно идти", "завершить", "завершим", "конец",
+]
+
+# Отрицания и вопросы, при которых конец диалога неочевиден
+DIALOG_END_VETO = re.compile(
+    r"\b(don't|dont|do not|not|never|не|нельзя|why|почему|how|как|what|что)\b",
+    re.IGNORECASE
+)
+
+# Вежливые вводные слова, которые не меняют смысла ("ok, bye", "спасибо, пока")
+DIALOG_END_FILLERS = re.compile(
+    r"^((ok|okay|well|thanks|thank you|so|ну|ладно|хорошо|ок|спасибо)\s*)+",
+    re.IGNORECASE
+)
+
+# Максимальная длина сообщения (в словах), которое может быть явным "пока"
+MAX_END_MESSAGE_WORDS = 6
+
+
+def get_confidence_threshold():
+    """Порог уверенности из окружения (INTENT_CONFIDENCE_THRESHOLD)"""
+    try:
+        return float(os.environ.get('INTENT_CONFIDENCE_THRESHOLD', DEFAULT_CONFIDENCE_THRESHOLD))
+    except ValueError:
+        return DEFAULT_CONFIDENCE_THRESHOLD
+
+
+def _normalize(text):
+    """Нижний регистр, без лишних пробелов и завершающей пунктуации"""
+    text = (text or '').lower().replace('ё', 'е').replace('’', "'")
+    text = re.sub(r'\s+', ' ', text).strip()
+    return text.strip(' .!?,;:)(…')
+
+
+def classify_grammar_intent(text):
+    """Определить, является ли запрос к режиму грамматики явно не по теме"""
+    normalized = _normalize(text)
+    if not normalized:
+        return {'intent': 'unknown', 'confidence': 0.0}
+
+    if GRAMMAR_CUES.search(normalized):
+        return {'intent': 'grammar', 'confidence': 0.0}
+
+    best = 0.0
+    for pattern, confidence in OFF_TOPIC_PATTERNS:
+        if re.search(pattern, normalized) and confidence > best:
+            best = confidence
+
+    if best > 0:
+        return {'intent': 'off_topic', 'confidence': best}
+    return {'intent': 'unknown', 'confidence': 0.0}
+
+
+def classify_dialog_intent(text):
+    """Определить, просит ли пользователь завершить текстовый диалог"""
+    normalized = _normalize(text)
+    if not normalized:
+        return {'intent': 'unknown', 'confidence': 0.0}
+
+    words = normalized.split(' ')
+    if len(words) > MAX_END_MESSAGE_WORDS or DIALOG_END_VETO.search(normalized):
+        return {'intent': 'continue', 'confidence': 0.0}
+
+    # Сообщение целиком состоит из фразы завершения ("bye", "пока", "let's stop")
+    if normalized in DIALOG_END_PHRASES:
+        return {'intent': 'end_dialog', 'confidence': 0.95}
+
+    # То же самое после вежливого вступления ("ok, bye", "спасибо, пока")
+    stripped = _normalize(DIALOG_END_FILLERS.sub('', normalized.replace(',', ' ')))
+    if stripped in DIALOG_END_PHRASES:
+        return {'intent': 'end_dialog', 'confidence': 0.9}
+
+    # Фраза завершения где-то внутри сообщения ("the end of the movie") - пусть решает модель
+    for phrase in DIALOG_END_PHRASES:
+        if re.search(r'(^|\W)' + re.escape(phrase) + r'($|\W)', normalized):
+            return {'intent': 'end_dialog', 'confidence': 0.6}
+
+    return {'intent': 'continue', 'confidence': 0.0}
+
+
+def get_local_grammar_reply(text):
+    """Готовый ответ для явно нерелевантного вопроса или None (решает модель)"""
+    result = classify_grammar_intent(text)
+    if result['intent'] == 'off_topic' and result['confidence'] >= get_confidence_threshold():
+        log.info("⚡ Local intent: grammar off_topic", confidence=result['confidence'])
+        return GRAMMAR_OFF_TOPIC_REPLY
+    return None
+
+
+def get_local_dialog_reply(text):
+    """Готовый ответ завершения диалога или None (решает модель)"""
+    result = classify_dialog_intent(text)
+    if result['intent'] == 'end_dialog' and result['confidence'] >= get_confidence_threshold():
+        log.info("⚡ Local intent: dialog end_dialog", confidence=result['confidence'])
+        return DIALOG_END_REPLY
+    return None
@@ -0,0 +1,228 @@
+"""Структурированный лог вместо print: уровни, ленивое форматирование, семплинг, маскирование
+
+Каждая запись - одна JSON-строка в stdout (CloudWatch принимает её как одно событие):
+{"level": "INFO", "logger": "translation", "cid": "...", "msg": "...", ...поля}
+
+    log = get_logger('translation')
+    start_request(event, context)                     # в начале запроса (декоратор shared.tracing.traced)
+    log.info("✅ Translation successful", chars=len(reply))
+    log.debug("Parsed body", body=body)               # поле: ключи-секреты маскируются, только если DEBUG включён
+
+Уровень задаётся LOG_LEVEL (по умолчанию INFO). DEBUG-записи горячих путей можно включать
+для доли запросов: LOG_DEBUG_SAMPLE_RATE=0.01 - весь DEBUG-лог каждого сотого запроса,
+или для одного запроса заголовками X-Debug-Log: 1 и X-Debug-Key: <LOG_DEBUG_SECRET> (без
+LOG_DEBUG_SECRET заголовок игнорируется - иначе любой клиент мог бы включить DEBUG). Поля с секретами (ключи, токены, подписи)
+и похожие на секреты строки маскируются, длинные значения обрезаются. Словари и списки
+передавайте полями, а не аргументами %s: аргументы-словари маскируются по ключам до
+форматирования, но в сообщении теряют структуру.
+"""
+import hmac
+import json
+import os
+import random
+import re
+import sys
+import time
+import uuid
+from contextvars import ContextVar
+
+
+LEVELS = {'DEBUG': 10, 'INFO': 20, 'WARNING': 30, 'ERROR': 40}
+
+DEFAULT_LEVEL = 'INFO'
+DEFAULT_MAX_FIELD_CHARS = 500
+
+# Поле маскируется, если его имя содержит один из фрагментов
+SECRET_FIELD_MARKERS = ('key', 'token', 'secret', 'password', 'authorization', 'signature', 'sha1_hash', 'cookie')
+# ...кроме счётчиков токенов OpenAI (prompt_tokens, completion_tokens)
+NON_SECRET_FIELD_SUFFIXES = ('_tokens',)
+# Значения, похожие на секреты, внутри строк (сообщения, ответы сервисов)
+SECRET_PATTERNS = [
+    (re.compile(r'(Bearer\s+)[\w\-.~+/=]+', re.IGNORECASE), r'\1***'),
+    (re.compile(r'\bsk-[A-Za-z0-9_\-]{8,}'), 'sk-***'),
+    (re.compile(r'\beyJ[\w\-]+\.[\w\-]+\.[\w\-]+'), 'eyJ***'),
+    (re.compile(r'((?:apikey|api_key|secret|password|token)=)[^&\s"\']+', re.IGNORECASE), r'\1***')
+]
+REDACTED = '***'
+
+# Заголовки, из которых берётся correlation id, присланный вызывающей стороной (воркер, API Gateway)
+CORRELATION_HEADERS = ('x-trace-id', 'x-correlation-id', 'x-request-id')
+DEBUG_HEADER = 'x-debug-log'
+DEBUG_KEY_HEADER = 'x-debug-key'
+
+_request = ContextVar('log_request', default=None)
+_config = None
+
+
+def get_config():
+    """Уровень, доля DEBUG-семплинга и лимит длины поля из окружения (читаются один раз)"""
+    global _config
+    if _config is None:
+        level_name = os.environ.get('LOG_LEVEL', DEFAULT_LEVEL).upper()
+        try:
+            sample_rate = float(os.environ.get('LOG_DEBUG_SAMPLE_RATE', 0))
+        except ValueError:
+            sample_rate = 0.0
+        _config = {
+            'level': LEVELS.get(level_name, LEVELS[DEFAULT_LEVEL]),
+            'debug_sample_rate': sample_rate,
+            'max_field_chars': int(os.environ.get('LOG_MAX_FIELD_CHARS', DEFAULT_MAX_FIELD_CHARS)),
+            'debug_secret': os.environ.get('LOG_DEBUG_SECRET') or None
+        }
+    return _config
+
+
+def reset_config():
+    """Перечитать настройки из окружения (для тестовых прогонов и локального сервера)"""
+    global _config
+    _config = None
+
+
+def _lower_headers(event):
+    headers = event.get('headers') if isinstance(event, dict) else None
+    if not isinstance(headers, dict):
+        return {}
+    return {str(name).lower(): value for name, value in headers.items()}
+
+
+def debug_requested(headers):
+    """DEBUG по заголовку X-Debug-Log - только с ключом, совпадающим с LOG_DEBUG_SECRET"""
+    if str(headers.get(DEBUG_HEADER, '')).lower() not in ('1', 'true', 'yes'):
+        return False
+    secret = get_config()['debug_secret']
+    key = headers.get(DEBUG_KEY_HEADER)
+    if not secret or not key:
+        return False
+    return hmac.compare_digest(str(key).encode('utf-8'), secret.encode('utf-8'))
+
+
+def start_request(event=None, context=None):
+    """Начать лог запроса: correlation id и решение о DEBUG-семплинге; возвращает correlation id"""
+    config = get_config()
+    headers = _lower_headers(event)
+
+    cid = next((headers[name] for name in CORRELATION_HEADERS if headers.get(name)), None)
+    if not cid:
+        cid = getattr(context, 'aws_request_id', None) or uuid.uuid4().hex[:16]
+
+    if config['level'] <= LEVELS['DEBUG']:
+        level = config['level']
+    elif debug_requested(headers):
+        level = LEVELS['DEBUG']
+    elif config['debug_sample_rate'] > 0 and random.random() < config['debug_sample_rate']:
+        level = LEVELS['DEBUG']
+    else:
+        level = config['level']
+
+    _request.set({'cid': str(cid), 'level': level})
+    return str(cid)
+
+
+def get_correlation_id():
+    """Correlation id текущего запроса (None вне запроса)"""
+    request = _request.get()
+    return request['cid'] if request else None
+
+
+def redact_text(text):
+    """Замаскировать похожие на секреты подстроки"""
+    for pattern, replacement in SECRET_PATTERNS:
+        text = pattern.sub(replacement, text)
+    return text
+
+
+def is_secret_field(name):
+    """Нужно ли маскировать поле с таким именем"""
+    name = str(name).lower()
+    return any(marker in name for marker in SECRET_FIELD_MARKERS) and not name.endswith(NON_SECRET_FIELD_SUFFIXES)
+
+
+def redact(value, max_chars=None, depth=0):
+    """Подготовить значение поля к записи: маскирование секретов, обрезка длинных строк"""
+    if max_chars is None:
+        max_chars = get_config()['max_field_chars']
+    if isinstance(value, dict):
+        if depth >= 4:
+            return '{...}'
+        return {
+            str(k): REDACTED if is_secret_field(k) and v not in (None, '')
+            else redact(v, max_chars, depth + 1)
+            for k, v in value.items()
+        }
+    if isinstance(value, (list, tuple)):
+        if depth >= 4:
+            return '[...]'
+        items = [redact(v, max_chars, depth + 1) for v in value[:20]]
+        if len(value) > 20:
+            items.append(f'... +{len(value) - 20} more')
+        return items
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    text = redact_text(value if isinstance(value, str) else str(value))
+    if len(text) > max_chars:
+        text = f'{text[:max_chars]}... [{len(text)} chars]'
+    return text
+
+
+class Logger:
+    """Логгер модуля; записи ниже текущего уровня отбрасываются до форматирования"""
+
+    def __init__(self, name):
+        self.name = name
+
+    def is_enabled(self, level_name):
+        """Будет ли записан уровень в текущем запросе (для дорогих вычислений перед логом)"""
+        request = _request.get()
+        threshold = request['level'] if request else get_config()['level']
+        return LEVELS[level_name] >= threshold
+
+    def log(self, level_name, msg, *args, **fields):
+        if not self.is_enabled(level_name):
+            return
+        if args:
+            # Словари и списки маскируются по ключам до подстановки в сообщение
+            args = tuple(redact(arg) if isinstance(arg, (dict, list, tuple)) else arg for arg in args)
+            try:
+                msg = msg % args
+            except (TypeError, ValueError):
+                msg = ' '.join([msg] + [str(arg) for arg in args])
+
+        record = {'level': level_name, 'logger': self.name, 'ts': round(time.time(), 3)}
+        request = _request.get()
+        if request:
+            record['cid'] = request['cid']
+        record['msg'] = redact(msg, max_chars=max(get_config()['max_field_chars'], 2000))
+        for key, value in fields.items():
+            if is_secret_field(key) and value not in (None, ''):
+                record[key] = REDACTED
+            else:
+                record[key] = redact(value)
+
+        try:
+            line = json.dumps(record, ensure_ascii=False, default=str)
+        except (TypeError, ValueError):
+            line = json.dumps({'level': level_name, 'logger': self.name, 'msg': str(msg)}, ensure_ascii=False)
+        sys.stdout.write(line + '\n')
+
+    def debug(self, msg, *args, **fields):
+        self.log('DEBUG', msg, *args, **fields)
+
+    def info(self, msg, *args, **fields):
+        self.log('INFO', msg, *args, **fields)
+
+    def warning(self, msg, *args, **fields):
+        self.log('WARNING', msg, *args, **fields)
+
+    def error(self, msg, *args, **fields):
+        self.log('ERROR', msg, *args, **fields)
+
+
+_loggers = {}
+
+
+def get_logger(name):
+    """Логгер с именем (обычно имя Lambda или модуля)"""
+    logger = _loggers.get(name)
+    if logger is None:
+        logger = _loggers.setdefault(name, Logger(name))
+    return logger
@@ -0,0 +1,372 @@
+"""Агрегированные метрики тёплого контейнера: гистограммы задержек, счётчики, кэши
+
+Каждый запрос (декоратор shared.tracing.traced) попадает в гистограмму своего действия,
+каждый вызов Supabase / OpenAI / Telegram (track_upstream, trace_span) - в гистограмму
+зависимости. Гистограммы в стиле HDR: логарифмические октавы по 16 линейных корзин,
+относительная погрешность перцентиля не больше ~6%, память - десятки корзин на серию.
+
+Снимок за всё время жизни контейнера отдаёт действие metrics каждой Lambda:
+
+    {"action": "metrics"}  ->  {"actions": {"translate": {"count": 120, "p99_ms": 2310.0, ...}}, ...}
+
+Раз в METRICS_FLUSH_INTERVAL секунд (по умолчанию 60, проверяется после запроса - между
+вызовами контейнер заморожен) окно с прошлого сброса пишется строками CloudWatch EMF:
+перцентили по действиям и зависимостям, токены OpenAI по моделям, попадания в кэши.
+В записи действия и зависимости есть поле histogram ([верхняя граница мс, число]) - корзины
+разных контейнеров складываются в запросе Logs Insights, что даёт p99 по всему парку.
+METRICS_ENABLED=false отключает учёт.
+"""
+import json
+import os
+import threading
+import time
+
+from shared.logger import get_logger
+
+log = get_logger(__name__)
+
+
+METRICS_NAMESPACE = 'LinguaPulse/Backend'
+DEFAULT_FLUSH_INTERVAL = 60
+
+# Значения ниже 2^SUB_BUCKET_BITS мкс хранятся точно, выше - по 2^(SUB_BUCKET_BITS-1) корзин на октаву
+SUB_BUCKET_BITS = 5
+SUB_BUCKET_HALF = 1 << (SUB_BUCKET_BITS - 1)
+
+PERCENTILES = (('p50_ms', 0.5), ('p90_ms', 0.9), ('p99_ms', 0.99), ('p999_ms', 0.999))
+
+# Имена действий приходят из тела запроса - ограничиваем число серий, остальное идёт в 'other'
+MAX_SERIES_PER_GROUP = 100
+OTHER_SERIES = 'other'
+
+
+def metrics_enabled():
+    return os.environ.get('METRICS_ENABLED', 'true').lower() != 'false'
+
+
+def bucket_index(value_us):
+    """Номер корзины для значения в микросекундах"""
+    value_us = max(0, int(value_us))
+    if value_us < 2 * SUB_BUCKET_HALF:
+        return value_us
+    shift = value_us.bit_length() - SUB_BUCKET_BITS
+    return shift * SUB_BUCKET_HALF + (value_us >> shift)
+
+
+def bucket_upper_us(index):
+    """Наибольшее значение (мкс), попадающее в корзину"""
+    if index < 2 * SUB_BUCKET_HALF:
+        return index
+    shift = (index - SUB_BUCKET_HALF) // SUB_BUCKET_HALF
+    top = index - shift * SUB_BUCKET_HALF
+    return ((top + 1) << shift) - 1
+
+
+class LatencyHistogram:
+    """Гистограмма задержек: разреженные корзины + count/sum/min/max (без собственной блокировки)"""
+
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+        self.total_ms = 0.0
+        self.min_ms = None
+        self.max_ms = 0.0
+
+    def record(self, value_ms):
+        index = bucket_index(value_ms * 1000)
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        self.total_ms += value_ms
+        if self.min_ms is None or value_ms < self.min_ms:
+            self.min_ms = value_ms
+        if value_ms > self.max_ms:
+            self.max_ms = value_ms
+
+    def percentile(self, fraction):
+        """Значение, не меньше которого доля fraction записей (верхняя граница корзины, мс)"""
+        if not self.count:
+            return 0.0
+        target = max(1, int(fraction * self.count + 0.999999))
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= target:
+                value_ms = bucket_upper_us(index) / 1000
+                return round(min(max(value_ms, self.min_ms), self.max_ms), 1)
+        return round(self.max_ms, 1)
+
+    def summary(self, include_buckets=False):
+        result = {'count': self.count}
+        for name, fraction in PERCENTILES:
+            result[name] = self.percentile(fraction)
+        result['max_ms'] = round(self.max_ms, 1)
+        result['mean_ms'] = round(self.total_ms / self.count, 1) if self.count else 0.0
+        if include_buckets:
+            result['histogram'] = [
+                [round(bucket_upper_us(index) / 1000, 3), count]
+                for index, count in sorted(self.buckets.items())
+            ]
+        return result
+
+
+class MetricsRegistry:
+    """Набор серий: гистограммы (группа, имя) и счётчики (счётчик, метка)"""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.histograms = {}
+        self.counters = {}
+
+    def _series_name(self, group, name):
+        if (group, name) in self.histograms:
+            return name
+        series = sum(1 for key in self.histograms if key[0] == group)
+        return name if series < MAX_SERIES_PER_GROUP else OTHER_SERIES
+
+    def record(self, group, name, value_ms):
+        key = (group, self._series_name(group, name))
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = LatencyHistogram()
+        histogram.record(value_ms)
+        return key[1]
+
+    def count(self, counter, label, value=1):
+        key = (counter, label)
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def counters_for(self, counter):
+        return {label: value for (name, label), value in self.counters.items() if name == counter}
+
+
+_lock = threading.Lock()
+_total = MetricsRegistry()
+_window = MetricsRegistry()
+_caches = {}
+_cache_marks = {}
+_sources = {}
+
+
+def _record(group, name, value_ms, counters):
+    with _lock:
+        for registry in (_total, _window):
+            label = registry.record(group, name, value_ms)
+            for counter in counters:
+                registry.count(counter, label)
+
+
+def record_request(action, duration_ms, status_code):
+    """Учесть обработанный запрос: задержка действия и ошибки (5xx - errors, 4xx - client_errors)"""
+    if not metrics_enabled():
+        return
+    counters = []
+    if status_code >= 500:
+        counters.append('action_errors')
+    elif status_code >= 400:
+        counters.append('action_client_errors')
+    _record('action', action or 'unknown', duration_ms, counters)
+
+
+def record_dependency(name, duration_ms, success):
+    """Учесть вызов внешнего сервиса (supabase, openai, telegram)"""
+    if not metrics_enabled():
+        return
+    _record('dependency', name, duration_ms, [] if success else ['dependency_errors'])
+
+
+def count_tokens(model, usage, coalesced=False):
+    """Учесть вызов OpenAI и его токены по модели (совмещённый вызов токенов не добавляет)"""
+    if not metrics_enabled():
+        return
+    usage = usage or {}
+    model = model or 'unknown'
+    with _lock:
+        for registry in (_total, _window):
+            registry.count('openai_requests', model)
+            if not coalesced:
+                registry.count('openai_prompt_tokens', model, usage.get('prompt_tokens', 0))
+                registry.count('openai_completion_tokens', model, usage.get('completion_tokens', 0))
+
+
+def register_cache(name, cache):
+    """Показывать статистику кэша (объект с методом stats(): hits, misses, size) в снимке и сбросах"""
+    _caches[name] = cache
+
+
+def register_source(name, snapshot_fn):
+    """Добавить в снимок метрик раздел name = snapshot_fn() (например, состояние admission control)"""
+    _sources[name] = snapshot_fn
+
+
+def get_cache_stats():
+    """Статистика всех зарегистрированных кэшей"""
+    return {name: cache.stats() for name, cache in _caches.items()}
+
+
+def get_source_snapshot(name):
+    """Раздел снимка от зарегистрированного источника (None, если источника нет)"""
+    snapshot_fn = _sources.get(name)
+    return snapshot_fn() if snapshot_fn else None
+
+
+def get_dependency_summary():
+    """Перцентили задержки и ошибки по зависимостям с момента старта контейнера"""
+    with _lock:
+        return _group_summary(_total, 'dependency')
+
+
+def _group_summary(registry, group, include_buckets=False):
+    result = {}
+    errors = registry.counters_for(f'{group}_errors')
+    client_errors = registry.counters_for(f'{group}_client_errors')
+    for (kind, name), histogram in sorted(registry.histograms.items()):
+        if kind != group:
+            continue
+        summary = histogram.summary(include_buckets)
+        summary['errors'] = errors.get(name, 0)
+        if group == 'action':
+            summary['client_errors'] = client_errors.get(name, 0)
+        result[name] = summary
+    return result
+
+
+def get_metrics_snapshot(function_name=None, include_buckets=False):
+    """Снимок метрик контейнера с момента старта (для действия metrics)"""
+    with _lock:
+        snapshot = {
+            'function': function_name,
+            'uptime_s': round(time.monotonic() - _total.started, 1),
+            'actions': _group_summary(_total, 'action', include_buckets),
+            'dependencies': _group_summary(_total, 'dependency', include_buckets),
+            'openai': {
+                model: {
+                    'requests': requests,
+                    'prompt_tokens': _total.counters.get(('openai_prompt_tokens', model), 0),
+                    'completion_tokens': _total.counters.get(('openai_completion_tokens', model), 0)
+                }
+                for model, requests in _total.counters_for('openai_requests').items()
+            }
+        }
+    snapshot['caches'] = get_cache_stats()
+    for name, snapshot_fn in _sources.items():
+        try:
+            snapshot[name] = snapshot_fn()
+        except Exception as e:
+            snapshot[name] = {'error': str(e)}
+    return snapshot
+
+
+def metrics_response_body(function_name, body=None):
+    """Тело ответа действия metrics; {"buckets": true} добавляет корзины гистограмм"""
+    include_buckets = bool((body or {}).get('buckets'))
+    return {'metrics': get_metrics_snapshot(function_name, include_buckets)}
+
+
+def _emf_record(dimensions, metrics, values):
+    record = {
+        '_aws': {
+            'Timestamp': int(time.time() * 1000),
+            'CloudWatchMetrics': [{
+                'Namespace': METRICS_NAMESPACE,
+                'Dimensions': [list(dimensions)],
+                'Metrics': [{'Name': name, 'Unit': unit} for name, unit in metrics]
+            }]
+        }
+    }
+    record.update(dimensions)
+    record.update(values)
+    return record
+
+
+def _latency_records(function_name, registry, group, dimension, prefix, window_s):
+    records = []
+    for name, summary in _group_summary(registry, group, include_buckets=True).items():
+        metrics = [(f'{prefix}Count', 'Count'), (f'{prefix}Errors', 'Count'),
+                   (f'{prefix}P50', 'Milliseconds'), (f'{prefix}P90', 'Milliseconds'),
+                   (f'{prefix}P99', 'Milliseconds'), (f'{prefix}Max', 'Milliseconds')]
+        values = {
+            f'{prefix}Count': summary['count'],
+            f'{prefix}Errors': summary['errors'],
+            f'{prefix}P50': summary['p50_ms'],
+            f'{prefix}P90': summary['p90_ms'],
+            f'{prefix}P99': summary['p99_ms'],
+            f'{prefix}Max': summary['max_ms'],
+            'window_s': window_s,
+            'histogram': summary['histogram']
+        }
+        records.append(_emf_record({'Function': function_name, dimension: name}, metrics, values))
+    return records
+
+
+def build_flush_records(function_name, registry, window_s):
+    """EMF-записи окна: действия, зависимости, токены по моделям, кэши"""
+    records = _latency_records(function_name, registry, 'action', 'Action', 'Action', window_s)
+    records += _latency_records(function_name, registry, 'dependency', 'Dependency', 'Dependency', window_s)
+
+    for model, requests in registry.counters_for('openai_requests').items():
+        records.append(_emf_record(
+            {'Function': function_name, 'Model': model},
+            [('OpenAIRequests', 'Count'), ('OpenAIPromptTokens', 'Count'), ('OpenAICompletionTokens', 'Count')],
+            {
+                'OpenAIRequests': requests,
+                'OpenAIPromptTokens': registry.counters.get(('openai_prompt_tokens', model), 0),
+                'OpenAICompletionTokens': registry.counters.get(('openai_completion_tokens', model), 0)
+            }
+        ))
+
+    for name, cache in _caches.items():
+        stats = cache.stats()
+        hits, misses = stats.get('hits', 0), stats.get('misses', 0)
+        last_hits, last_misses = _cache_marks.get(name, (0, 0))
+        # Счётчики кэша могли обнулиться (clear) - тогда окно считается с нуля
+        if hits < last_hits or misses < last_misses:
+            last_hits = last_misses = 0
+        _cache_marks[name] = (hits, misses)
+        window_hits, window_misses = hits - last_hits, misses - last_misses
+        lookups = window_hits + window_misses
+        if not lookups:
+            continue
+        records.append(_emf_record(
+            {'Function': function_name, 'Cache': name},
+            [('CacheHits', 'Count'), ('CacheMisses', 'Count'), ('CacheHitRate', 'Percent')],
+            {
+                'CacheHits': window_hits,
+                'CacheMisses': window_misses,
+                'CacheHitRate': round(100.0 * window_hits / lookups, 1),
+                'size': stats.get('size')
+            }
+        ))
+    return records
+
+
+def flush_metrics(function_name, force=False):
+    """Записать окно метрик строками EMF, если прошло METRICS_FLUSH_INTERVAL (или force); число записей"""
+    global _window
+
+    interval = float(os.environ.get('METRICS_FLUSH_INTERVAL', DEFAULT_FLUSH_INTERVAL))
+    with _lock:
+        window_s = time.monotonic() - _window.started
+        if not force and window_s < interval:
+            return 0
+        registry, _window = _window, MetricsRegistry()
+
+    if not registry.histograms and not registry.counters and not _caches:
+        return 0
+    try:
+        records = build_flush_records(function_name, registry, round(window_s, 1))
+    except Exception as e:
+        log.error(f"❌ Error building metrics flush: {e}")
+        return 0
+    for record in records:
+        print(json.dumps(record, separators=(',', ':'), ensure_ascii=False))
+    log.debug("📊 Metrics flushed: %d records for %.0fs window", len(records), window_s)
+    return len(records)
+
+
+def reset_metrics():
+    """Обнулить все серии (для локальных прогонов инструментов)"""
+    global _total, _window
+    with _lock:
+        _total = MetricsRegistry()
+        _window = MetricsRegistry()
+    _cache_marks.clear()
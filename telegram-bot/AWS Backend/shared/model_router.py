@@ -0,0 +1,232 @@
+"""Маршрутизация запросов к OpenAI: модель и параметры генерации по режиму и размеру входа
+
+Профили можно переопределить без деплоя кода через переменную окружения MODEL_PROFILES (JSON),
+например: {"translation": {"model": "gpt-4o"}, "audio_response": {"max_tokens": 80}}
+"""
+import json
+import os
+import re
+import threading
+import time
+from collections import deque
+
+from shared.openai_client import get_openai_response
+from shared.usage_ledger import record_usage
+from shared.metrics import count_tokens, register_source
+from shared.warmup import register_warmer
+from shared.logger import get_logger
+
+log = get_logger(__name__)
+
+
+# Профили генерации по умолчанию.
+# max_tokens - потолок; если задан tokens_per_char, бюджет считается от длины входа
+# и ограничивается снизу min_tokens. max_sentences обрезает ответ после генерации.
+DEFAULT_PROFILES = {
+    'translation': {
+        'model': 'gpt-4o-mini',
+        'temperature': 0.3,
+        'max_tokens': 1000,
+        'min_tokens': 60,
+        'tokens_per_char': 1.0
+    },
+    'grammar': {
+        'model': 'gpt-4o-mini',
+        'temperature': 0.5,
+        'max_tokens': 1000
+    },
+    'grammar_progressive': {
+        'model': 'gpt-4o-mini',
+        'temperature': 0.5,
+        'max_tokens': 450
+    },
+    'text_dialog': {
+        'model': 'gpt-4o-mini',
+        'temperature': 0.7,
+        'max_tokens': 600
+    },
+    # Фидбэк по шаблону (до 150 слов, эмодзи, markdown) на русском - около 360 токенов без запаса;
+    # потолок снижать только по completion_tokens_p95/truncated из метрик профилей
+    'dialog_feedback': {
+        'model': 'gpt-4o-mini',
+        'temperature': 0.7,
+        'max_tokens': 1000
+    },
+    # Текстовый помощник shared Lambda (process_text_message), режим передаётся явно
+    'text_message': {
+        'model': 'gpt-4o-mini',
+        'temperature': 0.7,
+        'max_tokens': 500
+    },
+    'audio_greeting': {
+        'model': 'gpt-4o-mini',
+        'temperature': 0.8,
+        'max_tokens': 150
+    },
+    'audio_response': {
+        'model': 'gpt-4o-mini',
+        'temperature': 0.7,
+        'max_tokens': 120,
+        'stop': ['\n\n'],
+        'max_sentences': 2
+    }
+}
+
+# Режим (для учёта токенов) по профилю, если вызывающий код не передал его явно
+PROFILE_MODES = {
+    'translation': 'translation',
+    'grammar': 'grammar',
+    'grammar_progressive': 'grammar',
+    'text_dialog': 'text_dialog',
+    # Аудио-фидбэк передаёт mode='audio_dialog' явно
+    'dialog_feedback': 'text_dialog',
+    'text_message': 'general',
+    'audio_greeting': 'audio_dialog',
+    'audio_response': 'audio_dialog'
+}
+
+# Сколько последних вызовов хранить на профиль для перцентилей задержки и длины ответа
+LATENCY_WINDOW = 500
+
+SENTENCE_END_RE = re.compile(r'(?<=[.!?…])\s+')
+
+_profiles = None
+_metrics = {}
+_metrics_lock = threading.Lock()
+
+
+def get_profiles():
+    """Профили по умолчанию с учётом переопределений из MODEL_PROFILES"""
+    global _profiles
+    if _profiles is None:
+        profiles = {name: dict(profile) for name, profile in DEFAULT_PROFILES.items()}
+        overrides_raw = os.environ.get('MODEL_PROFILES')
+        if overrides_raw:
+            try:
+                for name, override in json.loads(overrides_raw).items():
+                    profiles.setdefault(name, {}).update(override)
+            except (ValueError, AttributeError) as e:
+                log.warning(f"⚠️ Invalid MODEL_PROFILES, using defaults: {e}")
+        _profiles = profiles
+    return _profiles
+
+
+def route(profile_name, message=''):
+    """Параметры генерации для профиля с учётом длины входа"""
+    profiles = get_profiles()
+    profile = profiles.get(profile_name)
+    if profile is None:
+        log.warning(f"⚠️ Unknown generation profile '{profile_name}', using defaults")
+        profile = {}
+
+    max_tokens = profile.get('max_tokens', 1000)
+    if profile.get('tokens_per_char'):
+        scaled = int(len(message or '') * profile['tokens_per_char'])
+        max_tokens = min(max_tokens, max(profile.get('min_tokens', 0), scaled))
+
+    return {
+        'model': profile.get('model', 'gpt-4o-mini'),
+        'temperature': profile.get('temperature', 0.7),
+        'max_tokens': max_tokens,
+        'stop': profile.get('stop'),
+        'max_sentences': profile.get('max_sentences')
+    }
+
+
+def limit_sentences(text, max_sentences):
+    """Оставить в ответе не больше max_sentences предложений"""
+    sentences = SENTENCE_END_RE.split(text.strip())
+    return ' '.join(sentences[:max_sentences])
+
+
+def get_routed_response(profile_name, message, system_prompt=None, user_id=None, mode=None, deadline=None, **overrides):
+    """Получить ответ OpenAI с параметрами профиля, записать метрики профиля и учесть токены пользователя"""
+    params = route(profile_name, message)
+    params.update({key: value for key, value in overrides.items() if value is not None})
+    max_sentences = params.pop('max_sentences', None)
+
+    started = time.monotonic()
+    result = get_openai_response(message, system_prompt, deadline=deadline, **params)
+    latency_ms = (time.monotonic() - started) * 1000
+
+    if result['success'] and max_sentences:
+        result['reply'] = limit_sentences(result['reply'], max_sentences)
+
+    record_profile_call(profile_name, latency_ms, result.get('usage') or {}, result['success'],
+                        truncated=result.get('finish_reason') == 'length')
+    if result['success']:
+        record_usage(
+            user_id, mode or PROFILE_MODES.get(profile_name, profile_name), result.get('usage'),
+            profile=profile_name, model=result.get('model', params['model']), coalesced=result.get('coalesced', False)
+        )
+        count_tokens(result.get('model', params['model']), result.get('usage'), coalesced=result.get('coalesced', False))
+    return result
+
+
+def record_profile_call(profile_name, latency_ms, usage, success, truncated=False):
+    """Учесть вызов профиля: задержка, токены, ошибки, ответы, обрезанные по max_tokens"""
+    with _metrics_lock:
+        stats = _metrics.get(profile_name)
+        if stats is None:
+            stats = {
+                'calls': 0,
+                'errors': 0,
+                'prompt_tokens': 0,
+                'completion_tokens': 0,
+                'truncated': 0,
+                'latencies_ms': deque(maxlen=LATENCY_WINDOW),
+                'completions': deque(maxlen=LATENCY_WINDOW)
+            }
+            _metrics[profile_name] = stats
+
+        stats['calls'] += 1
+        if not success:
+            stats['errors'] += 1
+        stats['prompt_tokens'] += usage.get('prompt_tokens', 0)
+        stats['completion_tokens'] += usage.get('completion_tokens', 0)
+        stats['latencies_ms'].append(latency_ms)
+        if success:
+            stats['completions'].append(usage.get('completion_tokens', 0))
+        if truncated:
+            stats['truncated'] += 1
+
+    log.info(f"📈 Profile {profile_name}", profile=profile_name, latency_ms=round(latency_ms), success=success,
+             prompt_tokens=usage.get('prompt_tokens', 0), completion_tokens=usage.get('completion_tokens', 0))
+    if truncated:
+        log.warning(f"✂️ Profile {profile_name} reply cut at max_tokens", profile=profile_name,
+                    completion_tokens=usage.get('completion_tokens', 0))
+
+
+def _percentile(sorted_values, fraction):
+    """Перцентиль по отсортированному списку"""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return round(sorted_values[index], 1)
+
+
+def get_profile_metrics():
+    """Снимок метрик по профилям (раздел profiles действия metrics)"""
+    snapshot = {}
+    with _metrics_lock:
+        for profile_name, stats in _metrics.items():
+            latencies = sorted(stats['latencies_ms'])
+            completions = sorted(stats['completions'])
+            calls = stats['calls']
+            snapshot[profile_name] = {
+                'calls': calls,
+                'errors': stats['errors'],
+                'prompt_tokens': stats['prompt_tokens'],
+                'completion_tokens': stats['completion_tokens'],
+                'avg_completion_tokens': round(stats['completion_tokens'] / calls, 1) if calls else 0.0,
+                'completion_tokens_p95': _percentile(completions, 0.95),
+                'completion_tokens_max': completions[-1] if completions else 0,
+                'truncated': stats['truncated'],
+                'latency_p50_ms': _percentile(latencies, 0.5),
+                'latency_p95_ms': _percentile(latencies, 0.95)
+            }
+    return snapshot
+
+
+register_source('profiles', get_profile_metrics)
+register_warmer('model_profiles', lambda: len(get_profiles()))
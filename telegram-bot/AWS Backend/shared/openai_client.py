@@ -1,52 +1,139 @@
 """Общий клиент для работы с OpenAI API"""
+import hashlib
 import json
-import urllib.request
+import threading
 import os
 
+from shared.admission import track_upstream
+from shared.deadline import get_timeout
+from shared.logger import get_logger
+
+log = get_logger(__name__)
+
+
+# Базовый URL API (переопределяется OPENAI_BASE_URL, например для локального стенда)
+DEFAULT_OPENAI_BASE_URL = 'https://api.openai.com/v1'
+
+
+def get_openai_base_url():
+    """Базовый URL OpenAI API без завершающего слэша"""
+    return os.environ.get('OPENAI_BASE_URL', DEFAULT_OPENAI_BASE_URL).rstrip('/')
+
+
+class _InflightCall:
+    """Запрос к OpenAI, который уже выполняется; остальные одинаковые вызовы ждут его результат"""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.waiters = 0
+
+
+# Одинаковые запросы, выполняющиеся прямо сейчас (ключ - хэш полного тела запроса)
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+
+def get_openai_response(message, system_prompt=None, model='gpt-4o-mini', temperature=0.7, max_tokens=1000, stop=None, deadline=None):
+    """Получить ответ от OpenAI API (таймаут - от дедлайна запроса, DeadlineExceeded если времени не хватает)"""
+    openai_api_key = os.environ.get('OPENAI_API_KEY')
+    if not openai_api_key:
+        return {'success': False, 'error': 'OpenAI API key not found'}
+
+    # Формируем сообщения
+    messages = []
+    if system_prompt:
+        messages.append({'role': 'system', 'content': system_prompt})
+    messages.append({'role': 'user', 'content': message})
+
+    # Подготавливаем запрос
+    data = {
+        'model': model,
+        'messages': messages,
+        'temperature': temperature,
+        'max_tokens': max_tokens
+    }
+    if stop:
+        data['stop'] = stop
+
+    timeout = get_timeout(deadline, 'openai')
+    if os.environ.get('OPENAI_SINGLE_FLIGHT', 'true').lower() == 'false':
+        return _request_chat_completion(data, openai_api_key, timeout)
+    return _single_flight(data, openai_api_key, timeout)
+
+
+def _single_flight(data, openai_api_key, timeout):
+    """Одинаковые одновременные запросы делят один вызов OpenAI (и его ошибку)"""
+    key = hashlib.sha256(json.dumps(data, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+    with _inflight_lock:
+        call = _inflight.get(key)
+        is_leader = call is None
+        if is_leader:
+            call = _InflightCall()
+            _inflight[key] = call
+        else:
+            call.waiters += 1
+
+    if not is_leader:
+        # Ждём не дольше собственного таймаута; сам вызов ограничен таймаутом лидера
+        if not call.event.wait(timeout):
+            return {'success': False, 'error': 'Timed out waiting for in-flight OpenAI request'}
+        log.debug("🔗 OpenAI request coalesced with in-flight call")
+        result = dict(call.result)
+        result['coalesced'] = True
+        return result
+
+    try:
+        call.result = _request_chat_completion(data, openai_api_key, timeout)
+    except BaseException as e:
+        # Ожидающие не должны зависнуть, даже если лидер упал неожиданно
+        call.result = {'success': False, 'error': str(e)}
+        raise
+    finally:
+        with _inflight_lock:
+            _inflight.pop(key, None)
+        call.event.set()
+
+    if call.waiters:
+        log.debug("🔗 OpenAI response shared with %s identical request(s)", call.waiters)
+    return call.result
+
+
+def _request_chat_completion(data, openai_api_key, timeout):
+    """Выполнить запрос chat/completions"""
+    # urllib.request (с http.client и ssl) - при первом запросе, а не при импорте модуля: холодный старт
+    import urllib.request
 
-def get_openai_response(message, system_prompt=None, model='gpt-4o-mini', temperature=0.7, max_tokens=1000):
-    """Получить ответ от OpenAI API"""
     try:
-        openai_api_key = os.environ.get('OPENAI_API_KEY')
-        if not openai_api_key:
-            return {'success': False, 'error': 'OpenAI API key not found'}
-        
-        # Формируем сообщения
-        messages = []
-        if system_prompt:
-            messages.append({'role': 'system', 'content': system_prompt})
-        messages.append({'role': 'user', 'content': message})
-        
-        # Подготавливаем запрос
-        data = {
-            'model': model,
-            'messages': messages,
-            'temperature': temperature,
-            'max_tokens': max_tokens
-        }
-        
         headers = {
             'Content-Type': 'application/json',
             'Authorization': f'Bearer {openai_api_key}'
         }
-        
+
         # Отправляем запрос
         req = urllib.request.Request(
-            'https://api.openai.com/v1/chat/completions',
+            f"{get_openai_base_url()}/chat/completions",
             data=json.dumps(data).encode('utf-8'),
             headers=headers
         )
-        
-        with urllib.request.urlopen(req) as response:
+
+        with track_upstream('openai'), urllib.request.urlopen(req, timeout=timeout) as response:
             response_text = response.read().decode('utf-8')
             response_data = json.loads(response_text)
-            
+
             if 'choices' in response_data and response_data['choices']:
                 reply = response_data['choices'][0]['message']['content'].strip()
-                return {'success': True, 'reply': reply}
+                return {
+                    'success': True,
+                    'reply': reply,
+                    'model': response_data.get('model', data['model']),
+                    'usage': response_data.get('usage', {}),
+                    'finish_reason': response_data['choices'][0].get('finish_reason')
+                }
             else:
                 return {'success': False, 'error': 'No response from OpenAI'}
-                
+
     except Exception as e:
-        print(f"❌ OpenAI API error: {e}")
+        log.error(f"❌ OpenAI API error: {e}")
         return {'success': False, 'error': str(e)}
@@ -0,0 +1,224 @@
+"""Профилирование отдельных запросов по требованию: cProfile (CPU) и tracemalloc (память)
+
+Профиль снимается вокруг lambda_handler (декоратор shared.tracing.traced), только если
+запрос его попросил или попал в выборку:
+  заголовок X-Profile: cpu | mem | all (или 1/true)
+  поле тела "profile": "cpu" | "mem" | "all" (или true)
+  PROFILE_SAMPLE_RATE=0.001 - доля вызовов, PROFILE_ACTIONS=translate,check_grammar - только эти действия
+Профиль по запросу клиента замедляет контейнер, поэтому он снимается только с ключом
+PROFILE_SECRET в заголовке X-Profile-Key (или поле "profile_key"); без PROFILE_SECRET
+такие запросы игнорируются и работает только семплинг из окружения.
+В остальных запросах стоимость - одна проверка заголовков, профилировщики не импортируются.
+
+Сводка (топ PROFILE_TOP_N функций по суммарному времени и строк по приросту памяти) пишется
+в лог; PROFILE_OUTPUT=tmp дополнительно сохраняет .pstats и сводку в PROFILE_DIR (/tmp/profiles)
+для разбора через python -m pstats. Одновременно профилируется не больше одного запроса на процесс;
+cProfile видит только поток обработчика, tracemalloc - все потоки процесса.
+"""
+import hmac
+import json
+import os
+import random
+import threading
+import time
+
+from shared.logger import get_correlation_id, get_logger
+
+log = get_logger(__name__)
+
+
+PROFILE_HEADER = 'x-profile'
+PROFILE_KEY_HEADER = 'x-profile-key'
+PROFILE_MODES = {
+    'cpu': ('cpu',),
+    'mem': ('mem',),
+    'all': ('cpu', 'mem'),
+    '1': ('cpu', 'mem'),
+    'true': ('cpu', 'mem')
+}
+DEFAULT_TOP_N = 15
+DEFAULT_DIR = '/tmp/profiles'
+
+_active = threading.Lock()
+_config = None
+
+
+def get_config():
+    """Доля семплинга, действия, размер сводки и вывод из окружения (читаются один раз)"""
+    global _config
+    if _config is None:
+        try:
+            sample_rate = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+        except ValueError:
+            sample_rate = 0.0
+        actions = os.environ.get('PROFILE_ACTIONS', '')
+        _config = {
+            'sample_rate': sample_rate,
+            'actions': {a.strip() for a in actions.split(',') if a.strip()},
+            'sample_modes': PROFILE_MODES.get(os.environ.get('PROFILE_SAMPLE_MODE', 'all').lower(), ('cpu', 'mem')),
+            'top_n': int(os.environ.get('PROFILE_TOP_N', DEFAULT_TOP_N)),
+            'output': os.environ.get('PROFILE_OUTPUT', 'log').lower(),
+            'dir': os.environ.get('PROFILE_DIR', DEFAULT_DIR),
+            'secret': os.environ.get('PROFILE_SECRET') or None
+        }
+    return _config
+
+
+def reset_config():
+    """Перечитать настройки из окружения"""
+    global _config
+    _config = None
+
+
+def key_authorized(key):
+    """Ключ клиента совпадает с PROFILE_SECRET (без секрета профиль по запросу выключен)"""
+    secret = get_config()['secret']
+    if not secret or not key:
+        return False
+    return hmac.compare_digest(str(key).encode('utf-8'), secret.encode('utf-8'))
+
+
+def client_requested_modes(event):
+    """Режим, запрошенный клиентом заголовком или полем тела, и ключ к нему: (режим, ключ)"""
+    mode = key = None
+    headers = event.get('headers')
+    if isinstance(headers, dict) and headers:
+        for name, value in headers.items():
+            name = str(name).lower()
+            if name == PROFILE_HEADER:
+                mode = value
+            elif name == PROFILE_KEY_HEADER:
+                key = value
+    if mode is not None:
+        return mode, key
+
+    body = event.get('body', event)
+    if isinstance(body, str) and '"profile"' in body:
+        try:
+            body = json.loads(body)
+        except ValueError:
+            body = None
+    if isinstance(body, dict) and body.get('profile'):
+        return body['profile'], key or body.get('profile_key')
+    return None, None
+
+
+def requested_modes(event, action=None):
+    """Что профилировать в этом запросе: ('cpu', 'mem'), их часть или None"""
+    if isinstance(event, dict):
+        mode, key = client_requested_modes(event)
+        if mode is not None:
+            if key_authorized(key):
+                return PROFILE_MODES.get(str(mode).lower())
+            log.warning("🔬 Profile request ignored: missing or wrong profile key")
+
+    config = get_config()
+    if config['sample_rate'] > 0 and (not config['actions'] or action in config['actions']):
+        if random.random() < config['sample_rate']:
+            return config['sample_modes']
+    return None
+
+
+def start_profile(event, action=None):
+    """Включить профилировщики, если запрос этого просит; None - профиль не снимается"""
+    modes = requested_modes(event, action)
+    if not modes:
+        return None
+    if not _active.acquire(blocking=False):
+        log.debug("🔬 Profiling skipped: another request is being profiled")
+        return None
+
+    profile = {'modes': modes, 'started': time.monotonic(), 'cpu': None, 'mem': None}
+    if 'mem' in modes:
+        import tracemalloc
+        profile['mem_was_tracing'] = tracemalloc.is_tracing()
+        if profile['mem_was_tracing']:
+            tracemalloc.reset_peak()
+        else:
+            tracemalloc.start()
+        profile['mem'] = tracemalloc.take_snapshot()
+    if 'cpu' in modes:
+        import cProfile
+        profile['cpu'] = cProfile.Profile()
+        profile['cpu'].enable()
+    return profile
+
+
+def _short_path(path):
+    parts = path.replace('\\', '/').split('/')
+    return '/'.join(parts[-2:])
+
+
+def summarize_cpu(profiler, top_n):
+    """Топ функций по суммарному времени: 'cum мс | self мс | вызовы | файл:строка(функция)'"""
+    import pstats
+    stats = pstats.Stats(profiler)
+    rows = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)
+    top = []
+    for (filename, line, func), (_, ncalls, tottime, cumtime, _) in rows[:top_n]:
+        where = f'{_short_path(filename)}:{line}({func})' if line else func
+        top.append(f'{cumtime * 1000:.1f}ms cum | {tottime * 1000:.1f}ms self | {ncalls} calls | {where}')
+    return {'total_ms': round(stats.total_tt * 1000, 1), 'calls': stats.total_calls, 'top': top}
+
+
+def summarize_memory(start_snapshot, top_n):
+    """Строки с наибольшим приростом памяти за запрос и пик"""
+    import cProfile
+    import pstats
+    import tracemalloc
+    snapshot = tracemalloc.take_snapshot().filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, cProfile.__file__),
+        tracemalloc.Filter(False, pstats.__file__),
+        tracemalloc.Filter(False, __file__),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap>')
+    ])
+    current, peak = tracemalloc.get_traced_memory()
+    top = []
+    for stat in snapshot.compare_to(start_snapshot, 'lineno')[:top_n]:
+        frame = stat.traceback[0]
+        top.append(f'{stat.size_diff / 1024:+.1f} KiB | {stat.count_diff:+d} blocks | {_short_path(frame.filename)}:{frame.lineno}')
+    return {'current_kib': round(current / 1024, 1), 'peak_kib': round(peak / 1024, 1), 'top': top}
+
+
+def finish_profile(profile, function_name, action=None):
+    """Остановить профилировщики и записать сводку"""
+    if profile is None:
+        return None
+    try:
+        if profile['cpu'] is not None:
+            profile['cpu'].disable()
+        config = get_config()
+        summary = {
+            'function': function_name,
+            'action': action,
+            'wall_ms': round((time.monotonic() - profile['started']) * 1000, 1)
+        }
+        if profile['cpu'] is not None:
+            summary['cpu'] = summarize_cpu(profile['cpu'], config['top_n'])
+        if profile['mem'] is not None:
+            summary['memory'] = summarize_memory(profile['mem'], config['top_n'])
+
+        if config['output'] == 'tmp':
+            summary['path'] = _dump(profile, summary, config['dir'], function_name, action)
+        log.info(f"🔬 Profile {function_name}/{action or 'unknown'}", **summary)
+        return summary
+    except Exception as e:
+        log.error(f"❌ Error writing profile: {e}")
+        return None
+    finally:
+        # tracemalloc замедляет каждую аллокацию - выключаем его при любом исходе
+        if profile['mem'] is not None and not profile['mem_was_tracing']:
+            import tracemalloc
+            tracemalloc.stop()
+        _active.release()
+
+
+def _dump(profile, summary, directory, function_name, action):
+    os.makedirs(directory, exist_ok=True)
+    base = os.path.join(directory, f"{function_name}-{action or 'unknown'}-{get_correlation_id() or int(time.time())}")
+    if profile['cpu'] is not None:
+        profile['cpu'].dump_stats(f'{base}.pstats')
+    with open(f'{base}.json', 'w', encoding='utf-8') as f:
+        json.dump(summary, f, ensure_ascii=False, indent=1)
+    return base
@@ -0,0 +1,156 @@
+"""Ограничение частоты запросов к модели: token bucket на пару (telegram_id, режим)
+
+Быстрый путь - корзина в памяти контейнера Lambda. Если RATE_LIMIT_BACKEND=supabase,
+после локальной проверки токен дополнительно списывается из общей корзины в базе
+(RPC take_rate_limit_token), чтобы лимит действовал на все контейнеры сразу.
+Если общая корзина недоступна, запрос пропускается (fail-open) - лимитер не должен ронять бота.
+
+Лимиты переопределяются через RATE_LIMITS (JSON), например:
+{"grammar": {"burst": 3, "refill_per_sec": 0.1}, "default": {"burst": 10}}
+"""
+import json
+import math
+import os
+import threading
+import time
+
+from shared.database import supabase_request
+from shared.deadline import DeadlineExceeded
+from shared.logger import get_logger
+from shared.warmup import register_warmer
+
+log = get_logger(__name__)
+
+
+# burst - сколько запросов подряд можно сделать с полной корзиной,
+# refill_per_sec - сколько запросов в секунду восстанавливается
+DEFAULT_LIMITS = {
+    'translation': {'burst': 10, 'refill_per_sec': 0.5},
+    'grammar': {'burst': 5, 'refill_per_sec': 0.2},
+    'text_dialog': {'burst': 8, 'refill_per_sec': 0.3},
+    'default': {'burst': 6, 'refill_per_sec': 0.25}
+}
+
+RATE_LIMIT_REPLIES = {
+    'ru': "⏳ Слишком много запросов подряд. Пожалуйста, подождите {seconds} сек. и попробуйте снова.",
+    'en': "⏳ You're sending requests too fast. Please wait {seconds} s and try again."
+}
+
+# retry_after для корзины без пополнения (refill_per_sec = 0)
+NO_REFILL_RETRY_AFTER = 3600.0
+
+# Корзины, которые давно не трогали (полностью восстановились), удаляем при превышении этого размера
+MAX_LOCAL_BUCKETS = 10000
+
+_limits = None
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+
+class TokenBucket:
+    """Корзина токенов с непрерывным пополнением"""
+
+    def __init__(self, burst, refill_per_sec):
+        self.burst = float(burst)
+        self.refill_per_sec = float(refill_per_sec)
+        self.tokens = float(burst)
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.refill_per_sec)
+        self.updated_at = now
+
+    def take(self):
+        """Списать один токен; возвращает (разрешено, через сколько секунд появится токен)"""
+        self._refill(time.monotonic())
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True, 0.0
+        if self.refill_per_sec <= 0:
+            return False, NO_REFILL_RETRY_AFTER
+        return False, (1 - self.tokens) / self.refill_per_sec
+
+    def is_full(self, now):
+        return self.tokens + (now - self.updated_at) * self.refill_per_sec >= self.burst
+
+
+def get_limits():
+    """Лимиты по умолчанию с учётом переопределений из RATE_LIMITS"""
+    global _limits
+    if _limits is None:
+        limits = {mode: dict(limit) for mode, limit in DEFAULT_LIMITS.items()}
+        overrides_raw = os.environ.get('RATE_LIMITS')
+        if overrides_raw:
+            try:
+                for mode, override in json.loads(overrides_raw).items():
+                    limits.setdefault(mode, dict(limits['default'])).update(override)
+            except (ValueError, AttributeError) as e:
+                log.warning(f"⚠️ Invalid RATE_LIMITS, using defaults: {e}")
+        _limits = limits
+    return _limits
+
+
+def get_limit(mode):
+    """Лимит для режима (или default)"""
+    limits = get_limits()
+    return limits.get(mode, limits['default'])
+
+
+def _take_local(key, limit):
+    with _buckets_lock:
+        bucket = _buckets.get(key)
+        if bucket is None:
+            if len(_buckets) >= MAX_LOCAL_BUCKETS:
+                now = time.monotonic()
+                for stale_key in [k for k, b in _buckets.items() if b.is_full(now)]:
+                    del _buckets[stale_key]
+            bucket = TokenBucket(limit['burst'], limit['refill_per_sec'])
+            _buckets[key] = bucket
+        return bucket.take()
+
+
+def _take_shared(key, limit, deadline=None):
+    """Списать токен из общей корзины в базе (таймаут от дедлайна запроса); при ошибке - пропустить запрос"""
+    try:
+        result = supabase_request('rpc/take_rate_limit_token', 'POST', {
+            'p_key': key,
+            'p_burst': limit['burst'],
+            'p_refill_per_sec': limit['refill_per_sec']
+        }, deadline=deadline)
+        if isinstance(result, list):
+            result = result[0] if result else {}
+        result = result or {}
+        return bool(result.get('allowed', True)), float(result.get('retry_after') or 0)
+    except DeadlineExceeded:
+        raise
+    except Exception as e:
+        log.warning(f"⚠️ Shared rate limit unavailable, allowing request: {e}")
+        return True, 0.0
+
+
+def check_rate_limit(user_id, mode, deadline=None):
+    """Проверить лимит пользователя для режима; возвращает (разрешено, retry_after в секундах)"""
+    if os.environ.get('RATE_LIMIT_ENABLED', 'true').lower() == 'false':
+        return True, 0.0
+
+    limit = get_limit(mode)
+    key = f"{user_id}:{mode}"
+
+    # Локальный отказ окончателен - в общую корзину не ходим
+    allowed, retry_after = _take_local(key, limit)
+    if allowed and os.environ.get('RATE_LIMIT_BACKEND', 'memory').lower() == 'supabase':
+        allowed, retry_after = _take_shared(key, limit, deadline)
+
+    if not allowed:
+        log.warning("🚦 Rate limit hit", user_id=user_id, mode=mode, retry_after=round(retry_after, 1))
+    return allowed, retry_after
+
+
+def get_rate_limit_reply(retry_after, language='ru'):
+    """Локализованный ответ «подождите» для пользователя"""
+    template = RATE_LIMIT_REPLIES.get(language, RATE_LIMIT_REPLIES['ru'])
+    seconds = max(1, math.ceil(retry_after))
+    return template.format(seconds=seconds)
+
+
+register_warmer('rate_limits', lambda: len(get_limits()))
@@ -0,0 +1,318 @@
+"""Трассировка запроса: спаны исходящих вызовов и одна запись-«водопад» на запрос
+
+lambda_handler оборачивается декоратором traced: он начинает лог запроса (correlation id,
+см. shared/logger.py), открывает трассу и после ответа пишет одну JSON-строку в формате
+CloudWatch Embedded Metric Format. В ней метрики задержки (весь запрос, Supabase, OpenAI,
+Telegram, собственное время Lambda) и массив спанов [тип, вызов, начало мс, длительность мс, статус].
+
+Спаны открывает track_upstream (shared/admission.py) для каждого вызова Supabase и OpenAI
+через urllib; метод и путь запроса дописывает TraceHTTPProcessor. Он подключается к opener
+при первом трассируемом запросе: urllib.request не импортируется при импорте модуля и не
+удлиняет холодный старт. Вызовы через другие клиенты (requests в payments) оборачиваются
+в trace_span явно.
+
+Trace id приходит от воркера в заголовке X-Trace-Id (tg-<update_id>), поэтому записи всех
+Lambda, обработавших одно обновление Telegram, связываются между собой.
+TRACE_ENABLED=false отключает трассы: спаны становятся пустыми операциями.
+"""
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+
+from shared.logger import get_logger, start_request
+from shared.metrics import flush_metrics, record_dependency, record_request
+from shared.profiling import finish_profile, start_profile
+
+log = get_logger(__name__)
+
+METRICS_NAMESPACE = 'LinguaPulse/Backend'
+
+# Не больше стольких спанов в записи (остальные только учитываются в сумме задержки)
+MAX_SPANS = 50
+
+# Тип спана -> имя метрики суммарной задержки
+DEPENDENCY_METRICS = {
+    'supabase': 'SupabaseLatency',
+    'openai': 'OpenAILatency',
+    'telegram': 'TelegramLatency'
+}
+
+_trace = ContextVar('trace', default=None)
+_open_span = ContextVar('open_span', default=None)
+_processor_installed = False
+_processor_class = None
+_install_lock = threading.Lock()
+_first_request_hooks = []
+_first_request_lock = threading.Lock()
+_request_end_hooks = []
+
+
+def tracing_enabled():
+    return os.environ.get('TRACE_ENABLED', 'true').lower() != 'false'
+
+
+def start_trace(function_name, event=None, context=None, action=None):
+    """Начать трассу запроса; trace id совпадает с correlation id лога"""
+    trace_id = start_request(event, context)
+    if not tracing_enabled():
+        _trace.set(None)
+        return None
+    trace = {
+        'trace_id': trace_id,
+        'function': function_name,
+        'action': action,
+        'started': time.monotonic(),
+        'spans': [],
+        'lock': threading.Lock()
+    }
+    _trace.set(trace)
+    return trace
+
+
+def set_trace_action(action):
+    """Уточнить действие текущей трассы (если оно стало известно после разбора тела)"""
+    trace = _trace.get()
+    if trace is not None and action:
+        trace['action'] = action
+
+
+def start_span(kind, detail=None):
+    """Открыть спан в текущей трассе; None, если трасса не ведётся"""
+    trace = _trace.get()
+    if trace is None:
+        return None
+    span = {'kind': kind, 'detail': detail, 'start': time.monotonic(), 'status': None, 'trace': trace}
+    span['token'] = _open_span.set(span)
+    return span
+
+
+def end_span(span, success=True):
+    """Закрыть спан и добавить его в трассу"""
+    if span is None:
+        return
+    duration_ms = (time.monotonic() - span['start']) * 1000
+    _open_span.reset(span['token'])
+    trace = span['trace']
+    status = span['status'] or ('ok' if success else 'error')
+    record = [
+        span['kind'],
+        span['detail'] or '',
+        round((span['start'] - trace['started']) * 1000, 1),
+        round(duration_ms, 1),
+        status
+    ]
+    with trace['lock']:
+        trace['spans'].append(record)
+
+
+@contextmanager
+def trace_span(kind, detail=None):
+    """Спан вокруг произвольного исходящего вызова (задержка попадает и в метрики зависимости)"""
+    started = time.monotonic()
+    span = start_span(kind, detail)
+    success = False
+    try:
+        yield span
+        success = True
+    finally:
+        end_span(span, success)
+        record_dependency(kind, (time.monotonic() - started) * 1000, success)
+
+
+def annotate_span(detail=None, status=None):
+    """Дописать вызов и HTTP-статус в открытый спан (если детали ещё не заданы)"""
+    span = _open_span.get()
+    if span is None:
+        return
+    if detail and not span['detail']:
+        span['detail'] = detail
+    if status is not None:
+        span['status'] = status
+
+
+def get_trace_processor_class():
+    """Класс TraceHTTPProcessor; создаётся при первом обращении вместе с импортом urllib.request"""
+    global _processor_class
+    if _processor_class is not None:
+        return _processor_class
+
+    import urllib.request
+    from urllib.parse import urlsplit
+
+    class TraceHTTPProcessor(urllib.request.BaseHandler):
+        """Процессор urllib: метод, путь и статус запроса попадают в открытый спан"""
+
+        handler_order = 999
+
+        def http_request(self, request):
+            if _open_span.get() is not None:
+                path = urlsplit(request.full_url).path
+                annotate_span(f'{request.get_method()} {path}')
+            return request
+
+        https_request = http_request
+
+        def http_response(self, request, response):
+            annotate_span(status=response.status if hasattr(response, 'status') else response.getcode())
+            return response
+
+        https_response = http_response
+
+    _processor_class = TraceHTTPProcessor
+    return _processor_class
+
+
+def install_trace_processor(*handlers):
+    """Подключить TraceHTTPProcessor к глобальному opener urllib (вместе с дополнительными handlers)"""
+    global _processor_installed
+    with _install_lock:
+        if _processor_installed and not handlers:
+            return
+        import urllib.request
+        urllib.request.install_opener(urllib.request.build_opener(*handlers, get_trace_processor_class()()))
+        _processor_installed = True
+
+
+def on_first_request(hook):
+    """Выполнить hook() перед первым трассируемым запросом контейнера, а не при импорте"""
+    _first_request_hooks.append(hook)
+
+
+def prepare_first_request():
+    """Хуки первого запроса (например, пул соединений), затем TraceHTTPProcessor, если его ещё нет"""
+    with _first_request_lock:
+        while _first_request_hooks:
+            _first_request_hooks.pop(0)()
+    install_trace_processor()
+
+
+def on_request_end(hook):
+    """Выполнять hook(function_name, context) после того, как ответ обработчика сформирован"""
+    _request_end_hooks.append(hook)
+
+
+def run_request_end_hooks(function_name, context):
+    """Хуки конца запроса; их ошибки не меняют уже готовый ответ"""
+    for hook in _request_end_hooks:
+        try:
+            hook(function_name, context)
+        except Exception as e:
+            log.error(f"❌ Request end hook {getattr(hook, '__name__', hook)} failed: {e}")
+
+
+def merged_duration_ms(intervals):
+    """Суммарное время, покрытое интервалами (параллельные вызовы не считаются дважды)"""
+    total = 0.0
+    current_start = current_end = None
+    for start, end in sorted(intervals):
+        if current_end is None or start > current_end:
+            if current_end is not None:
+                total += current_end - current_start
+            current_start, current_end = start, end
+        else:
+            current_end = max(current_end, end)
+    if current_end is not None:
+        total += current_end - current_start
+    return total
+
+
+def build_waterfall(trace, status_code):
+    """Запись трассы в формате EMF: метрики задержек + массив спанов"""
+    total_ms = (time.monotonic() - trace['started']) * 1000
+    with trace['lock']:
+        spans = sorted(trace['spans'], key=lambda s: s[2])
+
+    record = {
+        '_aws': {
+            'Timestamp': int(time.time() * 1000),
+            'CloudWatchMetrics': [{
+                'Namespace': METRICS_NAMESPACE,
+                'Dimensions': [['Function', 'Action']],
+                'Metrics': [{'Name': 'RequestLatency', 'Unit': 'Milliseconds'},
+                            {'Name': 'LambdaOverhead', 'Unit': 'Milliseconds'}]
+                + [{'Name': name, 'Unit': 'Milliseconds'} for name in DEPENDENCY_METRICS.values()]
+            }]
+        },
+        'Function': trace['function'],
+        'Action': trace['action'] or 'unknown',
+        'trace_id': trace['trace_id'],
+        'status': status_code,
+        'RequestLatency': round(total_ms, 1)
+    }
+    for kind, metric in DEPENDENCY_METRICS.items():
+        record[metric] = round(sum(s[3] for s in spans if s[0] == kind), 1)
+    busy_ms = merged_duration_ms([(s[2], s[2] + s[3]) for s in spans])
+    record['LambdaOverhead'] = round(max(0.0, total_ms - busy_ms), 1)
+    record['spans'] = spans[:MAX_SPANS]
+    if len(spans) > MAX_SPANS:
+        record['spans_dropped'] = len(spans) - MAX_SPANS
+    return record
+
+
+def finish_trace(status_code):
+    """Закрыть трассу и записать водопад одной строкой"""
+    trace = _trace.get()
+    if trace is None:
+        return None
+    _trace.set(None)
+    record = build_waterfall(trace, status_code)
+    print(json.dumps(record, separators=(',', ':'), ensure_ascii=False))
+    return record
+
+
+def event_action(event):
+    """Действие из тела события (без ошибок на нестандартных событиях)"""
+    body = event.get('body', event) if isinstance(event, dict) else None
+    if isinstance(body, str):
+        if '"action"' not in body:
+            return None
+        try:
+            body = json.loads(body)
+        except ValueError:
+            return None
+    return body.get('action') if isinstance(body, dict) else None
+
+
+def traced(function_name, action=None):
+    """Декоратор lambda_handler: лог запроса, трасса и водопад, метрики действия, профиль по запросу"""
+    def decorator(handler):
+        @functools.wraps(handler)
+        def wrapper(event, context):
+            # Процессор ставится при первом запросе, а не при импорте - см. описание модуля
+            if not _processor_installed:
+                prepare_first_request()
+            request_action = action or event_action(event)
+            started = time.monotonic()
+            start_trace(function_name, event, context, request_action)
+            profile = start_profile(event, request_action)
+            status_code = 500
+            try:
+                response = handler(event, context)
+                status_code = response.get('statusCode', 200) if isinstance(response, dict) else 200
+                return response
+            finally:
+                if profile is not None:
+                    finish_profile(profile, function_name, request_action)
+                # Отложенные записи (учёт токенов) - после ответа, но до заморозки контейнера
+                run_request_end_hooks(function_name, context)
+                finish_trace(status_code)
+                # Профилированный запрос в разы медленнее обычного - в гистограммы его не пишем
+                if profile is None:
+                    record_request(request_action, (time.monotonic() - started) * 1000, status_code)
+                flush_metrics(function_name)
+        return wrapper
+    return decorator
+
+
+def run_in_trace(fn):
+    """Обернуть функцию для пула потоков: трасса и контекст лога (correlation id, уровень) переходят в поток"""
+    context = copy_context()
+
+    def wrapper(*args, **kwargs):
+        # Один контекст нельзя войти из нескольких потоков сразу - каждому вызову своя копия
+        return context.copy().run(fn, *args, **kwargs)
+    return wrapper
@@ -0,0 +1,126 @@
+"""Учёт токенов OpenAI по пользователям и режимам
+
+Каждый вызов модели добавляет prompt/completion токены в агрегат в памяти
+(день, пользователь, режим, профиль, модель). Агрегат сбрасывается в таблицу token_usage_ledger
+пачкой через RPC record_token_usage (инкремент счётчиков на стороне БД) не на пути вызова
+модели, а в конце запроса (хук shared.tracing.on_request_end) с таймаутом от дедлайна запроса,
+и не после каждого запроса, а пачкой: когда накопилось USAGE_FLUSH_MAX_ENTRIES ключей или
+самой старой несброшенной записи больше USAGE_FLUSH_INTERVAL секунд, и при остановке сервера.
+В Lambda замороженный контейнер сбрасывает агрегат на первом запросе после разморозки;
+теряются только записи контейнера, удалённого раньше, чем подошёл срок сброса.
+"""
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+from shared.database import supabase_request
+from shared.deadline import Deadline, DeadlineExceeded
+from shared.logger import get_logger
+from shared.tracing import on_request_end
+
+log = get_logger(__name__)
+
+
+DEFAULT_FLUSH_INTERVAL = 30
+DEFAULT_FLUSH_MAX_ENTRIES = 100
+
+_pending = {}
+_pending_lock = threading.Lock()
+# Когда в пустой агрегат попала первая из несброшенных записей
+_oldest_pending = None
+
+
+def record_usage(user_id, mode, usage, profile=None, model=None, coalesced=False):
+    """Учесть один вызов модели (в базу агрегат уходит в конце запроса)"""
+    global _oldest_pending
+    day = datetime.now(timezone.utc).date().isoformat()
+    key = (day, str(user_id or 'anonymous'), mode or 'unknown', profile or mode or 'unknown', model or 'unknown')
+
+    with _pending_lock:
+        if not _pending:
+            _oldest_pending = time.monotonic()
+        entry = _pending.get(key)
+        if entry is None:
+            entry = {'requests': 0, 'prompt_tokens': 0, 'completion_tokens': 0}
+            _pending[key] = entry
+        entry['requests'] += 1
+        # Совмещённый (single-flight) вызов не оплачивался отдельно - токены не дублируем
+        if not coalesced:
+            entry['prompt_tokens'] += (usage or {}).get('prompt_tokens', 0)
+            entry['completion_tokens'] += (usage or {}).get('completion_tokens', 0)
+
+
+def flush_usage_ledger(force=False, deadline=None):
+    """Сбросить накопленный агрегат в token_usage_ledger (если пора или force) в пределах дедлайна"""
+    global _oldest_pending
+
+    interval = float(os.environ.get('USAGE_FLUSH_INTERVAL', DEFAULT_FLUSH_INTERVAL))
+    max_entries = int(os.environ.get('USAGE_FLUSH_MAX_ENTRIES', DEFAULT_FLUSH_MAX_ENTRIES))
+
+    with _pending_lock:
+        if not _pending:
+            return 0
+        due = force or len(_pending) >= max_entries or time.monotonic() - _oldest_pending >= interval
+        if not due:
+            return 0
+        batch = _pending.copy()
+        _pending.clear()
+
+    entries = [
+        {
+            'day': day,
+            'telegram_id': user_id,
+            'mode': mode,
+            'profile': profile,
+            'model': model,
+            'requests': totals['requests'],
+            'prompt_tokens': totals['prompt_tokens'],
+            'completion_tokens': totals['completion_tokens']
+        }
+        for (day, user_id, mode, profile, model), totals in batch.items()
+    ]
+
+    try:
+        supabase_request('rpc/record_token_usage', 'POST', {'entries': entries}, deadline=deadline)
+        log.info(f"🧮 Token usage flushed: {len(entries)} ledger entries")
+        return len(entries)
+    except Exception as e:
+        if isinstance(e, DeadlineExceeded):
+            log.warning(f"⏱️ Token usage flush deferred: {e}")
+        else:
+            log.error(f"❌ Error flushing token usage: {e}")
+        # Возвращаем данные в агрегат, чтобы не потерять их до следующей попытки
+        with _pending_lock:
+            # Следующая попытка - не раньше чем через USAGE_FLUSH_INTERVAL, а не на каждом запросе
+            _oldest_pending = time.monotonic()
+            for key, totals in batch.items():
+                entry = _pending.setdefault(key, {'requests': 0, 'prompt_tokens': 0, 'completion_tokens': 0})
+                for field, value in totals.items():
+                    entry[field] += value
+        return 0
+
+
+def flush_after_request(function_name, context):
+    """Хук конца запроса: сбросить агрегат, если подошёл срок или он разросся"""
+    if not _pending:
+        return
+    flush_usage_ledger(deadline=Deadline.from_context(context))
+
+
+on_request_end(flush_after_request)
+
+
+def get_pending_usage():
+    """Ещё не сброшенный агрегат (для отладки и метрик)"""
+    with _pending_lock:
+        return {'|'.join(key): dict(totals) for key, totals in _pending.items()}
+
+
+def query_top_consumers(group_by='user', days=7, limit=20):
+    """Самые дорогие пользователи ('user') или промпты ('prompt') за последние N дней"""
+    return supabase_request('rpc/top_token_consumers', 'POST', {
+        'p_group_by': group_by,
+        'p_days': days,
+        'p_limit': limit
+    }) or []
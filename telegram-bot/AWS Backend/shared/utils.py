@@ -13,13 +13,14 @@ def success_response(data):
     }
 
 
-def error_response(error_message, status_code=400):
-    """Создать ответ с ошибкой"""
+def error_response(error_message, status_code=400, **details):
+    """Создать ответ с ошибкой (details - дополнительные поля, например error_code)"""
     return {
         'statusCode': status_code,
         'body': json.dumps({
             'success': False,
-            'error': error_message
+            'error': error_message,
+            **details
         })
     }
 
@@ -34,6 +35,21 @@ def parse_request_body(event):
         return {}
 
 
+def parse_bool(value, default=False):
+    """Флаг из тела запроса или окружения: true/false, 1/0, yes/no, on/off; иначе default"""
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, (int, float)):
+        return value != 0
+    if isinstance(value, str):
+        normalized = value.strip().lower()
+        if normalized in ('true', '1', 'yes', 'on'):
+            return True
+        if normalized in ('false', '0', 'no', 'off', ''):
+            return False
+    return default
+
+
 def validate_required_fields(body, required_fields):
     """Проверка обязательных полей"""
     missing_fields = []
@@ -0,0 +1,134 @@
+"""Прогрев контейнера: соединения, каталоги, конфигурация и кэши до первого запроса пользователя
+
+Модули регистрируют прогревающие функции через register_warmer (как источники метрик в
+shared/metrics.py), поэтому каждая Lambda греет только то, что сама импортирует:
+  connections    - по WARMUP_CONNECTIONS_PER_HOST соединений с Supabase и OpenAI в пуле keep-alive
+  model_profiles, rate_limits, dictionary, product_catalog, greeting_pool, action_modules - из своих модулей
+
+init_container(name) вызывается при импорте lambda_function. Для provisioned concurrency или
+WARMUP_ON_INIT=true он сразу подключает пул соединений и выполняет прогрев в init-фазе; иначе
+пул (HTTP_POOL_ENABLED=false - без пула) подключается перед первым запросом, и импорт
+обработчика не платит за urllib, http.client и ssl. Действие warmup делает то же по запросу
+планировщика и отвечает отчётом: что прогрето, за сколько и что не удалось.
+"""
+import json
+import os
+import time
+
+from shared.logger import get_logger
+from shared.tracing import on_first_request
+
+log = get_logger(__name__)
+
+
+DEFAULT_CONNECTIONS_PER_HOST = 2
+
+_warmers = {}
+_state = {'runs': 0}
+
+
+def pool_enabled():
+    return os.environ.get('HTTP_POOL_ENABLED', 'true').lower() != 'false'
+
+
+def register_warmer(name, warm_fn):
+    """Зарегистрировать прогрев name: warm_fn() -> краткий результат (число записей, размер и т.п.)"""
+    _warmers[name] = warm_fn
+
+
+def warm_connections(dependencies):
+    """Открыть соединения с зависимостями дешёвыми пробами; соединения остаются в пуле"""
+    from concurrent.futures import ThreadPoolExecutor
+    from shared.health import PROBES
+
+    per_host = int(os.environ.get('WARMUP_CONNECTIONS_PER_HOST', DEFAULT_CONNECTIONS_PER_HOST))
+    timeout = float(os.environ.get('HEALTH_PROBE_TIMEOUT', 3))
+    jobs = [name for name in dependencies for _ in range(per_host)]
+    # Пробы одной зависимости идут одновременно, иначе все они взяли бы одно и то же соединение
+    with ThreadPoolExecutor(max_workers=len(jobs)) as executor:
+        results = list(executor.map(lambda name: (name, PROBES[name](timeout)), jobs))
+
+    opened = {}
+    for name, (_, latency_ms, error) in results:
+        entry = opened.setdefault(name, {'opened': 0, 'max_ms': 0.0})
+        if error:
+            entry['error'] = error
+        else:
+            entry['opened'] += 1
+            entry['max_ms'] = max(entry['max_ms'], latency_ms)
+    return opened
+
+
+def run_warmup(function_name, dependencies=('supabase', 'openai'), trigger='action'):
+    """Выполнить все прогревы; отчёт по каждому (результат и время) и список неудачных"""
+    from shared.http_pool import get_pool_stats
+
+    started = time.monotonic()
+    warmed, failed = {}, {}
+
+    steps = [('connections', lambda: warm_connections(dependencies))] if dependencies else []
+    done = set()
+    while steps:
+        for name, warm_fn in steps:
+            done.add(name)
+            step_started = time.monotonic()
+            try:
+                result = warm_fn()
+                warmed[name] = {'ms': round((time.monotonic() - step_started) * 1000, 1), 'result': result}
+            except Exception as e:
+                failed[name] = str(e) or e.__class__.__name__
+        # Прогрев модулей действий импортирует новые модули - их прогревы выполняем следующим кругом
+        steps = [(name, warm_fn) for name, warm_fn in list(_warmers.items()) if name not in done]
+
+    _state['runs'] += 1
+    report = {
+        'function': function_name,
+        'trigger': trigger,
+        'total_ms': round((time.monotonic() - started) * 1000, 1),
+        'pooled': get_pool_stats() is not None,
+        'warmed': warmed,
+        'failed': failed,
+        'runs': _state['runs']
+    }
+    if failed:
+        log.warning(f"🔥 Warmup {function_name} incomplete", failed=failed, total_ms=report['total_ms'])
+    else:
+        log.info(f"🔥 Warmup {function_name} done", steps=list(warmed), total_ms=report['total_ms'])
+    return report
+
+
+def warmup_response(function_name, dependencies=('supabase', 'openai')):
+    """Ответ Lambda на действие warmup"""
+    report = run_warmup(function_name, dependencies)
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json'},
+        'body': json.dumps({'success': not report['failed'], 'warmup': report})
+    }
+
+
+def install_pool():
+    """Подключить пул соединений; ошибка не должна ронять контейнер - тогда запросы идут без пула"""
+    if not pool_enabled():
+        return
+    try:
+        from shared.http_pool import install_pooled_opener
+        install_pooled_opener()
+    except Exception as e:
+        log.error(f"❌ Connection pool not installed: {e}")
+
+
+def init_container(function_name, dependencies=('supabase', 'openai')):
+    """Init-хук Lambda: прогрев в init-фазе (provisioned concurrency или WARMUP_ON_INIT), иначе пул - к первому запросу"""
+    provisioned = os.environ.get('AWS_LAMBDA_INITIALIZATION_TYPE') == 'provisioned-concurrency'
+    if not provisioned and os.environ.get('WARMUP_ON_INIT', 'false').lower() != 'true':
+        on_first_request(install_pool)
+        return None
+
+    install_pool()
+    try:
+        return run_warmup(function_name, dependencies, trigger='init')
+    except Exception as e:
+        # Ошибка прогрева не должна ронять инициализацию контейнера
+        log.error(f"❌ Init warmup failed: {e}")
+    return None
@@ -7,14 +7,48 @@ import json
 sys.path.insert(0, '/var/task/shared')
 sys.path.insert(0, '/var/task')
 
-from shared.openai_client import get_openai_response
+from shared.model_router import get_routed_response
+from shared.intent_classifier import get_local_dialog_reply
+from shared.rate_limiter import check_rate_limit, get_rate_limit_reply
+from shared.health import health_response
+from shared.warmup import init_container, warmup_response
+from shared.metrics import metrics_response_body
+from shared.admission import admit
+from shared.deadline import Deadline, DeadlineExceeded
 from shared.database import log_text_usage, get_supabase_config
 from shared.utils import success_response, error_response, parse_request_body, validate_required_fields
+from shared.logger import get_logger
+from shared.tracing import traced
 
+log = get_logger('text_dialog')
 
+
+# Фидбэк без модели, если генерация сброшена при перегрузке: диалог всё равно завершается
+FALLBACK_TEXT_FEEDBACK = {
+    'ru': (
+        "🎉 **Отличная работа!**\n\n"
+        "Спасибо за интересный диалог! Подробный разбор сейчас недоступен, "
+        "но каждая такая практика делает ваш письменный английский увереннее.\n\n"
+        "💡 Возвращайтесь завтра - продолжим!"
+    ),
+    'en': (
+        "🎉 **Great work!**\n\n"
+        "Thank you for an interesting dialogue! A detailed review is not available right now, "
+        "but every practice like this makes your written English more confident.\n\n"
+        "💡 Come back tomorrow and let's keep going!"
+    )
+}
+
+
+# Init-фаза контейнера: пул соединений; прогрев сразу - при provisioned concurrency
+init_container('text_dialog')
+
+
+@traced('text_dialog')
 def lambda_handler(event, context):
     """Обработчик Lambda для текстовых диалогов"""
-    print(f"💬 Text Dialog Lambda called")
+    log.debug("💬 Text Dialog Lambda called")
+    deadline = Deadline.from_context(context)
     
     try:
         body = parse_request_body(event)
@@ -25,19 +59,38 @@ def lambda_handler(event, context):
         
         action = body['action']
         
-        if action == 'process_dialog':
-            return handle_text_dialog(body)
+        # При перегрузке upstream низкоприоритетные действия сбрасываются первыми
+        admitted, load_level = admit(action)
+        if not admitted:
+            if action == 'generate_dialog_feedback':
+                return success_response({
+                    'feedback': FALLBACK_TEXT_FEEDBACK.get(body.get('user_lang'), FALLBACK_TEXT_FEEDBACK['ru']),
+                    'degraded': True
+                })
+            return error_response(f'Service overloaded ({load_level}), action {action} shed, retry later', 503)
+        
+        if action == 'metrics':
+            return success_response(metrics_response_body('text_dialog', body))
+        elif action == 'health':
+            return health_response('text_dialog')
+        elif action == 'warmup':
+            return warmup_response('text_dialog')
+        elif action == 'process_dialog':
+            return handle_text_dialog(body, deadline)
         elif action == 'generate_dialog_feedback':
-            return handle_generate_feedback(body)
+            return handle_generate_feedback(body, deadline)
         else:
             return error_response(f'Unknown action: {action}')
             
+    except DeadlineExceeded as e:
+        log.warning(f"⏱️ Text Dialog Lambda deadline exceeded: {e}")
+        return error_response(str(e), 504, **e.details())
     except Exception as e:
-        print(f"❌ Text Dialog Lambda error: {e}")
+        log.error(f"❌ Text Dialog Lambda error: {e}")
         return error_response(f'Internal error: {str(e)}', 500)
 
 
-def handle_text_dialog(body):
+def handle_text_dialog(body, deadline=None):
     """Обработка текстового диалога"""
     validation_error = validate_required_fields(body, ['text', 'user_id'])
     if validation_error:
@@ -49,7 +102,27 @@ def handle_text_dialog(body):
     user_level = body.get('user_level', 'Intermediate')
     previous_messages = body.get('previous_messages', [])
     
-    print(f"💬 Processing text dialog for user {user_id}, count: {dialog_count}")
+    log.debug("💬 Processing text dialog for user %s, count: %s", user_id, dialog_count)
+    
+    # Явную просьбу закончить диалог обрабатываем локально, без вызова OpenAI
+    local_reply = get_local_dialog_reply(text)
+    if local_reply:
+        supabase_config = get_supabase_config()
+        if supabase_config['url'] and supabase_config['key']:
+            log_text_usage(user_id, supabase_config['url'], supabase_config['key'], deadline)
+        
+        return success_response({
+            'reply': local_reply
+        })
+    
+    # Лимит частоты запросов к модели (token bucket на пользователя и режим)
+    allowed, retry_after = check_rate_limit(user_id, 'text_dialog', deadline)
+    if not allowed:
+        return success_response({
+            'reply': get_rate_limit_reply(retry_after, body.get('interface_language', 'ru')),
+            'rate_limited': True,
+            'retry_after': round(retry_after, 1)
+        })
     
     # Строим контекст из предыдущих сообщений
     context = ""
@@ -119,25 +192,25 @@ That sounds like an amazing trip! What was your favorite moment during the vacat
 ||Это звучит как потрясающая поездка! Какой момент больше всего запомнился во время отпуска? Пробовали ли вы местную еду, которая вас удивила?||"""
     
     # Получаем ответ от OpenAI
-    result = get_openai_response(text, system_prompt)
+    result = get_routed_response('text_dialog', text, system_prompt, user_id=user_id, deadline=deadline)
     
     if result['success']:
-        print(f"✅ Text dialog successful for user {user_id}")
+        log.info(f"✅ Text dialog successful for user {user_id}")
         
         # Логируем использование
         supabase_config = get_supabase_config()
         if supabase_config['url'] and supabase_config['key']:
-            log_text_usage(user_id, supabase_config['url'], supabase_config['key'])
+            log_text_usage(user_id, supabase_config['url'], supabase_config['key'], deadline)
         
         return success_response({
             'reply': result['reply']
         })
     else:
-        print(f"❌ Text dialog failed: {result['error']}")
+        log.error(f"❌ Text dialog failed: {result['error']}")
         return error_response(f"Text dialog error: {result['error']}")
 
 
-def handle_generate_feedback(body):
+def handle_generate_feedback(body, deadline=None):
     """Генерация финального фидбэка для текстового диалога"""
     validation_error = validate_required_fields(body, ['user_id'])
     if validation_error:
@@ -146,7 +219,7 @@ def handle_generate_feedback(body):
     user_id = body['user_id']
     user_lang = body.get('user_lang', 'ru')
     
-    print(f"📊 Generating text dialog feedback for user {user_id}")
+    log.debug("📊 Generating text dialog feedback for user %s", user_id)
     
     # Системный промпт для фидбэка
     if user_lang == 'en':
@@ -193,13 +266,13 @@ Structure:
 Keep it concise (max 150 words) and encouraging. Give realistic scores 70-95. Focus only on text-based skills."""
     
     # Получаем фидбэк от OpenAI
-    result = get_openai_response("Generate feedback for completed text dialog", feedback_prompt)
+    result = get_routed_response('dialog_feedback', "Generate feedback for completed text dialog", feedback_prompt, user_id=user_id, deadline=deadline)
     
     if result['success']:
-        print(f"✅ Text dialog feedback generated for user {user_id}")
+        log.info(f"✅ Text dialog feedback generated for user {user_id}")
         return success_response({
             'feedback': result['reply']
         })
     else:
-        print(f"❌ Text dialog feedback failed: {result['error']}")
+        log.error(f"❌ Text dialog feedback failed: {result['error']}")
         return error_response(f"Feedback generation error: {result['error']}")
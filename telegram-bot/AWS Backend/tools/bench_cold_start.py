@@ -0,0 +1,353 @@
+"""Бенчмарк холодного старта Lambda: время импорта, первый и «тёплый» вызов
+
+Каждая Lambda запускается в отдельном процессе (как новый контейнер): импорт модуля
+обработчика, первый вызов lambda_handler и серия тёплых вызовов. Supabase и OpenAI
+заменены локальной заглушкой (все запросы отвечают сразу), поэтому замер показывает
+собственные накладные расходы кода. Отдельный запуск с -X importtime даёт разбивку
+самых дорогих импортов.
+
+С базовой линией сравнивается минимум по --runs холодным запускам: шум соседних процессов
+и планировщика только добавляет время, поэтому минимум устойчивее медианы. Скорость раннера
+плавает от прогона к прогону, поэтому между запусками Lambda в тех же условиях замеряется
+эталон - импорт фиксированного набора модулей стандартной библиотеки в новом процессе, - и
+бюджеты по времени умножаются на то, во сколько раз эталон сейчас медленнее, чем в базовой
+линии. Выход за бюджет по времени перемеряется ещё раз и засчитывается, только если повторился.
+Точный сигнал даёт import_modules - число модулей, загруженных импортом обработчика: оно не
+зависит от шума, и лишний тяжёлый импорт (urllib.request тянет http.client, ssl, email - десятки
+модулей) сразу выходит за MODULES_SLACK. Медианы пишутся в --output для справки.
+
+    python tools/bench_cold_start.py                     # сравнить с базовой линией, код 1 при регрессии
+    python tools/bench_cold_start.py --update-baseline   # записать новую базовую линию
+    python tools/bench_cold_start.py translation grammar --runs 10
+
+Базовая линия зависит от машины - обновляйте её на той же машине/раннере, где проверяете.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from tools.fake_openai import fake_completion_body
+
+
+DEFAULT_BASELINE = os.path.join(BACKEND_DIR, 'tools', 'benchmarks', 'cold_start_baseline.json')
+
+# Допустимое превышение базовой линии: относительное и абсолютное (шум на малых значениях)
+DEFAULT_TOLERANCE = 0.5
+DEFAULT_SLACK_MS = 10.0
+# Сколько модулей сверх базовой линии может добавить импорт обработчика
+MODULES_SLACK = 5
+
+# Эталонная нагрузка для поправки на скорость раннера: модули, которые Lambda не импортируют при старте
+CALIBRATION_CODE = r"""
+import sys, time
+started = time.perf_counter()
+import decimal, email.parser, http.client, ssl, urllib.request, xml.dom.minidom
+print('%s' + str((time.perf_counter() - started) * 1000))
+"""
+
+RESULT_MARKER = '@@BENCH_RESULT@@'
+
+# Lambda -> модуль обработчика, каталог в sys.path (как /var/task) и типичное событие
+LAMBDAS = {
+    'shared': {
+        'module': 'shared.lambda_function',
+        'path': None,
+        'event': {'body': {'action': 'get_ai_mode', 'user_id': 1}}
+    },
+    'translation': {
+        'module': 'lambda_function',
+        'path': 'translation',
+        'event': {'body': {'action': 'translate', 'text': 'Where is the nearest train station?', 'user_id': 1}}
+    },
+    'grammar': {
+        'module': 'lambda_function',
+        'path': 'grammar',
+        'event': {'body': {'action': 'check_grammar', 'text': 'When do I use present perfect?', 'user_id': 1}}
+    },
+    'text_dialog': {
+        'module': 'lambda_function',
+        'path': 'text_dialog',
+        'event': {'body': {'action': 'process_dialog', 'text': 'I went to the park yesterday', 'user_id': 1}}
+    },
+    'audio_dialog': {
+        'module': 'lambda_function',
+        'path': 'audio_dialog',
+        'event': {'body': {'action': 'generate_response', 'user_text': 'I like to travel', 'user_id': 1}}
+    },
+    'payments': {
+        'module': 'lambda_function',
+        'path': 'payments',
+        'event': {'body': ''}
+    }
+}
+
+METRICS = ('import_ms', 'first_call_ms', 'warm_call_ms')
+COUNTERS = ('import_modules',)
+
+
+class StubUpstreamHandler(BaseHTTPRequestHandler):
+    """Заглушка Supabase и OpenAI: chat/completions - ответ-эхо, всё остальное - []"""
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        if self.path.endswith('/chat/completions'):
+            payload = fake_completion_body(json.loads(body or b'{}'))
+        else:
+            payload = []
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    do_GET = do_POST = do_PATCH = do_PUT = do_DELETE = _reply
+
+
+def start_stub_server():
+    """Запустить заглушку upstream в фоне, вернуть (сервер, базовый URL)"""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubUpstreamHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_address[1]}'
+
+
+# Код дочернего процесса. До замера импорта не загружаем ничего, кроме sys и time,
+# чтобы стоимость общих модулей (json, urllib, ...) попала в замер, как в новом контейнере.
+CHILD_CODE = r"""
+import sys, time
+module_name, lambda_path, backend_dir, warm_calls, event_json = sys.argv[1:6]
+sys.path.insert(0, backend_dir)
+if lambda_path:
+    sys.path.insert(0, lambda_path)
+
+modules_before = len(sys.modules)
+started = time.perf_counter()
+module = __import__(module_name, fromlist=['lambda_handler'])
+import_ms = (time.perf_counter() - started) * 1000
+import_modules = len(sys.modules) - modules_before
+
+import json, statistics
+
+class FakeContext:
+    function_name = 'bench'
+    memory_limit_in_mb = 512
+    aws_request_id = 'bench-request'
+
+    def get_remaining_time_in_millis(self):
+        return 30000
+
+context = FakeContext()
+started = time.perf_counter()
+response = module.lambda_handler(json.loads(event_json), context)
+first_call_ms = (time.perf_counter() - started) * 1000
+
+warm = []
+for _ in range(int(warm_calls)):
+    started = time.perf_counter()
+    module.lambda_handler(json.loads(event_json), context)
+    warm.append((time.perf_counter() - started) * 1000)
+
+print('%s' + json.dumps({
+    'import_ms': import_ms,
+    'import_modules': import_modules,
+    'first_call_ms': first_call_ms,
+    'warm_call_ms': statistics.median(warm) if warm else 0.0,
+    'status_code': (response or {}).get('statusCode')
+}))
+""" % RESULT_MARKER
+
+
+def spawn_child(name, env, warm_calls, importtime=False):
+    """Запустить Lambda в новом процессе (холодный старт); вернуть (результат, stderr)"""
+    spec = LAMBDAS[name]
+    lambda_path = os.path.join(BACKEND_DIR, spec['path']) if spec['path'] else ''
+    cmd = [sys.executable]
+    if importtime:
+        cmd += ['-X', 'importtime']
+    cmd += ['-c', CHILD_CODE, spec['module'], lambda_path, BACKEND_DIR, str(warm_calls), json.dumps(spec['event'])]
+    proc = subprocess.run(cmd, env=env, capture_output=True, text=True, cwd=BACKEND_DIR)
+    for line in proc.stdout.splitlines():
+        if line.startswith(RESULT_MARKER):
+            return json.loads(line[len(RESULT_MARKER):]), proc.stderr
+    raise RuntimeError((proc.stderr.strip().splitlines() or ['no output'])[-1])
+
+
+def spawn_calibration(env):
+    """Время эталонного импорта в новом процессе, мс"""
+    proc = subprocess.run([sys.executable, '-c', CALIBRATION_CODE % RESULT_MARKER], env=env,
+                          capture_output=True, text=True, cwd=BACKEND_DIR)
+    for line in proc.stdout.splitlines():
+        if line.startswith(RESULT_MARKER):
+            return float(line[len(RESULT_MARKER):])
+    raise RuntimeError((proc.stderr.strip().splitlines() or ['calibration: no output'])[-1])
+
+
+def parse_importtime(stderr, top=10):
+    """Разбор вывода -X importtime: самые дорогие импорты по cumulative времени"""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, module = line[len('import time:'):].split('|')
+        # Вложенность импорта показана отступом после одного обязательного пробела
+        nested = module[1:].startswith(' ')
+        name = module.strip()
+        if nested and not name.startswith('shared'):
+            continue
+        rows.append({'module': name, 'self_ms': int(self_us) / 1000, 'cumulative_ms': int(cumulative_us) / 1000})
+    rows.sort(key=lambda row: row['cumulative_ms'], reverse=True)
+    return rows[:top]
+
+
+def benchmark(name, env, runs, warm_calls):
+    """Минимумы метрик по нескольким холодным запускам (для сравнения), медианы и разбивка импортов"""
+    samples, calibration = [], []
+    for _ in range(runs):
+        samples.append(spawn_child(name, env, warm_calls)[0])
+        calibration.append(spawn_calibration(env))
+    _, importtime_stderr = spawn_child(name, env, 0, importtime=True)
+    result = {metric: round(min(sample[metric] for sample in samples), 2) for metric in METRICS}
+    result['median'] = {metric: round(statistics.median(sample[metric] for sample in samples), 2) for metric in METRICS}
+    result['import_modules'] = samples[-1]['import_modules']
+    result['calibration_ms'] = round(min(calibration), 2)
+    result['status_code'] = samples[-1]['status_code']
+    result['top_imports'] = parse_importtime(importtime_stderr)
+    return result
+
+
+def compare(results, baseline, tolerance, slack_ms):
+    """Сравнить с базовой линией; вернуть регрессии (Lambda, описание, по времени ли)"""
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get('lambdas', {}).get(name)
+        if not base or 'error' in result:
+            continue
+        # Раннер сейчас медленнее, чем при записи базовой линии, - бюджеты по времени растут так же
+        speed = max(1.0, result['calibration_ms'] / base['calibration_ms']) if base.get('calibration_ms') else 1.0
+        for metric in METRICS:
+            if metric not in base:
+                continue
+            budget = base[metric] * speed * (1 + tolerance) + slack_ms
+            if result[metric] > budget:
+                regressions.append((name, f"{name}.{metric}: {result[metric]:.1f}ms > budget {budget:.1f}ms (baseline {base[metric]:.1f}ms)", True))
+        for counter in COUNTERS:
+            if counter in base and result[counter] > base[counter] + MODULES_SLACK:
+                regressions.append((name, f"{name}.{counter}: {result[counter]} > budget {base[counter] + MODULES_SLACK} (baseline {base[counter]})", False))
+    return regressions
+
+
+def print_result(name, r):
+    print(f"{name:<13} import {r['import_ms']:>8.1f}ms ({r['import_modules']:>3} modules)  first {r['first_call_ms']:>8.1f}ms  warm {r['warm_call_ms']:>7.2f}ms  ref {r['calibration_ms']:>6.1f}ms  (status {r['status_code']})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Cold-start and import-time benchmark for the Lambdas')
+    parser.add_argument('lambdas', nargs='*', help=f"default: all ({', '.join(sorted(LAMBDAS))})")
+    parser.add_argument('--runs', type=int, default=5, help='cold processes per Lambda')
+    parser.add_argument('--warm-calls', type=int, default=20)
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--update-baseline', action='store_true')
+    parser.add_argument('--tolerance', type=float, default=None, help=f'relative budget over baseline (default {DEFAULT_TOLERANCE})')
+    parser.add_argument('--output', help='write full results JSON here')
+    args = parser.parse_args()
+
+    unknown = [name for name in args.lambdas if name not in LAMBDAS]
+    if unknown:
+        parser.error(f"unknown Lambda(s): {', '.join(unknown)}")
+
+    server, stub_url = start_stub_server()
+    env = dict(os.environ)
+    env.update({
+        'SUPABASE_URL': stub_url,
+        'SUPABASE_SERVICE_KEY': 'bench',
+        'OPENAI_BASE_URL': f'{stub_url}/v1',
+        'OPENAI_API_KEY': 'bench',
+        # Повторяющиеся вызовы одного пользователя не должны упираться в лимиты
+        'RATE_LIMIT_ENABLED': 'false',
+        'ADMISSION_CONTROL_ENABLED': 'false',
+        'PYTHONDONTWRITEBYTECODE': '1'
+    })
+
+    results = {}
+    for name in args.lambdas or sorted(LAMBDAS):
+        try:
+            results[name] = benchmark(name, env, args.runs, args.warm_calls)
+            print_result(name, results[name])
+        except RuntimeError as e:
+            results[name] = {'error': str(e)}
+            print(f"{name:<13} skipped: {e}")
+
+    baseline = None
+    if not args.update_baseline and os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        tolerance = args.tolerance if args.tolerance is not None else baseline.get('tolerance', DEFAULT_TOLERANCE)
+        slack_ms = baseline.get('slack_ms', DEFAULT_SLACK_MS)
+        regressions = compare(results, baseline, tolerance, slack_ms)
+
+        # Выход за бюджет по времени может быть всплеском шума: такие Lambda перемеряем и берём
+        # минимум по обоим замерам - регрессия засчитывается, только если она повторилась
+        noisy = sorted({name for name, _, timing in regressions if timing})
+        if noisy:
+            print(f"🔁 Re-measuring {', '.join(noisy)} to rule out noise...")
+            for name in noisy:
+                retry = benchmark(name, env, args.runs, args.warm_calls)
+                for metric in METRICS + ('calibration_ms',):
+                    results[name][metric] = min(results[name][metric], retry[metric])
+                print_result(name, results[name])
+            regressions = compare(results, baseline, tolerance, slack_ms)
+    server.shutdown()
+
+    if args.output:
+        write_output(args.output, results)
+
+    if args.update_baseline:
+        baseline = {
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'tolerance': args.tolerance if args.tolerance is not None else DEFAULT_TOLERANCE,
+            'slack_ms': DEFAULT_SLACK_MS,
+            'lambdas': {
+                name: {metric: result[metric] for metric in METRICS + COUNTERS + ('calibration_ms',)}
+                for name, result in results.items() if 'error' not in result
+            }
+        }
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=2)
+            f.write('\n')
+        print(f"Baseline written to {args.baseline}")
+        return 0
+
+    if baseline is None:
+        print(f"No baseline at {args.baseline}; run with --update-baseline first")
+        return 0
+
+    for _, regression, _ in regressions:
+        print(f"❌ {regression}")
+    if not regressions:
+        print("✅ Within cold-start budget")
+    return 1 if regressions else 0
+
+
+def write_output(path, results):
+    """Полные результаты (с медианами и разбивкой импортов) в JSON"""
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
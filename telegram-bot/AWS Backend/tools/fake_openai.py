@@ -0,0 +1,417 @@
+"""Локальный стенд OpenAI API для тестов и нагрузочных прогонов без реальных вызовов
+
+Поддерживает POST /v1/chat/completions (в том числе stream=true, SSE), GET /v1/models и Batch API:
+POST /v1/files, POST /v1/batches, GET /v1/batches/{id}, GET /v1/files/{id}/content.
+Batch «выполняется» через --batch-delay секунд после создания, каждый запрос получает
+детерминированный ответ-заглушку.
+
+Для реалистичной нагрузки задаются распределение задержки (--latency), время на токен
+ответа (--token-latency-ms) и инъекция ошибок (--error-rate, --error-statuses, --hang-rate).
+Параметры можно менять на лету: POST /_fake/config, счётчики - GET /_fake/stats.
+
+    python tools/fake_openai.py --port 8090 --latency lognormal:600:0.4 --error-rate 0.02
+    OPENAI_BASE_URL=http://127.0.0.1:8090/v1 OPENAI_API_KEY=test python tools/run_batch_job.py greeting_pool
+"""
+import argparse
+import json
+import math
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeHTTPServer(ThreadingHTTPServer):
+    """ThreadingHTTPServer с увеличенной очередью соединений для нагрузочных прогонов"""
+
+    request_queue_size = 256
+
+
+class LatencyModel:
+    """Распределение задержки в мс: fixed:50, uniform:20:200, normal:300:80, lognormal:<медиана>:<sigma>"""
+
+    KINDS = {'fixed': 1, 'uniform': 2, 'normal': 2, 'lognormal': 2}
+
+    def __init__(self, spec='fixed:0', rng=None):
+        kind, *params = spec.split(':')
+        if kind not in self.KINDS or len(params) != self.KINDS[kind]:
+            raise ValueError(f"invalid latency spec {spec!r}, expected e.g. fixed:50, uniform:20:200, normal:300:80, lognormal:400:0.5")
+        self.spec = spec
+        self.kind = kind
+        self.params = [float(param) for param in params]
+        self.rng = rng or random.Random()
+
+    def sample_ms(self):
+        if self.kind == 'fixed':
+            return self.params[0]
+        if self.kind == 'uniform':
+            return self.rng.uniform(*self.params)
+        if self.kind == 'normal':
+            return max(0.0, self.rng.gauss(*self.params))
+        median, sigma = self.params
+        return self.rng.lognormvariate(math.log(max(median, 1e-3)), sigma)
+
+    def sleep(self):
+        delay_ms = self.sample_ms()
+        if delay_ms > 0:
+            time.sleep(delay_ms / 1000)
+
+
+class FaultInjector:
+    """Случайные ошибки upstream: HTTP-статус из списка (error_rate) или «зависание» (hang_rate)"""
+
+    def __init__(self, error_rate=0.0, error_statuses=(500,), hang_rate=0.0, hang_seconds=60.0, rng=None):
+        self.error_rate = error_rate
+        self.error_statuses = tuple(error_statuses)
+        self.hang_rate = hang_rate
+        self.hang_seconds = hang_seconds
+        self.rng = rng or random.Random()
+
+    def pick(self):
+        """None - отвечать нормально, ('error', статус) или ('hang', секунды)"""
+        roll = self.rng.random()
+        if roll < self.hang_rate:
+            return ('hang', self.hang_seconds)
+        if roll < self.hang_rate + self.error_rate:
+            return ('error', self.rng.choice(self.error_statuses))
+        return None
+
+
+def parse_statuses(value):
+    """'429,500,503' -> (429, 500, 503)"""
+    return tuple(int(status) for status in str(value).split(',') if status.strip())
+
+
+class FakeOpenAIState:
+    """Хранилище файлов и batch-заданий стенда, настройки задержек и ошибок, счётчики"""
+
+    def __init__(self, batch_delay=0.0, latency='fixed:0', token_latency_ms=0.0, error_rate=0.0,
+                 error_statuses=(500,), hang_rate=0.0, hang_seconds=60.0, seed=None):
+        self.batch_delay = batch_delay
+        self.files = {}
+        self.batches = {}
+        self.lock = threading.Lock()
+        self.rng = random.Random(seed)
+        self.latency = LatencyModel(latency, self.rng)
+        self.token_latency_ms = token_latency_ms
+        self.faults = FaultInjector(error_rate, error_statuses, hang_rate, hang_seconds, self.rng)
+        self.stats = {'chat_completions': 0, 'streamed': 0, 'injected_errors': 0, 'injected_hangs': 0, 'models': 0}
+
+    def configure(self, config):
+        """Изменить задержки/ошибки на лету (ключи как у аргументов командной строки)"""
+        with self.lock:
+            if 'latency' in config:
+                self.latency = LatencyModel(config['latency'], self.rng)
+            if 'token_latency_ms' in config:
+                self.token_latency_ms = float(config['token_latency_ms'])
+            if 'error_rate' in config:
+                self.faults.error_rate = float(config['error_rate'])
+            if 'error_statuses' in config:
+                self.faults.error_statuses = parse_statuses(config['error_statuses'])
+            if 'hang_rate' in config:
+                self.faults.hang_rate = float(config['hang_rate'])
+            if 'hang_seconds' in config:
+                self.faults.hang_seconds = float(config['hang_seconds'])
+            if 'batch_delay' in config:
+                self.batch_delay = float(config['batch_delay'])
+
+    def describe(self):
+        return {
+            'latency': self.latency.spec,
+            'token_latency_ms': self.token_latency_ms,
+            'error_rate': self.faults.error_rate,
+            'error_statuses': list(self.faults.error_statuses),
+            'hang_rate': self.faults.hang_rate,
+            'hang_seconds': self.faults.hang_seconds,
+            'batch_delay': self.batch_delay
+        }
+
+    def count(self, name):
+        with self.lock:
+            self.stats[name] += 1
+
+    def add_file(self, content, purpose):
+        file_id = f'file-{uuid.uuid4().hex[:24]}'
+        with self.lock:
+            self.files[file_id] = {'content': content, 'purpose': purpose}
+        return file_id
+
+
+def fake_completion_body(request_body):
+    """Ответ chat/completions: эхо последнего сообщения пользователя"""
+    messages = request_body.get('messages') or [{}]
+    user_text = messages[-1].get('content', '')
+    reply = f"[fake] {user_text[:80]}"
+    prompt_tokens = sum(len(m.get('content', '')) for m in messages) // 4 + 1
+    completion_tokens = len(reply) // 4 + 1
+    return {
+        'id': f'chatcmpl-{uuid.uuid4().hex[:24]}',
+        'object': 'chat.completion',
+        'created': int(time.time()),
+        'model': request_body.get('model', 'gpt-4o-mini'),
+        'choices': [{
+            'index': 0,
+            'message': {'role': 'assistant', 'content': reply},
+            'finish_reason': 'stop'
+        }],
+        'usage': {
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens,
+            'total_tokens': prompt_tokens + completion_tokens
+        }
+    }
+
+
+def fake_stream_chunks(completion, include_usage=False):
+    """Разбить ответ chat/completions на чанки chat.completion.chunk (по словам)"""
+    base = {'id': completion['id'], 'object': 'chat.completion.chunk', 'created': completion['created'], 'model': completion['model']}
+    words = completion['choices'][0]['message']['content'].split(' ')
+    yield {**base, 'choices': [{'index': 0, 'delta': {'role': 'assistant', 'content': ''}, 'finish_reason': None}]}
+    for i, word in enumerate(words):
+        piece = word if i == 0 else f' {word}'
+        yield {**base, 'choices': [{'index': 0, 'delta': {'content': piece}, 'finish_reason': None}]}
+    yield {**base, 'choices': [{'index': 0, 'delta': {}, 'finish_reason': 'stop'}]}
+    if include_usage:
+        yield {**base, 'choices': [], 'usage': completion['usage']}
+
+
+def parse_multipart(body, content_type):
+    """Минимальный разбор multipart/form-data: имя поля -> байты"""
+    boundary = content_type.split('boundary=', 1)[1].strip().strip('"').encode('utf-8')
+    fields = {}
+    for part in body.split(b'--' + boundary):
+        part = part.strip(b'\r\n')
+        if not part or part == b'--' or b'\r\n\r\n' not in part:
+            continue
+        raw_headers, value = part.split(b'\r\n\r\n', 1)
+        for header in raw_headers.decode('utf-8').split('\r\n'):
+            if header.lower().startswith('content-disposition') and 'name="' in header:
+                name = header.split('name="', 1)[1].split('"', 1)[0]
+                fields[name] = value
+    return fields
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    """HTTP-обработчик стенда"""
+
+    protocol_version = 'HTTP/1.1'
+    # Заголовки и тело ответа уходят отдельными write: без TCP_NODELAY keep-alive клиент
+    # ждёт delayed ACK (~40 мс) на каждом запросе, чего у настоящих сервисов нет
+    disable_nagle_algorithm = True
+    state = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, data, status=200, headers=None):
+        payload = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _inject_fault(self):
+        """Сымитировать сбой upstream; True, если ответ уже отправлен"""
+        fault = self.state.faults.pick()
+        if fault is None:
+            return False
+        kind, value = fault
+        if kind == 'hang':
+            self.state.count('injected_hangs')
+            # Клиент с корректным таймаутом отвалится раньше; соединение после этого закрываем
+            time.sleep(value)
+            self.close_connection = True
+            self._send_json({'error': {'message': 'Injected upstream hang', 'type': 'timeout'}}, 504)
+            return True
+
+        self.state.count('injected_errors')
+        error_type = 'rate_limit_exceeded' if value == 429 else 'server_error'
+        headers = {'Retry-After': '1'} if value in (429, 503) else None
+        self._send_json({'error': {'message': f'Injected error {value}', 'type': error_type, 'code': error_type}}, value, headers)
+        return True
+
+    def _chat_completion(self, body):
+        request = json.loads(body or b'{}')
+        self.state.count('chat_completions')
+        if self._inject_fault():
+            return
+
+        completion = fake_completion_body(request)
+        token_delay = self.state.token_latency_ms / 1000
+        # Время до первого токена
+        self.state.latency.sleep()
+
+        if not request.get('stream'):
+            time.sleep(token_delay * completion['usage']['completion_tokens'])
+            return self._send_json(completion)
+
+        self.state.count('streamed')
+        include_usage = bool((request.get('stream_options') or {}).get('include_usage'))
+        self.close_connection = True
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        for chunk in fake_stream_chunks(completion, include_usage):
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode('utf-8'))
+            self.wfile.flush()
+            if chunk['choices'] and chunk['choices'][0]['delta'].get('content'):
+                time.sleep(token_delay)
+        self.wfile.write(b'data: [DONE]\n\n')
+        self.wfile.flush()
+
+    def _read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    def do_POST(self):
+        body = self._read_body()
+
+        if self.path == '/v1/chat/completions':
+            return self._chat_completion(body)
+
+        if self.path == '/_fake/config':
+            try:
+                self.state.configure(json.loads(body or b'{}'))
+            except ValueError as e:
+                return self._send_json({'error': {'message': str(e)}}, 400)
+            return self._send_json(self.state.describe())
+
+        if self.path == '/v1/files':
+            fields = parse_multipart(body, self.headers.get('Content-Type', ''))
+            purpose = fields.get('purpose', b'batch').decode('utf-8')
+            file_id = self.state.add_file(fields.get('file', b''), purpose)
+            return self._send_json({'id': file_id, 'object': 'file', 'purpose': purpose, 'bytes': len(fields.get('file', b''))})
+
+        if self.path == '/v1/batches':
+            data = json.loads(body or b'{}')
+            if data.get('input_file_id') not in self.state.files:
+                return self._send_json({'error': {'message': 'input file not found'}}, 404)
+            batch_id = f'batch_{uuid.uuid4().hex[:24]}'
+            batch = {
+                'id': batch_id,
+                'object': 'batch',
+                'endpoint': data.get('endpoint'),
+                'input_file_id': data['input_file_id'],
+                'completion_window': data.get('completion_window'),
+                'metadata': data.get('metadata') or {},
+                'status': 'in_progress',
+                'output_file_id': None,
+                'created_at': int(time.time()),
+                '_ready_at': time.monotonic() + self.state.batch_delay
+            }
+            with self.state.lock:
+                self.state.batches[batch_id] = batch
+            return self._send_json(self._public_batch(batch))
+
+        return self._send_json({'error': {'message': f'Unknown path {self.path}'}}, 404)
+
+    def do_GET(self):
+        if self.path == '/_fake/stats':
+            return self._send_json({'config': self.state.describe(), 'stats': dict(self.state.stats)})
+
+        if self.path == '/v1/models' or self.path.startswith('/v1/models/'):
+            self.state.count('models')
+            self.state.latency.sleep()
+            model_id = self.path[len('/v1/models/'):]
+            if model_id:
+                return self._send_json({'id': model_id, 'object': 'model', 'owned_by': 'fake'})
+            return self._send_json({'object': 'list', 'data': [{'id': 'gpt-4o-mini', 'object': 'model', 'owned_by': 'fake'}]})
+
+        if self.path.startswith('/v1/batches/'):
+            batch = self.state.batches.get(self.path.rsplit('/', 1)[1])
+            if not batch:
+                return self._send_json({'error': {'message': 'batch not found'}}, 404)
+            self._complete_if_ready(batch)
+            return self._send_json(self._public_batch(batch))
+
+        if self.path.startswith('/v1/files/') and self.path.endswith('/content'):
+            file_id = self.path.split('/')[3]
+            stored = self.state.files.get(file_id)
+            if not stored:
+                return self._send_json({'error': {'message': 'file not found'}}, 404)
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/jsonl')
+            self.send_header('Content-Length', str(len(stored['content'])))
+            self.end_headers()
+            self.wfile.write(stored['content'])
+            return
+
+        return self._send_json({'error': {'message': f'Unknown path {self.path}'}}, 404)
+
+    def _complete_if_ready(self, batch):
+        """Выполнить batch, когда истекла задержка"""
+        with self.state.lock:
+            if batch['status'] != 'in_progress' or time.monotonic() < batch['_ready_at']:
+                return
+            input_lines = self.state.files[batch['input_file_id']]['content'].decode('utf-8').splitlines()
+
+        output_lines = []
+        for line in input_lines:
+            if not line.strip():
+                continue
+            request = json.loads(line)
+            output_lines.append(json.dumps({
+                'id': f'batch_req_{uuid.uuid4().hex[:16]}',
+                'custom_id': request['custom_id'],
+                'response': {'status_code': 200, 'body': fake_completion_body(request.get('body') or {})},
+                'error': None
+            }))
+
+        output_file_id = self.state.add_file(('\n'.join(output_lines) + '\n').encode('utf-8'), 'batch_output')
+        with self.state.lock:
+            batch['status'] = 'completed'
+            batch['output_file_id'] = output_file_id
+
+    @staticmethod
+    def _public_batch(batch):
+        return {key: value for key, value in batch.items() if not key.startswith('_')}
+
+
+def make_server(host='127.0.0.1', port=8090, batch_delay=0.0, **options):
+    """Создать (не запуская) сервер стенда; options - параметры FakeOpenAIState (latency, error_rate, ...)"""
+    handler = type('BoundFakeOpenAIHandler', (FakeOpenAIHandler,), {'state': FakeOpenAIState(batch_delay, **options)})
+    return FakeHTTPServer((host, port), handler)
+
+
+def add_fault_arguments(parser):
+    """Общие аргументы задержек и ошибок для локальных стендов"""
+    parser.add_argument('--latency', default='fixed:0', help='latency distribution in ms: fixed:50, uniform:20:200, normal:300:80, lognormal:400:0.5')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of requests answered with an injected error')
+    parser.add_argument('--error-statuses', type=parse_statuses, default=(500,), help='comma-separated statuses to inject, e.g. 429,500,503')
+    parser.add_argument('--hang-rate', type=float, default=0.0, help='share of requests that hang for --hang-seconds')
+    parser.add_argument('--hang-seconds', type=float, default=60.0)
+    parser.add_argument('--seed', type=int, default=None, help='random seed for reproducible latency and faults')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fake OpenAI API server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8090)
+    parser.add_argument('--batch-delay', type=float, default=0.0, help='seconds before a batch completes')
+    parser.add_argument('--token-latency-ms', type=float, default=0.0, help='extra delay per completion token (streamed per chunk)')
+    add_fault_arguments(parser)
+    args = parser.parse_args()
+
+    try:
+        server = make_server(
+            args.host, args.port, args.batch_delay,
+            latency=args.latency, token_latency_ms=args.token_latency_ms, error_rate=args.error_rate,
+            error_statuses=args.error_statuses, hang_rate=args.hang_rate, hang_seconds=args.hang_seconds, seed=args.seed
+        )
+    except ValueError as e:
+        parser.error(str(e))
+    print(f"🧪 Fake OpenAI listening on http://{args.host}:{args.port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,603 @@
+"""Локальный стенд Supabase (PostgREST) с таблицами в памяти для нагрузочных прогонов
+
+Реализует ту часть PostgREST, которой пользуются обработчики:
+- GET/POST/PATCH/DELETE /rest/v1/<таблица> с фильтрами eq, neq, gt, gte, lt, lte, like,
+  ilike, is, in (и not.<оператор>), select, order, limit, offset;
+- upsert: on_conflict и Prefer: resolution=merge-duplicates | ignore-duplicates,
+  конфликт без resolution - 409 (код 23505), как в Postgres;
+- Prefer: return=representation | minimal, count=exact (заголовок Content-Range);
+- RPC из migrations/: record_token_usage, top_token_consumers, take_rate_limit_token,
+  grant_payment_access.
+
+Таблицы заполняются продуктами и синтетическими пользователями (--users, telegram_id 1..N)
+или JSON-файлом {"таблица": [строки]} (--seed-file). Задержки и ошибки задаются так же, как
+у tools/fake_openai.py. Служебные маршруты: GET /_fake/stats, GET /_fake/tables[/<таблица>],
+POST /_fake/reset, POST /_fake/config.
+
+    python tools/fake_supabase.py --port 8091 --users 1000 --latency normal:15:5
+    SUPABASE_URL=http://127.0.0.1:8091 SUPABASE_SERVICE_KEY=test python -m server.app
+"""
+import argparse
+import copy
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qsl
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from tools.fake_openai import FakeHTTPServer, LatencyModel, FaultInjector, add_fault_arguments, parse_statuses
+
+
+# Таблица -> первичный ключ и уникальные ограничения (как в схеме Supabase и migrations/)
+TABLES = {
+    'users': {'primary_key': ['id'], 'unique': [['telegram_id']]},
+    'products': {'primary_key': ['id'], 'unique': []},
+    'payments': {'primary_key': ['id'], 'unique': []},
+    'feedback': {'primary_key': ['id'], 'unique': []},
+    'text_usage_daily': {'primary_key': ['user_id', 'day'], 'unique': []},
+    'greeting_pool': {'primary_key': ['id'], 'unique': [['batch_custom_id']]},
+    'progress_digests': {'primary_key': ['user_id', 'day'], 'unique': []},
+    'token_usage_ledger': {'primary_key': ['day', 'telegram_id', 'mode', 'profile', 'model'], 'unique': []},
+    'rate_limit_buckets': {'primary_key': ['key'], 'unique': []}
+}
+
+# Продукты, на которые ссылаются обработчики (стартовый пакет и пакеты YooMoney)
+PRODUCTS = [
+    {'id': '7d9d5dbb-7ed2-4bdc-9d2f-c88929085ab5', 'name': 'Starter pack', 'duration_days': 3, 'lessons': 3},
+    {'id': '3ec3f495-7257-466b-a0ba-bfac669a68c8', 'name': 'Mini', 'duration_days': 3, 'lessons': 3},
+    {'id': '551f676f-22e7-4c8c-ae7a-c5a8de655438', 'name': '2 weeks', 'duration_days': 14, 'lessons': 10},
+    {'id': 'fe88e77a-7931-410d-8a74-5b0473798c6c', 'name': 'Month', 'duration_days': 30, 'lessons': 30}
+]
+
+RESERVED_PARAMS = {'select', 'order', 'limit', 'offset', 'on_conflict', 'columns'}
+
+
+class PostgrestError(Exception):
+    """Ошибка в формате PostgREST: HTTP-статус и тело {code, message, details, hint}"""
+
+    def __init__(self, status, code, message, details=None):
+        super().__init__(message)
+        self.status = status
+        self.body = {'code': code, 'message': message, 'details': details, 'hint': None}
+
+
+def now_iso():
+    return datetime.now(timezone.utc).isoformat()
+
+
+def make_user(telegram_id):
+    """Синтетический активный пользователь с оплаченным пакетом"""
+    today = datetime.now(timezone.utc).date()
+    return {
+        'id': str(uuid.uuid5(uuid.NAMESPACE_DNS, f'fake-user-{telegram_id}')),
+        'telegram_id': telegram_id,
+        'username': f'user{telegram_id}',
+        'interface_language': 'ru' if telegram_id % 3 else 'en',
+        'current_level': 'Intermediate',
+        'is_active': True,
+        'ai_mode': 'translation',
+        'lessons_left': 10,
+        'total_lessons_completed': telegram_id % 20,
+        'current_streak': telegram_id % 7,
+        'last_lesson_date': (today - timedelta(days=1)).isoformat(),
+        'package_expires_at': (datetime.now(timezone.utc) + timedelta(days=30)).isoformat(),
+        'text_messages_total': 0,
+        'created_at': now_iso()
+    }
+
+
+def parse_prefer(header):
+    """'return=representation,resolution=merge-duplicates' -> {'return': ..., 'resolution': ...}"""
+    prefer = {}
+    for token in (header or '').split(','):
+        name, _, value = token.strip().partition('=')
+        if name:
+            prefer[name] = value
+    return prefer
+
+
+def _coerce(row_value, literal):
+    """Привести литерал фильтра к типу значения в строке"""
+    if isinstance(row_value, bool):
+        return literal.lower() == 'true'
+    if isinstance(row_value, (int, float)):
+        try:
+            return float(literal)
+        except ValueError:
+            return literal
+    return literal
+
+
+def _like_regex(pattern, flags=0):
+    parts = [re.escape(part) for part in re.split(r'[*%]', pattern)]
+    return re.compile('^' + '.*'.join(parts) + '$', flags | re.DOTALL)
+
+
+def _compare(op, row_value, literal):
+    if op == 'is':
+        expected = {'null': None, 'true': True, 'false': False}.get(literal.lower(), 'invalid')
+        if expected == 'invalid':
+            raise PostgrestError(400, 'PGRST100', f'"is" accepts null, true or false, got "{literal}"')
+        return row_value is expected
+    if op == 'in':
+        values = [value.strip().strip('"') for value in literal.strip('()').split(',')]
+        return row_value is not None and any(row_value == _coerce(row_value, value) for value in values)
+    # Сравнение с NULL в SQL не даёт истину
+    if row_value is None:
+        return False
+    if op in ('like', 'ilike'):
+        return bool(_like_regex(literal, re.IGNORECASE if op == 'ilike' else 0).match(str(row_value)))
+
+    value = _coerce(row_value, literal)
+    if isinstance(value, str) and not isinstance(row_value, str):
+        row_value = str(row_value)
+    if op == 'eq':
+        return row_value == value
+    if op == 'neq':
+        return row_value != value
+    if op == 'gt':
+        return row_value > value
+    if op == 'gte':
+        return row_value >= value
+    if op == 'lt':
+        return row_value < value
+    if op == 'lte':
+        return row_value <= value
+    raise PostgrestError(400, 'PGRST100', f'unsupported operator "{op}"')
+
+
+def parse_filters(params):
+    """Фильтры запроса: список (колонка, оператор, значение, отрицание)"""
+    filters = []
+    for column, expression in params:
+        if column in RESERVED_PARAMS:
+            continue
+        negate = expression.startswith('not.')
+        if negate:
+            expression = expression[len('not.'):]
+        op, dot, literal = expression.partition('.')
+        if not dot:
+            raise PostgrestError(400, 'PGRST100', f'failed to parse filter ({column}={expression})')
+        filters.append((column, op, literal, negate))
+    return filters
+
+
+def matches(row, filters):
+    return all(_compare(op, row.get(column), literal) != negate for column, op, literal, negate in filters)
+
+
+def apply_order(rows, order):
+    """order=col.asc,col2.desc.nullsfirst (по умолчанию NULL в конце для asc и в начале для desc)"""
+    for term in reversed([term for term in order.split(',') if term]):
+        column, *modifiers = term.split('.')
+        descending = 'desc' in modifiers
+        nulls_first = 'nullsfirst' in modifiers or (descending and 'nullslast' not in modifiers)
+        present = [row for row in rows if row.get(column) is not None]
+        missing = [row for row in rows if row.get(column) is None]
+        present.sort(key=lambda row: row[column], reverse=descending)
+        rows = missing + present if nulls_first else present + missing
+    return rows
+
+
+def project(row, select):
+    if not select or select == '*':
+        return dict(row)
+    return {column: row.get(column) for column in (part.strip() for part in select.split(',')) if column}
+
+
+def _resolve_defaults(values):
+    """'now()' в данных обработчиков -> текущее время, как его сохранит Postgres"""
+    return {key: now_iso() if value == 'now()' else value for key, value in values.items()}
+
+
+class FakeSupabaseState:
+    """Таблицы в памяти, настройки задержек/ошибок и счётчики запросов"""
+
+    def __init__(self, latency='fixed:0', error_rate=0.0, error_statuses=(500,), hang_rate=0.0,
+                 hang_seconds=60.0, seed=None, users=0, seed_file=None):
+        self.rng = random.Random(seed)
+        self.latency = LatencyModel(latency, self.rng)
+        self.faults = FaultInjector(error_rate, error_statuses, hang_rate, hang_seconds, self.rng)
+        self.lock = threading.RLock()
+        self.stats = {}
+        self.tables = {}
+        self.reset(users, seed_file)
+
+    def reset(self, users=0, seed_file=None):
+        """Пересоздать таблицы: продукты, N синтетических пользователей и данные из файла"""
+        with self.lock:
+            self.tables = {name: [] for name in TABLES}
+            self.tables['products'] = copy.deepcopy(PRODUCTS)
+            self.tables['users'] = [make_user(telegram_id) for telegram_id in range(1, users + 1)]
+            if seed_file:
+                with open(seed_file) as f:
+                    for name, rows in json.load(f).items():
+                        self.tables.setdefault(name, []).extend(rows)
+            self.stats = {}
+
+    def configure(self, config):
+        with self.lock:
+            if 'latency' in config:
+                self.latency = LatencyModel(config['latency'], self.rng)
+            if 'error_rate' in config:
+                self.faults.error_rate = float(config['error_rate'])
+            if 'error_statuses' in config:
+                self.faults.error_statuses = parse_statuses(config['error_statuses'])
+            if 'hang_rate' in config:
+                self.faults.hang_rate = float(config['hang_rate'])
+            if 'hang_seconds' in config:
+                self.faults.hang_seconds = float(config['hang_seconds'])
+
+    def describe(self):
+        return {
+            'latency': self.latency.spec,
+            'error_rate': self.faults.error_rate,
+            'error_statuses': list(self.faults.error_statuses),
+            'hang_rate': self.faults.hang_rate,
+            'hang_seconds': self.faults.hang_seconds,
+            'rows': {name: len(rows) for name, rows in self.tables.items()}
+        }
+
+    def count(self, key):
+        with self.lock:
+            self.stats[key] = self.stats.get(key, 0) + 1
+
+    def table(self, name):
+        if name not in self.tables:
+            raise PostgrestError(404, '42P01', f'relation "public.{name}" does not exist')
+        return self.tables[name]
+
+    # --- Операции с таблицами ---
+
+    def select(self, name, params):
+        filters = parse_filters(params)
+        query = dict(params)
+        with self.lock:
+            rows = [row for row in self.table(name) if matches(row, filters)]
+            rows = apply_order(rows, query.get('order', ''))
+            total = len(rows)
+            offset = int(query.get('offset') or 0)
+            limit = query.get('limit')
+            rows = rows[offset:offset + int(limit)] if limit is not None else rows[offset:]
+            return [project(row, query.get('select')) for row in rows], total, offset
+
+    def insert(self, name, params, payload, prefer):
+        """INSERT / upsert; возвращает вставленные или обновлённые строки"""
+        query = dict(params)
+        schema = TABLES.get(name, {'primary_key': ['id'], 'unique': []})
+        conflict_columns = [column.strip() for column in query['on_conflict'].split(',')] if query.get('on_conflict') else schema['primary_key']
+        resolution = prefer.get('resolution')
+        rows = payload if isinstance(payload, list) else [payload]
+        result = []
+
+        with self.lock:
+            table = self.table(name)
+            for values in rows:
+                row = _resolve_defaults(values)
+                if 'id' in schema['primary_key'] and 'id' not in row:
+                    row['id'] = str(uuid.uuid4())
+
+                existing = self._find(table, conflict_columns, row)
+                if existing is not None:
+                    if resolution == 'merge-duplicates':
+                        existing.update(row)
+                        result.append(existing)
+                        continue
+                    if resolution == 'ignore-duplicates':
+                        continue
+                    raise PostgrestError(409, '23505', f'duplicate key value violates unique constraint "{name}_pkey"',
+                                         f"Key ({', '.join(conflict_columns)}) already exists.")
+
+                for unique_columns in schema['unique']:
+                    if self._find(table, unique_columns, row) is not None:
+                        raise PostgrestError(409, '23505', f"duplicate key value violates unique constraint \"{name}_{'_'.join(unique_columns)}_key\"",
+                                             f"Key ({', '.join(unique_columns)}) already exists.")
+                row.setdefault('created_at', now_iso())
+                table.append(row)
+                result.append(row)
+            return [dict(row) for row in result]
+
+    @staticmethod
+    def _find(table, columns, row):
+        if not all(column in row for column in columns):
+            return None
+        for existing in table:
+            if all(existing.get(column) == row[column] for column in columns):
+                return existing
+        return None
+
+    def update(self, name, params, values):
+        filters = parse_filters(params)
+        values = _resolve_defaults(values)
+        with self.lock:
+            updated = [row for row in self.table(name) if matches(row, filters)]
+            for row in updated:
+                row.update(values)
+            return [dict(row) for row in updated]
+
+    def delete(self, name, params):
+        filters = parse_filters(params)
+        with self.lock:
+            table = self.table(name)
+            deleted = [row for row in table if matches(row, filters)]
+            self.tables[name] = [row for row in table if not matches(row, filters)]
+            return deleted
+
+    # --- RPC из migrations/ ---
+
+    def rpc(self, function, args):
+        handler = RPC_FUNCTIONS.get(function)
+        if handler is None:
+            raise PostgrestError(404, 'PGRST202', f'Could not find the function public.{function} in the schema cache')
+        with self.lock:
+            return handler(self, **args)
+
+
+def rpc_record_token_usage(state, entries):
+    """migrations/002: пакетный инкремент token_usage_ledger"""
+    table = state.tables['token_usage_ledger']
+    key_columns = TABLES['token_usage_ledger']['primary_key']
+    for entry in entries:
+        row = {column: entry.get(column) for column in key_columns}
+        existing = state._find(table, key_columns, row)
+        if existing is None:
+            existing = {**row, 'requests': 0, 'prompt_tokens': 0, 'completion_tokens': 0}
+            table.append(existing)
+        for counter in ('requests', 'prompt_tokens', 'completion_tokens'):
+            existing[counter] += int(entry.get(counter) or 0)
+        existing['updated_at'] = now_iso()
+    return len(entries)
+
+
+def rpc_top_token_consumers(state, p_group_by='user', p_days=7, p_limit=20):
+    """migrations/002: самые дорогие пользователи или промпты за N дней"""
+    since = (datetime.now(timezone.utc).date() - timedelta(days=p_days)).isoformat()
+    totals = {}
+    for row in state.tables['token_usage_ledger']:
+        if row['day'] < since:
+            continue
+        key = f"{row['mode']}/{row['profile']}" if p_group_by == 'prompt' else row['telegram_id']
+        total = totals.setdefault(key, {'key': key, 'requests': 0, 'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0})
+        total['requests'] += row['requests']
+        total['prompt_tokens'] += row['prompt_tokens']
+        total['completion_tokens'] += row['completion_tokens']
+        total['total_tokens'] += row['prompt_tokens'] + row['completion_tokens']
+    return sorted(totals.values(), key=lambda total: total['total_tokens'], reverse=True)[:p_limit]
+
+
+def rpc_take_rate_limit_token(state, p_key, p_burst, p_refill_per_sec):
+    """migrations/003: пополнить корзину и списать один токен"""
+    table = state.tables['rate_limit_buckets']
+    now = time.time()
+    bucket = state._find(table, ['key'], {'key': p_key})
+    if bucket is None:
+        bucket = {'key': p_key, 'tokens': float(p_burst), 'updated_at': now}
+        table.append(bucket)
+    tokens = min(p_burst, bucket['tokens'] + (now - bucket['updated_at']) * p_refill_per_sec)
+    bucket['updated_at'] = now
+    if tokens >= 1:
+        bucket['tokens'] = tokens - 1
+        return [{'allowed': True, 'retry_after': 0.0}]
+    bucket['tokens'] = tokens
+    retry_after = (1 - tokens) / p_refill_per_sec if p_refill_per_sec > 0 else 3600.0
+    return [{'allowed': False, 'retry_after': retry_after}]
+
+
+def rpc_grant_payment_access(state, p_payment_id, p_user_id, p_product_id, p_amount, p_provider_operation_id,
+                             p_label, p_raw, p_days, p_lessons):
+    """migrations/004: записать оплату и в той же транзакции продлить пакет и начислить уроки"""
+    user = state._find(state.tables['users'], ['id'], {'id': p_user_id})
+    if user is None:
+        raise PostgrestError(400, 'P0001', f'grant_payment_access: user {p_user_id} not found')
+    payment = state._find(state.tables['payments'], ['id'], {'id': p_payment_id})
+    if payment is not None and payment.get('status') == 'paid':
+        return [{'granted': False, 'package_expires_at': user.get('package_expires_at'), 'lessons_left': user.get('lessons_left')}]
+
+    values = {
+        'id': p_payment_id, 'user_id': p_user_id, 'product_id': p_product_id, 'amount': p_amount, 'status': 'paid',
+        'provider': 'yoomoney', 'provider_operation_id': p_provider_operation_id, 'label': p_label, 'raw': p_raw
+    }
+    if payment is None:
+        state.tables['payments'].append({**values, 'created_at': now_iso()})
+    else:
+        payment.update(values)
+    now = datetime.now(timezone.utc)
+    current = datetime.fromisoformat(user['package_expires_at']) if user.get('package_expires_at') else now
+    user['package_expires_at'] = (max(current, now) + timedelta(days=p_days)).isoformat()
+    user['lessons_left'] = (user.get('lessons_left') or 0) + p_lessons
+    return [{'granted': True, 'package_expires_at': user['package_expires_at'], 'lessons_left': user['lessons_left']}]
+
+
+RPC_FUNCTIONS = {
+    'record_token_usage': rpc_record_token_usage,
+    'top_token_consumers': rpc_top_token_consumers,
+    'take_rate_limit_token': rpc_take_rate_limit_token,
+    'grant_payment_access': rpc_grant_payment_access
+}
+
+
+class FakeSupabaseHandler(BaseHTTPRequestHandler):
+    """HTTP-обработчик стенда PostgREST"""
+
+    protocol_version = 'HTTP/1.1'
+    # Заголовки и тело ответа уходят отдельными write: без TCP_NODELAY keep-alive клиент
+    # ждёт delayed ACK (~40 мс) на каждом запросе, чего у настоящих сервисов нет
+    disable_nagle_algorithm = True
+    state = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, data, status=200, headers=None):
+        payload = json.dumps(data, default=str).encode('utf-8') if data is not None else b''
+        self.send_response(status)
+        if payload:
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _read_json(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        try:
+            return json.loads(body) if body else None
+        except ValueError:
+            raise PostgrestError(400, 'PGRST102', 'Empty or invalid json')
+
+    def _control(self, method, path):
+        """Служебные маршруты /_fake/*"""
+        if method == 'GET' and path == '/_fake/stats':
+            return self._send_json({'config': self.state.describe(), 'requests': dict(self.state.stats)})
+        if method == 'GET' and path.startswith('/_fake/tables'):
+            name = path[len('/_fake/tables'):].strip('/')
+            with self.state.lock:
+                return self._send_json(self.state.table(name) if name else self.state.tables)
+        if method == 'POST' and path == '/_fake/reset':
+            options = self._read_json() or {}
+            self.state.reset(int(options.get('users', 0)), options.get('seed_file'))
+            return self._send_json(self.state.describe())
+        if method == 'POST' and path == '/_fake/config':
+            try:
+                self.state.configure(self._read_json() or {})
+            except ValueError as e:
+                return self._send_json({'message': str(e)}, 400)
+            return self._send_json(self.state.describe())
+        return self._send_json({'message': f'Unknown control path {path}'}, 404)
+
+    def _inject_fault(self):
+        fault = self.state.faults.pick()
+        if fault is None:
+            return False
+        kind, value = fault
+        if kind == 'hang':
+            self.state.count('injected_hangs')
+            time.sleep(value)
+            self.close_connection = True
+            self._send_json({'code': 'PGRST000', 'message': 'Injected upstream hang'}, 504)
+            return True
+        self.state.count('injected_errors')
+        headers = {'Retry-After': '1'} if value in (429, 503) else None
+        self._send_json({'code': 'PGRST000', 'message': f'Injected error {value}', 'details': None, 'hint': None}, value, headers)
+        return True
+
+    def _handle(self, method):
+        url = urlsplit(self.path)
+        if url.path.startswith('/_fake/'):
+            try:
+                return self._control(method, url.path)
+            except PostgrestError as e:
+                return self._send_json(e.body, e.status)
+
+        if not url.path.startswith('/rest/v1/'):
+            return self._send_json({'message': f'Unknown path {url.path}'}, 404)
+        if not self.headers.get('apikey'):
+            return self._send_json({'message': 'No API key found in request', 'hint': 'No `apikey` request header or url param was found.'}, 401)
+
+        resource = url.path[len('/rest/v1/'):].strip('/')
+        params = parse_qsl(url.query, keep_blank_values=True)
+        prefer = parse_prefer(self.headers.get('Prefer'))
+        self.state.count(f'{method} {resource}')
+
+        try:
+            # Тело читаем до инъекции сбоя, чтобы не сломать keep-alive соединение
+            payload = self._read_json() if method in ('POST', 'PATCH') else None
+            if self._inject_fault():
+                return
+            self.state.latency.sleep()
+
+            if resource.startswith('rpc/'):
+                return self._send_json(self.state.rpc(resource[len('rpc/'):], payload or {}))
+
+            if method == 'GET':
+                rows, total, offset = self.state.select(resource, params)
+                headers = {}
+                if prefer.get('count') == 'exact':
+                    headers['Content-Range'] = f"{offset}-{offset + len(rows) - 1}/{total}" if rows else f"*/{total}"
+                if 'vnd.pgrst.object' in (self.headers.get('Accept') or ''):
+                    if len(rows) != 1:
+                        raise PostgrestError(406, 'PGRST116', 'JSON object requested, multiple (or no) rows returned',
+                                             f'The result contains {len(rows)} rows')
+                    return self._send_json(rows[0], 200, headers)
+                return self._send_json(rows, 200, headers)
+
+            if method == 'POST':
+                if payload is None:
+                    raise PostgrestError(400, 'PGRST102', 'Empty or invalid json')
+                rows = self.state.insert(resource, params, payload, prefer)
+                return self._send_json(rows if prefer.get('return') == 'representation' else None, 201)
+
+            if method == 'PATCH':
+                rows = self.state.update(resource, params, payload or {})
+                if prefer.get('return') == 'representation':
+                    return self._send_json(rows, 200)
+                return self._send_json(None, 204)
+
+            if method == 'DELETE':
+                rows = self.state.delete(resource, params)
+                if prefer.get('return') == 'representation':
+                    return self._send_json(rows, 200)
+                return self._send_json(None, 204)
+
+            return self._send_json({'message': f'Method {method} not allowed'}, 405)
+        except PostgrestError as e:
+            return self._send_json(e.body, e.status)
+        except (TypeError, ValueError) as e:
+            return self._send_json({'code': 'PGRST100', 'message': str(e), 'details': None, 'hint': None}, 400)
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def do_PATCH(self):
+        self._handle('PATCH')
+
+    def do_DELETE(self):
+        self._handle('DELETE')
+
+
+def make_server(host='127.0.0.1', port=8091, **options):
+    """Создать (не запуская) сервер стенда; options - параметры FakeSupabaseState (users, latency, ...)"""
+    handler = type('BoundFakeSupabaseHandler', (FakeSupabaseHandler,), {'state': FakeSupabaseState(**options)})
+    return FakeHTTPServer((host, port), handler)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fake Supabase (PostgREST) server with in-memory tables')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8091)
+    parser.add_argument('--users', type=int, default=100, help='synthetic users with telegram_id 1..N')
+    parser.add_argument('--seed-file', help='JSON file {"table": [rows]} loaded on start and on reset')
+    add_fault_arguments(parser)
+    args = parser.parse_args()
+
+    try:
+        server = make_server(
+            args.host, args.port, users=args.users, seed_file=args.seed_file,
+            latency=args.latency, error_rate=args.error_rate, error_statuses=args.error_statuses,
+            hang_rate=args.hang_rate, hang_seconds=args.hang_seconds, seed=args.seed
+        )
+    except ValueError as e:
+        parser.error(str(e))
+    print(f"🧪 Fake Supabase listening on http://{args.host}:{args.port} ({args.users} users)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,421 @@
+"""Бюджет промптов в токенах: регрессионный набор для системных промптов всех Lambda
+
+Каждый вариант промпта собирается тем же кодом, что и в проде: обработчики grammar,
+text_dialog, audio_dialog и translation вызываются напрямую, а get_routed_response
+подменяется перехватчиком, который записывает (системный промпт, сообщение пользователя)
+и сразу возвращает ответ. Промпты shared Lambda берутся из SYSTEM_PROMPTS. Варианты
+перебираются по уровню, языку фидбэка и длине истории диалога.
+
+Токены считаются офлайн: если установлен tiktoken с закэшированной кодировкой, то им,
+иначе встроенным приближённым токенизатором (разбиение как у cl100k/o200k + оценка длины
+слов). Базовая линия хранит имя токенизатора - сравнивать можно только одинаковые.
+
+    python tools/prompt_budget.py                     # сравнить с базовой линией, код 1 при регрессии
+    python tools/prompt_budget.py --update-baseline   # записать новую базовую линию
+    python tools/prompt_budget.py --show text_dialog  # вывести собранные промпты
+"""
+import argparse
+import importlib.util
+import json
+import math
+import os
+import re
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+# Без Supabase и без лимитов: обработчики доходят до вызова модели и ничего не пишут
+for _name in ('SUPABASE_URL', 'SUPABASE_SERVICE_KEY', 'SUPABASE_KEY'):
+    os.environ.pop(_name, None)
+os.environ['RATE_LIMIT_ENABLED'] = 'false'
+os.environ['ADMISSION_CONTROL_ENABLED'] = 'false'
+
+
+DEFAULT_BASELINE = os.path.join(BACKEND_DIR, 'tools', 'benchmarks', 'prompt_token_baseline.json')
+
+# Допустимый рост: относительный и абсолютный (мелкие правки формулировок)
+DEFAULT_TOLERANCE = 0.03
+DEFAULT_SLACK_TOKENS = 8
+
+# Накладные расходы chat-формата на сообщение и на праймер ответа ассистента
+TOKENS_PER_MESSAGE = 3
+TOKENS_REPLY_PRIMING = 3
+
+LEVELS = ['Beginner', 'Intermediate', 'Advanced']
+FEEDBACK_LANGUAGES = ['ru', 'en']
+# Воркер хранит до 10 сообщений истории, промпт берёт последние 4
+HISTORY_LENGTHS = [0, 2, 4, 10]
+
+SAMPLE_USER_TEXT = 'Yesterday I have went to the cinema with my friends and we watched a very interesting film.'
+SAMPLE_GRAMMAR_QUESTION = 'When should I use present perfect instead of past simple?'
+SAMPLE_TRANSLATION_TEXT = 'Could you tell me how to get to the nearest train station, please?'
+SAMPLE_BOT_REPLY = (
+    '*Feedback:* Good sentence! Small tip: say "I went" instead of "I have went".\n\n---SPLIT---\n\n'
+    'That sounds like a fun evening! What kind of films do you usually enjoy?\n\n'
+    '||Звучит как весёлый вечер! Какие фильмы вам обычно нравятся?||'
+)
+SAMPLE_GRAMMAR_ANSWER = (
+    '🔹 *Rule*\nUse present perfect for past actions connected to now; use past simple for finished time.\n\n'
+    '🔹 *Form*\nhave/has + V3: I have seen. Past simple: V2: I saw.'
+)
+SHARED_MESSAGES = {
+    'translation': SAMPLE_TRANSLATION_TEXT,
+    'grammar': SAMPLE_GRAMMAR_QUESTION,
+    'text_dialog': SAMPLE_USER_TEXT,
+    'audio_dialog': SAMPLE_USER_TEXT,
+    'general': 'What is the difference between "make" and "do"?'
+}
+
+
+# --- Токенизатор -------------------------------------------------------------
+
+# Пре-токенизация в духе cl100k/o200k (без \p{..}: буквы - [^\W\d_])
+PRETOKEN_PATTERN = re.compile(
+    r"'(?:[sdmt]|ll|ve|re)|[^\r\n\w]?[^\W\d_]+|\d{1,3}| ?[^\s\w]+[\r\n]*|\s*[\r\n]+|\s+(?!\S)|\s+",
+    re.IGNORECASE
+)
+
+
+def approx_piece_tokens(piece):
+    """Оценка числа BPE-токенов в одном фрагменте пре-токенизации"""
+    word = piece.strip()
+    if not word:
+        return 1
+    if word.isascii():
+        if word.isalpha():
+            # Частые английские слова - один токен, длинные режутся на куски ~6 символов
+            return 1 if len(word) <= 8 else math.ceil(len(word) / 6)
+        if word.isdigit():
+            return 1
+        # Пунктуация и разметка (**, ---, ||) склеиваются в токены по 2-3 символа
+        return math.ceil(len(word) / 3)
+    if word.isalpha():
+        # Кириллица и прочие алфавиты: ~3 символа на токен
+        return math.ceil(len(word) / 3)
+    # Эмодзи и прочие символы - по токену на символ
+    return len(word)
+
+
+class ApproxTokenizer:
+    """Детерминированная офлайн-оценка токенов без файлов словаря BPE"""
+
+    name = 'approx-v1'
+
+    def count(self, text):
+        return sum(approx_piece_tokens(piece) for piece in PRETOKEN_PATTERN.findall(text))
+
+
+class TiktokenTokenizer:
+    """Точный подсчёт через tiktoken (кодировка должна быть уже в локальном кэше)"""
+
+    def __init__(self, encoding_name):
+        import tiktoken
+        self.encoding = tiktoken.get_encoding(encoding_name)
+        self.name = f'tiktoken-{encoding_name}'
+
+    def count(self, text):
+        return len(self.encoding.encode(text, disallowed_special=()))
+
+
+def get_tokenizer(kind='auto', encoding_name='o200k_base'):
+    """approx, tiktoken или auto (tiktoken, если доступен офлайн)"""
+    if kind == 'approx':
+        return ApproxTokenizer()
+    try:
+        return TiktokenTokenizer(encoding_name)
+    except Exception as e:
+        if kind == 'tiktoken':
+            raise
+        print(f"ℹ️ tiktoken unavailable ({type(e).__name__}), using approximate tokenizer")
+        return ApproxTokenizer()
+
+
+def count_request_tokens(tokenizer, messages):
+    """Токены запроса chat/completions: содержимое + служебная разметка сообщений"""
+    return sum(tokenizer.count(m['content']) + TOKENS_PER_MESSAGE for m in messages) + TOKENS_REPLY_PRIMING
+
+
+# --- Сборка вариантов промптов -----------------------------------------------
+
+def load_lambda_module(name):
+    """Загрузить lambda_function.py Lambda так же, как server.app (модуль <name>_lambda_function)"""
+    module_name = f'{name}_lambda_function'
+    if module_name in sys.modules:
+        return sys.modules[module_name]
+    spec = importlib.util.spec_from_file_location(module_name, os.path.join(BACKEND_DIR, name, 'lambda_function.py'))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+class PromptRecorder:
+    """Подмена get_routed_response: запоминает последний запрос и отвечает заготовкой"""
+
+    def __init__(self):
+        self.calls = []
+        self.reply = 'OK'
+
+    def __call__(self, profile, message, system_prompt, **kwargs):
+        self.calls.append({'profile': profile, 'system': system_prompt, 'user': message})
+        return {'success': True, 'reply': self.reply}
+
+    def take(self, handler, body, reply='OK'):
+        """Вызвать обработчик и вернуть записанные вызовы модели и ответ обработчика"""
+        self.calls = []
+        self.reply = reply
+        response = handler(body)
+        return self.calls, response
+
+
+def make_history(length):
+    """История как у воркера: чередование 'User: ...' и полных ответов бота"""
+    history = []
+    for i in range(length):
+        history.append(f'User: {SAMPLE_USER_TEXT}' if i % 2 == 0 else SAMPLE_BOT_REPLY)
+    return history
+
+
+def patched(module, recorder):
+    module.get_routed_response = recorder
+    return module
+
+
+def variant(lambda_name, name, call, params):
+    return {
+        'lambda': lambda_name,
+        'variant': name,
+        'profile': call['profile'],
+        'params': params,
+        'messages': [
+            {'role': 'system', 'content': call['system']},
+            {'role': 'user', 'content': call['user']}
+        ]
+    }
+
+
+def render_shared():
+    from shared.actions.process_text_message import SYSTEM_PROMPTS
+    from shared.prompts import build_audio_greeting_prompt
+
+    variants = []
+    for mode, prompt in SYSTEM_PROMPTS.items():
+        call = {'profile': 'text_message', 'system': prompt, 'user': SHARED_MESSAGES.get(mode, SHARED_MESSAGES['general'])}
+        variants.append(variant('shared', f'mode={mode}', call, {'mode': mode}))
+    for level in LEVELS:
+        call = {'profile': 'audio_greeting', 'system': SYSTEM_PROMPTS['audio_dialog'], 'user': build_audio_greeting_prompt(level)}
+        variants.append(variant('shared', f'audio_greeting/level={level}', call, {'level': level}))
+    return variants
+
+
+def render_translation(recorder):
+    module = patched(load_lambda_module('translation'), recorder)
+    calls, _ = recorder.take(module.handle_translate, {'text': SAMPLE_TRANSLATION_TEXT, 'user_id': 1})
+    return [variant('translation', 'translate', calls[0], {})]
+
+
+def render_grammar(recorder):
+    module = patched(load_lambda_module('grammar'), recorder)
+    variants = []
+
+    calls, _ = recorder.take(module.handle_grammar_check, {'text': SAMPLE_GRAMMAR_QUESTION, 'user_id': 1, 'progressive': False})
+    variants.append(variant('grammar', 'check', calls[0], {}))
+
+    calls, response = recorder.take(module.handle_grammar_check,
+                                    {'text': SAMPLE_GRAMMAR_QUESTION, 'user_id': 1, 'progressive': True},
+                                    reply=f'{SAMPLE_GRAMMAR_ANSWER}\n{module.MORE_MARKER}')
+    variants.append(variant('grammar', 'progressive', calls[0], {}))
+
+    question_id = json.loads(response['body'])['question_id']
+    for group in range(1, len(module.GRAMMAR_SECTION_GROUPS)):
+        calls, _ = recorder.take(module.handle_grammar_more, {'question_id': question_id, 'user_id': 1},
+                                 reply=f'{SAMPLE_GRAMMAR_ANSWER}\n{module.MORE_MARKER}')
+        variants.append(variant('grammar', f'more/group={group}', calls[0], {'group': group}))
+    return variants
+
+
+def render_text_dialog(recorder):
+    module = patched(load_lambda_module('text_dialog'), recorder)
+    variants = []
+    for level in LEVELS:
+        for length in HISTORY_LENGTHS:
+            body = {'text': SAMPLE_USER_TEXT, 'user_id': 1, 'user_level': level,
+                    'dialog_count': length // 2 + 1, 'previous_messages': make_history(length)}
+            calls, _ = recorder.take(module.handle_text_dialog, body)
+            variants.append(variant('text_dialog', f'dialog/level={level}/history={length}', calls[0],
+                                    {'level': level, 'history': length}))
+    for lang in FEEDBACK_LANGUAGES:
+        calls, _ = recorder.take(module.handle_generate_feedback, {'user_id': 1, 'user_lang': lang})
+        variants.append(variant('text_dialog', f'feedback/lang={lang}', calls[0], {'lang': lang}))
+    return variants
+
+
+def render_audio_dialog(recorder):
+    module = patched(load_lambda_module('audio_dialog'), recorder)
+    variants = []
+    for level in LEVELS:
+        calls, _ = recorder.take(module.handle_generate_greeting, {'user_id': 1, 'user_level': level})
+        variants.append(variant('audio_dialog', f'greeting/level={level}', calls[0], {'level': level}))
+    for level in LEVELS:
+        for length in HISTORY_LENGTHS:
+            body = {'user_text': SAMPLE_USER_TEXT, 'user_id': 1, 'user_level': level, 'previous_messages': make_history(length)}
+            calls, _ = recorder.take(module.handle_generate_response, body)
+            variants.append(variant('audio_dialog', f'response/level={level}/history={length}', calls[0],
+                                    {'level': level, 'history': length}))
+    for lang in FEEDBACK_LANGUAGES:
+        calls, _ = recorder.take(module.handle_generate_feedback, {'user_id': 1, 'user_lang': lang})
+        variants.append(variant('audio_dialog', f'feedback/lang={lang}', calls[0], {'lang': lang}))
+    return variants
+
+
+RENDERERS = {
+    'shared': lambda recorder: render_shared(),
+    'translation': render_translation,
+    'grammar': render_grammar,
+    'text_dialog': render_text_dialog,
+    'audio_dialog': render_audio_dialog
+}
+
+
+def render_all(lambdas):
+    """Собрать все варианты промптов выбранных Lambda (вывод обработчиков подавлен)"""
+    recorder = PromptRecorder()
+    variants = []
+    stdout = sys.stdout
+    with open(os.devnull, 'w') as devnull:
+        for name in lambdas:
+            sys.stdout = devnull
+            try:
+                variants.extend(RENDERERS[name](recorder))
+            finally:
+                sys.stdout = stdout
+    return variants
+
+
+def measure(variants, tokenizer):
+    """Ключ варианта -> токены системного промпта, сообщения пользователя и всего запроса"""
+    results = {}
+    for v in variants:
+        system, user = v['messages']
+        results[f"{v['lambda']}/{v['variant']}"] = {
+            'system_tokens': tokenizer.count(system['content']),
+            'user_tokens': tokenizer.count(user['content']),
+            'request_tokens': count_request_tokens(tokenizer, v['messages']),
+            'system_chars': len(system['content'])
+        }
+    return results
+
+
+# --- Базовая линия -----------------------------------------------------------
+
+def compare(results, baseline, tolerance, slack_tokens):
+    """Список регрессий request_tokens/system_tokens относительно базовой линии"""
+    regressions = []
+    for key, current in sorted(results.items()):
+        base = baseline.get('variants', {}).get(key)
+        if not base:
+            continue
+        for metric in ('system_tokens', 'request_tokens'):
+            limit = max(base[metric] * (1 + tolerance), base[metric] + slack_tokens)
+            if current[metric] > limit:
+                regressions.append(f"{key}: {metric} {base[metric]} -> {current[metric]} "
+                                   f"(+{current[metric] - base[metric]}, limit {limit:.0f})")
+    return regressions
+
+
+def print_report(results, baseline):
+    base_variants = baseline.get('variants', {}) if baseline else {}
+    print(f"{'variant':<52}{'system':>8}{'user':>7}{'request':>9}{'Δ':>7}")
+    totals = {}
+    for key, r in sorted(results.items()):
+        base = base_variants.get(key)
+        delta = f"{r['request_tokens'] - base['request_tokens']:+d}" if base else 'new'
+        print(f"{key:<52}{r['system_tokens']:>8}{r['user_tokens']:>7}{r['request_tokens']:>9}{delta:>7}")
+        lambda_name = key.split('/', 1)[0]
+        totals[lambda_name] = max(totals.get(lambda_name, 0), r['request_tokens'])
+    print('\nLargest request per Lambda: ' + ', '.join(f'{name} {tokens}' for name, tokens in sorted(totals.items())))
+    for key in sorted(set(base_variants) - set(results)):
+        print(f"⚠️ {key}: in baseline but no longer rendered")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Prompt token budget regression suite')
+    parser.add_argument('lambdas', nargs='*', help=f"default: all ({', '.join(RENDERERS)})")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--update-baseline', action='store_true', help='Write current counts as the new baseline')
+    parser.add_argument('--tokenizer', choices=['auto', 'approx', 'tiktoken'], default='auto')
+    parser.add_argument('--encoding', default='o200k_base', help='tiktoken encoding (gpt-4o family: o200k_base)')
+    parser.add_argument('--tolerance', type=float, default=None, help='Allowed relative growth')
+    parser.add_argument('--slack-tokens', type=int, default=None, help='Allowed absolute growth in tokens')
+    parser.add_argument('--show', metavar='PREFIX', help='Print rendered prompts whose key starts with PREFIX')
+    parser.add_argument('--output', help='Write JSON report to file')
+    args = parser.parse_args()
+
+    unknown = [name for name in args.lambdas if name not in RENDERERS]
+    if unknown:
+        parser.error(f"unknown Lambda(s): {', '.join(unknown)}")
+
+    lambdas = args.lambdas or list(RENDERERS)
+    tokenizer = get_tokenizer(args.tokenizer, args.encoding)
+    variants = render_all(lambdas)
+    results = measure(variants, tokenizer)
+
+    if args.show:
+        for v in variants:
+            key = f"{v['lambda']}/{v['variant']}"
+            if key.startswith(args.show):
+                print(f"===== {key} [{v['profile']}]")
+                for message in v['messages']:
+                    print(f"--- {message['role']}\n{message['content']}")
+        return 0
+
+    baseline = None
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+
+    if args.update_baseline:
+        merged = dict(baseline.get('variants', {})) if baseline and baseline.get('tokenizer') == tokenizer.name and args.lambdas else {}
+        merged.update(results)
+        data = {
+            'tokenizer': tokenizer.name,
+            'tolerance': args.tolerance if args.tolerance is not None else (baseline or {}).get('tolerance', DEFAULT_TOLERANCE),
+            'slack_tokens': args.slack_tokens if args.slack_tokens is not None else (baseline or {}).get('slack_tokens', DEFAULT_SLACK_TOKENS),
+            'variants': dict(sorted(merged.items()))
+        }
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=2, ensure_ascii=False)
+            f.write('\n')
+        print_report(results, None)
+        print(f"\n✅ Baseline written to {args.baseline} ({len(results)} variants, {tokenizer.name})")
+        return 0
+
+    print_report(results, baseline)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'tokenizer': tokenizer.name, 'variants': results}, f, indent=2, ensure_ascii=False)
+
+    if not baseline:
+        print(f"\n⚠️ No baseline at {args.baseline}, run with --update-baseline")
+        return 0
+    if baseline.get('tokenizer') != tokenizer.name:
+        print(f"\n⚠️ Baseline was recorded with {baseline.get('tokenizer')}, current tokenizer is {tokenizer.name}; "
+              f"rerun with --tokenizer matching the baseline or update it")
+        return 2
+
+    tolerance = args.tolerance if args.tolerance is not None else baseline.get('tolerance', DEFAULT_TOLERANCE)
+    slack_tokens = args.slack_tokens if args.slack_tokens is not None else baseline.get('slack_tokens', DEFAULT_SLACK_TOKENS)
+    regressions = compare(results, baseline, tolerance, slack_tokens)
+    if regressions:
+        print(f"\n❌ {len(regressions)} prompt token regressions (tolerance {tolerance:.0%}, slack {slack_tokens} tokens):")
+        for line in regressions:
+            print(f"  {line}")
+        return 1
+    print(f"\n✅ No prompt token regressions ({len(results)} variants, {tokenizer.name})")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,455 @@
+"""Воспроизведение потока событий через обработчики Lambda с отчётом по перцентилям
+
+Поток событий - JSONL: по строке на событие, либо {"lambda": ..., "event": {...}}, либо
+просто Lambda-событие (как telegram-bot/test-payload.json) - Lambda тогда определяется
+по действию в теле, form-urlencoded тело уходит в payments. Синтетический поток
+(--synthetic N) собирается из типичной смеси действий бота по пользователям 1..--users.
+
+События выполняются в --concurrency потоках: в процессе через lambda_handler каждой
+Lambda (как в server/app.py) или по HTTP против запущенного сервера (--target).
+С --rate события подаются с фиксированной частотой, и задержка считается от момента
+плановой подачи, чтобы очередь перед обработчиками попадала в замер.
+
+    python tools/replay.py run --synthetic 2000 --fakes --concurrency 16 --output base.json
+    python tools/replay.py run --events recorded.jsonl --target http://127.0.0.1:8080
+    python tools/replay.py diff base.json new.json    # код 1 при регрессии p95
+"""
+import argparse
+import base64
+import contextlib
+import hashlib
+import json
+import math
+import os
+import platform
+import random
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from urllib.parse import urlencode
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from shared.actions import ACTION_MODULES
+
+
+# Действие -> Lambda (действия общей Lambda берутся из реестра shared.actions)
+ACTION_LAMBDAS = {
+    **{action: 'shared' for action in ACTION_MODULES},
+    'translate': 'translation',
+    'check_grammar': 'grammar',
+    'grammar_more': 'grammar',
+    'process_dialog': 'text_dialog',
+    'generate_greeting': 'audio_dialog',
+    'generate_response': 'audio_dialog',
+    'check_audio_access': 'audio_dialog',
+    'decrease_lessons_left': 'audio_dialog'
+}
+
+PAYMENT_ACTION = 'payment_webhook'
+
+# Типичная смесь запросов бота: (Lambda, действие, вес)
+SYNTHETIC_MIX = [
+    ('shared', 'get_profile', 15),
+    ('shared', 'process_text_message', 10),
+    ('shared', 'check_user', 8),
+    ('shared', 'get_ai_mode', 8),
+    ('shared', 'update_daily_streak', 6),
+    ('shared', 'set_ai_mode', 2),
+    ('shared', 'save_feedback', 1),
+    ('translation', 'translate', 15),
+    ('grammar', 'check_grammar', 8),
+    ('text_dialog', 'process_dialog', 10),
+    ('text_dialog', 'generate_dialog_feedback', 1),
+    ('audio_dialog', 'generate_response', 6),
+    ('audio_dialog', 'check_audio_access', 4),
+    ('audio_dialog', 'generate_greeting', 2),
+    ('audio_dialog', 'decrease_lessons_left', 1),
+    ('payments', PAYMENT_ACTION, 1)
+]
+
+SAMPLE_TEXTS = [
+    'Where is the nearest train station?',
+    'I went to the park yesterday with my friends',
+    'Как сказать по-английски «мне нужно больше практики»?',
+    'When do I use present perfect instead of past simple?',
+    'She dont like coffee in the morning',
+    'Can you help me prepare for a job interview?',
+    'Я хочу заказать столик на двоих на вечер',
+    'What is the difference between make and do?'
+]
+
+AI_MODES = ['translation', 'grammar', 'text_dialog', 'audio_dialog']
+
+DEFAULT_THRESHOLD = 0.10
+DEFAULT_SLACK_MS = 1.0
+
+
+def make_payment_event(rng, telegram_id, operation_id, package='mini', amount='149.00', label=None):
+    """Уведомление YooMoney (form-urlencoded), подписанное YOOMONEY_WEBHOOK_SECRET; label - готовая метка"""
+    params = {
+        'notification_type': 'p2p-incoming',
+        'operation_id': operation_id,
+        'amount': amount,
+        'currency': '643',
+        'datetime': datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ'),
+        'sender': str(rng.randint(10 ** 12, 10 ** 13)),
+        'codepro': 'false',
+        'label': label or base64.b64encode(json.dumps({'u': telegram_id, 'pkg': package}).encode('utf-8')).decode('ascii')
+    }
+    pieces = [params[key] for key in ('notification_type', 'operation_id', 'amount', 'currency', 'datetime', 'sender', 'codepro')]
+    pieces += [os.environ.get('YOOMONEY_WEBHOOK_SECRET', ''), params['label']]
+    params['sha1_hash'] = hashlib.sha1('&'.join(pieces).encode('utf-8')).hexdigest()
+    return {'body': urlencode(params), 'isBase64Encoded': False}
+
+
+def make_synthetic_body(rng, action, user_id):
+    """Тело запроса действия со случайными, но правдоподобными параметрами"""
+    text = rng.choice(SAMPLE_TEXTS)
+    language = rng.choice(['ru', 'en'])
+    bodies = {
+        'process_text_message': {'message': text, 'mode': rng.choice(['translation', 'grammar', 'text_dialog'])},
+        'set_ai_mode': {'mode': rng.choice(AI_MODES)},
+        'save_feedback': {'feedback_text': text},
+        'translate': {'text': text},
+        'check_grammar': {'text': text, 'interface_language': language},
+        'process_dialog': {'text': text, 'user_level': 'Intermediate'},
+        'generate_dialog_feedback': {'user_lang': language},
+        'generate_response': {'user_text': text, 'user_level': 'Intermediate'},
+        'generate_greeting': {'user_lang': language}
+    }
+    return {'action': action, 'user_id': user_id, **bodies.get(action, {})}
+
+
+def synthetic_events(count, users, seed=None):
+    """Синтетический поток: count событий по смеси SYNTHETIC_MIX для пользователей 1..users"""
+    rng = random.Random(seed)
+    weights = [weight for _, _, weight in SYNTHETIC_MIX]
+    events = []
+    for i in range(count):
+        lambda_name, action, _ = rng.choices(SYNTHETIC_MIX, weights)[0]
+        user_id = rng.randint(1, users)
+        if lambda_name == 'payments':
+            event = make_payment_event(rng, user_id, f'replay-{seed}-{i}')
+        else:
+            event = {'body': json.dumps(make_synthetic_body(rng, action, user_id))}
+        events.append({'lambda': lambda_name, 'action': action, 'event': event})
+    return events
+
+
+def classify_event(event):
+    """(Lambda, действие) для записанного Lambda-события"""
+    body = event.get('body', event)
+    if isinstance(body, str):
+        if 'notification_type=' in body or event.get('isBase64Encoded'):
+            return 'payments', PAYMENT_ACTION
+        try:
+            body = json.loads(body)
+        except ValueError:
+            return 'shared', 'unknown'
+    action = body.get('action', 'unknown') if isinstance(body, dict) else 'unknown'
+    return ACTION_LAMBDAS.get(action, 'shared'), action
+
+
+def load_events(path):
+    """Загрузить записанные события: JSONL, JSON-массив или одно Lambda-событие"""
+    with open(path) as f:
+        text = f.read().strip()
+    try:
+        records = json.loads(text)
+        records = records if isinstance(records, list) else [records]
+    except ValueError:
+        records = [json.loads(line) for line in text.splitlines() if line.strip()]
+
+    events = []
+    for record in records:
+        if 'event' in record and 'lambda' in record:
+            _, action = classify_event(record['event'])
+            events.append({'lambda': record['lambda'], 'action': record.get('action', action), 'event': record['event']})
+        else:
+            lambda_name, action = classify_event(record)
+            events.append({'lambda': lambda_name, 'action': action, 'event': record})
+    return events
+
+
+class InProcessTarget:
+    """Вызов lambda_handler в этом процессе (модули загружаются как в server/app.py)"""
+
+    def __init__(self, lambda_names, timeout_ms):
+        from server.app import ROUTES, ServerContext, load_handler
+        self.context_class = ServerContext
+        self.timeout_ms = timeout_ms
+        self.handlers = {name: load_handler(f'/{name}', ROUTES[f'/{name}']) for name in lambda_names}
+
+    def available(self, lambda_name):
+        return self.handlers.get(lambda_name) is not None
+
+    def call(self, lambda_name, event):
+        response = self.handlers[lambda_name](dict(event), self.context_class(lambda_name, self.timeout_ms))
+        # Некоторые действия возвращают тело без обёртки API Gateway - это успешный ответ
+        return response.get('statusCode', 200) if isinstance(response, dict) else 200
+
+
+class HttpTarget:
+    """POST на маршрут /<lambda> запущенного сервера (python -m server.app)"""
+
+    def __init__(self, base_url, timeout_ms):
+        from shared.http_pool import install_pooled_opener
+        install_pooled_opener()
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout_ms / 1000
+
+    def available(self, lambda_name):
+        return True
+
+    def call(self, lambda_name, event):
+        body = event.get('body', '')
+        data = (body if isinstance(body, str) else json.dumps(body)).encode('utf-8')
+        req = urllib.request.Request(f'{self.base_url}/{lambda_name}', data=data, method='POST')
+        try:
+            with urllib.request.urlopen(req, timeout=self.timeout) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as e:
+            e.read()
+            return e.code
+
+
+def percentile(sorted_values, p):
+    """Перцентиль по методу ближайшего ранга"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(p / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def summarize(samples, duration_s):
+    """Сводка по списку (задержка мс, статус)"""
+    latencies = sorted(latency for latency, _ in samples)
+    statuses = {}
+    for _, status in samples:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    errors = sum(count for status, count in statuses.items() if not status.isdigit() or int(status) >= 500)
+    return {
+        'count': len(samples),
+        'errors': errors,
+        'status_codes': statuses,
+        'throughput_rps': round(len(samples) / duration_s, 2) if duration_s else 0.0,
+        'p50_ms': round(percentile(latencies, 50), 2),
+        'p95_ms': round(percentile(latencies, 95), 2),
+        'p99_ms': round(percentile(latencies, 99), 2),
+        'mean_ms': round(sum(latencies) / len(latencies), 2) if latencies else 0.0,
+        'max_ms': round(latencies[-1], 2) if latencies else 0.0
+    }
+
+
+def replay(events, target, concurrency, rate=None):
+    """Прогнать события; вернуть (результаты по действиям, длительность, пропущенные)"""
+    results = {}
+    skipped = {}
+    lock = threading.Lock()
+    started = time.perf_counter()
+
+    def run_one(index, item):
+        if not target.available(item['lambda']):
+            with lock:
+                skipped[item['action']] = skipped.get(item['action'], 0) + 1
+            return
+        # В режиме --rate задержка считается от плановой подачи, включая ожидание в очереди
+        scheduled = started + index / rate if rate else time.perf_counter()
+        if rate:
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        call_started = scheduled if rate else time.perf_counter()
+        try:
+            status = target.call(item['lambda'], item['event'])
+        except Exception as e:
+            status = type(e).__name__
+        latency_ms = (time.perf_counter() - call_started) * 1000
+        with lock:
+            results.setdefault(item['action'], []).append((latency_ms, status))
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for future in [executor.submit(run_one, index, item) for index, item in enumerate(events)]:
+            future.result()
+    return results, time.perf_counter() - started, skipped
+
+
+@contextlib.contextmanager
+def handler_output(verbose):
+    """Подавить логи обработчиков на время прогона (кроме --verbose)"""
+    if verbose:
+        yield
+        return
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+def start_fakes(args):
+    """Поднять fake Supabase и fake OpenAI и направить на них переменные окружения"""
+    from tools import fake_openai, fake_supabase
+    supabase = fake_supabase.make_server(port=0, users=args.users, latency=args.supabase_latency, seed=args.seed)
+    openai = fake_openai.make_server(port=0, latency=args.openai_latency, error_rate=args.openai_error_rate,
+                                     error_statuses=(429, 500, 503), seed=args.seed)
+    for server in (supabase, openai):
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    os.environ.update({
+        'SUPABASE_URL': f'http://127.0.0.1:{supabase.server_address[1]}',
+        'SUPABASE_SERVICE_KEY': 'replay',
+        'OPENAI_BASE_URL': f'http://127.0.0.1:{openai.server_address[1]}/v1',
+        'OPENAI_API_KEY': 'replay'
+    })
+    return [supabase, openai]
+
+
+def print_report(report):
+    meta = report['meta']
+    print(f"\n{meta['events']} events in {meta['duration_s']:.2f}s, concurrency {meta['concurrency']}, target {meta['target']}")
+    print(f"{'action':<26}{'count':>7}{'err':>6}{'rps':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}")
+    rows = sorted(report['actions'].items()) + [('TOTAL', report['total'])]
+    for action, s in rows:
+        print(f"{action:<26}{s['count']:>7}{s['errors']:>6}{s['throughput_rps']:>9.1f}"
+              f"{s['p50_ms']:>9.1f}{s['p95_ms']:>9.1f}{s['p99_ms']:>9.1f}{s['max_ms']:>9.1f}")
+    for action, count in sorted(report['skipped'].items()):
+        print(f"⚠️ {action}: {count} events skipped (Lambda not available)")
+
+
+def command_run(args):
+    if not args.events and not args.synthetic:
+        print("Nothing to replay: pass --events FILE or --synthetic N")
+        return 2
+
+    servers = start_fakes(args) if args.fakes else []
+    if args.no_rate_limit:
+        os.environ['RATE_LIMIT_ENABLED'] = 'false'
+    if args.no_admission_control:
+        os.environ['ADMISSION_CONTROL_ENABLED'] = 'false'
+
+    events = load_events(args.events) if args.events else synthetic_events(args.synthetic, args.users, args.seed)
+    if args.write_events:
+        with open(args.write_events, 'w') as f:
+            for item in events:
+                f.write(json.dumps(item, ensure_ascii=False) + '\n')
+
+    lambda_names = sorted({item['lambda'] for item in events})
+    if args.target:
+        target = HttpTarget(args.target, args.timeout_ms)
+    else:
+        with handler_output(args.verbose):
+            target = InProcessTarget(lambda_names, args.timeout_ms)
+
+    if args.warmup:
+        with handler_output(args.verbose):
+            replay(events[:args.warmup], target, args.concurrency)
+
+    with handler_output(args.verbose):
+        results, duration_s, skipped = replay(events, target, args.concurrency, args.rate)
+    for server in servers:
+        server.shutdown()
+
+    all_samples = [sample for samples in results.values() for sample in samples]
+    report = {
+        'meta': {
+            'events': len(events),
+            'concurrency': args.concurrency,
+            'rate': args.rate,
+            'target': args.target or 'in-process',
+            'duration_s': round(duration_s, 3),
+            'python': platform.python_version(),
+            'created_at': datetime.now(timezone.utc).isoformat()
+        },
+        'actions': {action: summarize(samples, duration_s) for action, samples in results.items()},
+        'total': summarize(all_samples, duration_s),
+        'skipped': skipped
+    }
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"Report written to {args.output}")
+    return 0
+
+
+def diff_reports(base, new, threshold, slack_ms):
+    """Строки сравнения двух отчётов и список регрессий p95"""
+    lines = []
+    regressions = []
+    actions = sorted(set(base['actions']) | set(new['actions']))
+    for action in actions + ['TOTAL']:
+        before = base['total'] if action == 'TOTAL' else base['actions'].get(action)
+        after = new['total'] if action == 'TOTAL' else new['actions'].get(action)
+        if not before or not after:
+            lines.append(f"{action:<26} only in {'new' if after else 'base'} run")
+            continue
+        cells = []
+        for metric in ('p50_ms', 'p95_ms', 'p99_ms', 'throughput_rps'):
+            change = (after[metric] - before[metric]) / before[metric] * 100 if before[metric] else 0.0
+            cells.append(f"{before[metric]:>8.1f} → {after[metric]:<8.1f}({change:+.0f}%)")
+        if after['errors'] != before['errors']:
+            cells.append(f"errors {before['errors']} → {after['errors']}")
+        lines.append(f"{action:<26}" + '  '.join(cells))
+        if after['p95_ms'] > before['p95_ms'] * (1 + threshold) + slack_ms:
+            regressions.append(f"{action}: p95 {before['p95_ms']:.1f}ms → {after['p95_ms']:.1f}ms")
+        if after['errors'] > before['errors']:
+            regressions.append(f"{action}: errors {before['errors']} → {after['errors']}")
+    return lines, regressions
+
+
+def command_diff(args):
+    with open(args.base) as f:
+        base = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+    lines, regressions = diff_reports(base, new, args.threshold, args.slack_ms)
+    print(f"{'action':<26}{'p50':^26}{'p95':^26}{'p99':^26}{'rps':^26}")
+    for line in lines:
+        print(line)
+    for regression in regressions:
+        print(f"❌ {regression}")
+    if not regressions:
+        print("✅ No p95 or error regressions")
+    return 1 if regressions else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay recorded or synthetic events through the Lambda handlers')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run = subparsers.add_parser('run', help='replay events and report latency percentiles per action')
+    run.add_argument('--events', help='JSONL file of recorded events')
+    run.add_argument('--synthetic', type=int, default=0, help='generate N events from the typical action mix')
+    run.add_argument('--users', type=int, default=100, help='synthetic users (telegram_id 1..N)')
+    run.add_argument('--seed', type=int, default=1)
+    run.add_argument('--write-events', help='save the replayed stream as JSONL')
+    run.add_argument('--concurrency', type=int, default=8)
+    run.add_argument('--rate', type=float, default=None, help='open-loop arrival rate, events per second')
+    run.add_argument('--warmup', type=int, default=0, help='replay the first N events once before measuring')
+    run.add_argument('--target', help='base URL of a running server (python -m server.app); default in-process')
+    run.add_argument('--timeout-ms', type=int, default=30000, help='per-event deadline, like the Lambda timeout')
+    run.add_argument('--fakes', action='store_true', help='start tools/fake_supabase.py and tools/fake_openai.py in-process')
+    run.add_argument('--openai-latency', default='lognormal:400:0.5', help='fake OpenAI latency spec (with --fakes)')
+    run.add_argument('--openai-error-rate', type=float, default=0.0)
+    run.add_argument('--supabase-latency', default='normal:15:5', help='fake Supabase latency spec (with --fakes)')
+    run.add_argument('--no-rate-limit', action='store_true', help='disable per-user rate limiting for the run')
+    run.add_argument('--no-admission-control', action='store_true', help='disable load shedding (in-process replay shares one in-flight counter across all Lambdas)')
+    run.add_argument('--verbose', action='store_true', help='keep handler logs')
+    run.add_argument('--output', help='write the JSON report here')
+
+    diff = subparsers.add_parser('diff', help='compare two run reports')
+    diff.add_argument('base')
+    diff.add_argument('new')
+    diff.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD, help='allowed relative p95 increase')
+    diff.add_argument('--slack-ms', type=float, default=DEFAULT_SLACK_MS)
+
+    args = parser.parse_args()
+    return command_run(args) if args.command == 'run' else command_diff(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,35 @@
+"""Запуск пакетной задачи через OpenAI Batch API (cron / ручной запуск)
+
+Примеры:
+    python tools/run_batch_job.py greeting_pool
+    python tools/run_batch_job.py progress_digests --no-wait     # отправить и выйти, следующий запуск продолжит
+    OPENAI_BASE_URL=http://127.0.0.1:8090/v1 python tools/run_batch_job.py feedback_summaries   # локальный стенд
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from shared.batch_jobs import JOBS, run_batch_job
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run an OpenAI Batch API job')
+    parser.add_argument('job', choices=sorted(JOBS))
+    parser.add_argument('--no-wait', action='store_true', help='submit/poll once and exit; rerun to resume')
+    parser.add_argument('--poll-interval', type=float, default=60, help='seconds between status checks')
+    parser.add_argument('--timeout', type=float, default=None, help='stop polling after N seconds (resumable)')
+    args = parser.parse_args()
+
+    build_requests, apply_result = JOBS[args.job]
+    state = run_batch_job(
+        args.job, build_requests, apply_result,
+        wait=not args.no_wait, poll_interval=args.poll_interval, timeout=args.timeout
+    )
+    print(f"Job {args.job}: stage={state['stage']}")
+    return 1 if state['stage'] == 'failed' else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,331 @@
+"""Нагрузочная проверка идемпотентности вебхука YooMoney (payments/lambda_function.py)
+
+Обработчик вызывается в процессе против tools/fake_supabase.py, уведомления подписываются
+YOOMONEY_WEBHOOK_SECRET. Сценарии:
+- duplicates: много операций, каждая доставляется --duplicates раз вперемешку и параллельно,
+  несколько операций на пользователя;
+- amounts: границы допустимой суммы (90%-110% цены), неизвестный пакет/пользователь,
+  битая метка - каждая доставка дважды;
+- slow: duplicates при медленном Supabase (--slow-latency);
+- faults: Supabase отвечает ошибкой на долю запросов (--fault-rate), уведомления с ответом
+  не 200 доставляются повторно, как это делает YooMoney.
+
+После каждого сценария проверяется состояние таблиц: одна запись payments на операцию,
+начисление уроков и дней ровно один раз на принятую операцию и ни одного - на отклонённую.
+Код 1, если нарушено хотя бы одно условие.
+
+    python tools/stress_payments.py --operations 500 --duplicates 3 --concurrency 32
+    python tools/stress_payments.py amounts
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from tools import fake_supabase
+from tools.replay import make_payment_event, summarize, handler_output
+
+
+SCENARIOS = ('duplicates', 'amounts', 'slow', 'faults')
+STRESS_SECRET = 'stress-secret'
+
+# Пакет из метки -> (уроки, дни, цена в рублях), как PKG/PRICE в payments/lambda_function.py
+PACKAGES = {
+    'mini': (3, 3, 149.00),
+    '2weeks': (10, 14, 590.00),
+    'month': (30, 30, 1090.00)
+}
+
+# Допуск при сравнении срока действия пакета (время между чтением и записью)
+EXPIRY_TOLERANCE_SEC = 120
+# Сколько раз YooMoney повторяет уведомление, на которое ответили не 200
+MAX_REDELIVERIES = 10
+MAX_REPORTED_VIOLATIONS = 20
+
+
+def amount_cases():
+    """(название, пакет, сумма, будет ли начисление, ожидаемый статус ответа)"""
+    cases = []
+    for package, (_, _, price) in PACKAGES.items():
+        kopecks = int(round(price * 100))
+        min_kopecks, max_kopecks = int(kopecks * 0.90), int(kopecks * 1.10)
+        cases += [
+            (f'{package}: exact price', package, f'{price:.2f}', True, 200),
+            (f'{package}: 3% commission', package, f'{price * 0.97:.2f}', True, 200),
+            (f'{package}: lower bound', package, f'{min_kopecks / 100:.2f}', True, 200),
+            (f'{package}: below lower bound', package, f'{(min_kopecks - 1) / 100:.2f}', False, 400),
+            (f'{package}: upper bound', package, f'{max_kopecks / 100:.2f}', True, 200),
+            (f'{package}: above upper bound', package, f'{(max_kopecks + 1) / 100:.2f}', False, 400),
+            (f'{package}: zero', package, '0.00', False, 400)
+        ]
+    cases.append(('unknown package', str(uuid.uuid4()), '149.00', False, 400))
+    return cases
+
+
+class PaymentsStress:
+    """Стенд: fake Supabase в фоне и загруженный обработчик payments"""
+
+    def __init__(self, users, concurrency, seed, verbose=False):
+        self.users = users
+        self.concurrency = concurrency
+        self.rng = random.Random(seed)
+        self.verbose = verbose
+        self.server = fake_supabase.make_server(port=0, users=users, seed=seed)
+        self.state = self.server.RequestHandlerClass.state
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+        os.environ.update({
+            'SUPABASE_URL': f'http://127.0.0.1:{self.server.server_address[1]}',
+            'SUPABASE_SERVICE_KEY': 'stress',
+            'YOOMONEY_WEBHOOK_SECRET': STRESS_SECRET
+        })
+        # Уведомления в Telegram не отправляем
+        os.environ.pop('BOT_TOKEN', None)
+
+        from server.app import ROUTES, ServerContext, load_handler
+        with handler_output(verbose):
+            self.handler = load_handler('/payments', ROUTES['/payments'])
+        if self.handler is None:
+            raise RuntimeError("payments Lambda failed to import (pip install -r payments/requirements.txt)")
+        self.context_class = ServerContext
+
+    def reset(self, latency='fixed:0', users=None, error_rate=0.0):
+        self.state.reset(users or self.users)
+        self.state.configure({'latency': latency, 'error_rate': error_rate})
+
+    def snapshot_users(self):
+        with self.state.lock:
+            return {user['telegram_id']: dict(user) for user in self.state.tables['users']}
+
+    def deliver(self, deliveries):
+        """Параллельно доставить уведомления; вернуть [(задержка мс, статус, тело)]"""
+        def run(event):
+            started = time.perf_counter()
+            try:
+                response = self.handler(dict(event), self.context_class('payments', 30000))
+                status, body = response['statusCode'], response.get('body')
+            except Exception as e:
+                status, body = type(e).__name__, str(e)
+            return (time.perf_counter() - started) * 1000, status, body
+
+        started = time.perf_counter()
+        with handler_output(self.verbose), ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            results = list(executor.map(run, deliveries))
+        return results, time.perf_counter() - started
+
+    def check_grants(self, before, expected, violations):
+        """Сравнить начисления: expected - telegram_id -> (уроки, дни) по принятым операциям"""
+        after = self.snapshot_users()
+        for telegram_id, user in after.items():
+            lessons, days = expected.get(telegram_id, (0, 0))
+            initial = before.get(telegram_id)
+            if initial is None:
+                continue
+            granted_lessons = (user.get('lessons_left') or 0) - (initial.get('lessons_left') or 0)
+            if granted_lessons != lessons:
+                violations.append(f"user {telegram_id}: expected +{lessons} lessons, got {granted_lessons:+d}")
+
+            old_expiry = datetime.fromisoformat(initial['package_expires_at'])
+            new_expiry = datetime.fromisoformat(user['package_expires_at'])
+            granted_days = (new_expiry - old_expiry).total_seconds() / 86400
+            if abs(granted_days - days) * 86400 > EXPIRY_TOLERANCE_SEC:
+                violations.append(f"user {telegram_id}: expected +{days} days, got {granted_days:+.2f}")
+
+    def check_payment_rows(self, operations, violations):
+        """Одна запись payments на операцию с ожидаемым статусом"""
+        with self.state.lock:
+            rows = list(self.state.tables['payments'])
+        by_operation = {}
+        for row in rows:
+            by_operation.setdefault(row.get('provider_operation_id'), []).append(row)
+        for operation_id, expected_status in operations.items():
+            found = by_operation.get(operation_id, [])
+            if expected_status is None:
+                if found:
+                    violations.append(f"{operation_id}: unexpected payments row")
+                continue
+            if len(found) != 1:
+                violations.append(f"{operation_id}: {len(found)} payments rows, expected 1")
+            elif found[0].get('status') != expected_status:
+                violations.append(f"{operation_id}: status {found[0].get('status')}, expected {expected_status}")
+
+    def run_duplicates(self, operations, duplicates, latency='fixed:0'):
+        """Каждая операция доставляется duplicates раз, несколько операций на пользователя"""
+        self.reset(latency)
+        before = self.snapshot_users()
+        expected = {}
+        payment_status = {}
+        deliveries = []
+        for i in range(operations):
+            telegram_id = self.rng.randint(1, self.users)
+            package = self.rng.choice(list(PACKAGES))
+            lessons, days, price = PACKAGES[package]
+            operation_id = f'stress-{uuid.uuid4().hex[:12]}-{i}'
+            event = make_payment_event(self.rng, telegram_id, operation_id, package, f'{price:.2f}')
+            deliveries += [event] * duplicates
+            granted = expected.get(telegram_id, (0, 0))
+            expected[telegram_id] = (granted[0] + lessons, granted[1] + days)
+            payment_status[operation_id] = 'paid'
+        self.rng.shuffle(deliveries)
+
+        results, duration_s = self.deliver(deliveries)
+        violations = [f"delivery answered {status}: {body}" for _, status, body in results if status != 200]
+        self.check_payment_rows(payment_status, violations)
+        self.check_grants(before, expected, violations)
+        return results, duration_s, violations
+
+    def run_amounts(self):
+        """Границы суммы и некорректные уведомления; каждое доставляется дважды"""
+        cases = amount_cases()
+        # Отдельный пользователь на каждый случай
+        self.reset(users=max(self.users, len(cases)))
+        before = self.snapshot_users()
+        expected = {}
+        payment_status = {}
+        deliveries = []
+        expected_statuses = {}
+        for telegram_id, (name, package, amount, grant, status) in enumerate(cases, start=1):
+            operation_id = f'amount-{telegram_id}'
+            event = make_payment_event(self.rng, telegram_id, operation_id, package, amount)
+            deliveries += [event, event]
+            expected_statuses[operation_id] = (name, status)
+            payment_status[operation_id] = 'paid' if grant else 'failed'
+            if grant:
+                lessons, days, _ = PACKAGES[package]
+                expected[telegram_id] = (lessons, days)
+
+        # Пользователь, которого нет в базе, и повреждённая метка
+        missing_user = make_payment_event(self.rng, max(self.users, len(cases)) + 1000, 'amount-missing-user', 'mini', '149.00')
+        expected_statuses['amount-missing-user'] = ('unknown user', 400)
+        payment_status['amount-missing-user'] = 'failed'
+        bad_label = make_payment_event(self.rng, 1, 'amount-bad-label', 'mini', '149.00', label='bm90IGpzb24=')
+        expected_statuses['amount-bad-label'] = ('bad label', 400)
+        payment_status['amount-bad-label'] = None
+        deliveries += [missing_user, missing_user, bad_label, bad_label]
+
+        results, duration_s = self.deliver(deliveries)
+        violations = []
+        for event, (_, status, body) in zip(deliveries, results):
+            operation_id = event['body'].split('operation_id=', 1)[1].split('&', 1)[0]
+            name, expected_status = expected_statuses[operation_id]
+            # Повторная доставка отклонённой операции отвечает так же, принятой - 200
+            if status != expected_status:
+                violations.append(f"{name} ({operation_id}): answered {status} {body!r}, expected {expected_status}")
+        self.check_payment_rows(payment_status, violations)
+        self.check_grants(before, expected, violations)
+        return results, duration_s, violations
+
+    def run_faults(self, operations, error_rate):
+        """Supabase отвечает 500 на долю запросов; не-200 доставляется повторно, как это делает YooMoney"""
+        self.reset(error_rate=error_rate)
+        before = self.snapshot_users()
+        expected = {}
+        payment_status = {}
+        pending = []
+        for i in range(operations):
+            telegram_id = self.rng.randint(1, self.users)
+            package = self.rng.choice(list(PACKAGES))
+            lessons, days, price = PACKAGES[package]
+            operation_id = f'fault-{uuid.uuid4().hex[:12]}-{i}'
+            pending.append(make_payment_event(self.rng, telegram_id, operation_id, package, f'{price:.2f}'))
+            granted = expected.get(telegram_id, (0, 0))
+            expected[telegram_id] = (granted[0] + lessons, granted[1] + days)
+            payment_status[operation_id] = 'paid'
+
+        results, duration_s = [], 0.0
+        for _ in range(MAX_REDELIVERIES):
+            if not pending:
+                break
+            attempt, attempt_s = self.deliver(pending)
+            results += attempt
+            duration_s += attempt_s
+            pending = [event for event, (_, status, _) in zip(pending, attempt) if status != 200]
+
+        self.state.configure({'error_rate': 0.0})
+        violations = [f"{len(pending)} operations still not accepted after {MAX_REDELIVERIES} deliveries"] if pending else []
+        violations += [f"delivery answered {status}: {body}" for _, status, body in results if status not in (200, 500)]
+        self.check_payment_rows(payment_status, violations)
+        self.check_grants(before, expected, violations)
+        return results, duration_s, violations
+
+    def check_forged_signature(self):
+        """Предупреждение, если уведомление с неверной подписью всё равно принимается"""
+        self.reset()
+        event = make_payment_event(self.rng, 1, 'forged-signature', 'mini', '149.00')
+        event = {**event, 'body': event['body'].rsplit('sha1_hash=', 1)[0] + 'sha1_hash=' + '0' * 40}
+        results, _ = self.deliver([event])
+        return results[0][1] == 200
+
+
+def print_summary(name, results, duration_s, violations):
+    summary = summarize([(latency, status) for latency, status, _ in results], duration_s)
+    print(f"{name:<11} {summary['count']:>6} deliveries  {summary['throughput_rps']:>8.1f} rps  "
+          f"p50 {summary['p50_ms']:>7.1f}ms  p95 {summary['p95_ms']:>7.1f}ms  p99 {summary['p99_ms']:>7.1f}ms  "
+          f"statuses {summary['status_codes']}")
+    for violation in violations[:MAX_REPORTED_VIOLATIONS]:
+        print(f"   ❌ {violation}")
+    if len(violations) > MAX_REPORTED_VIOLATIONS:
+        print(f"   ❌ ... and {len(violations) - MAX_REPORTED_VIOLATIONS} more")
+    return {**summary, 'violations': violations}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load and idempotency stress suite for the YooMoney payments webhook')
+    parser.add_argument('scenarios', nargs='*', help=f"default: all ({', '.join(SCENARIOS)})")
+    parser.add_argument('--operations', type=int, default=300, help='distinct payment operations per scenario')
+    parser.add_argument('--duplicates', type=int, default=3, help='deliveries of each operation')
+    parser.add_argument('--users', type=int, default=50, help='users the operations are spread over')
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--slow-latency', default='normal:200:60', help='fake Supabase latency for the slow scenario')
+    parser.add_argument('--fault-rate', type=float, default=0.2, help='fake Supabase error rate for the faults scenario')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--verbose', action='store_true', help='keep handler logs')
+    parser.add_argument('--output', help='write the JSON report here')
+    args = parser.parse_args()
+
+    unknown = [name for name in args.scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenario(s): {', '.join(unknown)}")
+
+    try:
+        stress = PaymentsStress(args.users, args.concurrency, args.seed, args.verbose)
+    except RuntimeError as e:
+        print(f"❌ {e}")
+        return 2
+
+    report = {}
+    for name in args.scenarios or SCENARIOS:
+        if name == 'duplicates':
+            outcome = stress.run_duplicates(args.operations, args.duplicates)
+        elif name == 'amounts':
+            outcome = stress.run_amounts()
+        elif name == 'faults':
+            outcome = stress.run_faults(max(1, args.operations // 5), args.fault_rate)
+        else:
+            outcome = stress.run_duplicates(max(1, args.operations // 5), args.duplicates, args.slow_latency)
+        report[name] = print_summary(name, *outcome)
+
+    if stress.check_forged_signature():
+        print("⚠️ A notification with a wrong sha1_hash was accepted: signature verification is disabled in payments/lambda_function.py")
+    stress.server.shutdown()
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+    failed = [name for name, result in report.items() if result['violations']]
+    print(f"❌ Violations in: {', '.join(failed)}" if failed else "✅ Every operation granted access exactly once")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
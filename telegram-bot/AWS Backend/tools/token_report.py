@@ -0,0 +1,31 @@
+"""Отчёт по расходу токенов OpenAI из token_usage_ledger
+
+Примеры:
+    python tools/token_report.py                      # топ-20 пользователей за 7 дней
+    python tools/token_report.py --by prompt --days 1 # самые дорогие режимы/профили за сутки
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from shared.usage_ledger import query_top_consumers
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Top OpenAI token consumers')
+    parser.add_argument('--by', choices=['user', 'prompt'], default='user')
+    parser.add_argument('--days', type=int, default=7)
+    parser.add_argument('--limit', type=int, default=20)
+    args = parser.parse_args()
+
+    rows = query_top_consumers(args.by, args.days, args.limit)
+    print(f"{'key':<40} {'requests':>9} {'prompt':>10} {'completion':>11} {'total':>10}")
+    for row in rows:
+        print(f"{row['key']:<40} {row['requests']:>9} {row['prompt_tokens']:>10} {row['completion_tokens']:>11} {row['total_tokens']:>10}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -2,19 +2,67 @@
 import sys
 import os
 import json
+import re
+from concurrent.futures import ThreadPoolExecutor
 
 # Добавляем shared в path (находится в корне Lambda)
 sys.path.insert(0, '/var/task/shared')
 sys.path.insert(0, '/var/task')
 
-from shared.openai_client import get_openai_response
+from shared.model_router import get_routed_response
+from shared.dictionary import translate_short_text
+from shared.cache import TTLCache, make_cache_key
+from shared.rate_limiter import check_rate_limit, get_rate_limit_reply
+from shared.health import health_response
+from shared.warmup import init_container, warmup_response
+from shared.metrics import metrics_response_body, register_cache
+from shared.admission import admit
+from shared.deadline import Deadline, DeadlineExceeded
 from shared.database import log_text_usage, get_supabase_config
 from shared.utils import success_response, error_response, parse_request_body, validate_required_fields
+from shared.logger import get_logger
+from shared.tracing import traced, run_in_trace
 
+log = get_logger('translation')
 
+
+# Системный промпт для перевода (оригинальный формат)
+TRANSLATION_SYSTEM_PROMPT = """You are a bilingual translation bot. Your only task is to automatically translate each incoming message:
+
+If the message is in Russian → translate it into English.
+
+If the message is in English → translate it into Russian.
+
+Do not add explanations, comments, or extra text.
+Do not ask questions or start conversations.
+Only return the translated text, nothing else."""
+
+# Тексты длиннее этого порога переводятся по сегментам
+LONG_TEXT_CHARS = 600
+# Целевой размер сегмента (короткие предложения склеиваются до этого размера)
+SEGMENT_MAX_CHARS = 400
+# Сколько сегментов переводим одновременно (переопределяется TRANSLATION_MAX_PARALLEL)
+DEFAULT_MAX_PARALLEL = 4
+
+# Граница предложения (после . ! ? …) или абзаца
+SENTENCE_BOUNDARY_RE = re.compile(r'((?<=[.!?…])\s+|\n\s*\n)')
+# Пробелы между словами - запасная граница для предложений длиннее max_chars
+WORD_BOUNDARY_RE = re.compile(r'(\s+)')
+
+# Кэш переводов сегментов: повторно присланный или отредактированный текст платит только за изменённые части
+_segment_cache = TTLCache(maxsize=2048, ttl=24 * 3600)
+register_cache('translation_segments', _segment_cache)
+
+
+# Init-фаза контейнера: пул соединений; прогрев сразу - при provisioned concurrency
+init_container('translation')
+
+
+@traced('translation')
 def lambda_handler(event, context):
     """Обработчик Lambda для переводов"""
-    print(f"🔄 Translation Lambda called")
+    log.debug("🔄 Translation Lambda called")
+    deadline = Deadline.from_context(context)
     
     try:
         body = parse_request_body(event)
@@ -25,17 +73,31 @@ def lambda_handler(event, context):
         
         action = body['action']
         
-        if action == 'translate':
-            return handle_translate(body)
+        # При перегрузке upstream низкоприоритетные действия сбрасываются первыми
+        admitted, load_level = admit(action)
+        if not admitted:
+            return error_response(f'Service overloaded ({load_level}), action {action} shed, retry later', 503)
+        
+        if action == 'metrics':
+            return success_response(metrics_response_body('translation', body))
+        elif action == 'health':
+            return health_response('translation')
+        elif action == 'warmup':
+            return warmup_response('translation')
+        elif action == 'translate':
+            return handle_translate(body, deadline)
         else:
             return error_response(f'Unknown action: {action}')
             
+    except DeadlineExceeded as e:
+        log.warning(f"⏱️ Translation Lambda deadline exceeded: {e}")
+        return error_response(str(e), 504, **e.details())
     except Exception as e:
-        print(f"❌ Translation Lambda error: {e}")
+        log.error(f"❌ Translation Lambda error: {e}")
         return error_response(f'Internal error: {str(e)}', 500)
 
 
-def handle_translate(body):
+def handle_translate(body, deadline=None):
     """Обработка перевода текста"""
     validation_error = validate_required_fields(body, ['text', 'user_id'])
     if validation_error:
@@ -45,33 +107,152 @@ def handle_translate(body):
     user_id = body['user_id']
     target_language = body.get('target_language', 'Russian')
     
-    print(f"🔄 Translating text: {text[:50]}...")
+    log.debug("🔄 Translating text: %s...", text[:50])
     
-    # Системный промпт для перевода (оригинальный формат)
-    system_prompt = """You are a bilingual translation bot. Your only task is to automatically translate each incoming message:
-
-If the message is in Russian → translate it into English.
-
-If the message is in English → translate it into Russian.
-
-Do not add explanations, comments, or extra text.
-Do not ask questions or start conversations.
-Only return the translated text, nothing else."""
+    # Одно-два слова переводим по офлайн-словарю, остальное - через OpenAI
+    dictionary_reply = translate_short_text(text)
+    if dictionary_reply:
+        supabase_config = get_supabase_config()
+        if supabase_config['url'] and supabase_config['key']:
+            log_text_usage(user_id, supabase_config['url'], supabase_config['key'], deadline)
+        
+        return success_response({
+            'reply': dictionary_reply
+        })
     
-    # Получаем перевод от OpenAI
-    result = get_openai_response(text, system_prompt, max_tokens=500)
+    # Лимит частоты запросов к модели (token bucket на пользователя и режим)
+    allowed, retry_after = check_rate_limit(user_id, 'translation', deadline)
+    if not allowed:
+        return success_response({
+            'reply': get_rate_limit_reply(retry_after, body.get('interface_language', 'ru')),
+            'rate_limited': True,
+            'retry_after': round(retry_after, 1)
+        })
+    
+    # Получаем перевод от OpenAI (длинный текст - по сегментам параллельно, с кэшем)
+    result = translate_text(text, user_id, deadline)
     
     if result['success']:
-        print(f"✅ Translation successful")
+        log.info("✅ Translation successful")
         
         # Логируем использование
         supabase_config = get_supabase_config()
         if supabase_config['url'] and supabase_config['key']:
-            log_text_usage(user_id, supabase_config['url'], supabase_config['key'])
+            log_text_usage(user_id, supabase_config['url'], supabase_config['key'], deadline)
         
         return success_response({
             'reply': result['reply']
         })
     else:
-        print(f"❌ Translation failed: {result['error']}")
+        log.error(f"❌ Translation failed: {result['error']}")
         return error_response(f"Translation error: {result['error']}")
+
+
+def split_long_sentence(sentence, max_chars=SEGMENT_MAX_CHARS):
+    """Разрезать предложение длиннее max_chars по границам слов; слово длиннее max_chars режется как есть.
+    
+    Возвращает пары (кусок, разделитель_после); у последнего куска разделитель пустой.
+    """
+    parts = WORD_BOUNDARY_RE.split(sentence)
+    words = parts[0::2]
+    spaces = parts[1::2] + ['']
+    
+    pieces = []
+    current = ''
+    current_sep = ''
+    for word, space in zip(words, spaces):
+        while len(word) > max_chars:
+            if current:
+                pieces.append((current, current_sep))
+                current = ''
+            pieces.append((word[:max_chars], ''))
+            word = word[max_chars:]
+        if current and len(current) + len(current_sep) + len(word) <= max_chars:
+            current += current_sep + word
+        else:
+            if current:
+                pieces.append((current, current_sep))
+            current = word
+        current_sep = space
+    if current:
+        pieces.append((current, ''))
+    return pieces
+
+
+def split_into_segments(text, max_chars=SEGMENT_MAX_CHARS):
+    """Разбить текст на сегменты по границам предложений/абзацев.
+    
+    Возвращает список пар (сегмент, разделитель_после), чтобы собрать перевод
+    с исходными пробелами и переносами строк.
+    """
+    parts = SENTENCE_BOUNDARY_RE.split(text)
+    sentences = []
+    separators = []
+    for sentence, separator in zip(parts[0::2], parts[1::2] + ['']):
+        # Длинное предложение без знаков препинания - по словам, иначе один сегмент без параллелизма
+        if len(sentence) > max_chars:
+            pieces = split_long_sentence(sentence, max_chars)
+            sentences += [piece for piece, _ in pieces]
+            separators += [piece_sep for _, piece_sep in pieces[:-1]] + [separator]
+        else:
+            sentences.append(sentence)
+            separators.append(separator)
+    
+    segments = []
+    current = ''
+    current_sep = ''
+    for sentence, separator in zip(sentences, separators):
+        if not sentence:
+            current_sep += separator
+            continue
+        # Абзацы не склеиваем, короткие предложения - склеиваем до max_chars
+        if current and ('\n' not in current_sep) and len(current) + len(current_sep) + len(sentence) <= max_chars:
+            current += current_sep + sentence
+        elif current:
+            segments.append((current, current_sep))
+            current = sentence
+        else:
+            current = sentence
+        current_sep = separator
+    if current:
+        segments.append((current, current_sep))
+    return segments
+
+
+def translate_segment(segment, user_id=None, deadline=None):
+    """Перевести один сегмент (с кэшем по тексту сегмента)"""
+    cache_key = make_cache_key(TRANSLATION_SYSTEM_PROMPT, segment)
+    cached = _segment_cache.get(cache_key)
+    if cached is not None:
+        return {'success': True, 'reply': cached, 'cached': True}
+    
+    result = get_routed_response('translation', segment, TRANSLATION_SYSTEM_PROMPT, user_id=user_id, deadline=deadline)
+    if result['success']:
+        _segment_cache.set(cache_key, result['reply'])
+    return result
+
+
+def translate_text(text, user_id=None, deadline=None):
+    """Перевести текст: короткий - одним запросом, длинный - сегментами параллельно"""
+    stripped = text.strip()
+    if len(stripped) <= LONG_TEXT_CHARS:
+        return translate_segment(stripped, user_id, deadline)
+    
+    segments = split_into_segments(stripped)
+    log.info(f"🔄 Long text: {len(stripped)} chars -> {len(segments)} segments")
+    
+    max_workers = min(len(segments), int(os.environ.get('TRANSLATION_MAX_PARALLEL', DEFAULT_MAX_PARALLEL)))
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        # map сохраняет порядок сегментов
+        # run_in_trace: спаны сегментов из потоков пула попадают в трассу запроса
+        results = list(executor.map(run_in_trace(lambda segment: translate_segment(segment, user_id, deadline)), [segment for segment, _ in segments]))
+    
+    cached_count = sum(1 for r in results if r.get('cached'))
+    log.info(f"🔄 Segments translated: {len(results)} total, {cached_count} from cache")
+    
+    for result in results:
+        if not result['success']:
+            return {'success': False, 'error': result['error']}
+    
+    reply = ''.join(result['reply'] + separator for result, (_, separator) in zip(results, segments))
+    return {'success': True, 'reply': reply.strip()}
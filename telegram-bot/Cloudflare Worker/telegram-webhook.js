@@ -59,6 +59,9 @@ export default {
         return new Response('OK');
       }
 
+      // Trace id обновления: передаётся во все вызовы Lambda (заголовок X-Trace-Id)
+      env = { ...env, TRACE_ID: `tg-${update.update_id ?? Date.now()}` };
+
       // Handle /help command, unknown commands, and regular text messages
 const supportedCommands = ['/start', '/profile', '/lesson', '/talk', '/help', '/feedback', '/mode'];
 
@@ -903,6 +906,7 @@ if (update.message?.text === '/feedback') {
         try {
           // FIRST: Get AI mode from Supabase (single source of truth)
           let currentMode = null;
+          let interfaceLanguage = null;
           try {
             const modeResponse = await callLambdaFunction('shared', {
               user_id: chatId,
@@ -911,6 +915,7 @@ if (update.message?.text === '/feedback') {
             
             if (modeResponse && modeResponse.success && modeResponse.ai_mode) {
               currentMode = modeResponse.ai_mode;
+              interfaceLanguage = modeResponse.interface_language || null;
             }
           } catch (error) {
             console.error(`⚠️ [${chatId}] Could not get AI mode from Supabase:`, error);
@@ -1020,13 +1025,15 @@ if (update.message?.text === '/feedback') {
               action: 'translate',
               text: update.message.text,
               user_id: chatId,
-              target_language: 'Russian' // TODO: detect language
+              target_language: 'Russian', // TODO: detect language
+              interface_language: interfaceLanguage
             }, env);
           } else if (currentMode === 'grammar') {
             aiResponse = await callLambdaFunction('grammar', {
               action: 'check_grammar',
               text: update.message.text,
-              user_id: chatId
+              user_id: chatId,
+              interface_language: interfaceLanguage
             }, env);
           } else if (currentMode === 'text_dialog') {
             // Get dialog count and user level
@@ -1062,7 +1069,8 @@ if (update.message?.text === '/feedback') {
               user_id: chatId,
               dialog_count: dialogCount,
               user_level: userLevel,
-              previous_messages: previousMessages
+              previous_messages: previousMessages,
+              interface_language: interfaceLanguage
             }, env);
           } else {
             // Fallback to shared Lambda for unhandled modes
@@ -1070,22 +1078,39 @@ if (update.message?.text === '/feedback') {
               user_id: chatId,
               action: 'process_text_message',
               message: update.message.text,
-              mode: currentMode
+              mode: currentMode,
+              interface_language: interfaceLanguage
             }, env);
           }
           
           if (aiResponse && aiResponse.success) {
             console.log(`✅ [${chatId}] AI response received`);
 
-            // Получаем язык интерфейса пользователя для кнопки
-            const userResponse = await callLambdaFunction('shared', {
-              user_id: chatId,
-              action: 'check_user'
-            }, env);
-
-            const userLang = userResponse?.user_data?.interface_language || 'ru';
+            // Язык интерфейса для кнопки - из get_ai_mode, иначе из профиля
+            let userLang = interfaceLanguage;
+            if (!userLang) {
+              const userResponse = await callLambdaFunction('shared', {
+                user_id: chatId,
+                action: 'check_user'
+              }, env);
+              userLang = userResponse?.user_data?.interface_language || 'ru';
+            }
             const changeModeButtonText = userLang === 'en' ? "🔄 Change AI Mode" : "🔄 Сменить Режим ИИ";
 
+            // Клавиатура под ответом; у прогрессивного ответа грамматики - ещё кнопка «Подробнее» (grammar_more)
+            const replyKeyboard = [[{ text: changeModeButtonText, callback_data: "text_helper:start" }]];
+            if (currentMode === 'grammar' && aiResponse.has_more && aiResponse.question_id) {
+              // Вопрос и показанная часть ответа: Lambda восстановит по ним контекст, если контейнер сменился
+              await env.CHAT_KV.put(`grammar_more:${chatId}`, JSON.stringify({
+                question_id: aiResponse.question_id,
+                text: update.message.text,
+                answered: aiResponse.reply,
+                section_group: 1,
+                lang: userLang
+              }), { expirationTtl: 3600 });
+              replyKeyboard.unshift([{ text: userLang === 'en' ? "📖 More" : "📖 Подробнее", callback_data: `grammar_more:${aiResponse.question_id}` }]);
+            }
+
             // Разбиваем длинный ответ на части (лимит Telegram ~4096 символов)
             const maxLength = 4000; // Оставляем запас для кнопок
             const reply = aiResponse.reply;
@@ -1260,7 +1285,7 @@ if (update.message?.text === '/feedback') {
               await sendMessageViaTelegram(chatId, processedReply, env, {
                 parse_mode: parseMode,
                 reply_markup: {
-                  inline_keyboard: [[{ text: changeModeButtonText, callback_data: "text_helper:start" }]]
+                  inline_keyboard: replyKeyboard
                 }
               });
             } else {
@@ -1305,7 +1330,7 @@ if (update.message?.text === '/feedback') {
                 const options = isLast ? {
                   parse_mode: parseMode,
                   reply_markup: {
-                    inline_keyboard: [[{ text: changeModeButtonText, callback_data: "text_helper:start" }]]
+                    inline_keyboard: replyKeyboard
                   }
                 } : {
                   parse_mode: parseMode
@@ -2108,6 +2133,97 @@ Start with the mode that suits you best!`
         return new Response('OK');
       }
 
+      // 1.8. Handle grammar "more" button: следующая часть прогрессивного ответа (action grammar_more)
+      if (update.callback_query?.data?.startsWith('grammar_more:')) {
+        console.log(`📚 GRAMMAR MORE CALLBACK: "${update.callback_query.data}" from user ${chatId}`);
+        
+        try {
+          // Acknowledge callback
+          await callTelegram('answerCallbackQuery', {
+            callback_query_id: update.callback_query.id
+          }, env);
+          
+          const questionId = update.callback_query.data.split(':')[1];
+          let moreState = null;
+          const savedState = await env.CHAT_KV.get(`grammar_more:${chatId}`);
+          if (savedState) {
+            try {
+              moreState = JSON.parse(savedState);
+            } catch (e) {
+              console.log(`Error parsing grammar more state: ${e}`);
+            }
+          }
+          
+          const userLang = moreState?.lang || 'ru';
+          const changeModeButtonText = userLang === 'en' ? "🔄 Change AI Mode" : "🔄 Сменить Режим ИИ";
+          
+          // Кнопка от старого вопроса: продолжение есть только у последнего ответа
+          if (!moreState || moreState.question_id !== questionId) {
+            await sendMessageViaTelegram(chatId, userLang === 'en'
+              ? "⌛ This answer is no longer available. Please ask your question again."
+              : "⌛ Продолжение этого ответа уже недоступно. Задайте вопрос ещё раз.", env);
+            return new Response('OK');
+          }
+          
+          // Убираем «Подробнее» с предыдущего сообщения, чтобы продолжение не запросили дважды
+          await callTelegram('editMessageReplyMarkup', {
+            chat_id: chatId,
+            message_id: update.callback_query.message.message_id,
+            reply_markup: { inline_keyboard: [[{ text: changeModeButtonText, callback_data: "text_helper:start" }]] }
+          }, env);
+          
+          const moreResponse = await callLambdaFunction('grammar', {
+            action: 'grammar_more',
+            user_id: chatId,
+            question_id: moreState.question_id,
+            text: moreState.text,
+            answered: moreState.answered,
+            section_group: moreState.section_group,
+            interface_language: userLang
+          }, env);
+          
+          if (!moreResponse?.success) {
+            console.error(`❌ [${chatId}] Grammar more failed:`, moreResponse);
+            await sendMessageViaTelegram(chatId, moreResponse?.error || "❌ Произошла ошибка при обработке сообщения.", env);
+            return new Response('OK');
+          }
+          
+          const replyKeyboard = [[{ text: changeModeButtonText, callback_data: "text_helper:start" }]];
+          if (moreResponse.has_more) {
+            // При лимите частоты часть не сгенерирована - кнопка остаётся для повтора
+            if (!moreResponse.rate_limited) {
+              moreState.answered = `${moreState.answered}\n\n${moreResponse.reply}`.trim();
+              moreState.section_group += 1;
+              await env.CHAT_KV.put(`grammar_more:${chatId}`, JSON.stringify(moreState), { expirationTtl: 3600 });
+            }
+            replyKeyboard.unshift([{ text: userLang === 'en' ? "📖 More" : "📖 Подробнее", callback_data: `grammar_more:${questionId}` }]);
+          } else {
+            await env.CHAT_KV.delete(`grammar_more:${chatId}`);
+          }
+          
+          let moreReply = moreResponse.reply || (userLang === 'en' ? "That's the whole answer." : "Это весь ответ.");
+          let parseMode = 'Markdown';
+          // Ответы мини-практики приходят спойлерами ||...||, как в полном ответе
+          if (moreReply.includes('||')) {
+            moreReply = moreReply.replace(/\|\|([^|]+)\|\|/g, '<tg-spoiler>$1</tg-spoiler>');
+            moreReply = moreReply.replace(/\*([^*]+)\*/g, '<b>$1</b>');
+            parseMode = 'HTML';
+          }
+          
+          await sendMessageViaTelegram(chatId, moreReply, env, {
+            parse_mode: parseMode,
+            reply_markup: { inline_keyboard: replyKeyboard }
+          });
+          
+        } catch (error) {
+          console.error(`❌ [${chatId}] Error handling grammar more callback:`, error);
+          await sendMessageViaTelegram(chatId, 
+            "❌ Произошла ошибка. Попробуйте еще раз.", env);
+        }
+        
+        return new Response('OK');
+      }
+
       // 2. handle lesson buttons
       if (update.callback_query?.data === 'lesson:free' || 
           update.callback_query?.data === 'lesson:start') {
@@ -2723,10 +2839,22 @@ function getLambdaFunctionByMode(mode) {
   return modeToLambda[mode] || 'onboarding'; // fallback to old function
 }
 
+// Действия, которые проверяют доступ по подписанному токену (entitlement) вместо запроса к базе
+const ENTITLEMENT_ACTIONS = ['process_text_message', 'check_audio_access'];
+const ENTITLEMENT_KV_TTL = 300; // не дольше ENTITLEMENT_TOKEN_TTL в Lambda
+
 async function callLambdaFunction(functionName, payload, env) {
   try {
     console.log(`🔄 [LAMBDA] Calling ${functionName} with payload:`, JSON.stringify(payload).substring(0, 300));
     
+    const entitlementKey = payload?.user_id ? `entitlement:${payload.user_id}` : null;
+    if (env.CHAT_KV && entitlementKey && ENTITLEMENT_ACTIONS.includes(payload.action) && !payload.entitlement_token) {
+      const entitlementToken = await env.CHAT_KV.get(entitlementKey);
+      if (entitlementToken) {
+        payload = { ...payload, entitlement_token: entitlementToken };
+      }
+    }
+    
     // Map function names to environment variable names
     const functionUrlMap = {
       'shared': 'ONBOARDING_URL',  // shared functions use the old onboarding URL
@@ -2756,7 +2884,8 @@ async function callLambdaFunction(functionName, payload, env) {
       method: 'POST',
       headers: {
         'Content-Type': 'application/json',
-        'Authorization': `Bearer ${env.AWS_LAMBDA_TOKEN || 'default-token'}`
+        'Authorization': `Bearer ${env.AWS_LAMBDA_TOKEN || 'default-token'}`,
+        'X-Trace-Id': env.TRACE_ID || `tg-${crypto.randomUUID()}`
       },
       body: JSON.stringify(payload)
     });
@@ -2769,6 +2898,15 @@ async function callLambdaFunction(functionName, payload, env) {
     
     const result = await response.json();
     console.log(`✅ [LAMBDA] ${functionName} call successful`);
+    
+    // Свежий токен доступа заменяет старый; после списания урока старый токен без нового не оставляем
+    if (env.CHAT_KV && entitlementKey) {
+      if (result?.entitlement_token) {
+        await env.CHAT_KV.put(entitlementKey, result.entitlement_token, { expirationTtl: ENTITLEMENT_KV_TTL });
+      } else if (payload.action === 'decrease_lessons_left') {
+        await env.CHAT_KV.delete(entitlementKey);
+      }
+    }
     return result;
   } catch (error) {
     console.error(`❌ [LAMBDA] Error calling ${functionName}:`, error);